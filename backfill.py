@@ -0,0 +1,159 @@
+"""Regenerate all weekly and monthly reports of a date range in bulk
+
+    python backfill.py 2023-01-01 2024-12-31 [--output-dir backfill] [--export archive/]
+
+Instead of running every report with its own queries, the daily energy of the watt measurements
+and the daily last value of the counters are read once for the whole range, reduced with
+aggregateWindow(), and all timeframes of all reports are computed locally from these daily series.
+kWh are therefore summed over whole days (UTC) like with rollup_file. With rollup_file set, only the
+days that are not rolled up yet are queried.
+"""
+import argparse
+from datetime import datetime, time
+import logging
+import os
+
+from dateutil.relativedelta import relativedelta
+
+from catalog import TYPE_COUNTER, TYPE_WATT, load_catalog, plan_queries
+from create_png import create_bar_chart
+from helpers import get_same_calendar_week_days_one_year_ago, is_first_of_month, is_sunday
+from influx import GetFromInflux, InfluxSession, daily_kind
+from main import get_timeframes, get_timeframes_watt, process, report_name
+from rollup import KIND_ENERGY, KIND_LAST
+
+logger = logging.getLogger("influx_report.backfill")
+
+DEFAULT_OUTPUT_DIR = "backfill"
+
+
+def report_dates(first_day, last_day):
+    """All reports due from first_day to last_day, in the order main() would run them
+
+    Args:
+        first_day (datetime): first day of the range
+        last_day (datetime): last day of the range, inclusive
+
+    Returns:
+        list: tuples of the report date at 23:59:59 and is_month, the monthly report first on a day with both
+    """
+    reports = []
+    day = datetime.combine(first_day.date(), time(23, 59, 59))
+    while day.date() <= last_day.date():
+        if is_first_of_month(day):
+            reports.append((day, True))
+        if is_sunday(day):
+            reports.append((day, False))
+        day += relativedelta(days=1)
+    return reports
+
+
+def backfill_timeframes(reports):
+    """Timeframes of all reports, see main.get_timeframes()
+
+    The same calendar week one year ago of all weekly reports is computed at once.
+
+    Args:
+        reports (list): tuples of report date and is_month
+
+    Returns:
+        list: the timeframes per type of each report
+    """
+    weekly = [date for date, is_month in reports if not is_month]
+    one_year_ago = {
+        date: datetime.combine(day, time.min) for date, day in zip(weekly,
+                                                                  get_same_calendar_week_days_one_year_ago(weekly).astype(object))
+    }
+    week = relativedelta(weeks=1)
+    timeframes = []
+    for date, is_month in reports:
+        if is_month:
+            timeframes.append(get_timeframes(date, is_month))
+        else:
+            timeframes.append({
+                TYPE_WATT: get_timeframes_watt(date, is_month),
+                TYPE_COUNTER: ((one_year_ago[date] - week, one_year_ago[date]), (date - week, date)),
+            })
+    return timeframes
+
+
+def prefetch_daily(reports, influx, catalog):
+    """Fetch the daily series of all measurements for all reports and compute their results
+
+    Args:
+        reports (list): tuples of report date and is_month
+        influx (GetFromInflux): shared influx access of the run
+        catalog (list): CatalogEntry objects
+    """
+    plan = plan_queries(catalog, backfill_timeframes(reports))
+    logger.info(plan.describe()[0])
+    requests = influx.pending(plan.requests)
+    for kind in (KIND_ENERGY, KIND_LAST):
+        kind_requests = [request for request in requests if daily_kind(request) == kind]
+        if not kind_requests:
+            continue
+        names = list(dict.fromkeys(name for request in kind_requests for name in request.measurement_names))
+        ranges = [day_range for request in kind_requests for day_range in influx.daily_ranges(request)]
+        first_day = min(first for first, _ in ranges)
+        last_day = max(last for _, last in ranges)
+        logger.info("Get daily %s of %d measurements from %s to %s", kind, len(names), first_day, last_day)
+        daily = influx.get_daily_series(kind, names, first_day, last_day)
+        for request in kind_requests:
+            influx.remember_from_daily(request, daily)
+
+
+def backfill(first_day, last_day, influx=None, output_dir=DEFAULT_OUTPUT_DIR):
+    """Create the reports and charts of all weekly and monthly reports from first_day to last_day
+
+    Args:
+        first_day (datetime): first day of the range
+        last_day (datetime): last day of the range, inclusive
+        influx (GetFromInflux): shared influx access. If not given, one session is opened for the whole run.
+        output_dir (str): directory of the charts, one per report named after its period and date
+
+    Returns:
+        list: tuples of report date, is_month and the MeasurementSet objects of the report
+    """
+    if influx is None:
+        with InfluxSession() as session:
+            return backfill(first_day, last_day, GetFromInflux(session), output_dir)
+
+    reports = report_dates(first_day, last_day)
+    if not reports:
+        logger.warning("No report is due from %s to %s", first_day.date(), last_day.date())
+        return []
+    prefetch_daily(reports, influx, load_catalog())
+
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    for date, is_month in reports:
+        data = process(date, is_month, influx)
+        create_bar_chart(data, os.path.join(output_dir, f"bar_chart_{report_name(date, is_month)}.png"))
+        results.append((date, is_month, data))
+    return results
+
+
+def main(argv=None):
+    """Command line of the backfill
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Create all weekly and monthly reports of a date range")
+    parser.add_argument("first_day", type=datetime.fromisoformat, help="first day, e.g. 2023-01-01")
+    parser.add_argument("last_day", type=datetime.fromisoformat, help="last day, inclusive")
+    parser.add_argument("--output-dir", default=DEFAULT_OUTPUT_DIR, help=f"directory of the charts (default {DEFAULT_OUTPUT_DIR})")
+    parser.add_argument("--export", metavar="PATH", help="read the data from an export of InfluxDB or a directory of exports instead of the database")
+    args = parser.parse_args(argv)
+    if args.export:
+        # pylint: disable-next=import-outside-toplevel
+        from export import ExportInflux
+        with ExportInflux(args.export) as export:
+            reports = backfill(args.first_day, args.last_day, GetFromInflux(export.configured_session()), args.output_dir)
+    else:
+        reports = backfill(args.first_day, args.last_day, output_dir=args.output_dir)
+    print(f"{len(reports)} reports created in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+"""Rolling baseline statistics of the daily usage of the catalog lines
+
+The daily usage of all lines over the years before a report is held as one lines × days matrix,
+NaN where the usage of a day is unknown. The statistics of all lines and days are computed at once
+on views of the matrix, without a loop over the lines or the days:
+
+- the mean, the median, the percentiles BASELINE_PERCENTILES and the standard deviation of the
+  window of days before each day, and the z-score of each day against them
+- the usage of spans of days, e.g. the period of a report in each year before, from cumulative sums
+- the usage of every span of the length of the period, the z-score of the period against them
+
+A line whose period lies more than outlier_zscore standard deviations from its history is flagged
+as an outlier, and so is each day of the period that lies that far from the window before it.
+"""
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+DEFAULT_BASELINE_WINDOW = 28
+DEFAULT_OUTLIER_ZSCORE = 3.0
+# percentiles of the window before a day, the low and the high end of the usual usage
+BASELINE_PERCENTILES = (10, 90)
+
+
+@dataclass
+class Rolling:
+    """Statistics of the window of days before each day
+
+    All attributes are arrays of lines × days, NaN where no day of the window is known.
+
+    Attributes:
+        mean (numpy.ndarray): mean usage per day
+        median (numpy.ndarray): median usage per day
+        low (numpy.ndarray): usage of the lower percentile of BASELINE_PERCENTILES
+        high (numpy.ndarray): usage of the upper percentile of BASELINE_PERCENTILES
+        std (numpy.ndarray): standard deviation of the usage per day
+        zscore (numpy.ndarray): z-score of the day against the window, NaN if the window does not vary
+    """
+    mean: np.ndarray
+    median: np.ndarray
+    low: np.ndarray
+    high: np.ndarray
+    std: np.ndarray
+    zscore: np.ndarray
+
+
+@dataclass
+class Baseline:  # pylint: disable=too-many-instance-attributes
+    """Statistics of a line of a report against its history, None where they are unknown
+
+    Attributes:
+        mean (float): mean usage per day of the window before the period
+        median (float): median usage per day of the window before the period
+        low (float): lower percentile of the usage per day of the window, see BASELINE_PERCENTILES
+        high (float): upper percentile of the usage per day of the window
+        zscore (float): z-score of the usage of the period against all spans of its length before it
+        years (list): usage of the same period in each year before, the latest first
+        expected (float): mean of the known years, the multi-year baseline of the period
+        outlier (bool): the z-score of the period is beyond outlier_zscore
+        outlier_days (list): days of the period whose usage is beyond outlier_zscore of the window before them
+    """
+    mean: float
+    median: float
+    low: float
+    high: float
+    zscore: float
+    years: list
+    expected: float
+    outlier: bool
+    outlier_days: list
+
+    def to_dict(self):
+        """The baseline as JSON serialisable dict, the days in ISO format
+
+        Returns:
+            dict: all attributes
+        """
+        result = asdict(self)
+        result["outlier_days"] = [day.isoformat() for day in self.outlier_days]
+        return result
+
+
+class DailyMatrix():
+    """The usage per day of many lines as one lines × days matrix, NaN where a day is unknown"""
+
+    def __init__(self, labels, first_day, values):
+        """
+        Args:
+            labels (list): label of each line
+            first_day (datetime.date): day of the first column
+            values (list): usage per day of each line, None or NaN where it is unknown
+        """
+        self.labels = list(labels)
+        self.first_day = first_day
+        self.values = np.array(values, dtype=float).reshape(len(self.labels), -1)
+
+    @property
+    def days(self):
+        """Number of days"""
+        return self.values.shape[1]
+
+    def index(self, day):
+        """Column of a day, negative or beyond days if it is outside the matrix"""
+        return (day - self.first_day).days
+
+    def day(self, index):
+        """Day of a column"""
+        return self.first_day + timedelta(days=int(index))
+
+    def rolling(self, window=DEFAULT_BASELINE_WINDOW):
+        """Statistics of the window of days before each day, the day itself excluded
+
+        The mean and the standard deviation are differences of cumulative sums. For the median and
+        the percentiles the windows, a strided view of the matrix, are sorted once with the unknown
+        days last, and interpolated between the known days of each window.
+
+        Args:
+            window (int): days before each day
+
+        Returns:
+            Rolling: the statistics, NaN for the first window days
+        """
+        shape = self.values.shape
+        padding = np.full((shape[0], min(window, shape[1])), np.nan)
+        if shape[1] <= window:
+            return Rolling(*[padding] * 6)
+        known = ~np.isnan(self.values)
+        values = np.where(known, self.values, 0.0)
+        counts = _window_sums(known, window)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = _window_sums(values, window) / counts
+            std = np.sqrt(np.maximum(_window_sums(values**2, window) / counts - mean**2, 0.0))
+            zscore = np.where(std > 0, (self.values[:, window:] - mean) / std, np.nan)
+        ordered = np.sort(sliding_window_view(self.values[:, :-1], window, axis=1), axis=-1)
+        statistics = [mean, _percentile(ordered, counts, 50)] + [_percentile(ordered, counts, percentile) for percentile in BASELINE_PERCENTILES]
+        statistics += [std, zscore]
+        return Rolling(*[np.concatenate([padding, statistic], axis=1) for statistic in statistics])
+
+    def span_sums(self, starts, stops):
+        """Usage of spans of days of all lines, from cumulative sums of the matrix
+
+        Unknown days and days outside the matrix count with the mean of the known days of their span.
+
+        Args:
+            starts (list): column of the first day of each span
+            stops (list): column after the last day of each span
+
+        Returns:
+            numpy.ndarray: lines × spans, NaN where no day of a span is known
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        stops = np.asarray(stops, dtype=np.int64)
+        known = ~np.isnan(self.values)
+        zero = np.zeros((self.values.shape[0], 1))
+        sums = np.concatenate([zero, np.cumsum(np.where(known, self.values, 0.0), axis=1)], axis=1)
+        counts = np.concatenate([zero, np.cumsum(known, axis=1)], axis=1)
+        first = np.clip(starts, 0, self.days)
+        last = np.clip(stops, 0, self.days)
+        known_days = counts[:, last] - counts[:, first]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(known_days > 0, (sums[:, last] - sums[:, first]) / known_days * (stops - starts), np.nan)
+
+    def rolling_sums(self, length):
+        """Usage of every span of a number of days, see span_sums()
+
+        Args:
+            length (int): days of a span
+
+        Returns:
+            numpy.ndarray: lines × spans, the span starting at each column that has length days after it
+        """
+        starts = np.arange(max(self.days - length + 1, 0))
+        return self.span_sums(starts, starts + length)
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments,too-many-locals
+def baselines(matrix, start, stop, years=(), window=DEFAULT_BASELINE_WINDOW, outlier_zscore=DEFAULT_OUTLIER_ZSCORE):
+    """Baseline of each line of a matrix for a period of its days
+
+    Args:
+        matrix (DailyMatrix): usage per day of the lines, the days before the period are the history
+        start (int): column of the first day of the period
+        stop (int): column after the last day of the period
+        years (list): start and stop column of the same period in each year before, the latest first
+        window (int): days before a day its rolling statistics are computed from
+        outlier_zscore (float): z-score beyond which a period or a day is an outlier
+
+    Returns:
+        dict: Baseline per label
+    """
+    length = stop - start
+    rolling = matrix.rolling(window)
+    period = matrix.span_sums([start], [stop])[:, 0]
+    history = matrix.rolling_sums(length)[:, :max(start - length + 1, 0)]
+    mean, std = _mean_std(history)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        zscore = np.where(std > 0, (period - mean) / std, np.nan)
+    yearly = matrix.span_sums([span[0] for span in years], [span[1] for span in years])
+    expected, _ = _mean_std(yearly)
+    day_outliers = np.abs(rolling.zscore[:, start:stop]) > outlier_zscore
+
+    result = {}
+    for line, label in enumerate(matrix.labels):
+        result[label] = Baseline(mean=_optional(float(rolling.mean[line, start])),
+                                 median=_optional(float(rolling.median[line, start])),
+                                 low=_optional(float(rolling.low[line, start])),
+                                 high=_optional(float(rolling.high[line, start])),
+                                 zscore=_optional(float(zscore[line])),
+                                 years=[_optional(float(value)) for value in yearly[line]],
+                                 expected=_optional(float(expected[line])),
+                                 outlier=bool(abs(zscore[line]) > outlier_zscore),
+                                 outlier_days=[matrix.day(start + index) for index in np.flatnonzero(day_outliers[line])])
+    return result
+
+
+def _window_sums(values, window):
+    """Sums of the window of days before each day from the day window on, lines × (days - window)"""
+    sums = np.cumsum(values, axis=1, dtype=float)
+    sums = np.concatenate([np.zeros((values.shape[0], 1)), sums], axis=1)
+    return sums[:, window:-1] - sums[:, :-window - 1]
+
+
+def _percentile(ordered, counts, percentile):
+    """Percentile of sorted windows with unknown days last, interpolated between the known days"""
+    position = np.maximum(counts - 1, 0) * percentile / 100
+    lower = np.floor(position).astype(np.int64)
+    upper = np.ceil(position).astype(np.int64)
+    low = np.take_along_axis(ordered, lower[..., np.newaxis], axis=-1)[..., 0]
+    high = np.take_along_axis(ordered, upper[..., np.newaxis], axis=-1)[..., 0]
+    return np.where(counts > 0, low + (high - low) * (position - lower), np.nan)
+
+
+def _mean_std(values):
+    """Mean and standard deviation of each row, NaN ignored, NaN for a row without values"""
+    known = ~np.isnan(values)
+    counts = known.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(known, values, 0.0).sum(axis=1) / counts
+        std = np.sqrt(np.where(known, (values - mean[:, np.newaxis])**2, 0.0).sum(axis=1) / counts)
+    return mean, std
+
+
+def _optional(value):
+    """None instead of NaN"""
+    return None if value is None or math.isnan(value) else value
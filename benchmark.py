@@ -0,0 +1,364 @@
+"""Benchmarks of the report on synthetic high-resolution series
+
+    python benchmark.py [--quick] [--repeats 5] [--output benchmark.json]
+    python benchmark.py --compare before.json after.json
+
+Each case runs the real code against SyntheticInflux, see synthetic.py, and measures:
+
+- latency: seconds of each repetition, reported as percentiles
+- throughput: samples reduced per second at the median latency
+- peak memory: bytes allocated at most during one extra repetition traced with tracemalloc
+
+The series and their records are built before a case is measured. The results are stored as JSON
+together with the commit, so runs can be compared across commits with --compare.
+"""
+import argparse
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from baseline import DailyMatrix, baselines
+from catalog import TYPE_WATT, load_catalog
+from derived import source_measurements
+from influx import INTEGRATION_SERVER, GetFromInflux
+from main import get_timeframes, process
+from synthetic import SyntheticInflux, counter_series, join_series, power_series
+
+logger = logging.getLogger("influx_report.benchmark")
+
+DEFAULT_REPEATS = 5
+DEFAULT_OUTPUT_FILE = "benchmark.json"
+PERCENTILES = (50, 90, 99)
+# reference date of the reports, a Sunday and the first of the month
+REPORT_DATE = datetime(2024, 9, 1, 23, 59, 59)
+
+
+@dataclass
+class BenchmarkResult:
+    """Measurements of one benchmark case
+
+    Attributes:
+        name (str): name of the case
+        samples (int): samples reduced by one repetition
+        latencies (list): seconds of each repetition
+        peak_memory (int): bytes allocated at most during one repetition
+    """
+    name: str
+    samples: int
+    latencies: list = field(default_factory=list)
+    peak_memory: int = 0
+
+    @property
+    def throughput(self):
+        """Samples per second at the median latency"""
+        median = float(np.median(self.latencies))
+        return self.samples / median if median > 0 else 0.0
+
+    def percentiles(self):
+        """Latency percentiles
+
+        Returns:
+            dict: seconds per percentile, e.g. {"p50": 0.1, "p90": 0.2, "p99": 0.25}
+        """
+        return {f"p{percentile}": float(np.percentile(self.latencies, percentile)) for percentile in PERCENTILES}
+
+    def to_dict(self):
+        """The result as plain types for JSON"""
+        return {
+            "name": self.name,
+            "samples": self.samples,
+            "repeats": len(self.latencies),
+            "throughput": self.throughput,
+            "latency": self.percentiles(),
+            "peak_memory": self.peak_memory,
+        }
+
+
+def measure(name, function, samples, repeats=DEFAULT_REPEATS):
+    """Run a benchmark case
+
+    The first call is a warm-up and not measured. Memory is traced in an extra call, so tracing
+    does not slow down the measured ones.
+
+    Args:
+        name (str): name of the case
+        function (callable): one repetition, called without arguments
+        samples (int): samples reduced by one repetition
+        repeats (int): measured repetitions
+
+    Returns:
+        BenchmarkResult: the measurements
+    """
+    function()
+    result = BenchmarkResult(name, samples)
+    for _ in range(repeats):
+        started = time.perf_counter()
+        function()
+        result.latencies.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        function()
+        result.peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    logger.info("%-40s %12.0f samples/s  p50 %8.4f s  peak %8.1f MiB", name, result.throughput,
+                result.percentiles()["p50"], result.peak_memory / 2**20)
+    return result
+
+
+def bench_kwh(days, resolution_s, repeats=DEFAULT_REPEATS, **options):
+    """get_total_kwh_consumed_from_influx() of one power series
+
+    Args:
+        days (int): days of the timespan
+        resolution_s (float): seconds between two samples
+        repeats (int): measured repetitions
+        **options: fields of QueryOptionsClass, e.g. streaming=True
+
+    Returns:
+        BenchmarkResult: the measurements
+    """
+    start = REPORT_DATE - timedelta(days=days)
+    series = power_series("power", start, timedelta(days=days), resolution_s)
+    series.records()
+    influx = SyntheticInflux([series])
+    variant = "".join(f", {option}={value}" for option, value in options.items())
+
+    def run():
+        GetFromInflux(influx.session(**options)).get_total_kwh_consumed_from_influx("power", start, REPORT_DATE)
+
+    return measure(f"kwh {days} d @ {resolution_s:g} s{variant}", run, len(series), repeats)
+
+
+def bench_values(days, resolution_s, repeats=DEFAULT_REPEATS):
+    """get_values_from_influx() of one counter at the start and the end of a timespan
+
+    Args:
+        days (int): days of the timespan
+        resolution_s (float): seconds between two samples
+        repeats (int): measured repetitions
+
+    Returns:
+        BenchmarkResult: the measurements
+    """
+    start = REPORT_DATE - timedelta(days=days)
+    series = counter_series("counter", start - timedelta(days=10), timedelta(days=days + 11), resolution_s, resets=2)
+    influx = SyntheticInflux([series])
+
+    def run():
+        GetFromInflux(influx.session()).get_values_from_influx("counter", start, REPORT_DATE)
+
+    return measure(f"values {days} d @ {resolution_s:g} s", run, len(series), repeats)
+
+
+def report_series(date, is_month, resolution_s, catalog=None):
+    """Synthetic series of all catalog measurements over the timeframes of a report
+
+    Args:
+        date (datetime): reference date of the report
+        is_month (bool): the monthly or the weekly report
+        resolution_s (float): seconds between two samples of the power series
+        catalog (list): CatalogEntry objects, defaults to the catalog file
+
+    Returns:
+        list: Series objects, counters every 5 minutes over the whole time
+    """
+    catalog = catalog or load_catalog()
+    timeframes = get_timeframes(date, is_month)
+    series = []
+    for seed, entry in enumerate(catalog):
+        for name in source_measurements(entry.measurements):
+            if entry.type == TYPE_WATT:
+                series.append(join_series([power_series(name, start, end - start, resolution_s, seed=seed) for start, end in timeframes[TYPE_WATT]]))
+            elif name not in [known.measurement for known in series]:
+                start = min(start for start, _ in timeframes[entry.type]) - timedelta(days=10)
+                series.append(counter_series(name, start, date - start + timedelta(days=1), 300, seed=seed))
+    return series
+
+
+def bench_process(is_month, resolution_s, repeats=DEFAULT_REPEATS):
+    """process() of a whole report with all catalog lines
+
+    Args:
+        is_month (bool): the monthly or the weekly report
+        resolution_s (float): seconds between two samples of the power series
+        repeats (int): measured repetitions
+
+    Returns:
+        BenchmarkResult: the measurements
+    """
+    series = report_series(REPORT_DATE, is_month, resolution_s)
+    watt_names = [name for entry in load_catalog() if entry.type == TYPE_WATT for name in entry.measurements]
+    for measurement in series:
+        # the counters are only read with last()
+        if measurement.measurement in watt_names:
+            measurement.records()
+    influx = SyntheticInflux(series)
+
+    def run():
+        process(REPORT_DATE, is_month, GetFromInflux(influx.session()))
+
+    return measure(f"process {'month' if is_month else 'week'} @ {resolution_s:g} s", run, sum(len(measurement) for measurement in series), repeats)
+
+
+def bench_chart(repeats=DEFAULT_REPEATS):
+    """create_bar_chart() of a monthly report
+
+    Args:
+        repeats (int): measured repetitions
+
+    Returns:
+        BenchmarkResult: the measurements, samples are the measurements in the chart
+    """
+    # matplotlib is only imported for this case
+    # pylint: disable-next=import-outside-toplevel
+    from create_png import create_bar_chart
+    influx = SyntheticInflux(report_series(REPORT_DATE, True, 60))
+    data = process(REPORT_DATE, True, GetFromInflux(influx.session()))
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "bar_chart.png")
+        return measure("create_bar_chart month", lambda: create_bar_chart(data, filename), len(data), repeats)
+
+
+def bench_baseline(lines, years, repeats=DEFAULT_REPEATS):
+    """baselines() of a weekly report over years of daily usage
+
+    Args:
+        lines (int): lines of the report
+        years (int): years of daily usage before the report
+        repeats (int): measured repetitions
+
+    Returns:
+        BenchmarkResult: the measurements, samples are the days of all lines
+    """
+    rng = np.random.default_rng(0)
+    days = years * 365 + 7
+    values = rng.gamma(2.0, 3.0, (lines, days))
+    values[rng.random(values.shape) < 0.02] = np.nan
+    matrix = DailyMatrix([f"line {line}" for line in range(lines)], REPORT_DATE.date() - timedelta(days=days - 1), values)
+    spans = [(days - 7 - 364 * year, days - 364 * year) for year in range(1, years + 1)]
+    return measure(f"baselines {lines} lines x {years} years", lambda: baselines(matrix, days - 7, days, spans), lines * days, repeats)
+
+
+def run_benchmarks(quick=False, repeats=DEFAULT_REPEATS):
+    """Run all benchmark cases
+
+    Args:
+        quick (bool): only the small cases, e.g. to check the suite itself
+        repeats (int): measured repetitions of each case
+
+    Returns:
+        list: BenchmarkResult objects
+    """
+    results = [
+        bench_kwh(7, 10, repeats),
+        bench_kwh(7, 10, repeats, streaming=True),
+        bench_kwh(7, 10, repeats, integration=INTEGRATION_SERVER),
+        bench_values(7, 60, repeats),
+        bench_process(False, 60, repeats),
+        bench_baseline(24, 3, repeats),
+    ]
+    if not quick:
+        results += [
+            bench_kwh(7, 1, repeats),
+            bench_kwh(31, 10, repeats),
+            bench_kwh(31, 10, repeats, streaming=True),
+            bench_values(31, 10, repeats),
+            bench_process(False, 10, repeats),
+            bench_process(True, 10, repeats),
+            bench_baseline(48, 10, repeats),
+        ]
+    results.append(bench_chart(repeats))
+    return results
+
+
+def save_results(results, path=DEFAULT_OUTPUT_FILE):
+    """Store the results with the commit and the platform as JSON
+
+    Args:
+        results (list): BenchmarkResult objects
+        path (str): the JSON file
+
+    Returns:
+        dict: the stored document
+    """
+    document = {
+        "commit": _commit(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [result.to_dict() for result in results],
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(document, file, indent=2)
+    return document
+
+
+def compare_results(before, after):
+    """Compare two stored runs case by case
+
+    Args:
+        before (dict): document of save_results() of the older run
+        after (dict): document of save_results() of the newer run
+
+    Returns:
+        list: lines of text, the change of the median latency and the peak memory of each case in both runs
+    """
+    lines = [f"{before['commit'] or 'unknown'} -> {after['commit'] or 'unknown'}"]
+    old = {result["name"]: result for result in before["results"]}
+    for result in after["results"]:
+        if result["name"] not in old:
+            continue
+        latency = result["latency"]["p50"] / old[result["name"]]["latency"]["p50"] - 1
+        memory = result["peak_memory"] / old[result["name"]]["peak_memory"] - 1 if old[result["name"]]["peak_memory"] else 0.0
+        lines.append(f"  {result['name']:40} p50 {latency:+7.1%}  peak memory {memory:+7.1%}")
+    return lines
+
+
+def _commit():
+    """Commit of the working tree, empty if it is not a git repository"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main(argv=None):
+    """Command line of the benchmarks
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the report on synthetic high-resolution series")
+    parser.add_argument("--quick", action="store_true", help="only the small cases")
+    parser.add_argument("--repeats", type=int, default=DEFAULT_REPEATS, help=f"measured repetitions of each case (default {DEFAULT_REPEATS})")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_FILE, help=f"JSON file of the results (default {DEFAULT_OUTPUT_FILE})")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two JSON files instead of running the benchmarks")
+    args = parser.parse_args(argv)
+    # the reports themselves are not of interest here
+    for quiet in ("influx_report.main", "influx_report.helpers"):
+        logging.getLogger(quiet).setLevel(logging.ERROR)
+
+    if args.compare:
+        documents = []
+        for path in args.compare:
+            with open(path, encoding="utf-8") as file:
+                documents.append(json.load(file))
+        print("\n".join(compare_results(documents[0], documents[1])))
+        return
+    save_results(run_benchmarks(args.quick, args.repeats), args.output)
+    logger.info("Results stored in %s", args.output)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    main()
@@ -0,0 +1,236 @@
+"""Persistent cache of query results in SQLite
+
+Results of time ranges that are fully in the past never change and are kept forever.
+Results of ranges that reach into the present expire after a TTL. Naive times are UTC, like in
+the queries. The results of each source, i.e. InfluxDB url, org and bucket, are kept apart, so
+several sites can share one cache file.
+
+Inspect and purge the cache from the command line:
+
+    python cache.py list [--measurement NAME]
+    python cache.py purge [--expired | --open | --measurement NAME]
+"""
+import argparse
+import configparser
+from datetime import datetime, timezone
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger("influx_report.cache")
+
+DEFAULT_CACHE_TTL = 3600
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS results (
+    kind TEXT NOT NULL,
+    measurement TEXT NOT NULL,
+    start TEXT NOT NULL,
+    stop TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created REAL NOT NULL,
+    expires REAL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (source, kind, measurement, start, stop, variant)
+)"""
+_COLUMNS = ("kind", "measurement", "start", "stop", "variant", "value", "created", "expires", "source")
+
+
+class ResultCache():
+    """Query results keyed by source, kind, measurement, range and variant (integration method or look-back)"""
+
+    def __init__(self, path: str, ttl: int = DEFAULT_CACHE_TTL, source: str = ""):
+        """Open or create the cache file
+
+        A cache file of an older layout is emptied, its results are queried again. The cache may be
+        used by another thread than the one that opened it, but by one thread at a time.
+
+        Args:
+            path (str): path of the SQLite file
+            ttl (int): seconds a result of a range that reaches into the present stays valid
+            source (str): InfluxDB url, org and bucket the results are read from
+        """
+        self.path = path
+        self.ttl = ttl
+        self.source = source
+        self.hits = 0
+        self.misses = 0
+        # the reports of the daemon run on its HTTP thread, one at a time under its lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        columns = tuple(row[1] for row in self._connection.execute("PRAGMA table_info(results)"))
+        if columns and columns != _COLUMNS:
+            logger.info("Cache %s has an older layout, it is emptied", path)
+            self._connection.execute("DROP TABLE results")
+        self._connection.execute(_SCHEMA)
+        self._connection.commit()
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def get(self, kind, measurement, start, stop, variant):
+        """Look up a result
+
+        Args:
+            kind (str): kind of the query, e.g. influx.KIND_KWH
+            measurement (str): name of the measurement
+            start (datetime): start of the range
+            stop (datetime): end of the range
+            variant (str): everything else the result depends on
+
+        Returns:
+            tuple: (True, value) on a hit, (False, None) on a miss or if the entry expired
+        """
+        row = self._connection.execute(
+            "SELECT value, expires FROM results WHERE source=? AND kind=? AND measurement=? AND start=? AND stop=? AND variant=?",
+            (self.source, kind, measurement, start.isoformat(), stop.isoformat(), variant)).fetchone()
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, _from_json(json.loads(row[0]))
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def put(self, kind, measurement, start, stop, variant, value, now=None):
+        """Store a result, permanently if the range ended before now
+
+        Args:
+            kind (str): kind of the query, e.g. influx.KIND_KWH
+            measurement (str): name of the measurement
+            start (datetime): start of the range
+            stop (datetime): end of the range, UTC if it is naive
+            variant (str): everything else the result depends on
+            value: JSON serialisable result, tuples are restored on get()
+            now (datetime): reference to decide if the range is closed, defaults to now
+        """
+        now = now or datetime.now(timezone.utc)
+        expires = None if _utc(stop) < _utc(now) else time.time() + self.ttl
+        self._connection.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (kind, measurement, start.isoformat(), stop.isoformat(), variant, json.dumps(_to_json(value)), time.time(), expires, self.source))
+        self._connection.commit()
+
+    def entries(self, measurement=None):
+        """All entries of the cache, of all sources
+
+        Args:
+            measurement (str): only entries of this measurement
+
+        Returns:
+            list: tuples of kind, measurement, start, stop, variant, value, created, expires, source
+        """
+        query = "SELECT * FROM results"
+        parameters = ()
+        if measurement is not None:
+            query += " WHERE measurement=?"
+            parameters = (measurement,)
+        return self._connection.execute(query + " ORDER BY source, measurement, start", parameters).fetchall()
+
+    def purge(self, measurement=None, expired_only=False, open_only=False):
+        """Delete entries of all sources
+
+        Args:
+            measurement (str): only entries of this measurement
+            expired_only (bool): only entries whose TTL is over
+            open_only (bool): only entries of ranges that reached into the present, i.e. with a TTL
+
+        Returns:
+            int: number of deleted entries
+        """
+        conditions = []
+        parameters = []
+        if measurement is not None:
+            conditions.append("measurement=?")
+            parameters.append(measurement)
+        if expired_only:
+            conditions.append("expires IS NOT NULL AND expires < ?")
+            parameters.append(time.time())
+        if open_only:
+            conditions.append("expires IS NOT NULL")
+        query = "DELETE FROM results"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        deleted = self._connection.execute(query, parameters).rowcount
+        self._connection.commit()
+        return deleted
+
+    def close(self):
+        """Close the cache file"""
+        logger.debug("Cache %s: %d hits, %d misses", self.path, self.hits, self.misses)
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _utc(moment):
+    """A time as aware UTC time, naive times are UTC"""
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+
+
+def _to_json(value):
+    """Tuples become lists in JSON, mark them to restore them"""
+    if isinstance(value, tuple):
+        return {"tuple": list(value)}
+    return value
+
+
+def _from_json(value):
+    """Restore tuples marked by _to_json()"""
+    if isinstance(value, dict) and "tuple" in value:
+        return tuple(value["tuple"])
+    return value
+
+
+def main(argv=None):
+    """Command line to inspect and purge the cache
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv
+    """
+    parser = _parser()
+    args = parser.parse_args(argv)
+    path = args.file if args.file is not None else _configured_path()
+    if not path:
+        parser.error("No cache file, set cache_file in config.ini or use --file")
+
+    with ResultCache(path) as cache:
+        if args.command == "list":
+            _print_entries(cache.entries(args.measurement))
+        else:
+            deleted = cache.purge(args.measurement, args.expired, args.open)
+            print(f"{deleted} entries deleted")
+
+
+def _parser():
+    """Parser of the command line arguments"""
+    parser = argparse.ArgumentParser(description="Inspect and purge the query result cache")
+    parser.add_argument("--file", help="cache file, defaults to cache_file of the [InfluxDB] section of config.ini")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    list_parser = subparsers.add_parser("list", help="list the cached results")
+    list_parser.add_argument("--measurement", help="only results of this measurement")
+    purge_parser = subparsers.add_parser("purge", help="delete cached results, all of them without further options")
+    purge_parser.add_argument("--measurement", help="only results of this measurement")
+    purge_parser.add_argument("--expired", action="store_true", help="only results whose TTL is over")
+    purge_parser.add_argument("--open", action="store_true", help="only results of ranges that reached into the present")
+    return parser
+
+
+def _configured_path():
+    """cache_file of the [InfluxDB] section of config.ini, empty if it is not set"""
+    config = configparser.ConfigParser()
+    config.read("config.ini")
+    return config.get("InfluxDB", "cache_file", fallback="")
+
+
+def _print_entries(entries):
+    """Print one line per entry and their number"""
+    for kind, measurement, start, stop, variant, value, _created, expires, source in entries:
+        validity = "permanent" if expires is None else f"expires {datetime.fromtimestamp(expires):%d.%m.%y %H:%M:%S}"
+        print(f"{source} {measurement} {kind} {start} - {stop} [{variant}] = {value} ({validity})".lstrip())
+    print(f"{len(entries)} entries")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""Declarative catalog of the measurements of the report and the planner that compiles it into queries
+
+The catalog file (catalog.ini) has one section per line of the report, see the comments in it.
+The planner expands the catalog over the timeframes of all reports of a run into fetches of a
+measurement and a range, removes duplicate fetches and compiles the rest into few batched queries:
+
+- watt measurements: one KIND_KWH query per timeframe
+- counters: the value of a counter is read at the start and at the end of a timeframe. Identical
+  days are read once, e.g. the end day shared by the weekly and the monthly report, and all days
+  are read with one KIND_SNAPSHOTS query. The expression of a derived measurement, e.g. the sum of
+  three phases, is evaluated in that query, see derived.py.
+"""
+import configparser
+from dataclasses import dataclass
+from datetime import datetime, time
+import logging
+
+from derived import derived_name, is_derived
+from query_request import KIND_KWH, KIND_SNAPSHOTS, QueryRequest
+
+logger = logging.getLogger("influx_report.catalog")
+
+DEFAULT_CATALOG_FILE = "catalog.ini"
+
+TYPE_WATT = "watt"
+TYPE_COUNTER = "counter"
+
+
+@dataclass(frozen=True)
+class CatalogEntry:
+    """A line of the report
+
+    Attributes:
+        label (str): human friendly name, also used to refer to the line
+        measurements (tuple): names of the measurements in influx, their values are summed. A counter
+            line with an expression has one derived measurement, see derived.py
+        type (str): TYPE_WATT or TYPE_COUNTER
+        divisor (float): the value is divided by it
+        decimals (int): the value is rounded to this many decimals after dividing, None to keep it
+        subtract (str): label of an earlier line whose value is subtracted after rounding, optional
+    """
+    label: str
+    measurements: tuple
+    type: str = TYPE_COUNTER
+    divisor: float = 1
+    decimals: int = None
+    subtract: str = None
+
+    def apply(self, values, subtrahend=None):
+        """Scale, round and subtract the summed values of both timeframes
+
+        Args:
+            values (list): summed value of the past and of the current timeframe
+            subtrahend (list): values of the line named by subtract, optional
+
+        Returns:
+            list: the values of the line
+        """
+        result = list(values)
+        if self.divisor != 1:
+            result = [value / self.divisor for value in result]
+        if self.decimals is not None:
+            result = [round(value, self.decimals) for value in result]
+        if subtrahend is not None:
+            result = [value - other for value, other in zip(result, subtrahend)]
+        return result
+
+
+@dataclass(frozen=True)
+class Fetch:
+    """A result the report needs: a measurement over a range
+
+    Attributes:
+        kind (str): KIND_KWH for watt measurements, KIND_SNAPSHOTS for counters
+        measurement_name (str): name of the measurement in influx
+        start_date (datetime): start of the range
+        end_date (datetime): end of the range
+    """
+    kind: str
+    measurement_name: str
+    start_date: datetime
+    end_date: datetime
+
+
+@dataclass
+class QueryPlan:
+    """Queries that fetch everything the reports of a run need
+
+    Attributes:
+        requests (list): QueryRequest objects, one query each
+        fetches (int): fetches of all reports, including duplicates
+        unique_fetches (int): fetches after removing the duplicates
+        snapshots (int): counter values read at the start and end of the unique counter fetches
+        unique_snapshots (int): counter values after removing the duplicates
+    """
+    requests: list
+    fetches: int
+    unique_fetches: int
+    snapshots: int
+    unique_snapshots: int
+
+    def describe(self):
+        """The plan in human readable form
+
+        Returns:
+            list: lines of text, a summary and one line per query
+        """
+        lines = [(f"Query plan: {len(self.requests)} queries for {self.unique_fetches} of {self.fetches} fetches "
+                  f"and {self.unique_snapshots} of {self.snapshots} counter values, duplicates removed")]
+        for request in self.requests:
+            if request.kind == KIND_SNAPSHOTS:
+                days = ", ".join(day.strftime("%d.%m.%y") for day in request.days)
+                derived = sum(1 for name in request.measurement_names if is_derived(name))
+                lines.append(f"  {request.kind}: {len(request.measurement_names)} measurements{f' ({derived} derived)' if derived else ''} on {days}")
+            else:
+                lines.append(f"  {request.kind}: {len(request.measurement_names)} measurements "
+                             f"{request.start_date:%d.%m.%y} to {request.end_date:%d.%m.%y}")
+        return lines
+
+
+def load_catalog(path=DEFAULT_CATALOG_FILE):
+    """Read the catalog file
+
+    Args:
+        path (str): path of the catalog file, defaults to catalog.ini
+
+    Raises:
+        ValueError: if the file is missing, a type is unknown, an expression is invalid or subtract does not name an earlier line
+
+    Returns:
+        list: CatalogEntry objects in the order of the file
+    """
+    config = configparser.ConfigParser(interpolation=None)
+    if not config.read(path, encoding="utf-8"):
+        raise ValueError(f"Catalog file {path} not found")
+    entries = []
+    for label in config.sections():
+        section = config[label]
+        measurements = tuple(name.strip() for name in section.get("measurements", "").split(",") if name.strip())
+        if "expression" in section:
+            if measurements:
+                raise ValueError(f"Catalog line {label} has measurements and an expression")
+            if section.get("type", TYPE_COUNTER) != TYPE_COUNTER:
+                raise ValueError(f"Catalog line {label} has an expression, which is only supported for counters")
+            try:
+                measurements = (derived_name(section["expression"]),)
+            except ValueError as error:
+                raise ValueError(f"Catalog line {label}: {error}") from error
+        entry = CatalogEntry(
+            label=label,
+            measurements=measurements,
+            type=section.get("type", TYPE_COUNTER),
+            divisor=section.getfloat("divisor", 1),
+            decimals=section.getint("decimals", None),
+            subtract=section.get("subtract", None),
+        )
+        if not entry.measurements:
+            raise ValueError(f"Catalog line {label} has no measurements")
+        if entry.type not in (TYPE_WATT, TYPE_COUNTER):
+            raise ValueError(f"Catalog line {label} has unknown type {entry.type}")
+        if entry.subtract is not None and entry.subtract not in [earlier.label for earlier in entries]:
+            raise ValueError(f"Catalog line {label} subtracts {entry.subtract}, which is not an earlier line")
+        entries.append(entry)
+    return entries
+
+
+def plan_queries(entries, reports):
+    """Compile the catalog for the timeframes of the reports of a run into a minimal set of queries
+
+    Args:
+        entries (list): CatalogEntry objects
+        reports (list): per report a dict of the timeframes per type, i.e. TYPE_WATT and TYPE_COUNTER
+            each map to the past and the current timeframe as tuples of start and end date
+
+    Returns:
+        QueryPlan: the queries and how many fetches they replace
+    """
+    fetches = []
+    for timeframes in reports:
+        for entry in entries:
+            kind = KIND_KWH if entry.type == TYPE_WATT else KIND_SNAPSHOTS
+            for name in entry.measurements:
+                for start_date, end_date in timeframes[entry.type]:
+                    fetches.append(Fetch(kind, name, start_date, end_date))
+    unique = list(dict.fromkeys(fetches))
+
+    # kWh: one query per range with all its measurements
+    kwh_ranges = {}
+    for fetch in unique:
+        if fetch.kind == KIND_KWH:
+            kwh_ranges.setdefault((fetch.start_date, fetch.end_date), []).append(fetch.measurement_name)
+
+    # counters: the days each measurement is read on
+    days_per_name = {}
+    for fetch in unique:
+        if fetch.kind == KIND_SNAPSHOTS:
+            days_per_name.setdefault(fetch.measurement_name, set()).update(_day(date) for date in (fetch.start_date, fetch.end_date))
+
+    requests = _snapshot_requests(days_per_name)
+    requests += [QueryRequest(KIND_KWH, tuple(names), start_date, end_date) for (start_date, end_date), names in kwh_ranges.items()]
+    return QueryPlan(requests=requests,
+                     fetches=len(fetches),
+                     unique_fetches=len(unique),
+                     snapshots=2 * sum(1 for fetch in unique if fetch.kind == KIND_SNAPSHOTS),
+                     unique_snapshots=sum(len(days) for days in days_per_name.values()))
+
+
+def _snapshot_requests(days_per_name):
+    """One KIND_SNAPSHOTS request per set of days, with all measurements read on these days
+
+    Args:
+        days_per_name (dict): per measurement name the set of days to read
+
+    Returns:
+        list: QueryRequest objects
+    """
+    names_per_days = {}
+    for name, days in days_per_name.items():
+        names_per_days.setdefault(tuple(sorted(days)), []).append(name)
+    return [QueryRequest(KIND_SNAPSHOTS, tuple(names), days[0], days[-1], days) for days, names in names_per_days.items()]
+
+
+def _day(date):
+    """Start of the day of a datetime, keeping its timezone"""
+    return datetime.combine(date.date(), time.min, date.tzinfo)
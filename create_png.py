@@ -28,7 +28,7 @@ def create_bar_chart(measurement_sets: MeasurementSet, filename='bar_chart.png')
     Returns:
         None
     """
-    names = [f"{ms.name} {ms.data[1]:.1f}" for ms in measurement_sets]
+    names = [f"{ms.name} n/a" if ms.missing else f"{ms.name} {ms.data[1]:.1f}" for ms in measurement_sets]
     values_last = [ms.data[0] for ms in measurement_sets]
     values_this = [ms.data[1] for ms in measurement_sets]
 
@@ -43,6 +43,8 @@ def create_bar_chart(measurement_sets: MeasurementSet, filename='bar_chart.png')
     differences = np.array(values_this) - np.array(values_last)
 
     for i in range(len(names)):
+        if measurement_sets[i].missing:
+            continue
         axis.text(x_axis[i] - width / 2, max(values_last[i], values_this[i]) + 1, f"{differences[i]:+.1f}", ha='center', va='bottom')
         # if differences[i] < 0.0:
         # else:
@@ -61,3 +63,30 @@ def create_bar_chart(measurement_sets: MeasurementSet, filename='bar_chart.png')
     plt.tight_layout()
     plt.savefig(filename)  # Save the figure as a PNG
     plt.close()  # Close the figure
+
+
+def create_daily_chart(name, days, values, filename='daily_chart.png'):
+    """Creates a bar chart of the usage per day of one measurement over a period and saves it as a PNG.
+
+    Args:
+        name (str): The human friendly name of the measurement.
+        days (list): The days of the period as date or datetime objects.
+        values (list): The usage of each day.
+        filename (str): The filename to save the bar chart as a PNG.
+
+    Returns:
+        None
+    """
+    x_axis = np.arange(len(days))
+
+    _fig, axis = plt.subplots()
+    axis.bar(x_axis, values, color='skyblue')
+    axis.set_ylabel('Verbrauch in kWh oder m³')
+    axis.set_title(f"{name} {format_dates((days[0], days[-1]))}: {sum(values):.1f}" if days else name)
+    axis.set_xticks(x_axis)
+    axis.set_xticklabels([day.strftime("%d.%m.") for day in days], rotation=90)
+    axis.margins(y=0.1)
+
+    plt.tight_layout()
+    plt.savefig(filename)
+    plt.close()
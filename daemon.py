@@ -0,0 +1,238 @@
+"""Resident report service with a warm process
+
+    python daemon.py [--at 06:00] [--host 127.0.0.1] [--port 8765]
+
+The imports, the config, the connection pool of the InfluxDB client and the processes rendering the
+charts, with matplotlib imported, are set up once. Every day
+at the given time the reports due for the day before run, i.e. the weekly report after a Sunday and
+the monthly report after the first of the month. Reports are also run on demand over HTTP:
+
+    GET /report?date=2024-10-06&period=week   period is week, month or due (default), date defaults to yesterday
+    GET /health
+
+The answer is JSON with the measurements of the reports and the seconds they took.
+"""
+import argparse
+from datetime import datetime, time, timedelta
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
+import threading
+import time as timer
+from urllib.parse import parse_qs, urlparse
+
+from influx import GetFromInflux, InfluxSession
+from main import due_reports, reports_to_dict, run_reports
+from render import ChartRenderer
+
+logger = logging.getLogger("influx_report.daemon")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_REPORT_TIME = time(6, 0)
+
+PERIOD_WEEK = "week"
+PERIOD_MONTH = "month"
+PERIOD_DUE = "due"
+
+
+class ReportDaemon():
+    """Runs reports on a warm InfluxSession, on a daily schedule and on demand"""
+
+    def __init__(self, session: InfluxSession, report_time: time = DEFAULT_REPORT_TIME, renderer: ChartRenderer = None):
+        """
+        Args:
+            session (InfluxSession): session kept open for all reports
+            report_time (time): time of day of the scheduled reports
+            renderer (ChartRenderer): renders the charts of all reports, no charts without it
+        """
+        self.session = session
+        self.report_time = report_time
+        self.renderer = renderer
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def run_reports(self, date, reports):
+        """Run reports, one at a time
+
+        Each run gets its own GetFromInflux, so results of ranges that reach into the present are
+        not kept from one run to the next. The client and its connection pool are shared.
+
+        Args:
+            date (datetime): reference date of the reports, set to 23:59:59
+            reports (list): is_month of each report
+
+        Returns:
+            tuple: the MeasurementSet objects of each report and the seconds the run took
+        """
+        date = date.replace(hour=23, minute=59, second=59, microsecond=0)
+        with self._lock:
+            started = timer.perf_counter()
+            results = run_reports(date, reports, GetFromInflux(self.session), self.renderer)
+            seconds = timer.perf_counter() - started
+            # the session lives as long as the daemon, its metrics are those of one run
+            self.session.metrics.log_summary()
+            self.session.metrics.clear()
+        logger.info("%d reports of %s done in %.2f s", len(reports), date.date(), seconds)
+        return results, seconds
+
+    def next_run(self, now: datetime):
+        """Time of the next scheduled run
+
+        Args:
+            now (datetime): the current time
+
+        Returns:
+            datetime: today at report_time, or tomorrow if that is over
+        """
+        scheduled = datetime.combine(now.date(), self.report_time)
+        return scheduled if scheduled > now else scheduled + timedelta(days=1)
+
+    def run_scheduled(self, now: datetime):
+        """Run the reports due for the day before now
+
+        Args:
+            now (datetime): time of the scheduled run
+
+        Returns:
+            list: the MeasurementSet objects of each report, empty if none is due
+        """
+        yesterday = now - timedelta(days=1)
+        reports = due_reports(yesterday)
+        if not reports:
+            logger.debug("No report due for %s", yesterday.date())
+            return []
+        return self.run_reports(yesterday, reports)[0]
+
+    def serve(self, now=datetime.now):
+        """Run the scheduled reports until stop() is called
+
+        Args:
+            now (callable): returns the current time
+        """
+        while not self._stop.is_set():
+            scheduled = self.next_run(now())
+            logger.info("Next scheduled reports at %s", scheduled)
+            if self._stop.wait((scheduled - now()).total_seconds()):
+                break
+            try:
+                self.run_scheduled(scheduled)
+            except Exception:  # pylint: disable=broad-exception-caught
+                # the daemon keeps running, the next day may work again
+                logger.exception("Scheduled reports of %s failed", scheduled.date())
+
+    def stop(self):
+        """Stop serve()"""
+        self._stop.set()
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """HTTP endpoint of the ReportDaemon, see the module docstring"""
+
+    # set by make_server()
+    daemon = None
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer /health and /report"""
+        url = urlparse(self.path)
+        if url.path == "/health":
+            self._send_json(HTTPStatus.OK, {"status": "ok"})
+            return
+        if url.path != "/report":
+            self._send_json(HTTPStatus.NOT_FOUND, {"error": f"unknown path {url.path}"})
+            return
+
+        query = parse_qs(url.query)
+        try:
+            date = datetime.fromisoformat(query["date"][0]) if "date" in query else datetime.now() - timedelta(days=1)
+            reports = _reports_of_period(query.get("period", [PERIOD_DUE])[0], date)
+        except ValueError as error:
+            self._send_json(HTTPStatus.BAD_REQUEST, {"error": str(error)})
+            return
+
+        try:
+            results, seconds = self.daemon.run_reports(date, reports)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            logger.exception("Reports of %s failed", date.date())
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {"error": str(error)})
+            return
+        self._send_json(HTTPStatus.OK, {**reports_to_dict(date, reports, results), "seconds": round(seconds, 3)})
+
+    def _send_json(self, status, body):
+        """Send a JSON answer"""
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log requests with the logger of the module instead of stderr"""
+        logger.info("%s %s", self.address_string(), format % args)
+
+
+def _reports_of_period(period, date):
+    """is_month of the reports of a requested period
+
+    Raises:
+        ValueError: if the period is unknown
+
+    Returns:
+        list: is_month of each report
+    """
+    if period == PERIOD_MONTH:
+        return [True]
+    if period == PERIOD_WEEK:
+        return [False]
+    if period == PERIOD_DUE:
+        return due_reports(date)
+    raise ValueError(f"unknown period {period}, use {PERIOD_WEEK}, {PERIOD_MONTH} or {PERIOD_DUE}")
+
+
+def make_server(daemon: ReportDaemon, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """HTTP server of the on-demand reports
+
+    Args:
+        daemon (ReportDaemon): runs the reports
+        host (str): address to listen on, localhost by default
+        port (int): port to listen on, 0 for any free port
+
+    Returns:
+        HTTPServer: the server, run it with serve_forever()
+    """
+    handler = type("BoundReportRequestHandler", (ReportRequestHandler,), {"daemon": daemon})
+    return HTTPServer((host, port), handler)
+
+
+def main(argv=None):
+    """Command line of the daemon
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Run the reports on a schedule and on demand in a resident process")
+    parser.add_argument("--at", type=time.fromisoformat, default=DEFAULT_REPORT_TIME, help="time of day of the scheduled reports (default 06:00)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address of the HTTP endpoint (default {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port of the HTTP endpoint (default {DEFAULT_PORT})")
+    parser.add_argument("--chart-workers", type=int, help="processes rendering the charts (default: number of CPUs)")
+    args = parser.parse_args(argv)
+
+    with InfluxSession() as session, ChartRenderer(args.chart_workers) as renderer:
+        logger.info("%d chart workers ready", len(renderer.warm()))
+        daemon = ReportDaemon(session, args.at, renderer)
+        server = make_server(daemon, args.host, args.port)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info("Listening on http://%s:%d", *server.server_address[:2])
+        try:
+            daemon.serve()
+        except KeyboardInterrupt:
+            logger.info("Stopped")
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""Derived measurements: arithmetic expressions over other measurements that InfluxDB evaluates
+
+A derived measurement is named by its expression with a leading DERIVED_PREFIX, e.g.
+
+    =Shelly_Ph1_Total + Shelly_Ph2_Total + Shelly_Ph3_Total
+    =SmartMeter_HeizungNeu_Bezug / 1000 - SmartMeter_Haushalt_Bezug
+
+so it is used like any other measurement name: in the catalog, the query plan, the memo, the cache
+and the rollups. The queries of GetFromInflux read the measurements of the expression, pivot them
+into one row per time and evaluate the expression with map(), so only the combined value is
+transferred, see flux_tail().
+
+An expression has measurement names, names that are no identifiers in quotes, e.g. "Zähler Haus",
+numbers, +, -, *, / and parentheses. If one of its measurements has no value, it has no value. The
+report then reads the measurements of a sum on their own, so only the missing one counts 0 like in a
+line of several measurements, see summands().
+"""
+import ast
+from dataclasses import dataclass
+from functools import lru_cache
+import operator
+
+DERIVED_PREFIX = "="
+
+_OPERATORS = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/"}
+_FUNCTIONS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul, ast.Div: operator.truediv}
+
+
+@dataclass(frozen=True)
+class DerivedMeasurement:
+    """A measurement computed from other measurements
+
+    Attributes:
+        name (str): name of the derived measurement, DERIVED_PREFIX and the expression
+        measurements (tuple): names of the measurements of the expression, in their order
+        tree (ast.Expression): the parsed expression
+    """
+    name: str
+    measurements: tuple
+    tree: ast.Expression
+
+    def flux(self, row="r"):
+        """The expression in Flux, the measurements are columns of a pivoted row
+
+        Args:
+            row (str): name of the row in the map() function
+
+        Returns:
+            str: e.g. (r["a"] + r["b"]) / 1000.0
+        """
+        return _flux(self.tree.body, row)
+
+    def evaluate(self, values):
+        """Value of the expression
+
+        Args:
+            values (dict): value per measurement name
+
+        Returns:
+            float: the value, None if a measurement has no value
+        """
+        if any(values.get(name) is None for name in self.measurements):
+            return None
+        return _evaluate(self.tree.body, values)
+
+    def summands(self):
+        """The measurements of an expression that only adds measurements, e.g. the phases of a meter
+
+        Returns:
+            tuple: the measurement names in their order, empty for any other expression
+        """
+        return tuple(_summands(self.tree.body))
+
+
+def is_derived(name):
+    """Whether a measurement name is a derived measurement"""
+    return name.startswith(DERIVED_PREFIX)
+
+
+def derived_name(expression):
+    """Name of the derived measurement of an expression, the same for expressions that differ only in spacing
+
+    Args:
+        expression (str): e.g. a + b + c
+
+    Raises:
+        ValueError: if the expression is invalid
+
+    Returns:
+        str: e.g. =a + b + c
+    """
+    return DERIVED_PREFIX + ast.unparse(_parse(expression))
+
+
+@lru_cache(maxsize=None)
+def parse_derived(name):
+    """The derived measurement of a name
+
+    Args:
+        name (str): name of a derived measurement, see derived_name()
+
+    Raises:
+        ValueError: if the name is no derived measurement or its expression is invalid
+
+    Returns:
+        DerivedMeasurement: the measurements and the expression
+    """
+    if not is_derived(name):
+        raise ValueError(f"{name} is no derived measurement")
+    tree = _parse(name[len(DERIVED_PREFIX):])
+    return DerivedMeasurement(name, tuple(dict.fromkeys(_names(tree.body))), tree)
+
+
+def source_measurements(names):
+    """Measurements stored in influx of a list of names, derived measurements replaced by their measurements
+
+    Args:
+        names (iterable): measurement names, plain or derived
+
+    Returns:
+        list: the stored measurement names, each once
+    """
+    sources = []
+    for name in names:
+        sources += parse_derived(name).measurements if is_derived(name) else [name]
+    return list(dict.fromkeys(sources))
+
+
+def flux_tail(derived: DerivedMeasurement, time=None):
+    """Flux steps that turn the reduced records of the measurements of a derived measurement into its records
+
+    The records are pivoted into one row per time with a column per measurement, map() evaluates
+    the expression and rows where a measurement is missing are dropped.
+
+    Args:
+        derived (DerivedMeasurement): the derived measurement
+        time (datetime): time of all records, for one value per measurement at different times, e.g. after last()
+
+    Returns:
+        str: the steps, they keep only _measurement, _time and _value
+    """
+    if time is None:
+        steps = """
+        |> keep(columns: ["_measurement", "_time", "_value"])"""
+    else:
+        steps = f"""
+        |> map(fn: (r) => ({{_measurement: r._measurement, _time: {time.strftime('%Y-%m-%dT%H:%M:%SZ')}, _value: r._value}}))"""
+    return steps + f"""
+        |> group()
+        |> pivot(rowKey: ["_time"], columnKey: ["_measurement"], valueColumn: "_value")
+        |> map(fn: (r) => ({{_measurement: {flux_string(derived.name)}, _time: r._time, _value: {derived.flux()}}}))
+        |> filter(fn: (r) => exists r._value)"""
+
+
+def flux_string(text):
+    """Flux string literal of a text"""
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def _parse(expression):
+    """Parse and check an expression"""
+    try:
+        tree = ast.parse(expression.strip(), mode="eval")
+    except SyntaxError as error:
+        raise ValueError(f"Invalid expression {expression}: {error.msg}") from error
+    for node in ast.walk(tree.body):
+        if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+            continue
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+            continue
+        if isinstance(node, ast.Name) or (isinstance(node, ast.Constant) and isinstance(node.value, (str, int, float))):
+            continue
+        if isinstance(node, (ast.operator, ast.unaryop, ast.expr_context)):
+            continue
+        raise ValueError(f"Invalid expression {expression}: only measurements, numbers, +, -, *, / and parentheses are allowed")
+    if not list(_names(tree.body)):
+        raise ValueError(f"Invalid expression {expression}: no measurement")
+    return tree
+
+
+def _names(node):
+    """Measurement names of an expression in their order"""
+    if isinstance(node, ast.Name):
+        yield node.id
+    elif isinstance(node, ast.Constant) and isinstance(node.value, str):
+        yield node.value
+    for child in ast.iter_child_nodes(node):
+        yield from _names(child)
+
+
+def _summands(node):
+    """Measurement names of a sum of measurements, an empty list for any other node"""
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        left, right = _summands(node.left), _summands(node.right)
+        return left + right if left and right else []
+    if isinstance(node, ast.Name):
+        return [node.id]
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    return []
+
+
+def _flux(node, row):
+    """Flux of a node of a checked expression, numbers as floats like the values"""
+    if isinstance(node, ast.BinOp):
+        return f"({_flux(node.left, row)} {_OPERATORS[type(node.op)]} {_flux(node.right, row)})"
+    if isinstance(node, ast.UnaryOp):
+        return f"{'-' if isinstance(node.op, ast.USub) else '+'}{_flux(node.operand, row)}"
+    if isinstance(node, ast.Name):
+        return f"{row}[{flux_string(node.id)}]"
+    if isinstance(node.value, str):
+        return f"{row}[{flux_string(node.value)}]"
+    return repr(float(node.value))
+
+
+def _evaluate(node, values):
+    """Value of a node of a checked expression"""
+    if isinstance(node, ast.BinOp):
+        return _FUNCTIONS[type(node.op)](_evaluate(node.left, values), _evaluate(node.right, values))
+    if isinstance(node, ast.UnaryOp):
+        return -_evaluate(node.operand, values) if isinstance(node.op, ast.USub) else _evaluate(node.operand, values)
+    if isinstance(node, ast.Name):
+        return float(values[node.id])
+    return float(values[node.value] if isinstance(node.value, str) else node.value)
@@ -0,0 +1,167 @@
+"""Downsampled buckets that long ranges are read from instead of the raw data
+
+InfluxDB tasks keep aggregates of the raw bucket in coarser buckets, e.g. every minute and every
+hour. Each window is written with the time of its start and two fields:
+
+- mean: the mean power of a watt measurement, times the window length this is the energy
+- last: the last value of a counter measurement
+
+GetFromInflux reads the whole windows of a range from the coarsest bucket that is fine enough for
+it, see choose_bucket(), and the partial windows at the edges of the range from the raw bucket, see
+route(). Windows that the task may not have written yet are read from the raw bucket as well.
+The tasks that keep the buckets are generated by downsample_tasks.py.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+import re
+
+FIELD_MEAN = "mean"
+FIELD_LAST = "last"
+# a bucket is used if its window is at most this fraction of the range
+DEFAULT_ACCURACY = 0.01
+
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+_DAY = timedelta(days=1)
+
+
+@dataclass(frozen=True)
+class DownsampledBucket:
+    """A bucket with aggregates of the raw bucket
+
+    Attributes:
+        name (str): name of the bucket
+        every (timedelta): length of the windows, divides a day
+    """
+    name: str
+    every: timedelta
+
+    @property
+    def duration(self):
+        """The window length as a Flux duration, e.g. 1h"""
+        return format_duration(self.every)
+
+
+@dataclass(frozen=True)
+class DownsampleRoute:
+    """The part of a range that is read from a downsampled bucket
+
+    Attributes:
+        bucket (DownsampledBucket): the bucket
+        start (datetime): start of the first whole window of the range
+        stop (datetime): end of the last whole window of the range that the task has written
+    """
+    bucket: DownsampledBucket
+    start: datetime
+    stop: datetime
+
+
+def parse_duration(text):
+    """Parse a duration like 30s, 1m, 1h or 1d
+
+    Raises:
+        ValueError: if the text is no such duration
+
+    Returns:
+        timedelta: the duration
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*([smhd])\s*", text)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Invalid duration '{text}', expected e.g. 1m or 1h")
+    return timedelta(seconds=int(match.group(1)) * _UNITS[match.group(2)])
+
+
+def format_duration(duration):
+    """The largest unit a duration is a multiple of, e.g. 1h for one hour
+
+    Returns:
+        str: the Flux duration
+    """
+    seconds = int(duration.total_seconds())
+    for unit, size in sorted(_UNITS.items(), key=lambda item: -item[1]):
+        if seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+
+def parse_buckets(text):
+    """Parse the downsampled_buckets option, e.g. power_1m:1m, power_1h:1h
+
+    Raises:
+        ValueError: if an entry has no name or window, or the window does not divide a day
+
+    Returns:
+        list: DownsampledBucket objects, the coarsest first
+    """
+    buckets = []
+    for entry in filter(None, (entry.strip() for entry in text.split(","))):
+        name, _, every = entry.partition(":")
+        if not name.strip() or not every:
+            raise ValueError(f"Invalid downsampled bucket '{entry}', expected name:window, e.g. power_1h:1h")
+        bucket = DownsampledBucket(name.strip(), parse_duration(every))
+        if _DAY % bucket.every:
+            raise ValueError(f"Window {every} of bucket {bucket.name} does not divide a day")
+        buckets.append(bucket)
+    return sorted(buckets, key=lambda bucket: bucket.every, reverse=True)
+
+
+def choose_bucket(buckets, span, accuracy=DEFAULT_ACCURACY):
+    """The coarsest bucket whose window is at most accuracy of a span
+
+    Args:
+        buckets (list): DownsampledBucket objects, the coarsest first
+        span (timedelta): length of the range
+        accuracy (float): fraction of the span a window may be long at most
+
+    Returns:
+        DownsampledBucket: the bucket, None if none is fine enough
+    """
+    for bucket in buckets:
+        if bucket.every <= span * accuracy:
+            return bucket
+    return None
+
+
+def route(buckets, start, stop, accuracy=DEFAULT_ACCURACY, now=None):
+    """The whole windows of a range that are read from a downsampled bucket
+
+    The windows are aligned to midnight UTC, naive times are UTC like in the queries. Windows that
+    end later than one window before now may not be written by the task yet and are left out.
+
+    Args:
+        buckets (list): DownsampledBucket objects, the coarsest first
+        start (datetime): start of the range
+        stop (datetime): end of the range
+        accuracy (float): fraction of the span a window may be long at most
+        now (datetime): the current time, defaults to now in UTC
+
+    Returns:
+        DownsampleRoute: the whole windows, None if the range has none
+    """
+    bucket = choose_bucket(buckets, stop - start, accuracy)
+    if bucket is None:
+        return None
+    now = now or datetime.now(timezone.utc)
+    if start.tzinfo is None:
+        now = now.astimezone(timezone.utc).replace(tzinfo=None) if now.tzinfo else now
+    written = _floor(_as_offset(now), bucket.every) - bucket.every
+    first = -_floor(-_as_offset(start), bucket.every)
+    last = min(_floor(_as_offset(stop), bucket.every), written)
+    if first >= last:
+        return None
+    epoch = _epoch(start)
+    return DownsampleRoute(bucket, epoch + first, epoch + last)
+
+
+def _epoch(date):
+    """Midnight of 1970-01-01 in the zone of the date"""
+    return datetime(1970, 1, 1, tzinfo=timezone.utc) if date.tzinfo else datetime(1970, 1, 1)
+
+
+def _as_offset(date):
+    """Time since the epoch of a date"""
+    return date - _epoch(date)
+
+
+def _floor(offset, every):
+    """Round a time since the epoch down to a multiple of every"""
+    return offset - offset % every
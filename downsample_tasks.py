@@ -0,0 +1,107 @@
+"""InfluxDB tasks that keep the downsampled buckets of downsample.py
+
+Each task aggregates the last window of the raw bucket into its downsampled bucket: the mean of the
+watt measurements and the last value of the counters of the catalog. The task definitions are
+generated from the config and the catalog:
+
+    python downsample_tasks.py [--config config.ini] [--catalog catalog.ini] [--output-dir tasks]
+"""
+import argparse
+import configparser
+import logging
+import os
+
+from catalog import TYPE_COUNTER, TYPE_WATT, load_catalog
+from derived import source_measurements
+from downsample import FIELD_LAST, FIELD_MEAN, DownsampledBucket, parse_buckets
+
+logger = logging.getLogger("influx_report.downsample_tasks")
+
+# delay of the task runs after the end of a window, so late samples are included
+DEFAULT_TASK_OFFSET = "1m"
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def task_definition(bucket: DownsampledBucket, source_bucket, org, watt_measurements, counter_measurements, offset=DEFAULT_TASK_OFFSET):
+    """Flux of the task that keeps a downsampled bucket
+
+    Args:
+        bucket (DownsampledBucket): the bucket the task writes
+        source_bucket (str): the raw bucket
+        org (str): the organisation of both buckets
+        watt_measurements (list): measurements whose mean is written
+        counter_measurements (list): measurements whose last value is written
+        offset (str): delay of each run after the end of a window
+
+    Returns:
+        str: the task, e.g. for influx task create --file
+    """
+    task = f'''option task = {{name: "influx_report downsample {bucket.name}", every: {bucket.duration}, offset: {offset}}}
+
+data = from(bucket: "{source_bucket}")
+    |> range(start: -task.every)
+'''
+    for field, function, measurements in ((FIELD_MEAN, "mean", watt_measurements), (FIELD_LAST, "last", counter_measurements)):
+        if not measurements:
+            continue
+        names = ", ".join(f'"{name}"' for name in measurements)
+        task += f'''
+data
+    |> filter(fn: (r) => contains(value: r._measurement, set: [{names}]))
+    |> aggregateWindow(every: {bucket.duration}, fn: {function}, timeSrc: "_start", createEmpty: false)
+    |> set(key: "_field", value: "{field}")
+    |> to(bucket: "{bucket.name}", org: "{org}")
+'''
+    return task
+
+
+def task_definitions(config_file="config.ini", catalog=None):
+    """Task definitions of all downsampled buckets of the config
+
+    Args:
+        config_file (str): the config file with downsampled_buckets in the [InfluxDB] section
+        catalog (list): CatalogEntry objects, defaults to the catalog file
+
+    Returns:
+        dict: the Flux of the task per bucket name
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    catalog = catalog or load_catalog()
+    watt = source_measurements(name for entry in catalog if entry.type == TYPE_WATT for name in entry.measurements)
+    counters = source_measurements(name for entry in catalog if entry.type == TYPE_COUNTER for name in entry.measurements)
+    buckets = parse_buckets(config.get("InfluxDB", "downsampled_buckets", fallback=""))
+    return {
+        bucket.name: task_definition(bucket, config.get("InfluxDB", "bucket"), config.get("InfluxDB", "org"), watt, counters) for bucket in buckets
+    }
+
+
+def main(argv=None):
+    """Command line of the task generator
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Generate the InfluxDB tasks that keep the downsampled buckets")
+    parser.add_argument("--config", default="config.ini", help="config file with downsampled_buckets (default config.ini)")
+    parser.add_argument("--catalog", help="catalog file of the measurements (default catalog.ini)")
+    parser.add_argument("--output-dir", help="write one <bucket>.flux file per task instead of printing them")
+    args = parser.parse_args(argv)
+
+    tasks = task_definitions(args.config, load_catalog(args.catalog) if args.catalog else None)
+    if not tasks:
+        logger.warning("No downsampled_buckets in the [InfluxDB] section of %s", args.config)
+    for name, task in tasks.items():
+        if args.output_dir:
+            os.makedirs(args.output_dir, exist_ok=True)
+            path = os.path.join(args.output_dir, f"{name}.flux")
+            with open(path, "w", encoding="utf-8") as file:
+                file.write(task)
+            logger.info("Task of %s written to %s", name, path)
+        else:
+            print(task)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    main()
@@ -0,0 +1,365 @@
+"""Run the reports without a database, from exports of InfluxDB on disk
+
+    python main.py --export archive/
+    python backfill.py 2023-01-01 2023-12-31 --export archive/power.lp
+
+ExportInflux answers the queries of GetFromInflux like SyntheticInflux does, from files instead of
+synthetic series. A file or all files of a directory are read:
+
+- line protocol (.lp, .line, .txt), e.g. of influxd inspect export-lp: measurement[,tags] field=value
+  timestamp in nanoseconds. The first field of a line is its value, lines starting with # are skipped.
+- annotated CSV (.csv), e.g. of influx query --raw, or plain CSV with the columns _measurement, _time
+  (RFC3339) and _value.
+
+The files are memory-mapped and never read as a whole. When a file is opened for the first time its
+lines are scanned once for a time index: per measurement the runs of consecutive lines that are
+sorted by time, with the time and offset of every INDEX_STRIDE-th line. The index is stored next to
+the file as <file>.index.json and reused as long as the file does not change. A query of a range
+only reads the runs of its measurements that overlap the range, from the last indexed line before
+its start until its end.
+"""
+from bisect import bisect_left
+import configparser
+import csv
+from dataclasses import asdict, dataclass, field, replace
+import json
+import logging
+import mmap
+import os
+import re
+
+import numpy as np
+
+from influx import query_options
+from synthetic import Series, SyntheticInflux
+
+logger = logging.getLogger("influx_report.export")
+
+FORMAT_LINE_PROTOCOL = "line protocol"
+FORMAT_CSV = "csv"
+SUFFIXES = {".lp": FORMAT_LINE_PROTOCOL, ".line": FORMAT_LINE_PROTOCOL, ".txt": FORMAT_LINE_PROTOCOL, ".csv": FORMAT_CSV}
+INDEX_SUFFIX = ".index.json"
+# lines of a measurement between two entries of its index, a lookup reads at most this many of its lines before the range
+INDEX_STRIDE = 1024
+INDEX_VERSION = 2
+
+# the parts of a line of line protocol: key with the tags, fields and timestamp, separated by unescaped spaces
+_LINE_PROTOCOL_PART = re.compile(rb'(?:\\.|"(?:\\.|[^"\\])*"|[^ \\"])+')
+_UNESCAPED_COMMA = re.compile(rb"(?<!\\),")
+_ESCAPE = re.compile(rb"\\(.)")
+
+
+@dataclass
+class IndexRun:
+    """Lines of one measurement of a file sorted by time, lines of other measurements may lie between them
+
+    Attributes:
+        measurement (str): name of the measurement
+        first_ns (int): time of the first line
+        last_ns (int): time of the last line
+        stop_offset (int): offset after the last line
+        times_ns (list): time of every INDEX_STRIDE-th line of the measurement, starting with the first
+        offsets (list): offsets of these lines
+        columns (list): positions of _measurement, _time and _value in a CSV row, empty for line protocol
+    """
+    measurement: str
+    first_ns: int
+    last_ns: int
+    stop_offset: int = 0
+    times_ns: list = field(default_factory=list)
+    offsets: list = field(default_factory=list)
+    columns: list = field(default_factory=list)
+
+
+class ExportFile():
+    """A memory-mapped export with its time index"""
+
+    def __init__(self, path, save_index=True):
+        """
+        Args:
+            path (str): the file
+            save_index (bool): store a newly built index next to the file
+        """
+        self.path = path
+        self.format = SUFFIXES.get(os.path.splitext(path)[1].lower(), FORMAT_LINE_PROTOCOL)
+        self._file = open(path, "rb")  # pylint: disable=consider-using-with
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+        self.runs = self._load_index()
+        if self.runs is None:
+            self.runs = self._build_index()
+            if save_index:
+                self._save_index()
+
+    @property
+    def measurements(self):
+        """Names of the measurements of the file"""
+        return set(self.runs)
+
+    def read(self, measurement, start_ns, stop_ns):
+        """The samples of a measurement in a range
+
+        Args:
+            measurement (str): name of the measurement
+            start_ns (int): start of the range
+            stop_ns (int): end of the range, exclusive
+
+        Returns:
+            tuple: lists of the timestamps in nanoseconds and of the values, sorted by time within each run
+        """
+        timestamps, values = [], []
+        for run in self.runs.get(measurement, []):
+            if run.last_ns < start_ns or run.first_ns >= stop_ns:
+                continue
+            # the last indexed line before the start, lines with the time of the start may precede an indexed one
+            offset = run.offsets[max(0, bisect_left(run.times_ns, start_ns) - 1)]
+            columns = run.columns
+            for _, line in _lines(self._data, offset, run.stop_offset):
+                header = _csv_header(line) if self.format == FORMAT_CSV else None
+                if header is not None:
+                    columns = header
+                    continue
+                # lines of other measurements, also of CSV tables with other columns, lie between the lines of the run
+                sample = self._parse(line, columns) if columns == run.columns else None
+                if sample is None or sample[0] != measurement:
+                    continue
+                if sample[1] >= stop_ns:
+                    break
+                if sample[1] >= start_ns:
+                    timestamps.append(sample[1])
+                    values.append(sample[2])
+        return timestamps, values
+
+    def close(self):
+        """Unmap and close the file"""
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def _parse(self, line, columns):
+        """Measurement, timestamp and value of a line, None if it holds no sample"""
+        if self.format == FORMAT_CSV:
+            return _parse_csv(line, columns)
+        return _parse_line_protocol(line)
+
+    def _build_index(self):
+        """Scan all lines once and index the lines of each measurement
+
+        A measurement has a new run only where its time goes back or the columns of its CSV table
+        change, so a time-ordered export of interleaved measurements has one run per measurement.
+        """
+        runs = {}
+        current = {}
+        counts = {}
+        columns = []
+        for offset, line in _lines(self._data):
+            header = _csv_header(line) if self.format == FORMAT_CSV else None
+            if header is not None:
+                columns = header
+                continue
+            sample = self._parse(line, columns)
+            if sample is None:
+                continue
+            measurement, timestamp_ns, _ = sample
+            run = current.get(measurement)
+            if run is None or timestamp_ns < run.last_ns or run.columns != columns:
+                run = IndexRun(measurement, timestamp_ns, timestamp_ns, times_ns=[timestamp_ns], offsets=[offset], columns=columns)
+                runs.setdefault(measurement, []).append(run)
+                current[measurement] = run
+                counts[measurement] = 0
+            else:
+                counts[measurement] += 1
+                if counts[measurement] % INDEX_STRIDE == 0:
+                    run.times_ns.append(timestamp_ns)
+                    run.offsets.append(offset)
+            run.last_ns = timestamp_ns
+            run.stop_offset = offset + len(line) + 1
+        for run in current.values():
+            run.stop_offset = min(run.stop_offset, len(self._data))
+        logger.info("Indexed %s: %d runs of %d measurements", self.path, sum(len(measurement_runs) for measurement_runs in runs.values()), len(runs))
+        return runs
+
+    def _stamp(self):
+        """Size and modification time of the file, an index is valid for the file it was built of"""
+        stat = os.stat(self.path)
+        return {"version": INDEX_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "stride": INDEX_STRIDE}
+
+    def _load_index(self):
+        """The stored index, None if there is none or the file has changed"""
+        try:
+            with open(self.path + INDEX_SUFFIX, encoding="utf-8") as file:
+                stored = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if stored.get("stamp") != self._stamp():
+            logger.debug("Index of %s is outdated", self.path)
+            return None
+        runs = {}
+        for run in stored["runs"]:
+            runs.setdefault(run["measurement"], []).append(IndexRun(**run))
+        return runs
+
+    def _save_index(self):
+        """Store the index next to the file, e.g. not possible on a read-only archive"""
+        try:
+            with open(self.path + INDEX_SUFFIX, "w", encoding="utf-8") as file:
+                json.dump({"stamp": self._stamp(), "runs": [asdict(run) for runs in self.runs.values() for run in runs]}, file)
+        except OSError as error:
+            logger.debug("Index of %s not stored: %s", self.path, error)
+
+
+class ExportInflux(SyntheticInflux):
+    """Answers the Flux queries of GetFromInflux from exports on disk, like query_api() of the client
+
+        with ExportInflux("archive/") as export:
+            influx = GetFromInflux(export.session())
+    """
+
+    def __init__(self, path, bucket="export", save_index=True):
+        """
+        Args:
+            path (str): an export or a directory of exports
+            bucket (str): bucket of the session
+            save_index (bool): store newly built indexes next to the files
+        """
+        super().__init__([], bucket)
+        self.files = [ExportFile(file, save_index) for file in export_files(path)]
+        self.sessions = []
+        if not self.files:
+            logger.warning("No exports found in %s", path)
+
+    @property
+    def measurements(self):
+        """Names of the measurements of all files"""
+        return set().union(*(file.measurements for file in self.files))
+
+    def configured_session(self, config_file="config.ini", metrics=None):
+        """Session with the options of the [InfluxDB] section of a config file, the defaults without one
+
+        The options that need a database are turned off: cache_file, rollup_file, downsampled_buckets
+        and concurrency. The session is closed together with the export.
+
+        Args:
+            config_file (str): the config file, it may be missing
+            metrics (RunMetrics): records the queries of the session, a new one by default
+
+        Returns:
+            StandInSession: the session for GetFromInflux
+        """
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        options = replace(query_options(config), cache_file="", rollup_file="", downsampled_buckets="", concurrency=0)
+        session = self.session(metrics, **asdict(options))
+        self.sessions.append(session)
+        return session
+
+    def samples(self, measurement, start_ns, stop_ns):
+        """The samples of a measurement in a range, read from all files
+
+        Args:
+            measurement (str): name of the measurement
+            start_ns (int): start of the range
+            stop_ns (int): end of the range, exclusive
+
+        Returns:
+            Series: samples of the range sorted by time, None if there are none
+        """
+        parts = [file.read(measurement, start_ns, stop_ns) for file in self.files]
+        timestamps_ns = np.array([timestamp for timestamps, _ in parts for timestamp in timestamps], dtype=np.int64)
+        if timestamps_ns.size == 0:
+            return None
+        values = np.array([value for _, values in parts for value in values], dtype=np.float64)
+        order = np.argsort(timestamps_ns, kind="stable")
+        return Series(measurement, timestamps_ns[order], values[order])
+
+    def close(self):
+        """Close the configured sessions and all files"""
+        for session in self.sessions:
+            session.close()
+        self.sessions = []
+        for file in self.files:
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def export_files(path):
+    """The exports of a path
+
+    Args:
+        path (str): an export or a directory, whose files with one of the SUFFIXES are read in the order of their names
+
+    Returns:
+        list: paths of the files
+    """
+    if not os.path.isdir(path):
+        return [path]
+    return [
+        os.path.join(path, name)
+        for name in sorted(os.listdir(path))
+        if os.path.splitext(name)[1].lower() in SUFFIXES and os.path.isfile(os.path.join(path, name))
+    ]
+
+
+def _lines(data, start=0, stop=None):
+    """Offset and bytes of each line from start until before stop, without the line break"""
+    stop = len(data) if stop is None else stop
+    while start < stop:
+        end = data.find(b"\n", start, stop)
+        end = stop if end < 0 else end
+        yield start, data[start:end].rstrip(b"\r")
+        start = end + 1
+
+
+def _parse_line_protocol(line):
+    """Measurement, timestamp and value of the first field of a line of line protocol, None if it has none"""
+    if not line or line.startswith(b"#"):
+        return None
+    parts = _LINE_PROTOCOL_PART.findall(line)
+    if len(parts) != 3 or not parts[2].isdigit():
+        return None
+    measurement = _ESCAPE.sub(rb"\1", _UNESCAPED_COMMA.split(parts[0], 1)[0])
+    _, _, value = _UNESCAPED_COMMA.split(parts[1], 1)[0].partition(b"=")
+    try:
+        value = float(value[:-1] if value[-1:] in (b"i", b"u") else value)
+    except ValueError:
+        # strings and booleans
+        return None
+    return measurement.decode("utf-8"), int(parts[2]), value
+
+
+def _csv_header(line):
+    """Positions of _measurement, _time and _value if the line is the header of a CSV table, otherwise None"""
+    if b"_time" not in line or b"_value" not in line:
+        return None
+    row = next(csv.reader([line.decode("utf-8")]))
+    if not {"_measurement", "_time", "_value"} <= set(row):
+        return None
+    return [row.index("_measurement"), row.index("_time"), row.index("_value")]
+
+
+def _parse_csv(line, columns):
+    """Measurement, timestamp and value of a CSV row, None for annotations, headers and rows without a value"""
+    if not columns or not line or line.startswith(b"#"):
+        return None
+    row = next(csv.reader([line.decode("utf-8")]))
+    try:
+        return row[columns[0]], _parse_rfc3339(row[columns[1]]), float(row[columns[2]])
+    except (IndexError, ValueError):
+        return None
+
+
+def _parse_rfc3339(text):
+    """Nanoseconds since epoch of an RFC3339 time, times without a zone are UTC"""
+    text = text.strip()
+    if text.endswith("Z"):
+        text = text[:-1]
+    elif re.search(r"[+-]\d\d:\d\d$", text):
+        offset_minutes = int(text[-6:-3]) * 60 + (int(text[-2:]) if text[-6] == "+" else -int(text[-2:]))
+        return int(np.datetime64(text[:-6], "ns").astype(np.int64)) - offset_minutes * 60 * 1_000_000_000
+    if not text or not text[0].isdigit():
+        raise ValueError(f"Invalid time '{text}'")
+    return int(np.datetime64(text, "ns").astype(np.int64))
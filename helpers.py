@@ -2,9 +2,12 @@
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 import logging
-from typing import \
+from typing import TYPE_CHECKING, \
     List  # until Python 3.8 you can't use list[] but must use typing.List[]
 
+if TYPE_CHECKING:
+    from baseline import Baseline
+
 logger = logging.getLogger("influx_report.helpers")
 
 
@@ -16,10 +19,30 @@ class MeasurementSet:
         name (str): The name of the measurement set.
         data (list): A list containing the measurement data.
         dates (tuple): A tuple containing the dates associated with the measurements.
+        missing (bool): The values could not be queried in time, data is 0.0.
+        baseline (baseline.Baseline): Statistics of the line against its daily history, None if not computed.
     """
     name: str
     data: list
     dates: tuple
+    missing: bool = False
+    baseline: "Baseline" = None
+
+    def to_dict(self):
+        """The measurement set as JSON serialisable dict, the dates in ISO format
+
+        Returns:
+            dict: name, data, dates and missing, and the baseline if it is computed
+        """
+        result = {
+            "name": self.name,
+            "data": list(self.data),
+            "dates": [[date.isoformat() for date in timeframe] for timeframe in self.dates],
+            "missing": self.missing,
+        }
+        if self.baseline is not None:
+            result["baseline"] = self.baseline.to_dict()
+        return result
 
 
 def log_difference(values, timeframes, measurement_name):
@@ -143,3 +166,33 @@ def get_same_calendar_week_day_one_year_ago(date):
     same_weekday_one_year_ago = first_day_of_year_one_ago + timedelta(days=current_weekday)
 
     return same_weekday_one_year_ago
+
+
+def get_same_calendar_week_days_one_year_ago(dates):
+    """Vectorised get_same_calendar_week_day_one_year_ago() for many dates at once.
+
+    The ISO calendar week of every date is computed with integer arithmetic on day numbers,
+    then the same weekday of that week in the year before is looked up.
+
+    Args:
+        dates (list): The reference dates, datetime, date or numpy datetime64 objects.
+
+    Returns:
+        numpy.ndarray: datetime64[D] array of the corresponding weekdays from the same calendar week one year ago.
+    """
+    # only the backfill needs numpy here, keep it out of the start of a report
+    import numpy as np  # pylint: disable=import-outside-toplevel
+    days = np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+    # 01.01.1970 was a Thursday, 0=Monday, 6=Sunday
+    weekday = (days + 3) % 7
+    year = days.astype("datetime64[D]").astype("datetime64[Y]").astype(np.int64) + 1970
+
+    # the ISO week of a date is the week of its Thursday, counted in the year of the Thursday
+    thursday = days - weekday + 3
+    thursday_year_start = thursday.astype("datetime64[D]").astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64)
+    calendar_week = (thursday - thursday_year_start) // 7 + 1
+
+    # week 1 of a year is the week with 4 January in it
+    january_4 = (year - 1 - 1970).astype("datetime64[Y]").astype("datetime64[D]").astype(np.int64) + 3
+    first_monday = january_4 - (january_4 + 3) % 7
+    return (first_monday + 7 * (calendar_week - 1) + weekday).astype("datetime64[D]")
@@ -1,9 +1,27 @@
 """Get data from InfluxDB"""
-from datetime import datetime
-from dataclasses import dataclass
+# pylint: disable=too-many-lines
+from datetime import datetime, time, timedelta, timezone
+from dataclasses import dataclass, fields, replace
+import asyncio
+from itertools import islice
 import logging
 import configparser
-from influxdb_client import InfluxDBClient
+import socket
+import threading
+import time as timer
+from typing import TYPE_CHECKING
+from baseline import DEFAULT_BASELINE_WINDOW, DEFAULT_OUTLIER_ZSCORE
+from cache import DEFAULT_CACHE_TTL, ResultCache
+from derived import flux_tail, is_derived, parse_derived
+from downsample import DEFAULT_ACCURACY, FIELD_LAST, FIELD_MEAN, DownsampleRoute, parse_buckets, route
+from integration import RULE_LEFT, DailyEnergyAccumulator, EnergyAccumulator, LastValueAccumulator
+from metrics import RunMetrics
+from query_request import KIND_KWH, KIND_SNAPSHOTS, KIND_VALUES, QueryRequest
+from resilience import QueryGuard
+from rollup import KIND_ENERGY, KIND_LAST, RollupStore, contiguous_spans, days_between, last_on_or_before, sum_days
+
+if TYPE_CHECKING:
+    from influxdb_client import InfluxDBClient
 
 
 @dataclass
@@ -13,29 +31,186 @@ class InfluxConfigClass:
     token: str
     org: str
     bucket: str
-    client: InfluxDBClient
+    client: "InfluxDBClient"
+
+
+@dataclass
+class IntegrationParity:
+    """kWh of one measurement and timespan computed on the client and on the server
+
+    Attributes:
+        measurement_name (str): name of the measurement stored in influx
+        client_kwh (float): left-Riemann sum of the raw samples
+        server_kwh (float): Flux integral() evaluated by InfluxDB
+    """
+    measurement_name: str
+    client_kwh: float
+    server_kwh: float
+
+    @property
+    def difference(self):
+        """float: server_kwh - client_kwh"""
+        return self.server_kwh - self.client_kwh
+
+    @property
+    def relative_difference(self):
+        """float: difference relative to client_kwh, 0.0 if both are 0"""
+        if self.client_kwh == 0.0:
+            return 0.0 if self.server_kwh == 0.0 else float("inf")
+        return self.difference / self.client_kwh
 
 
 logger = logging.getLogger("influx_report.influx")
 
+DEFAULT_POOL_SIZE = 4
+# section of the config file with the options of InfluxDB, and the defaults of the sites
+DEFAULT_SECTION = "InfluxDB"
+DEFAULT_KEEP_ALIVE = True
+# ask for gzip compressed responses, annotated CSV shrinks to a fraction
+DEFAULT_GZIP = True
+DEFAULT_LOOKBACK_DAYS = 7
 
-# pylint: disable-next=too-few-public-methods
-class GetFromInflux():
-    """Get data from InfluxDB"""
+# left-Riemann sum of the raw samples on the client, the reference
+INTEGRATION_CLIENT = "client"
+# integral() on the server, only one scalar per measurement is transferred
+INTEGRATION_SERVER = "server"
+DEFAULT_INTEGRATION = INTEGRATION_CLIENT
+# seconds, 0 integrates every interval in full
+DEFAULT_MAX_GAP = 0.0
+
+# results of the pipelines of a query routed to a downsampled bucket, see kwh_batch_query()
+RESULT_HEAD = "head"
+RESULT_DOWNSAMPLED = "downsampled"
+RESULT_TAIL = "tail"
+# separates the result of a pipeline of a derived measurement from the result it belongs to, e.g. 2024-10-06#1
+DERIVED_RESULT_SEPARATOR = "#"
+
+# seconds of the first random delay before a retry, doubled with every retry
+DEFAULT_RETRY_BACKOFF = 0.5
+
+# the only columns the reduction reads, every other column is dropped by the server, see KEEP
+KEEP_COLUMNS = ("_measurement", "_time", "_value")
+KEEP = f"""
+        |> keep(columns: [{", ".join(f'"{column}"' for column in KEEP_COLUMNS)}])"""
+
+# streamed records taken at once by _records(), so reading the clock does not slow down the stream
+RECORDS_PER_CHUNK = 1000
+
+
+@dataclass
+class QueryOptionsClass:  # pylint: disable=too-many-instance-attributes
+    """Options of the [InfluxDB] section that control how GetFromInflux queries and reduces data
+
+    Attributes:
+        lookback_days (int): days a counter snapshot looks back if the requested day has no data
+        integration (str): how watt measurements become kWh, INTEGRATION_CLIENT or INTEGRATION_SERVER
+        integration_rule (str): rule of the client integration, see integration.integrate_kwh()
+        max_gap (float): seconds a value is integrated at most, 0 for no limit
+        streaming (bool): stream the records with query_stream() instead of materialising all tables
+        concurrency (int): queries of prefetch() in flight at once on the async client, 0 runs them one after another
+        rate_limit (float): queries of prefetch() started per second at most, 0 for no limit
+        batch_size (int): measurements per query of prefetch(), 0 puts all measurements of a request into one query
+        cache_file (str): SQLite file that keeps query results between runs, empty disables the cache
+        cache_ttl (int): seconds a cached result of a range that reaches into the present stays valid
+        rollup_file (str): SQLite file with daily rollups that prefetch() computes the results from, empty disables it
+        downsampled_buckets (str): buckets with aggregates of the raw data, e.g. power_1m:1m, power_1h:1h, see downsample.py
+        downsample_accuracy (float): a downsampled bucket is used if its window is at most this fraction of the range
+        query_timeout (float): seconds a query may take, 0 for no limit
+        retries (int): retries of a query after a transient error, e.g. a refused connection or a 503
+        retry_backoff (float): seconds a retry is delayed at most, doubled with every retry
+        hedge_percentile (float): latency percentile of the queries of the run after which a second request is sent, 0 disables hedging
+        report_deadline (float): seconds a run may take, afterwards no query is sent and the missing lines are marked, 0 for no limit
+        gzip (bool): ask for gzip compressed responses
+        baseline_years (int): years of daily usage before a report its lines are compared with, 0 disables the baseline, see baseline.py
+        baseline_window (int): days before a day its rolling baseline statistics are computed from
+        outlier_zscore (float): z-score beyond which a period or a day of a line is flagged as an outlier
+    """
+    lookback_days: int = DEFAULT_LOOKBACK_DAYS
+    integration: str = DEFAULT_INTEGRATION
+    integration_rule: str = RULE_LEFT
+    max_gap: float = DEFAULT_MAX_GAP
+    streaming: bool = False
+    concurrency: int = 0
+    rate_limit: float = 0.0
+    batch_size: int = 0
+    cache_file: str = ""
+    cache_ttl: int = DEFAULT_CACHE_TTL
+    rollup_file: str = ""
+    downsampled_buckets: str = ""
+    downsample_accuracy: float = DEFAULT_ACCURACY
+    query_timeout: float = 0.0
+    retries: int = 0
+    retry_backoff: float = DEFAULT_RETRY_BACKOFF
+    hedge_percentile: float = 0.0
+    report_deadline: float = 0.0
+    gzip: bool = DEFAULT_GZIP
+    baseline_years: int = 0
+    baseline_window: int = DEFAULT_BASELINE_WINDOW
+    outlier_zscore: float = DEFAULT_OUTLIER_ZSCORE
+
+    def __post_init__(self):
+        if self.integration not in (INTEGRATION_CLIENT, INTEGRATION_SERVER):
+            raise ValueError(f"Unknown integration {self.integration}, use {INTEGRATION_CLIENT} or {INTEGRATION_SERVER}")
+
+
+# pylint: disable-next=too-many-instance-attributes
+class InfluxSession():
+    """One pooled InfluxDB client and one query API shared by all queries of a run
+
+    Use it as a context manager so the connections are closed at the end of the run:
+
+        with InfluxSession() as session:
+            influx = GetFromInflux(session)
+    """
 
-    def __init__(self):
-        """Parse config.ini and create the influx client"""
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(self,
+                 config_file='config.ini',
+                 pool_size=None,
+                 keep_alive=None,
+                 metrics: RunMetrics = None,
+                 section=DEFAULT_SECTION,
+                 pool_manager=None):
+        """Parse the [InfluxDB] section of the config file and create the pooled client
+
+        Args:
+            config_file (str): path to the config file, defaults to config.ini
+            pool_size (int): number of connections kept open for reuse, overrides pool_size of the config
+            keep_alive (bool): enable TCP keep-alive on the pooled connections, overrides keep_alive of the config
+            metrics (RunMetrics): records the queries of the session, a new one by default
+            section (str): section of a site, e.g. "InfluxDB home", options it does not set are read from [InfluxDB]
+            pool_manager (urllib3.PoolManager): connection pool shared with other sessions instead of an own one,
+                concurrency is turned off then, as the async client would not use it
+        """
+        # the client library takes long to import, only import it when a session is opened
+        # pylint: disable-next=import-outside-toplevel
+        from influxdb_client import InfluxDBClient
         config = configparser.ConfigParser()
 
         try:
-            config.read('config.ini')
+            config.read(config_file)
+            if pool_size is None:
+                pool_size = _get_optional(config, "pool_size", DEFAULT_POOL_SIZE, section)
+            if keep_alive is None:
+                keep_alive = _get_optional(config, "keep_alive", DEFAULT_KEEP_ALIVE, section)
+            self.pool_size = pool_size
+            self.keep_alive = keep_alive
+            self.options = query_options(config, section)
+            if pool_manager is not None and self.options.concurrency > 0:
+                # the async client opens its own connections and would bypass the limit per host of the shared pool
+                logger.info("Session of %s shares a connection pool, its queries run one after another", section)
+                self.options = replace(self.options, concurrency=0)
+            client_options = {"connection_pool_maxsize": pool_size, "enable_gzip": self.options.gzip}
+            if self.options.query_timeout > 0:
+                # ends the HTTP requests of abandoned queries as well
+                client_options["timeout"] = int(self.options.query_timeout * 1000)
             self.influx = InfluxConfigClass(
-                url=config.get("InfluxDB", "url"),
-                token=config.get("InfluxDB", "token"),
-                org=config.get("InfluxDB", "org"),
-                bucket=config.get("InfluxDB", "bucket"),
+                url=_get_required(config, "url", section),
+                token=_get_required(config, "token", section),
+                org=_get_required(config, "org", section),
+                bucket=_get_required(config, "bucket", section),
                 # Verbindung zur InfluxDB herstellen
-                client=InfluxDBClient(url=config.get("InfluxDB", "url"), token=config.get("InfluxDB", "token")))
+                client=InfluxDBClient(url=_get_required(config, "url", section), token=_get_required(config, "token", section), **client_options))
             logger.debug("Fill connect to InfluxDB %s", self.influx.url)
         except configparser.NoSectionError as error:
             logger.error("Not recoverable error: %s", error.message)
@@ -43,11 +218,771 @@ class GetFromInflux():
             logger.error(" See README.md for more details")
             raise error
 
+        if keep_alive:
+            _enable_keep_alive(self.influx.client)
+        self._own_pool_manager = None
+        if pool_manager is not None:
+            # keep-alive of a shared pool manager is set by its owner, see keep_alive_socket_options()
+            self._own_pool_manager = _share_pool_manager(self.influx.client, pool_manager)
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self._responses = threading.local()
+        self._track_responses()
+        self.guard = QueryGuard(self.options, self.metrics)
+        self._query_api = None
+        self.cache = ResultCache(self.options.cache_file, self.options.cache_ttl, self.source) if self.options.cache_file else None
+        self.rollups = RollupStore(self.options.rollup_file, self.source) if self.options.rollup_file else None
+
+    @property
+    def source(self):
+        """str: url, org and bucket of the session, they keep the results of sites apart in a shared cache or rollup file"""
+        return f"{self.influx.url} {self.influx.org}/{self.influx.bucket}"
+
+    @property
+    def query_api(self):
+        """The query API of the shared client, created once on first use"""
+        if self._query_api is None:
+            self._query_api = self.influx.client.query_api()
+        return self._query_api
+
+    def _track_responses(self):
+        """Keep the last HTTP response of each thread, so its bytes can be counted, see take_response()"""
+        try:
+            rest_client = self.influx.client.api_client.rest_client
+        except AttributeError:
+            logger.debug("Client has no REST client, response bytes are not counted")
+            return
+        request = rest_client.request
+
+        def tracked_request(*args, **kwargs):
+            response = request(*args, **kwargs)
+            _count_decoded_bytes(response)
+            self._responses.last = response
+            return response
+
+        rest_client.request = tracked_request
+
+    def take_response(self):
+        """The last HTTP response of the calling thread, forgotten afterwards
+
+        Returns:
+            HTTPResponse: the response, None if there is none
+        """
+        response = getattr(self._responses, "last", None)
+        self._responses.last = None
+        return response
+
+    def close(self):
+        """Close the client, all pooled connections and the cache"""
+        logger.debug("Close connection to InfluxDB %s", self.influx.url)
+        self._query_api = None
+        self.guard.close()
+        if self._own_pool_manager is not None:
+            # closing the client clears its pool manager, the shared one stays open for the other sessions
+            self.influx.client.api_client.rest_client.pool_manager = self._own_pool_manager
+        self.influx.client.close()
+        if self.cache is not None:
+            self.cache.close()
+        if self.rollups is not None:
+            self.rollups.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def query_options(config, section=DEFAULT_SECTION):
+    """The options of a section that control how GetFromInflux queries and reduces data
+
+    Args:
+        config (configparser.ConfigParser): the parsed config file
+        section (str): section of a site, options it does not set are read from [InfluxDB]
+
+    Raises:
+        ValueError: if integration is unknown
+
+    Returns:
+        QueryOptionsClass: the options, the defaults for options that are not set
+    """
+    return QueryOptionsClass(**{field.name: _get_optional(config, field.name, field.default, section) for field in fields(QueryOptionsClass)})
+
+
+def _get_optional(config, option, fallback, section=DEFAULT_SECTION):
+    """Read an optional option of the [InfluxDB] section, converted to the type of the fallback
+
+    Args:
+        config (configparser.ConfigParser): the parsed config file
+        option (str): name of the option
+        fallback (bool | int | float | str): value used if the option is not set
+        section (str): section of a site, options it does not set are read from [InfluxDB]
+
+    Returns:
+        bool | int | float | str: the configured value or the fallback
+    """
+    if not config.has_option(section, option):
+        if section == DEFAULT_SECTION:
+            return fallback
+        return _get_optional(config, option, fallback)
+    if isinstance(fallback, bool):
+        return config.getboolean(section, option)
+    if isinstance(fallback, int):
+        return config.getint(section, option)
+    if isinstance(fallback, float):
+        return config.getfloat(section, option)
+    return config.get(section, option)
+
+
+def _get_required(config, option, section=DEFAULT_SECTION):
+    """Read an option of the section of a site, or of the [InfluxDB] section if the site does not set it
+
+    Raises:
+        configparser.NoSectionError: if neither section exists
+        configparser.NoOptionError: if neither section sets the option
+
+    Returns:
+        str: the configured value
+    """
+    if section != DEFAULT_SECTION and not config.has_option(section, option) and config.has_section(DEFAULT_SECTION):
+        section = DEFAULT_SECTION
+    return config.get(section, option)
+
+
+def _share_pool_manager(client, pool_manager):
+    """Let the client use a pool manager shared with other clients
+
+    Args:
+        client (InfluxDBClient): the client
+        pool_manager (urllib3.PoolManager): the shared pool manager
+
+    Returns:
+        urllib3.PoolManager: the own pool manager of the client, None if it has none
+    """
+    try:
+        rest_client = client.api_client.rest_client
+    except AttributeError:
+        logger.debug("Client has no REST client, the pool is not shared")
+        return None
+    own = rest_client.pool_manager
+    rest_client.pool_manager = pool_manager
+    return own
+
+
+def _response_bytes(response):
+    """Bytes of an HTTP response read from the connection so far, compressed with gzip, 0 if unknown"""
+    read = getattr(response, "tell", None)
+    value = read() if callable(read) else 0
+    return value if isinstance(value, int) else 0
+
+
+def _count_decoded_bytes(response):
+    """Count the bytes of an urllib3 response after decompression in its decoded_bytes attribute
+
+    The client parses the response line by line from stream(), which decodes gzip. tell() only
+    counts the bytes of the connection, so the size of the CSV is summed from the chunks.
+    """
+    stream = getattr(response, "stream", None)
+    if not callable(stream):
+        return
+    response.decoded_bytes = 0
+
+    def counted_stream(*args, **kwargs):
+        for chunk in stream(*args, **kwargs):
+            response.decoded_bytes += len(chunk)
+            yield chunk
+
+    response.stream = counted_stream
+
+
+def _decoded_bytes(response):
+    """Bytes of an HTTP response after decompression, 0 if unknown"""
+    value = getattr(response, "decoded_bytes", 0)
+    return value if isinstance(value, int) else 0
+
+
+def keep_alive_socket_options():
+    """Socket options of urllib3 connections with SO_KEEPALIVE set
+
+    Returns:
+        list: the default socket options of urllib3 and SO_KEEPALIVE
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from urllib3.connection import HTTPConnection
+    return HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+
+def _enable_keep_alive(client):
+    """Set SO_KEEPALIVE on every connection the client's pool opens
+
+    Args:
+        client (InfluxDBClient): the client whose connection pool is adjusted
+    """
+    try:
+        pool_manager = client.api_client.rest_client.pool_manager
+    except AttributeError:
+        logger.debug("Client has no urllib3 pool manager, keep-alive not set")
+        return
+    pool_manager.connection_pool_kw["socket_options"] = keep_alive_socket_options()
+
+
+# pylint: disable-next=too-many-public-methods
+class GetFromInflux():
+    """Get data from InfluxDB"""
+
+    def __init__(self, session: InfluxSession = None):
+        """Use the shared session or, without one, parse config.ini and create a private session
+
+        Args:
+            session (InfluxSession): shared session of the run, optional
+        """
+        self.session = session if session is not None else InfluxSession()
+        self.influx = self.session.influx
+        # results of batched queries, served to the single measurement getters
+        self._batched = {}
+        # daily series fetched so far, per kind and measurement name the values and the fetched days
+        self._daily = {}
+        self.downsampled_buckets = parse_buckets(self.session.options.downsampled_buckets)
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def _key(self, kind, measurement_name, start_date, end_date, method=None):
+        """Key of a result in the memo and in the cache
+
+        The range is the one actually queried and the variant holds all options the result depends on.
+
+        Args:
+            kind (str): KIND_KWH, KIND_VALUES or KIND_SNAPSHOTS
+            measurement_name (str): name of the measurement stored in influx
+            start_date (datetime): start of the timespan, or day of the first value
+            end_date (datetime): end of the timespan, or day of the second value
+            method (str): INTEGRATION_CLIENT or INTEGRATION_SERVER for KIND_KWH
+
+        Returns:
+            tuple: kind, measurement name, start, stop and variant
+        """
+        if kind == KIND_KWH:
+            return (kind, measurement_name, start_date, end_date, self._energy_variant(method))
+        start = datetime.combine(start_date.date(), time.min, start_date.tzinfo)
+        stop = datetime.combine(end_date.date(), time(23, 59, 59), end_date.tzinfo)
+        return (kind, measurement_name, start, stop, f"lookback_days={self.session.options.lookback_days}")
+
+    def _energy_variant(self, method):
+        """The options an energy depends on, the variant of its key in the cache and in the rollups
+
+        Args:
+            method (str): INTEGRATION_CLIENT or INTEGRATION_SERVER
+
+        Returns:
+            str: e.g. client/left/max_gap=0.0
+        """
+        options = self.session.options
+        variant = method if method == INTEGRATION_SERVER else f"{method}/{options.integration_rule}/max_gap={options.max_gap}"
+        if options.downsampled_buckets:
+            variant += f"/downsampled={options.downsampled_buckets}@{options.downsample_accuracy}"
+        return variant
+
+    def _recall(self, key):
+        """Look up a result in the memo and then in the cache
+
+        Values of KIND_VALUES are also known if the snapshots of both days are known.
+
+        Args:
+            key (tuple): see _key()
+
+        Returns:
+            tuple: (True, value) if the result is known, (False, None) otherwise
+        """
+        if key in self._batched:
+            return True, self._batched[key]
+        if self.session.cache is not None:
+            hit, value = self.session.cache.get(*key)
+            if hit:
+                self._batched[key] = value
+                return True, value
+        if key[0] == KIND_VALUES:
+            start_hit, start_value = self._recall(self._key(KIND_SNAPSHOTS, key[1], key[2], key[2]))
+            end_hit, end_value = self._recall(self._key(KIND_SNAPSHOTS, key[1], key[3], key[3]))
+            if start_hit and end_hit:
+                self._batched[key] = (start_value, end_value)
+                return True, self._batched[key]
+        return False, None
+
+    def _remember(self, key, value):
+        """Keep a result in the memo and in the cache
+
+        Args:
+            key (tuple): see _key()
+            value: the result
+        """
+        self._batched[key] = value
+        # a missing value may still arrive, so it is not cached
+        if self.session.cache is not None and not (value is None or (isinstance(value, tuple) and None in value)):
+            self.session.cache.put(*key, value)
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def _recall_all(self, kind, measurement_names, start_date, end_date, method=None):
+        """Known results of several measurements
+
+        Returns:
+            dict: result per measurement name, only for the known ones
+        """
+        known = {}
+        for name in measurement_names:
+            hit, value = self._recall(self._key(kind, name, start_date, end_date, method))
+            if hit:
+                known[name] = value
+        return known
+
+    def _unknown_part(self, request: QueryRequest):
+        """The part of a QueryRequest whose results are neither in the memo nor in the cache
+
+        Args:
+            request (QueryRequest): the query to run
+
+        Returns:
+            QueryRequest: with only the unknown measurements, None if all are known
+        """
+        if request.kind == KIND_SNAPSHOTS:
+            unknown_days = {name: self._unknown_days(name, request.days) for name in request.measurement_names}
+            unknown = tuple(name for name in request.measurement_names if unknown_days[name])
+            # only the days some measurement still needs
+            days = tuple(day for day in request.days if any(day in unknown_days[name] for name in unknown))
+            return QueryRequest(request.kind, unknown, days[0], days[-1], days) if unknown else None
+        known = self._recall_all(request.kind, request.measurement_names, request.start_date, request.end_date, self.session.options.integration)
+        unknown = tuple(name for name in request.measurement_names if name not in known)
+        if not unknown:
+            return None
+        return QueryRequest(request.kind, unknown, request.start_date, request.end_date, request.days)
+
+    def _unknown_days(self, measurement_name, days):
+        """Days whose snapshot of a measurement is neither in the memo nor in the cache
+
+        Returns:
+            list: the unknown days
+        """
+        return [day for day in days if not self._recall(self._key(KIND_SNAPSHOTS, measurement_name, day, day))[0]]
+
+    def pending(self, requests: list):
+        """The parts of QueryRequests whose results are neither in the memo nor in the cache
+
+        Args:
+            requests (list): QueryRequest objects
+
+        Returns:
+            list: QueryRequest objects with only the unknown measurements, requests without any are left out
+        """
+        return [request for request in map(self._unknown_part, requests) if request is not None]
+
+    def downsample_route(self, start_date, end_date, accuracy=None):
+        """The whole windows of a range that are read from a downsampled bucket, see downsample.route()
+
+        Args:
+            start_date (datetime): start of the range
+            end_date (datetime): end of the range
+            accuracy (float): fraction of the range a window may be long at most, defaults to downsample_accuracy
+
+        Returns:
+            DownsampleRoute: the windows, None without downsampled_buckets or if no bucket fits
+        """
+        if not self.downsampled_buckets:
+            return None
+        return route(self.downsampled_buckets, start_date, end_date, accuracy or self.session.options.downsample_accuracy)
+
+    def _records(self, query, request: QueryRequest):
+        """Run a query and yield its records
+
+        With the streaming option the records are parsed one by one from the response with
+        query_stream(), otherwise the whole result is materialised with query() first.
+
+        The query is sent by the QueryGuard of the session with timeout, retries and hedging.
+        A stream is only retried until its response starts, afterwards the deadline of the run is
+        checked between the chunks of records.
+
+        The query is recorded in the metrics of the session. The time until the records arrived
+        counts as query time, the time the caller spends between the records as integration.
+        Streamed records are taken in chunks, so the clock is not read for every record.
+
+        Args:
+            query (str): the Flux query
+            request (QueryRequest): kind, measurements and range of the query, for the metrics
+
+        Yields:
+            FluxRecord: the records of all tables in order
+        """
+        started = timer.perf_counter()
+
+        def send():
+            # runs in a thread of the guard with a timeout or hedging, the response is kept there
+            if self.session.options.streaming:
+                result = self.session.query_api.query_stream(org=self.influx.org, query=query)
+            else:
+                result = self.session.query_api.query(org=self.influx.org, query=query)
+            return result, self.session.take_response()
+
+        result, response = self.session.guard.call(send)
+        records = iter(result) if self.session.options.streaming else (record for table in result for record in table.records)
+        query_seconds = timer.perf_counter() - started
+        rows = 0
+        try:
+            while True:
+                if rows:
+                    self.session.guard.check()
+                fetching = timer.perf_counter()
+                chunk = list(islice(records, RECORDS_PER_CHUNK))
+                query_seconds += timer.perf_counter() - fetching
+                if not chunk:
+                    break
+                rows += len(chunk)
+                yield from chunk
+        finally:
+            self.session.metrics.record_query(request, query_seconds, rows, _response_bytes(response),
+                                              timer.perf_counter() - started - query_seconds, _decoded_bytes(response))
+
+    def query_batch(self, request: QueryRequest):
+        """Run a QueryRequest with the matching batched getter
+
+        Args:
+            request (QueryRequest): the query to run
+
+        Returns:
+            dict: result per measurement name, see the batched getters
+        """
+        if request.kind == KIND_KWH:
+            return self.get_total_kwh_consumed_batch_from_influx(list(request.measurement_names), request.start_date, request.end_date)
+        if request.kind == KIND_SNAPSHOTS:
+            return self.get_snapshots_batch_from_influx(list(request.measurement_names), request.days)
+        return self.get_values_batch_from_influx(list(request.measurement_names), request.start_date, request.end_date)
+
+    def prefetch(self, requests: list):
+        """Run QueryRequests, so the single measurement getters are answered from their results
+
+        Measurements whose results are already known from earlier requests or from the cache are
+        left out. With rollup_file set, the results are computed from daily rollups, see
+        prefetch_from_rollups(). Otherwise the requests are split into queries of at most
+        batch_size measurements and, with concurrency set, the queries run concurrently on the
+        async client, see influx_async.py.
+
+        Args:
+            requests (list): QueryRequest objects
+        """
+        requests = self.pending(requests)
+        if self.session.rollups is not None:
+            self.prefetch_from_rollups(requests)
+            return
+        requests = split_requests(requests, self.session.options.batch_size)
+        if not requests:
+            return
+        if self.session.options.concurrency > 0:
+            # the async client needs aiohttp, only import it if it is used
+            # pylint: disable-next=import-outside-toplevel
+            from influx_async import prefetch_concurrently
+            asyncio.run(prefetch_concurrently(self, requests))
+            return
+        for request in requests:
+            self.query_batch(request)
+
+    def prefetch_from_rollups(self, requests: list, today=None):
+        """Compute the results of QueryRequests from daily rollups
+
+        Days that are not rolled up yet are fetched with one query per kind and span of days and
+        stored, then the results are computed with remember_from_daily().
+
+        Args:
+            requests (list): QueryRequest objects
+            today (date): days from today on are incomplete and not stored, defaults to today in UTC
+        """
+        for request in requests:
+            names = list(request.measurement_names)
+            daily = {name: {} for name in names}
+            for first_day, last_day in self.daily_ranges(request):
+                for name, values in self.get_daily_series(daily_kind(request), names, first_day, last_day, today).items():
+                    daily[name].update(values)
+            self.remember_from_daily(request, daily)
+
+    def daily_ranges(self, request: QueryRequest):
+        """Days of daily values remember_from_daily() needs for a QueryRequest
+
+        Args:
+            request (QueryRequest): the query
+
+        Returns:
+            list: tuples of first and last day, both inclusive
+        """
+        lookback = timedelta(days=self.session.options.lookback_days)
+        if request.kind == KIND_KWH:
+            return [(request.start_date.date() + timedelta(days=1), request.end_date.date())]
+        days = request.days if request.kind == KIND_SNAPSHOTS else (request.start_date, request.end_date)
+        return [(day.date() - lookback, day.date()) for day in days]
+
+    def remember_from_daily(self, request: QueryRequest, daily: dict):
+        """Compute the results of a QueryRequest from daily values and remember them
+
+        kWh of a timespan is the sum of the daily energy of the days after the start day up to the
+        end day. Counter values are the last values of the start and end day, or of the snapshot
+        days, or of the latest day before within lookback_days.
+
+        Args:
+            request (QueryRequest): the query
+            daily (dict): per measurement name a dict of day and value, at least of daily_ranges()
+        """
+        lookback_days = self.session.options.lookback_days
+        start_day = request.start_date.date()
+        end_day = request.end_date.date()
+        for name in request.measurement_names:
+            if request.kind == KIND_KWH:
+                key = self._key(KIND_KWH, name, request.start_date, request.end_date, self.session.options.integration)
+                self._batched[key] = sum_days(daily[name], start_day + timedelta(days=1), end_day)
+            elif request.kind == KIND_SNAPSHOTS:
+                for day in request.days:
+                    self._batched[self._key(KIND_SNAPSHOTS, name, day, day)] = last_on_or_before(daily[name], day.date(), lookback_days)
+            else:
+                self._batched[self._key(KIND_VALUES, name, request.start_date, request.end_date)] = (
+                    last_on_or_before(daily[name], start_day, lookback_days),
+                    last_on_or_before(daily[name], end_day, lookback_days),
+                )
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def get_daily_series(self, kind, measurement_names: list, first_day, last_day, today=None):
+        """Daily energy or daily last values of several measurements
+
+        With rollup_file set, only the days that are not rolled up yet are queried and stored.
+
+        Args:
+            kind (str): KIND_ENERGY for get_daily_kwh_from_influx(), KIND_LAST for get_daily_last_values_from_influx()
+            measurement_names (list): names of the measurements stored in influx
+            first_day (date): first day
+            last_day (date): last day, inclusive
+            today (date): days from today on are incomplete and not stored, defaults to today in UTC
+
+        Returns:
+            dict: per measurement name a dict of day and value
+        """
+        days = days_between(first_day, last_day)
+        unknown = [name for name in measurement_names if not self._daily_known(kind, name, first_day, last_day)]
+        if unknown:
+            if self.session.rollups is not None:
+                fetched = self._daily_rollups(kind, unknown, first_day, last_day, today or datetime.now(timezone.utc).date())
+            elif kind == KIND_ENERGY:
+                fetched = self.get_daily_kwh_from_influx(unknown, first_day, last_day)
+            else:
+                fetched = self.get_daily_last_values_from_influx(unknown, first_day, last_day)
+            for name in unknown:
+                values, fetched_days = self._daily.setdefault((kind, name), ({}, set()))
+                values.update(fetched[name])
+                fetched_days.update(days)
+        return {
+            name: {
+                day: value for day, value in self._daily[(kind, name)][0].items() if first_day <= day <= last_day
+            } for name in measurement_names
+        }
+
+    def _daily_known(self, kind, measurement_name, first_day, last_day):
+        """Whether the daily series of a measurement was fetched for all days of a range"""
+        fetched_days = self._daily.get((kind, measurement_name), ({}, set()))[1]
+        return all(day in fetched_days for day in days_between(first_day, last_day))
+
+    def remember_known_daily(self, requests: list):
+        """Compute the results of QueryRequests from the daily series fetched so far
+
+        The parts of the requests whose days are all known are remembered with remember_from_daily(),
+        e.g. the totals of the timeframe of a report after its daily usage was read, so pending()
+        leaves them out. The kWh are only computed from the days if that is exact: with client
+        integration of the raw samples. The days integrated on the server miss the samples across
+        midnight and the days of downsampled buckets are read with other windows than the
+        timeframe, so with either the kWh requests stay pending.
+
+        Args:
+            requests (list): QueryRequest objects
+        """
+        options = self.session.options
+        exact_energy = options.integration == INTEGRATION_CLIENT and not options.downsampled_buckets
+        for request in requests:
+            kind = daily_kind(request)
+            if kind == KIND_ENERGY and not exact_energy:
+                continue
+            names = [name for name in request.measurement_names if (kind, name) in self._daily]
+            if request.kind == KIND_SNAPSHOTS:
+                days = tuple(day for day, (first_day, last_day) in zip(request.days, self.daily_ranges(request)) if all(
+                    self._daily_known(kind, name, first_day, last_day) for name in names))
+                request = QueryRequest(request.kind, request.measurement_names, request.start_date, request.end_date, days)
+            else:
+                names = [name for name in names if all(self._daily_known(kind, name, *days) for days in self.daily_ranges(request))]
+            if names and (request.kind != KIND_SNAPSHOTS or request.days):
+                known = QueryRequest(request.kind, tuple(names), request.start_date, request.end_date, request.days)
+                self.remember_from_daily(known, {name: self._daily[(kind, name)][0] for name in names})
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def _daily_rollups(self, kind, measurement_names, first_day, last_day, today):
+        """Daily rollups of a range, the missing days are fetched and stored first
+
+        Args:
+            kind (str): KIND_ENERGY or KIND_LAST
+            measurement_names (list): names of the measurements stored in influx
+            first_day (date): first day of the range
+            last_day (date): last day of the range, inclusive
+            today (date): days from today on are incomplete and not stored
+
+        Returns:
+            dict: per measurement name a dict of day and value
+        """
+        rollups = self.session.rollups
+        getter = self.get_daily_kwh_from_influx if kind == KIND_ENERGY else self.get_daily_last_values_from_influx
+        # the last value of a day is the same with every option, the energy depends on the integration
+        variant = self._energy_variant(self.session.options.integration) if kind == KIND_ENERGY else ""
+        fetched = {name: {} for name in measurement_names}
+        for span_first, span_last in contiguous_spans(rollups.missing_days(kind, measurement_names, first_day, last_day, today, variant)):
+            daily = getter(measurement_names, span_first, span_last)
+            rollups.put(kind, daily, days_between(span_first, span_last), today, variant)
+            for name in measurement_names:
+                fetched[name].update(daily[name])
+        return {name: {**rollups.get(kind, name, first_day, last_day, variant), **fetched[name]} for name in measurement_names}
+
+    def get_daily_kwh_from_influx(self, measurement_names: list, first_day, last_day):
+        """Energy per day of several watt measurements with one query
+
+        With INTEGRATION_SERVER the energy is integrated per day window with aggregateWindow() on
+        the server, otherwise the raw samples are integrated per day on the client. With
+        downsampled_buckets the days are read from the coarsest bucket, see daily_kwh_query().
+
+        Args:
+            measurement_names (list): names of the measurements stored in influx
+            first_day (date): first day, from 00:00:00 UTC
+            last_day (date): last day, inclusive
+
+        Returns:
+            dict: per measurement name a dict of day and kWh
+        """
+        logger.debug("Get daily kWh of %d measurements from %s to %s", len(measurement_names), first_day, last_day)
+        # the windows divide the days, so every bucket gives whole days
+        downsampled = self.downsample_route(datetime.combine(first_day, time.min), datetime.combine(last_day + timedelta(days=1), time.min), 1.0)
+        query = self.daily_kwh_query(measurement_names, first_day, last_day, downsampled)
+        # Wh per day of the server and of the downsampled bucket
+        daily_wh = {name: {} for name in measurement_names}
+        accumulators = {
+            name: DailyEnergyAccumulator(self.session.options.integration_rule, self.session.options.max_gap or None) for name in measurement_names
+        }
+        for record in self._records(query, QueryRequest(KIND_ENERGY, tuple(measurement_names), first_day, last_day)):
+            try:
+                if self.session.options.integration == INTEGRATION_SERVER or (downsampled is not None and
+                                                                              record.values.get("result") == RESULT_DOWNSAMPLED):
+                    day = record.get_time().date()
+                    daily_wh[record.get_measurement()][day] = daily_wh[record.get_measurement()].get(day, 0.0) + record.get_value()
+                else:
+                    accumulators[record.get_measurement()].add(record.get_time(), record.get_value())
+            except KeyError as exception:
+                logger.error(exception)
+        daily = {name: dict(accumulators[name].kwh_per_day) for name in measurement_names}
+        for name in measurement_names:
+            for day, wh in daily_wh[name].items():
+                daily[name][day] = daily[name].get(day, 0.0) + wh / 1000.0
+        return daily
+
+    def daily_kwh_query(self, measurement_names, first_day, last_day, downsampled: DownsampleRoute = None):
+        """Flux query of get_daily_kwh_from_influx()
+
+        With a route the energy of the days is summed from the mean power of the windows of the
+        downsampled bucket (RESULT_DOWNSAMPLED), the days the task has not written yet are read
+        from the raw bucket (RESULT_TAIL).
+
+        Args:
+            measurement_names (list): names of the measurements stored in influx
+            first_day (date): first day, from 00:00:00 UTC
+            last_day (date): last day, inclusive
+            downsampled (DownsampleRoute): the windows read from a downsampled bucket, see downsample_route()
+
+        Returns:
+            str: the Flux query
+        """
+        start = datetime.combine(first_day, time.min)
+        stop = datetime.combine(last_day + timedelta(days=1), time.min)
+        query = ""
+        if downsampled is not None:
+            query = _downsampled_query(
+                downsampled, measurement_names, FIELD_MEAN, f"""
+        |> aggregateWindow(every: 1d, fn: sum, timeSrc: "_start", createEmpty: false)
+        |> map(fn: (r) => ({{r with _value: r._value * {_hours(downsampled)}}}))
+        |> group(columns: ["_measurement"])""")
+            start = downsampled.stop
+        if start < stop:
+            query += f"""from(bucket:"{self.influx.bucket}")
+        |> range(start: {start.strftime('%Y-%m-%dT%H:%M:%SZ')}, stop: {stop.strftime('%Y-%m-%dT%H:%M:%SZ')})
+        |> filter(fn: (r) => contains(value: r._measurement, set: {_flux_set(measurement_names)}))"""
+            if self.session.options.integration == INTEGRATION_SERVER:
+                query += """
+        |> aggregateWindow(every: 1d, fn: (tables=<-, column) => tables |> integral(unit: 1h, column: column), timeSrc: "_start", createEmpty: false)
+        |> group(columns: ["_measurement", "_time"])
+        |> sum()
+        |> group(columns: ["_measurement"])"""
+            else:
+                query += """
+        |> group(columns: ["_measurement"])
+        |> sort(columns: ["_time"], desc: false)"""
+            query += KEEP
+            if downsampled is not None:
+                query += f"""
+        |> yield(name: "{RESULT_TAIL}")
+"""
+        return query
+
+    # pylint: disable-next=too-many-locals
+    def get_daily_last_values_from_influx(self, measurement_names: list, first_day, last_day):
+        """Last value per day of several counter measurements with one query, reduced with
+        aggregateWindow() and last() on the server
+
+        With downsampled_buckets the days are read from the last values of the coarsest bucket and
+        only the days the task has not written yet from the raw bucket.
+
+        Args:
+            measurement_names (list): names of the measurements stored in influx
+            first_day (date): first day, from 00:00:00 UTC
+            last_day (date): last day, inclusive
+
+        Returns:
+            dict: per measurement name a dict of day and last value, days without data are left out
+        """
+        logger.debug("Get daily values of %d measurements from %s to %s", len(measurement_names), first_day, last_day)
+        start = datetime.combine(first_day, time.min)
+        stop = datetime.combine(last_day + timedelta(days=1), time.min)
+        # the windows divide the days, so every bucket gives whole days
+        downsampled = self.downsample_route(start, stop, 1.0)
+        query = ""
+        reduction = """
+        |> aggregateWindow(every: 1d, fn: last, timeSrc: "_start", createEmpty: false)
+        |> group(columns: ["_measurement"])
+        |> sort(columns: ["_time"], desc: false)"""
+        groups = _pipeline_groups(measurement_names, RESULT_TAIL if downsampled is not None else "_result")
+        if downsampled is not None:
+            for names, derived, result in _pipeline_groups(measurement_names, RESULT_DOWNSAMPLED):
+                query += _downsampled_query(downsampled, names, FIELD_LAST, reduction, derived, result)
+            start = downsampled.stop
+        if start < stop:
+            # after the downsampled days, so the value of a day read from both is the raw one
+            for names, derived, result in groups:
+                query += f"""from(bucket:"{self.influx.bucket}")
+        |> range(start: {start.strftime('%Y-%m-%dT%H:%M:%SZ')}, stop: {stop.strftime('%Y-%m-%dT%H:%M:%SZ')})
+        |> filter(fn: (r) => contains(value: r._measurement, set: {_flux_set(names)})){reduction}"""
+                query += KEEP if derived is None else flux_tail(derived)
+                if downsampled is not None or len(groups) > 1:
+                    query += f"""
+        |> yield(name: "{result}")
+"""
+        daily = {name: {} for name in measurement_names}
+        for record in self._records(query, QueryRequest(KIND_LAST, tuple(measurement_names), first_day, last_day)):
+            try:
+                daily[record.get_measurement()][record.get_time().date()] = record.get_value()
+            except KeyError as exception:
+                logger.error(exception)
+        return daily
+
+    def _energy_accumulator(self):
+        """EnergyAccumulator with the integration rule and gap clamp of the session"""
+        return EnergyAccumulator(self.session.options.integration_rule, self.session.options.max_gap or None)
+
     def get_total_kwh_consumed_from_influx(
         self,
         measurement_name: str,
         start_date: datetime,
         end_date: datetime,
+        method: str = None,
     ):
         """Calculate kWh consumed over a certain timespan from InfluxDB
 
@@ -55,40 +990,33 @@ class GetFromInflux():
             measurement_name (str): name of the measurement stored in influx
             start_date (datetime): date when to start the query
             end_date (datetime): date when to end the query
+            method (str): INTEGRATION_CLIENT or INTEGRATION_SERVER, defaults to the integration of the session
 
         Returns:
             float: total kWh consumed during the timespan
         """
         logger.debug("Get kWh from %s to %s", start_date, end_date)
+        method = method or self.session.options.integration
+        key = self._key(KIND_KWH, measurement_name, start_date, end_date, method)
+        hit, value = self._recall(key)
+        if hit:
+            return value
+        if method == INTEGRATION_SERVER or self.downsample_route(start_date, end_date) is not None:
+            return self.get_total_kwh_consumed_batch_from_influx([measurement_name], start_date, end_date, method)[measurement_name]
         query = f"""from(bucket:"{self.influx.bucket}")
         |> range(start: {start_date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}, stop: {end_date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')})
         |> filter(fn: (r) => r._measurement == "{measurement_name}")
-        |> sort(columns: ["_time"], desc: false)"""
+        |> sort(columns: ["_time"], desc: false)""" + KEEP
 
-        result = self.influx.client.query_api().query(org=self.influx.org, query=query)
+        accumulator = self._energy_accumulator()
+        for record in self._records(query, QueryRequest(KIND_KWH, (measurement_name,), start_date, end_date)):
+            try:
+                accumulator.add(record.get_time(), record.get_value())
+            except KeyError as exception:
+                logger.error(exception)
 
-        values = []
-        timestamps = []
-
-        for table in result:
-            for record in table.records:
-                try:
-                    values.append(record.get_value())
-                    timestamps.append(record.get_time())
-                except KeyError as exception:
-                    logger.error(exception)
-
-        if len(values) < 2:
-            return 0.0  # Not enough data to calculate kWh
-
-        total_kwh = 0.0
-        for i in range(1, len(values)):
-            # Calculate the time difference in hours
-            time_diff = (timestamps[i] - timestamps[i - 1]).total_seconds() / 3600.0
-            # Calculate kWh for the interval and accumulate
-            total_kwh += (values[i - 1] * time_diff) / 1000.0  # Convert Watts to kW
-
-        return total_kwh
+        self._remember(key, accumulator.kwh)
+        return accumulator.kwh
 
     def get_values_from_influx(
         self,
@@ -99,56 +1027,447 @@ class GetFromInflux():
         """
         Retrieves the last recorded values from InfluxDB for a specified measurement 
         over two distinct timeframes: the entire day of the start date and the entire 
-        day of the end date.
+        day of the end date. Both values are reduced with last() on the server and
+        fetched with a single query.
+
+        If a day has no data, the last value of the lookback_days before is used.
 
         Args:
             measurement_name (str): The name of the measurement stored in InfluxDB.
             start_date (datetime): The date for the start of the query, used to define 
                                 the range from 00:00:00 to 23:59:59 of that day.
             end_date (datetime): The date for the end of the query, used to define 
-                                the range from 00:00:00 to 23:59:00 of that day.
+                                the range from 00:00:00 to 23:59:59 of that day.
 
         Returns:
             tuple: A tuple containing the last value recorded for the start date and 
-                the last value recorded for the end date. If no values are found, 
-                None is returned for that timeframe.
+                the last value recorded for the end date. If no values are found
+                within the look-back, None is returned for that timeframe.
         """
         logger.debug("Get value from %s to %s", start_date, end_date)
-        # Query for start_date from 00:00:00 to 23:59:59
-        query_start = f"""from(bucket:"{self.influx.bucket}")
-        |> range(start: {start_date.strftime('%Y-%m-%dT00:00:00Z')}, stop: {start_date.strftime('%Y-%m-%dT23:59:59Z')})
-        |> filter(fn: (r) => r._measurement == "{measurement_name}")
-        |> sort(columns: ["_time"], desc: false)"""
+        hit, value = self._recall(self._key(KIND_VALUES, measurement_name, start_date, end_date))
+        if hit:
+            return value
+        return self.get_values_batch_from_influx([measurement_name], start_date, end_date)[measurement_name]
 
-        result_start = self.influx.client.query_api().query(org=self.influx.org, query=query_start)
+    def get_total_kwh_consumed_batch_from_influx(
+        self,
+        measurement_names: list,
+        start_date: datetime,
+        end_date: datetime,
+        method: str = None,
+    ):
+        """Calculate kWh consumed over a certain timespan for several measurements with one query
 
-        values_start = []
+        With INTEGRATION_CLIENT the raw samples are transferred and integrated with a left-Riemann sum.
+        With INTEGRATION_SERVER each series is integrated with integral() on the server and summed
+        per measurement, so only one value per measurement is transferred. integral() uses the
+        trapezoidal rule, see check_integration_parity() for the difference between both.
 
-        for table in result_start:
-            for record in table.records:
-                try:
-                    value = record.get_value()
-                    values_start.append(value)
-                except KeyError as exception:
-                    logger.error(exception)
+        The results are remembered, so a later get_total_kwh_consumed_from_influx() for the same
+        measurement, timespan and method is answered without another round trip. Results known
+        from the cache are not queried again.
 
-        # Query for end_date from 00:00:00 to 23:59:00
-        query_end = f"""from(bucket:"{self.influx.bucket}")
-        |> range(start: {end_date.strftime('%Y-%m-%dT00:00:00Z')}, stop: {end_date.strftime('%Y-%m-%dT23:59:59Z')})
-        |> filter(fn: (r) => r._measurement == "{measurement_name}")
+        Args:
+            measurement_names (list): names of the measurements stored in influx
+            start_date (datetime): date when to start the query
+            end_date (datetime): date when to end the query
+            method (str): INTEGRATION_CLIENT or INTEGRATION_SERVER, defaults to the integration of the session
+
+        Returns:
+            dict: total kWh consumed during the timespan per measurement name
+        """
+        logger.debug("Get kWh of %d measurements from %s to %s", len(measurement_names), start_date, end_date)
+        method = method or self.session.options.integration
+        total_kwh = self._recall_all(KIND_KWH, measurement_names, start_date, end_date, method)
+        unknown = [name for name in measurement_names if name not in total_kwh]
+        if unknown:
+            downsampled = self.downsample_route(start_date, end_date)
+            query = self.kwh_batch_query(unknown, start_date, end_date, method, downsampled)
+            records = self._records(query, QueryRequest(KIND_KWH, tuple(unknown), start_date, end_date))
+            total_kwh.update(self.reduce_kwh_batch(records, unknown, start_date, end_date, method, downsampled))
+        return {name: total_kwh[name] for name in measurement_names}
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def kwh_batch_query(self, measurement_names, start_date, end_date, method, downsampled: DownsampleRoute = None):
+        """Flux query of get_total_kwh_consumed_batch_from_influx()
+
+        With a route the whole windows are read from the downsampled bucket, their mean power
+        times the window length is summed on the server (RESULT_DOWNSAMPLED). The partial windows
+        before and after are read from the raw bucket (RESULT_HEAD and RESULT_TAIL).
+
+        Args:
+            measurement_names (list): names of the measurements stored in influx
+            start_date (datetime): date when to start the query
+            end_date (datetime): date when to end the query
+            method (str): INTEGRATION_CLIENT or INTEGRATION_SERVER
+            downsampled (DownsampleRoute): the windows read from a downsampled bucket, see downsample_route()
+
+        Returns:
+            str: the Flux query
+        """
+        if downsampled is None:
+            return self._kwh_query(measurement_names, start_date, end_date, method)
+        query = _downsampled_query(
+            downsampled, measurement_names, FIELD_MEAN, f"""
+        |> group(columns: ["_measurement"])
+        |> sum()
+        |> map(fn: (r) => ({{r with _value: r._value * {_hours(downsampled)}}}))""")
+        for label, start, stop in ((RESULT_HEAD, start_date, downsampled.start), (RESULT_TAIL, downsampled.stop, end_date)):
+            if start < stop:
+                query += self._kwh_query(measurement_names, start, stop, method) + f"""
+        |> yield(name: "{label}")
+"""
+        return query
+
+    def _kwh_query(self, measurement_names, start_date, end_date, method):
+        """Flux pipeline of the kWh of a range of the raw bucket"""
+        query = f"""from(bucket:"{self.influx.bucket}")
+        |> range(start: {start_date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}, stop: {end_date.strftime('%Y-%m-%dT%H:%M:%S.%fZ')})
+        |> filter(fn: (r) => contains(value: r._measurement, set: {_flux_set(measurement_names)}))"""
+        if method == INTEGRATION_SERVER:
+            query += """
+        |> integral(unit: 1h)
+        |> group(columns: ["_measurement"])
+        |> sum()"""
+        else:
+            query += """
+        |> group(columns: ["_measurement"])
         |> sort(columns: ["_time"], desc: false)"""
+        return query + KEEP
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def reduce_kwh_batch(self, records, measurement_names, start_date, end_date, method, downsampled: DownsampleRoute = None):
+        """Reduce the records of a kwh_batch_query() to kWh per measurement and remember them
+
+        Args:
+            records (iterable): FluxRecord objects of the query
+            measurement_names (list): names of the measurements stored in influx
+            start_date (datetime): date when the query started
+            end_date (datetime): date when the query ended
+            method (str): INTEGRATION_CLIENT or INTEGRATION_SERVER
+            downsampled (DownsampleRoute): the route the query was built with
+
+        Returns:
+            dict: total kWh consumed during the timespan per measurement name
+        """
+        # the raw samples of the head and of the tail are integrated separately, not across the downsampled windows
+        accumulators = {name: {} for name in measurement_names}
+        server_wh = {name: 0.0 for name in measurement_names}
+
+        for record in records:
+            try:
+                result = record.values.get("result") if downsampled is not None else RESULT_HEAD
+                if method == INTEGRATION_SERVER or result == RESULT_DOWNSAMPLED:
+                    server_wh[record.get_measurement()] += record.get_value()
+                else:
+                    pieces = accumulators[record.get_measurement()]
+                    if result not in pieces:
+                        pieces[result] = self._energy_accumulator()
+                    pieces[result].add(record.get_time(), record.get_value())
+            except KeyError as exception:
+                logger.error(exception)
+
+        total_kwh = {}
+        for name in measurement_names:
+            # integral() and the downsampled windows return Wh
+            total_kwh[name] = server_wh[name] / 1000.0 + sum(accumulator.kwh for accumulator in accumulators[name].values())
+            self._remember(self._key(KIND_KWH, name, start_date, end_date, method), total_kwh[name])
+        return total_kwh
+
+    def check_integration_parity(
+        self,
+        measurement_names: list,
+        start_date: datetime,
+        end_date: datetime,
+    ):
+        """Integrate watt measurements on the client and on the server and report the difference
+
+        Run this for representative measurements and timespans before switching the integration
+        to INTEGRATION_SERVER.
+
+        Args:
+            measurement_names (list): names of the measurements stored in influx
+            start_date (datetime): date when to start the query
+            end_date (datetime): date when to end the query
+
+        Returns:
+            list: an IntegrationParity per measurement name
+        """
+        client_kwh = self.get_total_kwh_consumed_batch_from_influx(measurement_names, start_date, end_date, INTEGRATION_CLIENT)
+        server_kwh = self.get_total_kwh_consumed_batch_from_influx(measurement_names, start_date, end_date, INTEGRATION_SERVER)
+        parities = []
+        for name in measurement_names:
+            parity = IntegrationParity(measurement_name=name, client_kwh=client_kwh[name], server_kwh=server_kwh[name])
+            logger.info("%s: client %.3f kWh, server %.3f kWh, difference %+.3f kWh (%+.2f %%)", name, parity.client_kwh, parity.server_kwh,
+                        parity.difference, parity.relative_difference * 100)
+            parities.append(parity)
+        return parities
+
+    def get_values_batch_from_influx(
+        self,
+        measurement_names: list,
+        start_date: datetime,
+        end_date: datetime,
+    ):
+        """Retrieves the last recorded values of several measurements for the day of the
+        start date and the day of the end date with one query.
+
+        last() is evaluated on the server, first per series and then per measurement, so only
+        one row per measurement and day is transferred. The range of each day reaches back
+        lookback_days, so the last value before a day without data is used instead of None.
+
+        The results are remembered, so a later get_values_from_influx() for the same
+        measurement and days is answered without another round trip. Results known from the
+        cache are not queried again.
+
+        Args:
+            measurement_names (list): names of the measurements stored in InfluxDB.
+            start_date (datetime): day of the first value, from 00:00:00 to 23:59:59
+            end_date (datetime): day of the second value, from 00:00:00 to 23:59:59
+
+        Returns:
+            dict: per measurement name a tuple of the last value of the start date and the
+                last value of the end date, None if no value was found within the look-back.
+        """
+        logger.debug("Get values of %d measurements from %s to %s", len(measurement_names), start_date, end_date)
+        values = self._recall_all(KIND_VALUES, measurement_names, start_date, end_date)
+        unknown = [name for name in measurement_names if name not in values]
+        if unknown:
+            query = self.values_batch_query(unknown, start_date, end_date)
+            records = self._records(query, QueryRequest(KIND_VALUES, tuple(unknown), start_date, end_date))
+            values.update(self.reduce_values_batch(records, unknown, start_date, end_date))
+        return {name: values[name] for name in measurement_names}
+
+    def values_batch_query(self, measurement_names, start_date, end_date):
+        """Flux query of get_values_batch_from_influx()
+
+        Args:
+            measurement_names (list): names of the measurements stored in InfluxDB.
+            start_date (datetime): day of the first value
+            end_date (datetime): day of the second value
+
+        Returns:
+            str: the Flux query
+        """
+        query = ""
+        for label, date in (("start", start_date), ("end", end_date)):
+            query += self._last_value_pipelines(measurement_names, date, label)
+        return query
+
+    def reduce_values_batch(self, records, measurement_names, start_date, end_date):
+        """Reduce the records of a values_batch_query() to the values per measurement and remember them
+
+        Args:
+            records (iterable): FluxRecord objects of the query
+            measurement_names (list): names of the measurements stored in InfluxDB.
+            start_date (datetime): day of the first value
+            end_date (datetime): day of the second value
+
+        Returns:
+            dict: per measurement name a tuple of the last value of the start date and the
+                last value of the end date, None if no value was found within the look-back.
+        """
+        last_values = {name: {"start": LastValueAccumulator(), "end": LastValueAccumulator()} for name in measurement_names}
+
+        for record in records:
+            try:
+                last_values[record.get_measurement()][_base_result(record.values["result"])].add(record.values.get("_time"), record.get_value())
+            except KeyError as exception:
+                logger.error(exception)
+
+        values = {}
+        for name in measurement_names:
+            values[name] = (last_values[name]["start"].value, last_values[name]["end"].value)
+            if None in values[name]:
+                logger.warning("No value of %s within %d days before %s or %s", name, self.session.options.lookback_days, start_date.date(),
+                               end_date.date())
+            self._remember(self._key(KIND_VALUES, name, start_date, end_date), values[name])
+        return values
+
+    def get_snapshots_batch_from_influx(self, measurement_names: list, days: tuple):
+        """Retrieves the last recorded values of several measurements on several days with one query
+
+        Like get_values_batch_from_influx(), but for any number of days, so a day shared by
+        several timeframes is read once. The range of each day reaches back lookback_days.
+        Afterwards get_values_from_influx() for any two of the days is answered without another
+        round trip. Results known from the cache are not queried again.
+
+        Args:
+            measurement_names (list): names of the measurements stored in InfluxDB.
+            days (tuple): datetimes of the days, each day from 00:00:00 to 23:59:59
+
+        Returns:
+            dict: per measurement name a dict of the last value per day, None if no value was
+                found within the look-back.
+        """
+        logger.debug("Get values of %d measurements on %d days", len(measurement_names), len(days))
+        unknown_days = {name: self._unknown_days(name, days) for name in measurement_names}
+        unknown = [name for name in measurement_names if unknown_days[name]]
+        if unknown:
+            query_days = tuple(day for day in days if any(day in unknown_days[name] for name in unknown))
+            query = self.snapshots_batch_query(unknown, query_days)
+            records = self._records(query, QueryRequest(KIND_SNAPSHOTS, tuple(unknown), query_days[0], query_days[-1], query_days))
+            self.reduce_snapshots_batch(records, unknown, query_days)
+        return {name: {day: self._recall(self._key(KIND_SNAPSHOTS, name, day, day))[1] for day in days} for name in measurement_names}
+
+    def snapshots_batch_query(self, measurement_names, days):
+        """Flux query of get_snapshots_batch_from_influx(), one pipeline per day
+
+        Args:
+            measurement_names (list): names of the measurements stored in InfluxDB.
+            days (tuple): datetimes of the days
+
+        Returns:
+            str: the Flux query, the result of each day is named like the day, e.g. 2024-10-06
+        """
+        return "".join(self._last_value_pipelines(measurement_names, day, day.strftime('%Y-%m-%d')) for day in days)
+
+    def _last_value_pipelines(self, measurement_names, day, label):
+        """Pipelines of the last value of measurements on a day, reaching back lookback_days
+
+        last() is evaluated on the server, first per series and then per measurement. A derived
+        measurement has its own pipeline that evaluates its expression on the last values of its
+        measurements, its result is the label, DERIVED_RESULT_SEPARATOR and a number.
+
+        Args:
+            measurement_names (list): names of the measurements, plain or derived
+            day (datetime): the day, from 00:00:00 to 23:59:59
+            label (str): name of the result
+
+        Returns:
+            str: the pipelines
+        """
+        lookback_date = day - timedelta(days=self.session.options.lookback_days)
+        stop = datetime(day.year, day.month, day.day, 23, 59, 59)
+        query = ""
+        for names, derived, result in _pipeline_groups(measurement_names, label):
+            query += f"""from(bucket:"{self.influx.bucket}")
+        |> range(start: {lookback_date.strftime('%Y-%m-%dT00:00:00Z')}, stop: {stop.strftime('%Y-%m-%dT%H:%M:%SZ')})
+        |> filter(fn: (r) => contains(value: r._measurement, set: {_flux_set(names)}))
+        |> last()
+        |> group(columns: ["_measurement"])
+        |> sort(columns: ["_time"], desc: false)
+        |> last(){KEEP if derived is None else flux_tail(derived, stop)}
+        |> yield(name: "{result}")
+"""
+        return query
+
+    def reduce_snapshots_batch(self, records, measurement_names, days):
+        """Reduce the records of a snapshots_batch_query() to the values per measurement and day and remember them
+
+        Args:
+            records (iterable): FluxRecord objects of the query
+            measurement_names (list): names of the measurements stored in InfluxDB.
+            days (tuple): datetimes of the days
+
+        Returns:
+            dict: per measurement name a dict of the last value per day, None if no value was
+                found within the look-back.
+        """
+        days_by_label = {day.strftime('%Y-%m-%d'): day for day in days}
+        last_values = {name: {day: LastValueAccumulator() for day in days} for name in measurement_names}
+
+        for record in records:
+            try:
+                last_values[record.get_measurement()][days_by_label[_base_result(record.values["result"])]].add(
+                    record.values.get("_time"), record.get_value())
+            except KeyError as exception:
+                logger.error(exception)
+
+        values = {}
+        for name in measurement_names:
+            values[name] = {day: accumulator.value for day, accumulator in last_values[name].items()}
+            for day, value in values[name].items():
+                if value is None:
+                    logger.warning("No value of %s within %d days before %s", name, self.session.options.lookback_days, day.date())
+                self._remember(self._key(KIND_SNAPSHOTS, name, day, day), value)
+        return values
+
+
+def daily_kind(request: QueryRequest):
+    """KIND_ENERGY for kWh requests, KIND_LAST for the counter values"""
+    return KIND_ENERGY if request.kind == KIND_KWH else KIND_LAST
+
+
+def split_requests(requests, batch_size):
+    """Split QueryRequests into requests of at most batch_size measurements
+
+    Args:
+        requests (list): QueryRequest objects
+        batch_size (int): measurements per request, 0 keeps the requests as they are
+
+    Returns:
+        list: QueryRequest objects
+    """
+    if batch_size <= 0:
+        return list(requests)
+    split = []
+    for request in requests:
+        names = request.measurement_names
+        for pos in range(0, len(names), batch_size):
+            split.append(QueryRequest(request.kind, tuple(names[pos:pos + batch_size]), request.start_date, request.end_date, request.days))
+    return split
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def _downsampled_query(downsampled: DownsampleRoute, measurement_names, field, reduction, derived=None, result=RESULT_DOWNSAMPLED):
+    """Flux pipeline of the whole windows of a route, named RESULT_DOWNSAMPLED
+
+    Args:
+        downsampled (DownsampleRoute): the windows
+        measurement_names (list): names of the measurements stored in influx
+        field (str): FIELD_MEAN or FIELD_LAST
+        reduction (str): the steps after the filter
+        derived (DerivedMeasurement): evaluated on the reduced measurements, optional
+        result (str): name of the result
+
+    Returns:
+        str: the pipeline
+    """
+    return f"""from(bucket:"{downsampled.bucket.name}")
+        |> range(start: {downsampled.start.strftime('%Y-%m-%dT%H:%M:%SZ')}, stop: {downsampled.stop.strftime('%Y-%m-%dT%H:%M:%SZ')})
+        |> filter(fn: (r) => contains(value: r._measurement, set: {_flux_set(measurement_names)}) and r._field == "{field}"){reduction}{KEEP if derived is None else flux_tail(derived)}
+        |> yield(name: "{result}")
+"""
+
+
+def _pipeline_groups(measurement_names, result):
+    """Measurements of the pipelines of a query: the plain ones together, each derived measurement on its own
+
+    Args:
+        measurement_names (list): names of the measurements, plain or derived
+        result (str): name of the result of the plain measurements
+
+    Returns:
+        list: tuples of the measurement names read by a pipeline, its DerivedMeasurement or None and its result
+    """
+    plain = [name for name in measurement_names if not is_derived(name)]
+    groups = [(plain, None, result)] if plain else []
+    derived = [parse_derived(name) for name in measurement_names if is_derived(name)]
+    groups += [
+        (measurement.measurements, measurement, f"{result}{DERIVED_RESULT_SEPARATOR}{number}") for number, measurement in enumerate(derived, 1)
+    ]
+    return groups
+
+
+def _base_result(result):
+    """The result a pipeline of a derived measurement belongs to, see _pipeline_groups()"""
+    return result.split(DERIVED_RESULT_SEPARATOR)[0]
+
+
+def _hours(downsampled: DownsampleRoute):
+    """Hours of a window of the route as a Flux float, mean W times hours is Wh"""
+    return repr(downsampled.bucket.every.total_seconds() / 3600)
 
-        result_end = self.influx.client.query_api().query(org=self.influx.org, query=query_end)
 
-        values_end = []
+def _flux_set(names):
+    """Format a list of strings as a Flux array literal
 
-        for table in result_end:
-            for record in table.records:
-                try:
-                    value = record.get_value()
-                    values_end.append(value)
-                except KeyError as exception:
-                    logger.error(exception)
+    Args:
+        names (list): strings to put into the array
 
-        # Return the last value from both queries
-        return (values_start[-1] if values_start else None, values_end[-1] if values_end else None)
+    Returns:
+        str: e.g. ["a", "b"]
+    """
+    return "[" + ", ".join(f'"{name}"' for name in names) + "]"
@@ -0,0 +1,124 @@
+"""Run the batched queries of GetFromInflux concurrently on the async InfluxDB client"""
+import asyncio
+import logging
+import time
+from typing import TYPE_CHECKING
+
+from influxdb_client.client.influxdb_client_async import InfluxDBClientAsync
+
+from query_request import KIND_KWH, KIND_SNAPSHOTS, QueryRequest
+
+if TYPE_CHECKING:
+    from influx import GetFromInflux
+
+logger = logging.getLogger("influx_report.influx_async")
+
+
+# pylint: disable-next=too-few-public-methods
+class RateLimiter():
+    """Let at most rate callers per second pass, evenly spaced"""
+
+    def __init__(self, rate: float):
+        """
+        Args:
+            rate (float): callers per second, 0 for no limit
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        """Wait until the next caller may start"""
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# pylint: disable-next=too-few-public-methods
+class AsyncGetFromInflux():
+    """Run QueryRequests of a GetFromInflux on the async client with bounded concurrency
+
+    Query building and the reduction of the records are done by the GetFromInflux, so the
+    results are the same as with its synchronous getters and are remembered there as well.
+    """
+
+    def __init__(self, influx: "GetFromInflux", query_api, concurrency: int, rate_limit: float = 0.0):
+        """
+        Args:
+            influx (GetFromInflux): builds the queries and keeps the results
+            query_api (QueryApiAsync): query API of the async client
+            concurrency (int): queries in flight at once
+            rate_limit (float): queries started per second at most, 0 for no limit
+        """
+        self.influx = influx
+        self.query_api = query_api
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self._rate_limiter = RateLimiter(rate_limit)
+
+    async def query_batch(self, request: QueryRequest):
+        """Run a QueryRequest
+
+        Args:
+            request (QueryRequest): the query to run
+
+        Returns:
+            dict: result per measurement name, see the batched getters of GetFromInflux
+        """
+        names = list(request.measurement_names)
+        method = self.influx.session.options.integration
+        downsampled = self.influx.downsample_route(request.start_date, request.end_date) if request.kind == KIND_KWH else None
+        if request.kind == KIND_KWH:
+            query = self.influx.kwh_batch_query(names, request.start_date, request.end_date, method, downsampled)
+        elif request.kind == KIND_SNAPSHOTS:
+            query = self.influx.snapshots_batch_query(names, request.days)
+        else:
+            query = self.influx.values_batch_query(names, request.start_date, request.end_date)
+
+        async with self._semaphore:
+            await self._rate_limiter.wait()
+            logger.debug("Query %s of %d measurements from %s to %s", request.kind, len(names), request.start_date, request.end_date)
+            started = time.perf_counter()
+            tables = await self.influx.session.guard.call_async(lambda: self.query_api.query(query, org=self.influx.influx.org))
+            query_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        records = (record for table in tables for record in table.records)
+        if request.kind == KIND_KWH:
+            result = self.influx.reduce_kwh_batch(records, names, request.start_date, request.end_date, method, downsampled)
+        elif request.kind == KIND_SNAPSHOTS:
+            result = self.influx.reduce_snapshots_batch(records, names, request.days)
+        else:
+            result = self.influx.reduce_values_batch(records, names, request.start_date, request.end_date)
+        # the async client does not expose the response, its bytes are unknown
+        self.influx.session.metrics.record_query(request, query_seconds, sum(len(table.records) for table in tables), 0,
+                                                 time.perf_counter() - started)
+        return result
+
+
+async def prefetch_concurrently(influx: "GetFromInflux", requests: list):
+    """Run all QueryRequests concurrently, at most concurrency of them at once
+
+    The async client is opened for the requests with concurrency connections and the gzip and
+    query_timeout of the session. It does not share the connection pool, pool_size and keep_alive
+    of the session, and the bytes of its responses are not counted.
+
+    Args:
+        influx (GetFromInflux): builds the queries and keeps the results
+        requests (list): QueryRequest objects
+
+    Returns:
+        list: results of the requests in the same order
+    """
+    options = influx.session.options
+    client_options = {"connection_pool_maxsize": options.concurrency, "enable_gzip": options.gzip}
+    if options.query_timeout > 0:
+        # like InfluxSession, ends the HTTP requests of abandoned queries as well
+        client_options["timeout"] = int(options.query_timeout * 1000)
+    async with InfluxDBClientAsync(url=influx.influx.url, token=influx.influx.token, org=influx.influx.org, **client_options) as client:
+        async_influx = AsyncGetFromInflux(influx, client.query_api(), options.concurrency, options.rate_limit)
+        return await asyncio.gather(*(async_influx.query_batch(request) for request in requests))
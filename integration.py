@@ -0,0 +1,230 @@
+"""Integrate power samples in W to energy in kWh with NumPy, on arrays or in a single pass"""
+from datetime import datetime, timedelta, timezone
+import logging
+
+import numpy as np
+
+logger = logging.getLogger("influx_report.integration")
+
+# each value holds until the next timestamp, the behaviour of the original loop
+RULE_LEFT = "left"
+# linear interpolation between two samples, like Flux integral()
+RULE_TRAPEZOID = "trapezoid"
+
+NS_PER_HOUR = 3_600_000_000_000
+_EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_EPOCH_NAIVE = datetime(1970, 1, 1)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+# samples buffered by EnergyAccumulator before they are integrated
+DEFAULT_CHUNK_SIZE = 10_000
+
+
+def integrate_kwh(timestamps_ns, values, rule=RULE_LEFT, max_gap_s=None):
+    """Integrate power samples in W to energy in kWh
+
+    Args:
+        timestamps_ns (np.ndarray): int64 nanoseconds since epoch, sorted ascending
+        values (np.ndarray): float64 power in W, values[i] was sampled at timestamps_ns[i]
+        rule (str): RULE_LEFT or RULE_TRAPEZOID
+        max_gap_s (float): intervals longer than this many seconds are clamped to it, so a sensor
+            outage adds at most max_gap_s worth of energy. None integrates every interval in full.
+
+    Raises:
+        ValueError: if the rule is unknown or the arrays differ in length
+
+    Returns:
+        float: energy in kWh, 0.0 if there are less than two samples
+    """
+    timestamps_ns = np.asarray(timestamps_ns, dtype=np.int64)
+    values = np.asarray(values, dtype=np.float64)
+    if timestamps_ns.shape != values.shape:
+        raise ValueError(f"Length of timestamps and values must be same! {timestamps_ns.shape} != {values.shape}")
+    if len(values) < 2:
+        return 0.0  # Not enough data to calculate kWh
+
+    intervals_ns = np.diff(timestamps_ns)
+    if max_gap_s is not None:
+        intervals_ns = np.minimum(intervals_ns, np.int64(max_gap_s * 1_000_000_000))
+
+    if rule == RULE_LEFT:
+        heights = values[:-1]
+    elif rule == RULE_TRAPEZOID:
+        heights = (values[:-1] + values[1:]) / 2.0
+    else:
+        raise ValueError(f"Unknown integration rule {rule}")
+
+    # Wh = W * ns / ns_per_hour, kWh = Wh / 1000
+    return float(np.dot(heights, intervals_ns) / NS_PER_HOUR / 1000.0)
+
+
+def datetimes_to_ns(timestamps):
+    """Convert datetimes to int64 nanoseconds since epoch
+
+    Naive datetimes are counted from a naive epoch, so only their differences are meaningful.
+
+    Args:
+        timestamps (list): datetime objects, either all timezone aware or all naive
+
+    Returns:
+        np.ndarray: int64 nanoseconds since epoch
+    """
+    if len(timestamps) == 0:
+        return np.empty(0, dtype=np.int64)
+    epoch = _EPOCH_UTC if timestamps[0].tzinfo is not None else _EPOCH_NAIVE
+    microseconds = np.fromiter(((timestamp - epoch) // _ONE_MICROSECOND for timestamp in timestamps), dtype=np.int64, count=len(timestamps))
+    return microseconds * 1000
+
+
+def tables_to_arrays(tables):
+    """Collect the _time and _value columns of a query result into arrays
+
+    Args:
+        tables (list): FluxTable objects as returned by query_api.query()
+
+    Returns:
+        tuple: int64 nanosecond timestamps and float64 values
+    """
+    values = []
+    timestamps = []
+    for table in tables:
+        for record in table.records:
+            try:
+                values.append(record.get_value())
+                timestamps.append(record.get_time())
+            except KeyError as exception:
+                logger.error(exception)
+    return datetimes_to_ns(timestamps), np.asarray(values, dtype=np.float64)
+
+
+def integrate_tables_kwh(tables, rule=RULE_LEFT, max_gap_s=None):
+    """Integrate a query result of power samples in W to energy in kWh
+
+    Args:
+        tables (list): FluxTable objects as returned by query_api.query(), sorted by _time
+        rule (str): RULE_LEFT or RULE_TRAPEZOID
+        max_gap_s (float): clamp for intervals in seconds, see integrate_kwh()
+
+    Returns:
+        float: energy in kWh
+    """
+    timestamps_ns, values = tables_to_arrays(tables)
+    return integrate_kwh(timestamps_ns, values, rule, max_gap_s)
+
+
+class EnergyAccumulator():
+    """Running energy integral over power samples that arrive in time order
+
+    Samples are buffered in chunks of chunk_size and integrated with integrate_kwh(), the last
+    sample of a chunk is carried over to the next one. Memory stays constant no matter how many
+    samples are added.
+    """
+
+    def __init__(self, rule=RULE_LEFT, max_gap_s=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            rule (str): RULE_LEFT or RULE_TRAPEZOID
+            max_gap_s (float): clamp for intervals in seconds, see integrate_kwh()
+            chunk_size (int): number of samples buffered before they are integrated
+        """
+        self.rule = rule
+        self.max_gap_s = max_gap_s
+        self.chunk_size = chunk_size
+        self.samples = 0
+        self._kwh = 0.0
+        self._timestamps = []
+        self._values = []
+
+    def add(self, timestamp, value):
+        """Add the next sample
+
+        Args:
+            timestamp (datetime): time of the sample, not before the previous one
+            value (float): power in W
+        """
+        self._timestamps.append(timestamp)
+        self._values.append(value)
+        self.samples += 1
+        if len(self._values) >= self.chunk_size:
+            self._flush()
+
+    def _flush(self):
+        """Integrate the buffered samples and keep only the last one"""
+        self._kwh += integrate_kwh(datetimes_to_ns(self._timestamps), self._values, self.rule, self.max_gap_s)
+        self._timestamps = self._timestamps[-1:]
+        self._values = self._values[-1:]
+
+    @property
+    def kwh(self):
+        """float: energy in kWh of all samples added so far"""
+        if len(self._values) > 1:
+            self._flush()
+        return self._kwh
+
+
+# the same add() interface as EnergyAccumulator, so the streaming reducers treat both alike
+# pylint: disable-next=too-few-public-methods
+class LastValueAccumulator():
+    """Running latest value of a series, the sample with the newest timestamp wins"""
+
+    def __init__(self):
+        self.timestamp = None
+        self.value = None
+
+    def add(self, timestamp, value):
+        """Add the next sample
+
+        Args:
+            timestamp (datetime): time of the sample, None if the query does not return _time
+            value: the value of the sample
+        """
+        if self.timestamp is None or timestamp is None or timestamp >= self.timestamp:
+            self.timestamp = timestamp
+            self.value = value
+
+
+class DailyEnergyAccumulator():
+    """Running energy integral per day over power samples that arrive in time order
+
+    The interval between two samples belongs to the day of its first sample, so the sum over
+    all days equals the integral over the whole range.
+    """
+
+    def __init__(self, rule=RULE_LEFT, max_gap_s=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            rule (str): RULE_LEFT or RULE_TRAPEZOID
+            max_gap_s (float): clamp for intervals in seconds, see integrate_kwh()
+            chunk_size (int): number of samples buffered before they are integrated
+        """
+        self.rule = rule
+        self.max_gap_s = max_gap_s
+        self.chunk_size = chunk_size
+        self._days = {}
+        self._day = None
+        self._current = None
+
+    def add(self, timestamp, value):
+        """Add the next sample
+
+        Args:
+            timestamp (datetime): time of the sample, not before the previous one
+            value (float): power in W
+        """
+        day = timestamp.date()
+        if self._current is not None and day != self._day:
+            # the sample closes the last interval of the previous day
+            self._current.add(timestamp, value)
+            self._days[self._day] = self._current.kwh
+            self._current = None
+        if self._current is None:
+            self._current = EnergyAccumulator(self.rule, self.max_gap_s, self.chunk_size)
+            self._day = day
+        self._current.add(timestamp, value)
+
+    @property
+    def kwh_per_day(self):
+        """dict: energy in kWh per day of all samples added so far"""
+        days = dict(self._days)
+        if self._current is not None:
+            days[self._day] = self._current.kwh
+        return days
@@ -3,22 +3,47 @@ Read from an influxdb for a certain item the values of last month or week,
 depending on if it is the first of the month or sunday.
 Compare it against same timeframe last year.
 Ouput details to console
+
+    python main.py [--no-chart] [--format json] [--import-times] [--manifest manifest.json] [--force]
+
+Besides the summary chart of a report, a chart of the usage per day is created for every line of
+the catalog. The charts are rendered in worker processes while the report continues, see render.py.
+They need matplotlib, which takes long to import. Only the workers import it, so runs with
+--no-chart or --format json never load it.
+
+The charts are named after the period and date of their report, e.g. bar_chart_week_2024-10-06.png.
+The manifest records the inputs of the reports, a rerun only renders the reports whose inputs
+changed, see manifest.py.
 """
+import argparse
+import cProfile
+import json
 import logging
-from datetime import datetime
+import math
+import os
+import re
+from datetime import datetime, timedelta
 
 from dateutil.relativedelta import relativedelta
 
-from helpers import (get_same_calendar_week_day_one_year_ago, is_first_of_month, is_sunday, log_difference)
-from create_png import create_bar_chart
-from influx import GetFromInflux
+from baseline import DailyMatrix, baselines
+from helpers import (MeasurementSet, get_same_calendar_week_day_one_year_ago, is_first_of_month, is_sunday, log_difference)
+from catalog import TYPE_COUNTER, TYPE_WATT, load_catalog, plan_queries
+from derived import is_derived, parse_derived
+from influx import GetFromInflux, InfluxSession
+from manifest import MANIFEST_FILE, Manifest, config_version, inputs_hash
+from metrics import PHASE_RENDERING, RunMetrics
+from render import ChartRenderer
+from resilience import is_unavailable
+from rollup import KIND_ENERGY, KIND_LAST, days_between, last_on_or_before
 
 logging.basicConfig(level=logging.INFO, format='%(message)s')
 #logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s %(message)s', datefmt='%d.%m.%y %H:%M:%S')
 logger = logging.getLogger("influx_report.main")
 
 
-def process_and_log(date, is_month, measurement_name, name, is_watt=False):
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def process_and_log(date, is_month, measurement_name, name, is_watt=False, influx=None):
     """
     Processes the specified measurement for a given date, determining values and 
     timeframes, and logs the differences.
@@ -29,89 +54,172 @@ def process_and_log(date, is_month, measurement_name, name, is_watt=False):
         measurement_name (str): The name of the measurement in the influx db
         name (str): The human friendly name of the measurement to be processed.
         is_watt (bool): True if the value is in Watt / kW, False (default) if the vaule is in Wh or kWh
+        influx (GetFromInflux): shared influx access of the run, optional
 
     Returns:
         dict: the data packed into a dict
     """
     if is_watt:
-        values, timeframes = process_measurement_watt(date, is_month, measurement_name)
+        values, timeframes = process_measurement_watt(date, is_month, measurement_name, influx)
     else:
-        values, timeframes = process_measurement_kwh(date, is_month, measurement_name)
+        values, timeframes = process_measurement_kwh(date, is_month, measurement_name, influx)
     return log_difference(values, timeframes, name)
 
 
-# pylint: disable-next=too-many-locals
-def process(date, is_month):
+def process(date, is_month, influx=None, catalog=None):
     """
-    Processes the energy measurements for a given date, determining whether to use monthly or weekly data.
+    Processes the energy measurements of the catalog for a given date, determining whether to use monthly or weekly data.
+
+    A line whose values cannot be queried because of a timeout, the deadline of the run or a
+    transient error after all retries is marked as missing, and so is a line that subtracts it.
 
     Args:
         date (datetime): The reference date for processing the measurements.
         is_month (bool): A flag indicating whether to process monthly data (True) or weekly data (False).
+        influx (GetFromInflux): shared influx access of the run. If not given, one session is opened for all measurements.
+        catalog (list): CatalogEntry objects, defaults to the catalog file
 
     Returns:
-        None
+        list: a MeasurementSet per line of the catalog
     """
+    if influx is None:
+        with InfluxSession() as session:
+            return process(date, is_month, GetFromInflux(session), catalog)
+    catalog = catalog or load_catalog()
+    prefetch(date, [is_month], influx, catalog)
     processed_data = []
-
-    processed_data.append(process_and_log(date, is_month, "Strom_Leistung_Kuehlschrank", "Kühlschrank", True))
-    processed_data.append(process_and_log(date, is_month, "Strom_Leistung_Waschmaschine", "Waschmaschine", True))
-    processed_data.append(process_and_log(date, is_month, "Strom_Leistung_Trockner", "Trockner", True))
-    processed_data.append(process_and_log(date, is_month, "Strom_Leistung_TV_EG", "TV EG", True))
-    processed_data.append(process_and_log(date, is_month, "Strom_TV_K1_Watt", "TV UG", True))
-    processed_data.append(process_and_log(date, is_month, "Strom_Leistung_Wasserpumpe", "Wasserpumpe", True))
-    # go-e "eto" is in deka kWh, value 1 = 0.1kWh
-    goe, timeframes = process_measurement_kwh(date, is_month, "GoEChargerEnergyTotal")
-    processed_data.append(log_difference((goe[0] / 10, goe[1] / 10), timeframes, "E-Auto"))
-
-    just_log_measurements = [
-        ("Zaehler_Ceran", "Kochfeld"),
-        ("Zaehler_Mikrowelle", "Mikrowelle"),
-        ("Zaehler_Netzwerkschrank", "Netzwerkschrank"),
-        ("Zaehler_Spuelmaschine", "Spülmaschine"),
-        ("Zaehler_Wasser", "Wasser (m³)"),
-        ("Zaehler_Wasser_Garten", "Wasser Garten (m³)"),
-        #("Zaehler_Backofen","Heizung"),
-    ]
-    for measurement in just_log_measurements:
-        processed_data.append(process_and_log(date, is_month, measurement[0], measurement[1]))
-    # Haushalt is in kWh
-    haushalt, _ = process_measurement_kwh(date, is_month, "SmartMeter_Haushalt_Bezug")
-    processed_data.append(log_difference(haushalt, timeframes, "Haushalt Zähler"))
-
-    shelly_hh_ph1, _ = process_measurement_kwh(date, is_month, "Test_Shelly_3EM_Haushalt_Ph1_Total")
-    shelly_hh_ph2, _ = process_measurement_kwh(date, is_month, "Test_Shelly_3EM_Haushalt_Ph2_Total")
-    shelly_hh_ph3, _ = process_measurement_kwh(date, is_month, "Test_Shelly_3EM_Haushalt_Ph3_Total")
-    shelly_hh_total = [
-        round((shelly_hh_ph1[0] + shelly_hh_ph2[0] + shelly_hh_ph3[0]) / 1000, 1),
-        round((shelly_hh_ph1[1] + shelly_hh_ph2[1] + shelly_hh_ph3[1]) / 1000, 1),
-    ]
-    processed_data.append(log_difference(shelly_hh_total, timeframes, "Haushalt absolut"))
-
-    # Heizung is in Wh, and Heizung also counts Haushalt (Kaskadenschaltung)
-    heizung, _ = process_measurement_kwh(date, is_month, "SmartMeter_HeizungNeu_Bezug")
-    heizung[0] = round(heizung[0] / 1000, 1) - haushalt[0]
-    heizung[1] = round(heizung[1] / 1000, 1) - haushalt[1]
-    processed_data.append(log_difference(heizung, timeframes, "Heizung"))
-
-    shelly_hei_ph1, _ = process_measurement_kwh(date, is_month, "Test_Shelly_3EM_Heizung_Ph1_Total")
-    shelly_hei_ph2, _ = process_measurement_kwh(date, is_month, "Test_Shelly_3EM_Heizung_Ph2_Total")
-    shelly_hei_ph3, _ = process_measurement_kwh(date, is_month, "Test_Shelly_3EM_Heizung_Ph3_Total")
-    shelly_hh_total = [
-        round((shelly_hei_ph1[0] + shelly_hei_ph2[0] + shelly_hei_ph3[0]) / 1000, 1),
-        round((shelly_hei_ph1[1] + shelly_hei_ph2[1] + shelly_hei_ph3[1]) / 1000, 1),
-    ]
-    processed_data.append(log_difference(shelly_hh_total, timeframes, "Heizung absolut"))
-
-    einspeisung, _ = process_measurement_kwh(date, is_month, "SmartMeter_HeizungNeu_Einspeisung")
-    einspeisung[0] = round(einspeisung[0] / 1000, 1)
-    einspeisung[1] = round(einspeisung[1] / 1000, 1)
-    processed_data.append(log_difference(einspeisung, timeframes, "PV Einspeisung"))
+    values = {}
+    missing = set()
+
+    for entry in catalog:
+        try:
+            if entry.subtract in missing:
+                raise LookupError(f"{entry.subtract} is missing")
+            if entry.type == TYPE_WATT:
+                measured = [process_measurement_watt(date, is_month, name, influx) for name in entry.measurements]
+            else:
+                measured = [process_measurement_kwh(date, is_month, name, influx) for name in entry.measurements]
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            if not (is_unavailable(error) or entry.subtract in missing):
+                raise
+            logger.warning("%s is missing: %s", entry.label, error)
+            missing.add(entry.label)
+            processed_data.append(MeasurementSet(name=entry.label, data=[0.0, 0.0], dates=get_timeframes(date, is_month)[entry.type], missing=True))
+            continue
+        timeframes = measured[0][1]
+        summed = [sum(result[0] for result, _ in measured), sum(result[1] for result, _ in measured)]
+        values[entry.label] = entry.apply(summed, values.get(entry.subtract))
+        processed_data.append(log_difference(values[entry.label], timeframes, entry.label))
 
     return processed_data
 
 
-def process_measurement_kwh(date, is_month, measurement_name):
+def prefetch(date, reports, influx, catalog=None, daily=False):
+    """
+    Fetch all measurements of the catalog for the reports of a date with a deduplicated query
+    plan, so the single measurement getters afterwards are answered without further round trips.
+    Depending on the session options the queries run concurrently.
+
+    With daily, the daily usage of the current timeframe of each report is read first, see
+    daily_usage(). The totals of the current timeframes are computed from it, so only the
+    timeframes of the year before are queried.
+
+    Args:
+        date (datetime): The reference date for processing the measurements.
+        reports (list): is_month of each report, True for the monthly and False for the weekly report
+        influx (GetFromInflux): shared influx access of the run.
+        catalog (list): CatalogEntry objects, defaults to the catalog file
+        daily (bool): read the daily usage of the reports, e.g. for their daily charts
+
+    Returns:
+        None
+    """
+    catalog = catalog or load_catalog()
+    plan = plan_queries(catalog, [get_timeframes(date, is_month) for is_month in reports])
+    if daily:
+        try:
+            for is_month in reports:
+                daily_usage(date, is_month, influx, catalog)
+            influx.remember_known_daily(plan.requests)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            if not is_unavailable(error):
+                raise
+            logger.warning("Daily usage failed: %s", error)
+    requests = influx.pending(plan.requests)
+    if not requests:
+        logger.debug("All measurements of the query plan are known")
+        return
+    for line in plan.describe():
+        logger.info(line)
+    try:
+        influx.prefetch(requests)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        if not is_unavailable(error):
+            raise
+        # the lines are queried one by one, the ones that fail again are marked as missing
+        logger.warning("Prefetch failed: %s", error)
+
+
+def get_timeframes(date, is_month):
+    """
+    Timeframes of both types of catalog lines.
+
+    Args:
+        date (datetime): The reference date for calculations.
+        is_month (bool): If True, the period is considered to be a month; if False, it is a week.
+
+    Returns:
+        dict: the timeframes of get_timeframes_watt() for TYPE_WATT and of get_timeframes_kwh() for TYPE_COUNTER
+    """
+    return {TYPE_WATT: get_timeframes_watt(date, is_month), TYPE_COUNTER: get_timeframes_kwh(date, is_month)}
+
+
+def get_timeframes_kwh(date, is_month):
+    """
+    Timeframes compared for measurements in Wh or kWh: the period and the same period last year.
+
+    Args:
+        date (datetime): The reference date for calculations.
+        is_month (bool): If True, the period is considered to be a month; if False, it is a week.
+
+    Returns:
+        tuple: A tuple containing two tuples:
+            - first tuple (datetime, datetime): Last year start and end date.
+            - second tuple (datetime, datetime): This year start and end date.
+    """
+    if is_month:
+        delta = relativedelta(months=1)
+        one_year_ago = date - relativedelta(years=1)
+    else:
+        delta = relativedelta(weeks=1)
+        one_year_ago = get_same_calendar_week_day_one_year_ago(date)
+    return ((one_year_ago - delta, one_year_ago), (date - delta, date))
+
+
+def get_timeframes_watt(date, is_month):
+    """
+    Timeframes compared for measurements in W or kW: the month and the same month last year,
+    or the week and the week before.
+
+    Args:
+        date (datetime): The reference date for calculations.
+        is_month (bool): If True, the period is considered to be a month; if False, it is a week.
+
+    Returns:
+        tuple: A tuple containing two tuples:
+            - first tuple (datetime, datetime): Past start and end date.
+            - second tuple (datetime, datetime): Current start and end date.
+    """
+    if is_month:
+        delta = relativedelta(months=1)
+        past_timeframe = date - relativedelta(years=1)
+    else:
+        delta = relativedelta(weeks=1)
+        past_timeframe = date - relativedelta(days=7)
+    return ((past_timeframe - delta, past_timeframe), (date - delta, date))
+
+
+def process_measurement_kwh(date, is_month, measurement_name, influx=None):
     """
     Entry point for processing usage data based on the specified period. The measurement is in Wh or kWh.
 
@@ -119,6 +227,7 @@ def process_measurement_kwh(date, is_month, measurement_name):
         date (datetime): The reference date for calculations.
         is_month (bool): If True, the period is considered to be a month; if False, it is a week.
         measurement_name (str): The name of the measurement to be processed.
+        influx (GetFromInflux): shared influx access of the run. If not given, a new one is created.
 
     Raises:
         ValueError: If an invalid period is specified.
@@ -131,37 +240,66 @@ def process_measurement_kwh(date, is_month, measurement_name):
             - first tuple (float, float): Last year start and end date.
             - this_year_value (float): This year start and end date.
     """
-    influx = GetFromInflux()
+    if influx is None:
+        influx = GetFromInflux()
 
-    if is_month:
-        delta = relativedelta(months=1)
-        one_year_ago = date - relativedelta(years=1)
-    else:
-        delta = relativedelta(weeks=1)
-        one_year_ago = get_same_calendar_week_day_one_year_ago(date)
-
-    # Get today's usage data for the specified period
-    values_today = influx.get_values_from_influx(
-        measurement_name=measurement_name,
-        start_date=date - delta,
-        end_date=date,
-    )
+    timeframes = get_timeframes_kwh(date, is_month)
 
     # Calculate current year's usage
-    this_year_usage = values_today[1] - values_today[0]
+    this_year_usage = counter_usage(influx, measurement_name, timeframes[1][0], timeframes[1][1])
 
     # Calculate last year's usage for the same period
-    values_last_year = influx.get_values_from_influx(
+    last_year_usage = counter_usage(influx, measurement_name, timeframes[0][0], timeframes[0][1])
+    return [last_year_usage, this_year_usage], timeframes
+
+
+def counter_usage(influx, measurement_name, start_date, end_date):
+    """
+    Usage of a counter over a period.
+
+    If a derived measurement that sums measurements, e.g. the phases of a meter, has no value at
+    the start or the end, its measurements are read on their own and their usages are summed, so
+    only a measurement without a value counts 0.
+
+    Args:
+        influx (GetFromInflux): shared influx access of the run.
+        measurement_name (str): The name of the measurement, plain or derived.
+        start_date (datetime): start of the period
+        end_date (datetime): end of the period
+
+    Returns:
+        float: end value minus start value, 0.0 if one of the values is unknown
+    """
+    values = influx.get_values_from_influx(
         measurement_name=measurement_name,
-        start_date=one_year_ago - delta,
-        end_date=one_year_ago,
+        start_date=start_date,
+        end_date=end_date,
     )
+    summands = parse_derived(measurement_name).summands() if None in values and is_derived(measurement_name) else ()
+    if summands:
+        logger.warning("Missing value of %s, its measurements are read on their own", measurement_name)
+        return sum(counter_usage(influx, name, start_date, end_date) for name in summands)
+    return counter_difference(values, measurement_name)
 
-    last_year_usage = values_last_year[1] - values_last_year[0]
-    return [last_year_usage, this_year_usage], ((one_year_ago - delta, one_year_ago), (date - delta, date))
 
+def counter_difference(values, measurement_name):
+    """
+    Difference of the counter values at the end and at the start of a period.
+
+    Args:
+        values (tuple): counter value at the start and at the end of the period, None if unknown
+        measurement_name (str): The name of the measurement, used for logging.
 
-def process_measurement_watt(date, is_month, measurement_name):
+    Returns:
+        float: end value minus start value, 0.0 if one of the values is unknown
+    """
+    if None in values:
+        logger.warning("Missing value of %s, usage is set to 0", measurement_name)
+        return 0.0
+    return values[1] - values[0]
+
+
+def process_measurement_watt(date, is_month, measurement_name, influx=None):
     """
     Entry point for processing usage data based on the specified period. The measurement is in W or kW.
 
@@ -169,6 +307,7 @@ def process_measurement_watt(date, is_month, measurement_name):
         date (datetime): The reference date for calculations.
         is_month (bool): If True, the period is considered to be a month; if False, it is a week.
         measurement_name (str): The name of the measurement to be processed.
+        influx (GetFromInflux): shared influx access of the run. If not given, a new one is created.
 
     Raises:
         ValueError: If an invalid period is specified.
@@ -181,65 +320,453 @@ def process_measurement_watt(date, is_month, measurement_name):
             - first tuple (float, float): Last year start and end date.
             - this_year_value (float): This year start and end date.
     """
-    influx = GetFromInflux()
+    if influx is None:
+        influx = GetFromInflux()
 
-    if is_month:
-        delta = relativedelta(months=1)
-        past_timeframe = date - relativedelta(years=1)
-    else:
-        delta = relativedelta(weeks=1)
-        past_timeframe = date - relativedelta(days=7)
+    timeframes = get_timeframes_watt(date, is_month)
 
     # Get today's usage data for the specified period
     current_usage = influx.get_total_kwh_consumed_from_influx(
         measurement_name=measurement_name,
-        start_date=date - delta,
-        end_date=date,
+        start_date=timeframes[1][0],
+        end_date=timeframes[1][1],
     )
 
     # Calculate last year's usage for the same period
     past_usage = influx.get_total_kwh_consumed_from_influx(
         measurement_name=measurement_name,
-        start_date=past_timeframe - delta,
-        end_date=past_timeframe,
+        start_date=timeframes[0][0],
+        end_date=timeframes[0][1],
     )
 
-    return [past_usage, current_usage], ((past_timeframe - delta, past_timeframe), (date - delta, date))
+    return [past_usage, current_usage], timeframes
 
 
-def main(today=datetime.now().replace(hour=23, minute=59, second=59)):
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def main(today=datetime.now().replace(hour=23, minute=59, second=59), influx=None, charts=True, chart_workers=None, metrics=None, manifest=None):
     """
     Main function to execute the processing of energy measurements.
 
     Args:
         today (datetime, optional): The reference datetime for processing. Defaults to the current datetime set to 23:59:59.
+        influx (GetFromInflux, optional): shared influx access. If not given, one session is opened for the whole run.
+        charts (bool, optional): create the charts of the reports, defaults to True
+        chart_workers (int, optional): processes rendering the charts, defaults to the number of CPUs
+        metrics (RunMetrics, optional): records the queries of the session opened for the run
+        manifest (Manifest, optional): skips the charts of the reports whose inputs are unchanged
 
     Returns:
-        None
+        tuple: the date of the reports, is_month of each report and their MeasurementSet objects
     """
-    was_processed = False
-    data = []
+    if influx is None:
+        with InfluxSession(metrics=metrics) as session:
+            return main(today, GetFromInflux(session), charts, chart_workers, manifest=manifest)
 
-    if is_first_of_month(today):
-        logger.debug("%s is the first of the month.", today.date())
-        data = process(date=today, is_month=True)
-        create_bar_chart(data, "bar_chart_month.png")
-        was_processed = True
+    today, reports = latest_reports(today)
+    with ChartRenderer(chart_workers if charts else 0) as renderer:
+        return today, reports, run_reports(today, reports, influx, renderer if charts else None, manifest=manifest)
+
+
+def latest_reports(date):
+    """
+    The latest day with due reports, the day itself or the last one before.
+
+    Args:
+        date (datetime): The day to start from.
+
+    Returns:
+        tuple: the day and is_month of each report due on it, see due_reports()
+    """
+    reports = due_reports(date)
+    while not reports:
+        date -= relativedelta(days=1)
+        reports = due_reports(date)
+    return date, reports
+
+
+def due_reports(date):
+    """
+    Reports due on a date: the monthly report on the first of the month, the weekly report on a Sunday.
+
+    Args:
+        date (datetime): The day to check.
+
+    Returns:
+        list: is_month of each due report, the monthly report first
+    """
+    reports = []
+    if is_first_of_month(date):
+        logger.debug("%s is the first of the month.", date.date())
+        reports.append(True)
     else:
-        logger.debug("%s is not the first of the month.", today.date())
+        logger.debug("%s is not the first of the month.", date.date())
 
-    if is_sunday(today):
-        logger.debug("%s is a Sunday.", today.date())
-        data = process(date=today, is_month=False)
-        create_bar_chart(data, "bar_chart_week.png")
-        was_processed = True
+    if is_sunday(date):
+        logger.debug("%s is a Sunday.", date.date())
+        reports.append(False)
     else:
-        logger.debug("%s is not a Sunday.", today.date())
+        logger.debug("%s is not a Sunday.", date.date())
+    return reports
+
+
+def report_name(date, is_month):
+    """
+    Name of a report, e.g. week_2024-10-06, used for its files and in the manifest.
+
+    Args:
+        date (datetime): The reference date of the report.
+        is_month (bool): If True, the report is the monthly one, otherwise the weekly one.
+
+    Returns:
+        str: the period and the date of the report
+    """
+    return f"{'month' if is_month else 'week'}_{date:%Y-%m-%d}"
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def run_reports(date, reports, influx, renderer=None, catalog=None, output_dir="", manifest=None):
+    """
+    Process the reports of a date and create their charts.
+
+    The charts of a report are submitted to the renderer as soon as the report is processed and
+    rendered while the daily usage and the next report are queried. The metrics of the session
+    are kept in the sections prefetch, month, week and charts. The deadline of the run, see
+    report_deadline, starts here.
+
+    If baseline_years is set, the baseline statistics of the lines are attached to each report,
+    see report_baselines().
+
+    With a manifest, the daily usage and the charts of a report whose inputs and version are
+    unchanged are skipped. Complete reports are recorded in the manifest once their charts are
+    rendered.
+
+    Args:
+        date (datetime): The reference date of the reports.
+        reports (list): is_month of each report
+        influx (GetFromInflux): shared influx access of the run.
+        renderer (ChartRenderer): renders the charts, no charts without it
+        catalog (list): CatalogEntry objects, defaults to the catalog file
+        output_dir (str): directory of the charts, defaults to the working directory
+        manifest (Manifest): the reports created so far, optional
+
+    Returns:
+        list: the MeasurementSet objects of each report
+    """
+    metrics = influx.session.metrics
+    influx.session.guard.start()
+    catalog = catalog or load_catalog()
+    version = config_version(catalog, influx.session.options) if manifest is not None and renderer is not None else None
+    # one plan for all reports, so the queries they share run once
+    with metrics.section("prefetch"):
+        prefetch(date, reports, influx, catalog, daily=renderer is not None)
+    results = []
+    created = []
+    for is_month in reports:
+        with metrics.section("month" if is_month else "week"):
+            data = process(date=date, is_month=is_month, influx=influx, catalog=catalog)
+            if influx.session.options.baseline_years > 0:
+                report_baselines(date, is_month, data, influx, catalog)
+            if renderer is not None:
+                entry = _render_or_skip(renderer, date, is_month, data, influx, catalog, output_dir, manifest, version)
+                if entry is not None:
+                    created.append(entry)
+        results.append(data)
+    if renderer is not None:
+        with metrics.section("charts"):
+            renderer.wait()
+            metrics.add_phase(PHASE_RENDERING, renderer.seconds)
+    if created:
+        for entry in created:
+            manifest.record(*entry)
+        manifest.save()
+    return results
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def _render_or_skip(renderer, date, is_month, data, influx, catalog, output_dir, manifest, version):
+    """Submit the charts of a report unless the manifest has it with the same inputs and version
+
+    Args:
+        renderer (ChartRenderer): renders the charts
+        date (datetime): The reference date of the report.
+        is_month (bool): the monthly or the weekly report
+        data (list): MeasurementSet objects of the report
+        influx (GetFromInflux): shared influx access of the run.
+        catalog (list): CatalogEntry objects
+        output_dir (str): directory of the charts
+        manifest (Manifest): the reports created so far, None without a manifest
+        version (str): version of the code and config, see config_version(), None without a manifest
+
+    Returns:
+        tuple: name, inputs, version and files to record in the manifest once the charts are rendered,
+        None if the report is skipped, incomplete or there is no manifest
+    """
+    name = report_name(date, is_month)
+    inputs = inputs_hash(data) if version is not None else None
+    if version is not None and manifest.unchanged(name, inputs, version):
+        logger.info("Inputs of report %s unchanged, its charts are kept", name)
+        return None
+    files, complete = submit_charts(renderer, date, is_month, data, influx, catalog, output_dir)
+    if version is None or not complete or any(measurement_set.missing for measurement_set in data):
+        return None
+    return name, inputs, version, files
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def submit_charts(renderer, date, is_month, data, influx, catalog=None, output_dir=""):
+    """
+    Submit the summary chart of a report and the chart of the daily usage of each catalog line.
+
+    Args:
+        renderer (ChartRenderer): renders the charts
+        date (datetime): The reference date of the report.
+        is_month (bool): If True, the report is the monthly one, otherwise the weekly one.
+        data (list): MeasurementSet objects of the report
+        influx (GetFromInflux): shared influx access of the run.
+        catalog (list): CatalogEntry objects, defaults to the catalog file
+        output_dir (str): directory of the charts, defaults to the working directory
+
+    Returns:
+        tuple: the filenames of the submitted charts and False if the daily charts are missing
+    """
+    name = report_name(date, is_month)
+    files = [os.path.join(output_dir, f"bar_chart_{name}.png")]
+    renderer.summary_chart(data, files[0])
+    try:
+        usage = daily_usage(date, is_month, influx, catalog)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        if not is_unavailable(error):
+            raise
+        logger.warning("No daily charts of report %s: %s", name, error)
+        return files, False
+    for label, days, values in usage:
+        slug = re.sub(r"\W+", "_", label).strip("_")
+        files.append(os.path.join(output_dir, f"daily_chart_{name}_{slug}.png"))
+        renderer.daily_chart(label, days, values, files[-1])
+    return files, True
+
+
+def daily_usage(date, is_month, influx, catalog=None):
+    """
+    Usage per day of every catalog line over the current timeframe of a report.
 
-    if not was_processed:
-        main(today - relativedelta(days=1))
+    The daily energy and daily last values are read with one query per type of line, or from
+    the rollups if rollup_file is set, and kept for the run, see prefetch(). The usage of a
+    counter on a day is the difference of its last value on that day and on the day before.
+
+    Args:
+        date (datetime): The reference date of the report.
+        is_month (bool): If True, the period is considered to be a month; if False, it is a week.
+        influx (GetFromInflux): shared influx access of the run.
+        catalog (list): CatalogEntry objects, defaults to the catalog file
+
+    Returns:
+        list: tuples of label, days and the usage of each day, in the order of the catalog
+    """
+    timeframes = get_timeframes(date, is_month)
+    days = {
+        entry_type: days_between(timeframe[1][0].date() + timedelta(days=1), timeframe[1][1].date()) for entry_type, timeframe in timeframes.items()
+    }
+    catalog = catalog or load_catalog()
+    lines = line_usage(influx, catalog, days)
+    return [(entry.label, days[entry.type], lines[entry.label]) for entry in catalog]
+
+
+def line_usage(influx, catalog, days, unknown=0.0):
+    """
+    Usage per day of every catalog line, see daily_usage().
+
+    Args:
+        influx (GetFromInflux): shared influx access of the run.
+        catalog (list): CatalogEntry objects
+        days (dict): per type of line the consecutive days
+        unknown (float): usage of a measurement on a day it is unknown
+
+    Returns:
+        dict: per label the usage of each day
+    """
+    usage = {}
+    for entry_type in (TYPE_WATT, TYPE_COUNTER):
+        names = [name for entry in catalog if entry.type == entry_type for name in entry.measurements]
+        if names:
+            usage.update(daily_measurement_usage(influx, entry_type, names, days[entry_type], unknown))
+
+    lines = {}
+    for entry in catalog:
+        summed = [sum(values) for values in zip(*(usage[name] for name in entry.measurements))]
+        lines[entry.label] = entry.apply(summed, lines.get(entry.subtract))
+    return lines
+
+
+def daily_measurement_usage(influx, entry_type, names, days, unknown=0.0):
+    """
+    Usage per day of measurements of one type.
+
+    Args:
+        influx (GetFromInflux): shared influx access of the run.
+        entry_type (str): TYPE_WATT or TYPE_COUNTER
+        names (list): names of the measurements
+        days (list): the days, consecutive
+        unknown (float): usage on a day it is unknown
+
+    Returns:
+        dict: per measurement name the usage of each day
+    """
+    if entry_type == TYPE_WATT:
+        daily = influx.get_daily_series(KIND_ENERGY, names, days[0], days[-1])
+        return {name: [unknown if daily[name].get(day) is None else daily[name][day] for day in days] for name in names}
+
+    lookback_days = influx.session.options.lookback_days
+    day_before = days[0] - timedelta(days=1)
+    daily = influx.get_daily_series(KIND_LAST, names, day_before - timedelta(days=lookback_days), days[-1])
+    usage = {}
+    sums = {}
+    for name in names:
+        values = [last_on_or_before(daily[name], day, lookback_days) for day in [day_before] + days]
+        summands = parse_derived(name).summands() if None in values and is_derived(name) else ()
+        if summands:
+            # like counter_usage(), only the measurements of the sum without a value count unknown
+            sums[name] = summands
+            continue
+        usage[name] = [unknown if None in (before, value) else value - before for before, value in zip(values, values[1:])]
+    if sums:
+        parts = daily_measurement_usage(influx, entry_type, list(dict.fromkeys(name for summands in sums.values() for name in summands)), days,
+                                        unknown)
+        for name, summands in sums.items():
+            usage[name] = [sum(values) for values in zip(*(parts[summand] for summand in summands))]
+    return usage
+
+
+# pylint: disable-next=too-many-locals
+def report_baselines(date, is_month, data, influx, catalog=None):
+    """
+    Attach the baseline statistics of every line to the MeasurementSet objects of a report.
+
+    The usage per day of all lines over the baseline_years before the current timeframe is read
+    like in daily_usage() and compared with the timeframe in one pass, see baseline.py. The same
+    timeframe in a year before is the same month, or the week 52 weeks earlier, so it starts on the
+    same weekday. If the daily usage cannot be queried, the report has no baselines.
+
+    Args:
+        date (datetime): The reference date of the report.
+        is_month (bool): If True, the period is considered to be a month; if False, it is a week.
+        data (list): MeasurementSet objects of the report, their baseline is set
+        influx (GetFromInflux): shared influx access of the run.
+        catalog (list): CatalogEntry objects, defaults to the catalog file
+
+    Returns:
+        list: the MeasurementSet objects
+    """
+    options = influx.session.options
+    catalog = catalog or load_catalog()
+    timeframe = get_timeframes(date, is_month)[TYPE_COUNTER][1]
+    period = days_between(timeframe[0].date() + timedelta(days=1), timeframe[1].date())
+    shifts = [relativedelta(years=year) if is_month else relativedelta(weeks=52 * year) for year in range(1, options.baseline_years + 1)]
+    first_day = min(period[0] - shifts[-1], period[0] - timedelta(days=options.baseline_window))
+    days = days_between(first_day, period[-1])
+    try:
+        lines = line_usage(influx, catalog, {TYPE_WATT: days, TYPE_COUNTER: days}, math.nan)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        if not is_unavailable(error):
+            raise
+        logger.warning("No baselines of report %s: %s", report_name(date, is_month), error)
+        return data
+    matrix = DailyMatrix([entry.label for entry in catalog], first_day, [lines[entry.label] for entry in catalog])
+    years = [(matrix.index(period[0] - shift), matrix.index(period[-1] - shift) + 1) for shift in shifts]
+    results = baselines(matrix, matrix.index(period[0]), matrix.days, years, options.baseline_window, options.outlier_zscore)
+    for measurement_set in data:
+        measurement_set.baseline = baseline = results[measurement_set.name]
+        logger.info("Baseline %s: median %s per day, %s in the same period of the years before, z-score %s", measurement_set.name,
+                    _statistic(baseline.median), _statistic(baseline.expected), _statistic(baseline.zscore))
+        if baseline.outlier:
+            logger.warning("%s is an outlier, z-score %s", measurement_set.name, _statistic(baseline.zscore))
+        if baseline.outlier_days:
+            logger.warning("%s is unusual on %s", measurement_set.name, ", ".join(day.strftime("%d.%m.%y") for day in baseline.outlier_days))
+    return data
+
+
+def _statistic(value):
+    """A statistic of a baseline for the log, n/a if it is unknown"""
+    return "n/a" if value is None else f"{value:.1f}"
+
+
+def reports_to_dict(date, reports, results):
+    """
+    The results of reports as JSON serialisable dict.
+
+    Args:
+        date (datetime): The reference date of the reports.
+        reports (list): is_month of each report
+        results (list): the MeasurementSet objects of each report
+
+    Returns:
+        dict: the date and per report its period (month or week) and measurements
+    """
+    return {
+        "date":
+            date.date().isoformat(),
+        "reports": [{
+            "period": "month" if is_month else "week",
+            "measurements": [measurement_set.to_dict() for measurement_set in data],
+        } for is_month, data in zip(reports, results)],
+    }
+
+
+def cli(argv=None):
+    """
+    Command line of the report.
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Compare the energy usage of the last week or month with last year")
+    parser.add_argument("--no-chart", action="store_true", help="do not create the charts, matplotlib is not loaded")
+    parser.add_argument("--format", choices=["text", "json"], default="text", help="json prints the results as JSON to stdout, implies --no-chart")
+    parser.add_argument("--chart-workers", type=int, help="processes rendering the charts (default: number of CPUs, 0: no extra processes)")
+    parser.add_argument("--import-times", action="store_true", help="log the import time of the modules of the report first")
+    parser.add_argument("--metrics", action="store_true", help="log the queries and the time per phase of the run as JSON")
+    parser.add_argument("--metrics-file", help="write the metrics of the run as a Prometheus textfile")
+    parser.add_argument("--profile", metavar="FILE", help="dump a cProfile of the run, view it with python -m pstats FILE")
+    parser.add_argument("--manifest", default=MANIFEST_FILE, help=f"manifest of the reports created so far (default {MANIFEST_FILE})")
+    parser.add_argument("--force", action="store_true", help="render all charts, even of reports whose inputs are unchanged")
+    parser.add_argument("--export", metavar="PATH", help="read the data from an export of InfluxDB or a directory of exports instead of the database")
+    args = parser.parse_args(argv)
+
+    if args.import_times:
+        # pylint: disable-next=import-outside-toplevel
+        from startup import log_import_times
+        log_import_times()
+    metrics = RunMetrics()
+    export = None
+    if args.export:
+        # pylint: disable-next=import-outside-toplevel
+        from export import ExportInflux
+        export = ExportInflux(args.export)
+    profile = cProfile.Profile() if args.profile else None
+    if profile is not None:
+        profile.enable()
+    try:
+        date, reports, results = main(datetime.now().replace(hour=23, minute=59, second=59, microsecond=0),
+                                      influx=GetFromInflux(export.configured_session(metrics=metrics)) if export is not None else None,
+                                      charts=not args.no_chart and args.format == "text",
+                                      chart_workers=args.chart_workers,
+                                      metrics=metrics,
+                                      manifest=Manifest(args.manifest, args.force))
+    finally:
+        if export is not None:
+            export.close()
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(args.profile)
+            logger.info("Profile of the run written to %s", args.profile)
+    if args.metrics:
+        metrics.log_summary()
+    if args.metrics_file:
+        metrics.write_textfile(args.metrics_file)
+    if args.format == "json":
+        print(json.dumps(reports_to_dict(date, reports, results), ensure_ascii=False, indent=2))
 
 
 if __name__ == "__main__":
     #main(datetime(year=2024, month=9, day=30))
-    main()
+    cli()
@@ -0,0 +1,145 @@
+"""Manifest of the reports created so far, so a rerun only renders the reports whose inputs changed
+
+For every report the manifest records a hash of its input data, the values of all catalog lines,
+the version of the code and of the config it was created with and the files it wrote. A rerun,
+e.g. by cron after a failure, still queries the values of the reports, which is cheap with
+cache_file or rollup_file, but skips the daily queries and the charts of a report whose hash and
+version are unchanged and whose files still exist.
+
+Reports with a missing line are not recorded, so the next run completes them.
+"""
+from dataclasses import asdict, dataclass
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger("influx_report.manifest")
+
+MANIFEST_FILE = "manifest.json"
+# options of the [InfluxDB] section that change the values of a report
+VERSION_OPTIONS = ("lookback_days", "integration", "integration_rule", "max_gap", "downsampled_buckets", "downsample_accuracy")
+
+
+@dataclass
+class ManifestEntry:
+    """A report of the manifest
+
+    Attributes:
+        inputs (str): hash of the input data, see inputs_hash()
+        version (str): version of the code and config, see config_version()
+        files (list): files written for the report
+        created (str): time the report was created, ISO format
+    """
+    inputs: str
+    version: str
+    files: list
+    created: str
+
+
+def inputs_hash(data):
+    """Hash of the input data of a report
+
+    Args:
+        data (list): MeasurementSet objects of the report
+
+    Returns:
+        str: hex digest of the values and timeframes of all lines
+    """
+    return _digest(json.dumps([measurement_set.to_dict() for measurement_set in data], sort_keys=True))
+
+
+def version_modules():
+    """The modules whose code may decide the values and charts of a report
+
+    Returns:
+        list: paths of all modules next to this one except the tests, sorted
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".py") and not name.startswith("test_"))
+
+
+def config_version(catalog, options):
+    """Version of the code and config a report is created with
+
+    Args:
+        catalog (list): CatalogEntry objects
+        options (QueryOptionsClass): the options of the session, only VERSION_OPTIONS count
+
+    Returns:
+        str: hex digest of the source of version_modules(), the catalog and the options
+    """
+    digest = hashlib.sha256()
+    for path in version_modules():
+        digest.update(os.path.basename(path).encode("utf-8"))
+        with open(path, "rb") as file:
+            digest.update(file.read())
+    options = asdict(options)
+    digest.update(
+        json.dumps([[asdict(entry) for entry in catalog], {
+            name: options[name] for name in VERSION_OPTIONS
+        }], sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class Manifest():
+    """The reports created so far, stored as JSON"""
+
+    def __init__(self, path=MANIFEST_FILE, force=False):
+        """
+        Args:
+            path (str): the manifest file, it is created by save()
+            force (bool): treat all reports as changed, they are created and recorded again
+        """
+        self.path = path
+        self.force = force
+        self.entries = {}
+        try:
+            with open(path, encoding="utf-8") as file:
+                self.entries = {key: ManifestEntry(**entry) for key, entry in json.load(file).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as error:
+            logger.warning("Manifest %s not readable, all reports are created: %s", path, error)
+
+    def unchanged(self, key, inputs, version):
+        """Whether a report was created with the same inputs and version and its files exist
+
+        Args:
+            key (str): name of the report, see main.report_name()
+            inputs (str): hash of its input data
+            version (str): version of the code and config
+
+        Returns:
+            bool: True if the report can be skipped
+        """
+        entry = self.entries.get(key)
+        return not self.force and entry is not None and entry.inputs == inputs and entry.version == version and all(
+            os.path.exists(file) for file in entry.files)
+
+    def record(self, key, inputs, version, files):
+        """Add or replace a report, see save()
+
+        Args:
+            key (str): name of the report
+            inputs (str): hash of its input data
+            version (str): version of the code and config
+            files (list): files written for the report
+        """
+        self.entries[key] = ManifestEntry(inputs, version, list(files), datetime.now().isoformat(timespec="seconds"))
+
+    def save(self):
+        """Write the manifest, replaced at once so an interrupted run never leaves half a file"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump({key: asdict(entry) for key, entry in sorted(self.entries.items())}, file, ensure_ascii=False, indent=2)
+        os.replace(temporary, self.path)
+
+
+def _digest(text):
+    """Hex digest of a text"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
@@ -0,0 +1,230 @@
+"""Metrics of the queries of a run and where its time goes
+
+GetFromInflux records every query it sends: the kind, the measurements, the range, the seconds
+until the records arrived, the rows and the bytes of the response, on the wire and decompressed. The time spent on reducing
+the records, e.g. integrating power to kWh, and on rendering the charts is added per phase.
+Everything is kept per section of the run, e.g. per report, and summarised at the end:
+
+- as one JSON line in the log, see log_summary()
+- as a Prometheus textfile for the textfile collector of the node exporter, see write_textfile()
+"""
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger("influx_report.metrics")
+
+PHASE_QUERY = "query"
+PHASE_INTEGRATION = "integration"
+PHASE_RENDERING = "rendering"
+PHASES = (PHASE_QUERY, PHASE_INTEGRATION, PHASE_RENDERING)
+
+DEFAULT_SECTION = "run"
+DEFAULT_SLOWEST = 5
+
+
+@dataclass
+class QueryMetric:  # pylint: disable=too-many-instance-attributes
+    """One query sent to InfluxDB
+
+    Attributes:
+        section (str): section of the run the query was sent in, e.g. the report
+        kind (str): kind of the query, e.g. KIND_KWH
+        measurements (tuple): names of the measurements
+        start (str): start of the range in ISO format
+        end (str): end of the range in ISO format
+        seconds (float): seconds until all records arrived, without the time spent on reducing them
+        rows (int): records of the response
+        bytes (int): bytes of the response on the wire, compressed with gzip, 0 if unknown
+        decoded_bytes (int): bytes of the response after decompression, 0 if unknown
+    """
+    section: str
+    kind: str
+    measurements: tuple
+    start: str
+    end: str
+    seconds: float
+    rows: int
+    bytes: int
+    decoded_bytes: int = 0
+
+
+class RunMetrics():
+    """Queries and phase times of a run, thread-safe"""
+
+    def __init__(self):
+        self.queries = []
+        self.phases = {}
+        self.started = time.time()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @property
+    def current_section(self):
+        """Section the queries and phases are added to, DEFAULT_SECTION outside of section()"""
+        return getattr(self._local, "section", DEFAULT_SECTION)
+
+    @contextmanager
+    def section(self, name):
+        """Add the queries and phases of the block to a section
+
+        Args:
+            name (str): name of the section, e.g. week or month
+        """
+        outer = self.current_section
+        self._local.section = name
+        try:
+            yield self
+        finally:
+            self._local.section = outer
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def record_query(self, request, seconds, rows, response_bytes=0, integration_seconds=0.0, decoded_bytes=0):
+        """Add a query
+
+        Args:
+            request (QueryRequest): kind, measurements and range of the query
+            seconds (float): seconds until all records arrived
+            rows (int): records of the response
+            response_bytes (int): bytes of the response on the wire, 0 if unknown
+            integration_seconds (float): seconds spent on reducing the records
+            decoded_bytes (int): bytes of the response after decompression, 0 if unknown
+        """
+        metric = QueryMetric(self.current_section, request.kind, tuple(request.measurement_names), _isoformat(request.start_date),
+                             _isoformat(request.end_date), seconds, rows, response_bytes, decoded_bytes)
+        with self._lock:
+            self.queries.append(metric)
+        self.add_phase(PHASE_QUERY, seconds)
+        self.add_phase(PHASE_INTEGRATION, integration_seconds)
+
+    def add_phase(self, phase, seconds):
+        """Add time to a phase of the current section
+
+        Args:
+            phase (str): PHASE_QUERY, PHASE_INTEGRATION or PHASE_RENDERING
+            seconds (float): the time
+        """
+        with self._lock:
+            phases = self.phases.setdefault(self.current_section, dict.fromkeys(PHASES, 0.0))
+            phases[phase] += seconds
+
+    def clear(self):
+        """Forget all queries and phases, e.g. before the next run of the daemon"""
+        with self._lock:
+            self.queries = []
+            self.phases = {}
+            self.started = time.time()
+
+    def summary(self, slowest=DEFAULT_SLOWEST):
+        """Totals of the run and of each section
+
+        Args:
+            slowest (int): number of the slowest queries listed per section
+
+        Returns:
+            dict: per section and in total the number of queries, rows, bytes, decoded bytes, the seconds per phase
+                and the slowest queries
+        """
+        with self._lock:
+            queries = list(self.queries)
+            phases = {section: dict(seconds) for section, seconds in self.phases.items()}
+        sections = list(dict.fromkeys([query.section for query in queries] + list(phases)))
+        result = {
+            "sections": {
+                section: _totals([query for query in queries if query.section == section], [phases.get(section, {})], slowest) for section in sections
+            }
+        }
+        result["total"] = _totals(queries, list(phases.values()), slowest)
+        return result
+
+    def log_summary(self, slowest=DEFAULT_SLOWEST):
+        """Log the summary as one JSON line
+
+        Args:
+            slowest (int): number of the slowest queries listed per section
+        """
+        logger.info("Run metrics %s", json.dumps(self.summary(slowest), ensure_ascii=False))
+
+    def prometheus(self, slowest=DEFAULT_SLOWEST):
+        """The summary in the Prometheus text format
+
+        The slowest queries are labelled with their rank, section and kind only, so the number of
+        series stays bounded. Their measurements and ranges are in the summary of log_summary().
+
+        Args:
+            slowest (int): number of the slowest queries exported
+
+        Returns:
+            str: the metrics
+        """
+        summary = self.summary(slowest)
+        lines = []
+        gauges = [
+            ("queries", "Queries sent to InfluxDB", "queries"),
+            ("query_rows", "Records returned by InfluxDB", "rows"),
+            ("response_bytes", "Bytes of the responses of InfluxDB on the wire", "bytes"),
+            ("response_decoded_bytes", "Bytes of the responses of InfluxDB after decompression", "decoded_bytes"),
+        ]
+        for name, help_text, key in gauges:
+            lines += [f"# HELP influx_report_{name} {help_text}", f"# TYPE influx_report_{name} gauge"]
+            lines += [f'influx_report_{name}{{section="{_label(section)}"}} {totals[key]}' for section, totals in summary["sections"].items()]
+        lines += ["# HELP influx_report_phase_seconds Seconds spent per phase", "# TYPE influx_report_phase_seconds gauge"]
+        for section, totals in summary["sections"].items():
+            lines += [
+                f'influx_report_phase_seconds{{section="{_label(section)}",phase="{phase}"}} {seconds:.6f}'
+                for phase, seconds in totals["phases"].items()
+            ]
+        lines += [
+            "# HELP influx_report_slowest_query_seconds Seconds of the slowest queries of the run", "# TYPE influx_report_slowest_query_seconds gauge"
+        ]
+        # labels that stay the same from run to run, the measurements and ranges of the queries are in the log
+        for rank, query in enumerate(summary["total"]["slowest"], start=1):
+            lines.append(f'influx_report_slowest_query_seconds{{rank="{rank}",section="{_label(query["section"])}",kind="{_label(query["kind"])}"}}'
+                         f' {query["seconds"]:.6f}')
+        lines += [
+            "# HELP influx_report_last_run_timestamp_seconds Time the run started",
+            "# TYPE influx_report_last_run_timestamp_seconds gauge",
+            f"influx_report_last_run_timestamp_seconds {self.started:.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path, slowest=DEFAULT_SLOWEST):
+        """Write the Prometheus textfile, replaced at once so the collector never reads half a file
+
+        Args:
+            path (str): the file, e.g. /var/lib/node_exporter/influx_report.prom
+            slowest (int): number of the slowest queries exported
+        """
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            file.write(self.prometheus(slowest))
+        os.replace(temporary, path)
+        logger.debug("Metrics written to %s", path)
+
+
+def _totals(queries, phases, slowest):
+    """Totals of queries and phase times"""
+    return {
+        "queries": len(queries),
+        "rows": sum(query.rows for query in queries),
+        "bytes": sum(query.bytes for query in queries),
+        "decoded_bytes": sum(query.decoded_bytes for query in queries),
+        "phases": {
+            phase: sum(seconds.get(phase, 0.0) for seconds in phases) for phase in PHASES
+        },
+        "slowest": [asdict(query) for query in sorted(queries, key=lambda query: query.seconds, reverse=True)[:slowest]],
+    }
+
+
+def _isoformat(date):
+    """ISO format of a date or datetime, empty if there is none"""
+    return date.isoformat() if date is not None else ""
+
+
+def _label(value):
+    """Escape a Prometheus label value"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -0,0 +1,32 @@
+"""Batched queries of GetFromInflux, see influx.py
+
+They are kept apart from influx.py, so the query plan of catalog.py and the async client of
+influx_async.py, which influx.py imports for concurrent queries, use them without importing it.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+
+# kinds of batched queries
+KIND_KWH = "kwh"
+KIND_VALUES = "values"
+KIND_SNAPSHOTS = "snapshots"
+
+
+@dataclass(frozen=True)
+class QueryRequest:
+    """One batched query for several measurements and one timespan
+
+    Attributes:
+        kind (str): KIND_KWH for get_total_kwh_consumed_batch_from_influx(),
+            KIND_VALUES for get_values_batch_from_influx(),
+            KIND_SNAPSHOTS for get_snapshots_batch_from_influx()
+        measurement_names (tuple): names of the measurements stored in influx
+        start_date (datetime): start of the timespan, or day of the first value
+        end_date (datetime): end of the timespan, or day of the second value
+        days (tuple): days of the values of KIND_SNAPSHOTS
+    """
+    kind: str
+    measurement_names: tuple
+    start_date: datetime
+    end_date: datetime
+    days: tuple = ()
@@ -0,0 +1,134 @@
+"""Render the charts of a report in a pool of processes
+
+matplotlib is not thread-safe, so the charts are rendered by worker processes. Charts are submitted
+as soon as their data is known and rendered while the report continues with its next queries.
+create_png and with it matplotlib is only imported by the workers, on their first chart or when
+they are warmed up, see ChartRenderer.warm().
+"""
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import time
+
+logger = logging.getLogger("influx_report.render")
+
+CHART_SUMMARY = "summary"
+CHART_DAILY = "daily"
+
+
+def render(chart, *args):
+    """Render a chart with create_png, runs in a worker process
+
+    Args:
+        chart (str): CHART_SUMMARY for create_bar_chart(), CHART_DAILY for create_daily_chart()
+        *args: the arguments of the create_png function, the filename last
+
+    Returns:
+        tuple: the filename of the chart and the seconds it took to render
+    """
+    started = time.perf_counter()
+    # pylint: disable-next=import-outside-toplevel
+    from create_png import create_bar_chart, create_daily_chart
+    if chart == CHART_SUMMARY:
+        create_bar_chart(*args)
+    else:
+        create_daily_chart(*args)
+    return args[-1], time.perf_counter() - started
+
+
+def warm_up():
+    """Import create_png and with it matplotlib, runs in a worker process
+
+    Returns:
+        int: the process id of the worker
+    """
+    # pylint: disable-next=import-outside-toplevel,unused-import
+    import create_png
+    return os.getpid()
+
+
+class ChartRenderer():
+    """Submit charts to a pool of worker processes and wait for all of them at the end"""
+
+    def __init__(self, workers=None, executor=None):
+        """
+        Args:
+            workers (int): number of worker processes, defaults to the number of CPUs.
+                0 renders each chart in the calling process when it is submitted.
+            executor (ProcessPoolExecutor): pool shared with other renderers instead of an own one, e.g. of
+                the reports of several sites. It is not shut down by close().
+        """
+        self.workers = os.cpu_count() if workers is None else workers
+        self._shared = executor is not None
+        if executor is None and self.workers > 0:
+            executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._executor = executor
+        self._futures = []
+        # seconds the charts of the last wait() took to render, summed over the workers
+        self.seconds = 0.0
+
+    def summary_chart(self, measurement_sets, filename):
+        """Render the bar chart of all measurements of a report
+
+        Args:
+            measurement_sets (list): MeasurementSet objects of the report
+            filename (str): The filename to save the bar chart as a PNG.
+        """
+        self._submit(CHART_SUMMARY, measurement_sets, filename)
+
+    def daily_chart(self, name, days, values, filename):
+        """Render the bar chart of the usage per day of one measurement
+
+        Args:
+            name (str): The human friendly name of the measurement.
+            days (list): The days of the period.
+            values (list): The usage of each day.
+            filename (str): The filename to save the bar chart as a PNG.
+        """
+        self._submit(CHART_DAILY, name, days, values, filename)
+
+    def _submit(self, chart, *args):
+        """Render a chart in a worker, or right away without workers"""
+        if self._executor is None:
+            self._futures.append(render(chart, *args))
+            return
+        self._futures.append(self._executor.submit(render, chart, *args))
+
+    def warm(self):
+        """Start all worker processes and import matplotlib in them, so the first charts are rendered at full speed
+
+        Without workers matplotlib is imported in the calling process.
+
+        Returns:
+            set: process ids of the workers that imported matplotlib
+        """
+        if self._executor is None:
+            return {warm_up()}
+        # no worker is idle before the first results, so every submit starts a process
+        return {future.result() for future in [self._executor.submit(warm_up) for _ in range(self.workers)]}
+
+    def wait(self):
+        """Wait until all submitted charts are rendered
+
+        Raises:
+            Exception: the first error of a worker
+
+        Returns:
+            list: filenames of the rendered charts, in the order they were submitted
+        """
+        rendered = [future if self._executor is None else future.result() for future in self._futures]
+        self._futures = []
+        self.seconds = sum(seconds for _, seconds in rendered)
+        logger.debug("%d charts rendered in %.2f s", len(rendered), self.seconds)
+        return [filename for filename, _ in rendered]
+
+    def close(self):
+        """Stop the worker processes"""
+        if self._executor is not None and not self._shared:
+            self._executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
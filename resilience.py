@@ -0,0 +1,231 @@
+"""Timeouts, retries, hedged requests and the deadline of a run for the queries of GetFromInflux
+
+QueryGuard runs the call that sends a query:
+
+- query_timeout: the call is abandoned after this many seconds with QueryTimeout
+- retries: transient errors, e.g. a refused connection or a 503, are retried after a random
+  delay of up to retry_backoff seconds, doubled with every retry (full jitter)
+- hedge_percentile: if the call takes longer than this percentile of the queries of the run so
+  far, a second identical call is sent and the first answer is used
+- report_deadline: no query is sent or retried after the deadline of the run, see start()
+
+All reads of the report are idempotent, so retried and hedged calls do no harm. Abandoned calls
+keep running in a background thread until the HTTP timeout of the client ends them.
+"""
+import asyncio
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+import random
+import time
+
+import numpy as np
+
+logger = logging.getLogger("influx_report.resilience")
+
+# queries of the run that are needed before the latency percentile is trusted for hedging
+HEDGE_MIN_QUERIES = 5
+# calls of hedged or timed out queries that run at once
+GUARD_WORKERS = 4
+# HTTP status codes of the server that are worth a retry
+TRANSIENT_STATUS = (429, 500, 502, 503, 504)
+
+
+class QueryTimeout(TimeoutError):
+    """A query did not finish within query_timeout"""
+
+
+class DeadlineExceeded(TimeoutError):
+    """The deadline of the run passed before a query could finish"""
+
+
+def is_transient(error):
+    """Whether an error of a query is worth a retry
+
+    Args:
+        error (Exception): the error
+
+    Returns:
+        bool: True for timeouts, connection errors, errors of urllib3 and aiohttp and TRANSIENT_STATUS answers
+    """
+    if isinstance(error, DeadlineExceeded):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError, asyncio.TimeoutError)):
+        return True
+    if getattr(error, "status", None) in TRANSIENT_STATUS:
+        return True
+    return type(error).__module__.split(".")[0] in ("urllib3", "aiohttp")
+
+
+def is_unavailable(error):
+    """Whether a query failed because the database is unavailable or too slow, not because of a bug
+
+    A line of the report whose query failed like this is marked as missing instead of aborting the report.
+
+    Args:
+        error (Exception): the error
+
+    Returns:
+        bool: True for timeouts, the deadline and transient errors
+    """
+    return isinstance(error, TimeoutError) or is_transient(error)
+
+
+class QueryGuard():
+    """Timeouts, retries and hedging of the queries of a session and the deadline of its run"""
+
+    def __init__(self, options, metrics, rng=None):
+        """
+        Args:
+            options (QueryOptionsClass): query_timeout, retries, retry_backoff, hedge_percentile and report_deadline
+            metrics (RunMetrics): the queries of the run, their latencies decide when to hedge
+            rng (random.Random): random numbers of the jitter, optional
+        """
+        self.options = options
+        self.metrics = metrics
+        self.rng = rng or random.Random()
+        self.deadline = None
+        self.retried = 0
+        self.hedged = 0
+        self._executor = None
+
+    def start(self):
+        """Start the deadline of a run, report_deadline seconds from now"""
+        self.deadline = time.monotonic() + self.options.report_deadline if self.options.report_deadline > 0 else None
+
+    def remaining(self):
+        """Seconds until the deadline, None without a deadline"""
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def check(self):
+        """Raise DeadlineExceeded if the deadline of the run has passed
+
+        Raises:
+            DeadlineExceeded: after the deadline
+        """
+        remaining = self.remaining()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {self.options.report_deadline:g} s of the run has passed")
+
+    def timeout(self):
+        """Seconds a query may take, the query_timeout or the time until the deadline if that is earlier
+
+        Returns:
+            float: the seconds, None for no limit
+        """
+        limits = [limit for limit in (self.options.query_timeout or None, self.remaining()) if limit is not None]
+        return max(0.0, min(limits)) if limits else None
+
+    def hedge_delay(self):
+        """Seconds after which a second call is sent, the hedge_percentile of the query latencies of the run
+
+        Returns:
+            float: the seconds, None without hedging or with less than HEDGE_MIN_QUERIES queries so far
+        """
+        if self.options.hedge_percentile <= 0 or len(self.metrics.queries) < HEDGE_MIN_QUERIES:
+            return None
+        return float(np.percentile([query.seconds for query in self.metrics.queries], self.options.hedge_percentile))
+
+    def backoff(self, attempt):
+        """Random delay before a retry, up to retry_backoff * 2 ** attempt seconds and not beyond the deadline"""
+        delay = self.rng.uniform(0.0, self.options.retry_backoff * 2**attempt)
+        remaining = self.remaining()
+        return delay if remaining is None else max(0.0, min(delay, remaining))
+
+    def call(self, function):
+        """Run a query with timeout, hedging and retries
+
+        Args:
+            function (callable): sends the query, called without arguments, maybe more than once
+
+        Raises:
+            QueryTimeout: if the last attempt timed out
+            DeadlineExceeded: if the deadline has passed
+            Exception: the error of the last attempt
+
+        Returns:
+            the result of the function
+        """
+        attempt = 0
+        while True:
+            self.check()
+            try:
+                return self._attempt(function)
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                if attempt >= self.options.retries or not is_transient(error):
+                    raise
+                delay = self.backoff(attempt)
+                attempt += 1
+                self.retried += 1
+                logger.warning("Query failed with %s, retry %d of %d in %.2f s", error, attempt, self.options.retries, delay)
+                time.sleep(delay)
+
+    def _attempt(self, function):
+        """One attempt of call(), hedged and abandoned after the timeout in worker threads if needed"""
+        timeout = self.timeout()
+        hedge_delay = self.hedge_delay()
+        if timeout is None and hedge_delay is None:
+            return function()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=GUARD_WORKERS, thread_name_prefix="influx_report_query")
+        started = time.monotonic()
+        pending = {self._executor.submit(function)}
+        error = None
+        while pending:
+            limits = [limit for limit in (timeout, hedge_delay) if limit is not None]
+            done, pending = wait(pending,
+                                 timeout=max(0.0,
+                                             min(limits) - (time.monotonic() - started)) if limits else None,
+                                 return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future.result()
+                error = future.exception()
+            elapsed = time.monotonic() - started
+            if done:
+                continue
+            if timeout is not None and elapsed >= timeout:
+                raise QueryTimeout(f"Query did not finish within {timeout:.1f} s")
+            if hedge_delay is not None and elapsed >= hedge_delay:
+                logger.info("Query takes longer than %.2f s, sending a hedged request", hedge_delay)
+                self.hedged += 1
+                hedge_delay = None
+                pending.add(self._executor.submit(function))
+        raise error
+
+    async def call_async(self, coroutine_function):
+        """Run a query of the async client with timeout and retries, without hedging
+
+        Args:
+            coroutine_function (callable): returns the awaitable that sends the query, maybe more than once
+
+        Raises:
+            QueryTimeout: if the last attempt timed out
+            DeadlineExceeded: if the deadline has passed
+            Exception: the error of the last attempt
+
+        Returns:
+            the result of the awaitable
+        """
+        attempt = 0
+        while True:
+            self.check()
+            timeout = self.timeout()
+            try:
+                try:
+                    return await asyncio.wait_for(coroutine_function(), timeout)
+                except asyncio.TimeoutError as error:
+                    raise QueryTimeout(f"Query did not finish within {timeout:.1f} s") from error
+            except Exception as error:  # pylint: disable=broad-exception-caught
+                if attempt >= self.options.retries or not is_transient(error):
+                    raise
+                delay = self.backoff(attempt)
+                attempt += 1
+                self.retried += 1
+                logger.warning("Query failed with %s, retry %d of %d in %.2f s", error, attempt, self.options.retries, delay)
+                await asyncio.sleep(delay)
+
+    def close(self):
+        """Stop waiting for abandoned calls"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
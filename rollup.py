@@ -0,0 +1,179 @@
+"""Local store of daily rollups, one row per measurement, kind and day
+
+Kinds:
+    KIND_ENERGY: energy of the day in kWh of a watt measurement
+    KIND_LAST: last value of the day of a counter measurement
+
+Only completed days are stored, so a run fetches just the days not rolled up yet and the
+current day. Period values are then computed locally by summing or differencing rollups.
+
+Each rollup is stored with the variant it was computed with, e.g. the integration method of the
+energy, so rollups of another configuration are never mixed in but computed anew. The rollups of
+each source, i.e. InfluxDB url, org and bucket, are kept apart, so several sites can share one file.
+"""
+from datetime import date, timedelta
+import logging
+import sqlite3
+
+logger = logging.getLogger("influx_report.rollup")
+
+KIND_ENERGY = "energy"
+KIND_LAST = "last"
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS daily (
+    kind TEXT NOT NULL,
+    measurement TEXT NOT NULL,
+    day TEXT NOT NULL,
+    value REAL,
+    variant TEXT NOT NULL,
+    source TEXT NOT NULL,
+    PRIMARY KEY (source, kind, measurement, day, variant)
+)"""
+_COLUMNS = ("kind", "measurement", "day", "value", "variant", "source")
+
+
+class RollupStore():
+    """Daily rollups in a SQLite file"""
+
+    def __init__(self, path: str, source: str = ""):
+        """Open or create the rollup file
+
+        A rollup file of an older layout is emptied, its rollups are computed again. The store may be
+        used by another thread than the one that opened it, but by one thread at a time.
+
+        Args:
+            path (str): path of the SQLite file
+            source (str): InfluxDB url, org and bucket the rollups are computed from
+        """
+        self.path = path
+        self.source = source
+        # the reports of the daemon run on its HTTP thread, one at a time under its lock
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        columns = tuple(row[1] for row in self._connection.execute("PRAGMA table_info(daily)"))
+        if columns and columns != _COLUMNS:
+            logger.info("Rollup file %s has an older layout, it is emptied", path)
+            self._connection.execute("DROP TABLE daily")
+        self._connection.execute(_SCHEMA)
+        self._connection.commit()
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def missing_days(self, kind, measurement_names, first_day: date, last_day: date, today: date, variant=""):
+        """Days of a range that are not rolled up for all measurements yet
+
+        Args:
+            kind (str): KIND_ENERGY or KIND_LAST
+            measurement_names (list): names of the measurements
+            first_day (date): first day of the range
+            last_day (date): last day of the range, inclusive
+            today (date): days from today on are never complete and always missing
+            variant (str): everything else the rollups depend on
+
+        Returns:
+            list: sorted days to fetch
+        """
+        rows = self._connection.execute(
+            "SELECT day, COUNT(*) FROM daily WHERE source=? AND kind=? AND variant=? AND day BETWEEN ? AND ?"
+            f" AND measurement IN ({', '.join('?' * len(measurement_names))}) GROUP BY day",
+            (self.source, kind, variant, first_day.isoformat(), last_day.isoformat(), *measurement_names)).fetchall()
+        complete = {row[0] for row in rows if row[1] == len(measurement_names)}
+        return [day for day in days_between(first_day, last_day) if day >= today or day.isoformat() not in complete]
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def put(self, kind, daily_values: dict, days: list, today: date, variant=""):
+        """Store fetched rollups of completed days
+
+        Days before today without a value are stored as NULL, so they are not fetched again.
+
+        Args:
+            kind (str): KIND_ENERGY or KIND_LAST
+            daily_values (dict): per measurement name a dict of day and value
+            days (list): all days that were fetched
+            today (date): this and later days are not stored
+            variant (str): everything else the rollups depend on
+        """
+        rows = []
+        for name, values in daily_values.items():
+            for day in days:
+                if day < today:
+                    rows.append((kind, name, day.isoformat(), values.get(day), variant, self.source))
+        self._connection.executemany("INSERT OR REPLACE INTO daily VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._connection.commit()
+        logger.debug("Stored %d %s rollups", len(rows), kind)
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def get(self, kind, measurement_name, first_day: date, last_day: date, variant=""):
+        """Stored rollups of one measurement
+
+        Args:
+            kind (str): KIND_ENERGY or KIND_LAST
+            measurement_name (str): name of the measurement
+            first_day (date): first day of the range
+            last_day (date): last day of the range, inclusive
+            variant (str): everything else the rollups depend on
+
+        Returns:
+            dict: value per day, None for days without data
+        """
+        rows = self._connection.execute(
+            "SELECT day, value FROM daily WHERE source=? AND kind=? AND variant=? AND measurement=? AND day BETWEEN ? AND ?",
+            (self.source, kind, variant, measurement_name, first_day.isoformat(), last_day.isoformat())).fetchall()
+        return {date.fromisoformat(row[0]): row[1] for row in rows}
+
+    def close(self):
+        """Close the rollup file"""
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def days_between(first_day: date, last_day: date):
+    """All days from first_day to last_day, both inclusive
+
+    Returns:
+        list: the days
+    """
+    return [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+
+
+def contiguous_spans(days: list):
+    """Group sorted days into spans of consecutive days
+
+    Args:
+        days (list): sorted days
+
+    Returns:
+        list: tuples of first and last day of each span
+    """
+    spans = []
+    for day in days:
+        if spans and day - spans[-1][1] == timedelta(days=1):
+            spans[-1] = (spans[-1][0], day)
+        else:
+            spans.append((day, day))
+    return spans
+
+
+def sum_days(daily: dict, first_day: date, last_day: date):
+    """Sum of the daily values from first_day to last_day, days without data count as 0
+
+    Returns:
+        float: the sum
+    """
+    return sum(daily.get(day) or 0.0 for day in days_between(first_day, last_day))
+
+
+def last_on_or_before(daily: dict, day: date, lookback_days: int):
+    """Value of the day, or of the latest day before within lookback_days
+
+    Returns:
+        float: the value, None if there is none within the look-back
+    """
+    for offset in range(lookback_days + 1):
+        value = daily.get(day - timedelta(days=offset))
+        if value is not None:
+            return value
+    return None
@@ -0,0 +1,248 @@
+"""Report several sites, e.g. households, in one run
+
+    python sites.py [--config config.ini] [--workers 8] [--no-chart] [--output-dir sites]
+
+Each site has a section named "InfluxDB <site>" in the config file with its own url, token, org,
+bucket and optionally its catalog file and output directory. Options a site does not set are taken
+from the [InfluxDB] section, which may therefore hold the common options only. A cache_file or
+rollup_file of the [InfluxDB] section is shared, the results of the sites are kept apart by their
+url, org and bucket:
+
+    [InfluxDB]
+    pool_size=8
+    report_deadline=300
+
+    [InfluxDB home]
+    url=http://influx.example:8086
+    token=...
+    org=home
+    bucket=home
+    catalog=catalog_home.ini
+
+The sites are reported in parallel threads. Their sessions share one urllib3 pool manager, so at
+most pool_size connections are open to each host however many sites it serves, and their charts
+are rendered by one pool of processes. The async client of concurrency would open connections of
+its own, so the queries of each site run one after another. Every site writes its charts and report.json into its
+output directory. A site that fails does not stop the others.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import configparser
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+
+from catalog import DEFAULT_CATALOG_FILE, load_catalog
+from influx import DEFAULT_KEEP_ALIVE, DEFAULT_POOL_SIZE, DEFAULT_SECTION, GetFromInflux, InfluxSession, keep_alive_socket_options
+from main import latest_reports, reports_to_dict, run_reports
+from manifest import MANIFEST_FILE, Manifest
+from render import ChartRenderer
+
+logger = logging.getLogger("influx_report.sites")
+
+SITE_PREFIX = f"{DEFAULT_SECTION} "
+DEFAULT_OUTPUT_DIR = "sites"
+DEFAULT_WORKERS = 8
+REPORT_FILE = "report.json"
+
+
+@dataclass(frozen=True)
+class Site:
+    """A site of the config file
+
+    Attributes:
+        name (str): name of the site, the section name without SITE_PREFIX
+        section (str): section of the config file
+        url (str): url of its InfluxDB
+        catalog_file (str): its catalog file
+        output_dir (str): directory of its charts and report
+    """
+    name: str
+    section: str
+    url: str
+    catalog_file: str
+    output_dir: str
+
+    @property
+    def host(self):
+        """Host and port of the InfluxDB, the unit connections are limited per"""
+        return urlsplit(self.url).netloc
+
+
+@dataclass
+class SiteResult:
+    """Outcome of the report of a site
+
+    Attributes:
+        site (Site): the site
+        seconds (float): duration of its report
+        files (list): files written
+        missing (list): labels of the lines marked as missing
+        error (str): the error that stopped the report, empty if it succeeded
+    """
+    site: Site
+    seconds: float
+    files: list
+    missing: list
+    error: str = ""
+
+
+def load_sites(config_file="config.ini", output_dir=DEFAULT_OUTPUT_DIR):
+    """The sites of a config file
+
+    Args:
+        config_file (str): the config file
+        output_dir (str): parent of the output directories of the sites that do not set output_dir
+
+    Returns:
+        list: Site objects in the order of the config file
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    sites = []
+    for section in config.sections():
+        if not section.startswith(SITE_PREFIX):
+            continue
+        name = section[len(SITE_PREFIX):].strip()
+        options = config[section]
+        sites.append(
+            Site(name=name,
+                 section=section,
+                 url=options.get("url", config.get(DEFAULT_SECTION, "url", fallback="")),
+                 catalog_file=options.get("catalog", DEFAULT_CATALOG_FILE),
+                 output_dir=options.get("output_dir", os.path.join(output_dir, name))))
+    return sites
+
+
+def shared_pool_manager(sites, pool_size=DEFAULT_POOL_SIZE, keep_alive=DEFAULT_KEEP_ALIVE):
+    """One pool manager for the sessions of all sites, blocking at pool_size connections per host
+
+    Args:
+        sites (list): Site objects
+        pool_size (int): connections per host at most
+        keep_alive (bool): enable TCP keep-alive on the pooled connections
+
+    Returns:
+        urllib3.PoolManager: the pool manager
+    """
+    # pylint: disable-next=import-outside-toplevel
+    import certifi
+    # pylint: disable-next=import-outside-toplevel
+    import urllib3
+    hosts = {site.host for site in sites}
+    options = {"socket_options": keep_alive_socket_options()} if keep_alive else {}
+    return urllib3.PoolManager(num_pools=max(len(hosts), 1),
+                               maxsize=pool_size,
+                               block=True,
+                               cert_reqs="CERT_REQUIRED",
+                               ca_certs=certifi.where(),
+                               retries=False,
+                               **options)
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def report_site(site: Site, date, reports, config_file="config.ini", pool_manager=None, executor=None):
+    """Run the reports of one site and write its charts and report.json
+
+    Args:
+        site (Site): the site
+        date (datetime): the reference date of the reports
+        reports (list): is_month of each report
+        config_file (str): the config file
+        pool_manager (urllib3.PoolManager): connection pool shared by the sites
+        executor (ProcessPoolExecutor): pool rendering the charts of all sites, no charts without it
+
+    Returns:
+        SiteResult: the outcome, errors are recorded in it and not raised
+    """
+    started = time.perf_counter()
+    try:
+        os.makedirs(site.output_dir, exist_ok=True)
+        catalog = load_catalog(site.catalog_file)
+        renderer = ChartRenderer(executor=executor) if executor is not None else None
+        with InfluxSession(config_file, section=site.section, pool_manager=pool_manager) as session:
+            results = run_reports(date, reports, GetFromInflux(session), renderer, catalog, site.output_dir,
+                                  Manifest(os.path.join(site.output_dir, MANIFEST_FILE)))
+        with open(os.path.join(site.output_dir, REPORT_FILE), "w", encoding="utf-8") as file:
+            json.dump({"site": site.name, **reports_to_dict(date, reports, results)}, file, ensure_ascii=False, indent=2)
+        files = sorted(os.path.join(site.output_dir, name) for name in os.listdir(site.output_dir))
+        missing = [measurement_set.name for data in results for measurement_set in data if measurement_set.missing]
+        return SiteResult(site, time.perf_counter() - started, files, missing)
+    except Exception as error:  # pylint: disable=broad-exception-caught
+        logger.exception("Report of site %s failed", site.name)
+        return SiteResult(site, time.perf_counter() - started, [], [], str(error) or type(error).__name__)
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def report_sites(sites, date, reports, config_file="config.ini", workers=DEFAULT_WORKERS, charts=True, pool_size=None):
+    """Run the reports of all sites in parallel
+
+    Args:
+        sites (list): Site objects
+        date (datetime): the reference date of the reports
+        reports (list): is_month of each report
+        config_file (str): the config file
+        workers (int): sites reported at once
+        charts (bool): create the charts
+        pool_size (int): connections per host at most, defaults to pool_size of the [InfluxDB] section
+
+    Returns:
+        list: a SiteResult per site in the order of the sites
+    """
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    if pool_size is None:
+        pool_size = config.getint(DEFAULT_SECTION, "pool_size", fallback=DEFAULT_POOL_SIZE)
+    pool_manager = shared_pool_manager(sites, pool_size, config.getboolean(DEFAULT_SECTION, "keep_alive", fallback=DEFAULT_KEEP_ALIVE))
+    executor = ProcessPoolExecutor() if charts else None
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="influx_report_site") as threads:
+            return list(threads.map(lambda site: report_site(site, date, reports, config_file, pool_manager, executor), sites))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        pool_manager.clear()
+
+
+def main(argv=None):
+    """Command line of the reports of all sites
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv
+
+    Returns:
+        int: 0 if all sites were reported, 1 otherwise
+    """
+    parser = argparse.ArgumentParser(description="Report all sites of the config file in parallel")
+    parser.add_argument("--config", default="config.ini", help="config file with a section 'InfluxDB <site>' per site (default config.ini)")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"sites reported at once (default {DEFAULT_WORKERS})")
+    parser.add_argument("--pool-size", type=int, help="connections per InfluxDB host at most (default pool_size of [InfluxDB])")
+    parser.add_argument("--output-dir",
+                        default=DEFAULT_OUTPUT_DIR,
+                        help=f"parent of the output directories of the sites (default {DEFAULT_OUTPUT_DIR})")
+    parser.add_argument("--no-chart", action="store_true", help="do not create the charts")
+    parser.add_argument("--site", action="append", help="report only this site, may be repeated")
+    args = parser.parse_args(argv)
+
+    sites = [site for site in load_sites(args.config, args.output_dir) if not args.site or site.name in args.site]
+    if not sites:
+        logger.error("No sites in %s, add sections named '%s<site>'", args.config, SITE_PREFIX)
+        return 1
+    date, reports = latest_reports(datetime.now().replace(hour=23, minute=59, second=59, microsecond=0))
+    results = report_sites(sites, date, reports, args.config, args.workers, not args.no_chart, args.pool_size)
+    for result in results:
+        if result.error:
+            logger.error("%-20s failed after %.1f s: %s", result.site.name, result.seconds, result.error)
+        else:
+            logger.info("%-20s %.1f s, %d files%s", result.site.name, result.seconds, len(result.files),
+                        f", missing: {', '.join(result.missing)}" if result.missing else "")
+    return 1 if any(result.error for result in results) else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(threadName)s %(message)s')
+    raise SystemExit(main())
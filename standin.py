@@ -0,0 +1,416 @@
+"""Local stand-in of the InfluxDB query endpoint for end-to-end and load tests
+
+    python standin.py synthetic [--days 400] [--resolution 10]
+    python standin.py fixture FILE [FILE ...]
+    python standin.py record DIRECTORY [--config config.ini]
+    python standin.py replay DIRECTORY
+
+    common options: [--host 127.0.0.1] [--port 8086] [--latency 0.05] [--jitter 0.02]
+                    [--max-concurrent 4] [--bandwidth 1000000]
+
+Set url of the [InfluxDB] section to the stand-in, e.g. http://127.0.0.1:8086. POST /api/v2/query
+is answered with annotated CSV like InfluxDB 2 does, so the whole path of the client runs: HTTP,
+connection pooling, CSV parsing, streaming and the async client. The data comes from:
+
+- synthetic: series of all catalog measurements, see synthetic.py
+- fixture: CSV files with the columns _measurement, _time and _value
+- record: each query is forwarded to the InfluxDB of the config file, its response is passed on
+  and stored in DIRECTORY
+- replay: each query is answered with the response stored by record, unknown queries get 404
+
+Each response is delayed by latency plus or minus jitter seconds, at most max-concurrent queries
+are answered at once while the others wait, and bandwidth limits the bytes per second of a response.
+Responses are compressed with gzip if the client asks for it, like InfluxDB does.
+"""
+import argparse
+import configparser
+import csv
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import gzip
+import hashlib
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urlparse
+from urllib.request import Request, urlopen
+
+import numpy as np
+
+from catalog import TYPE_WATT, load_catalog
+from derived import source_measurements
+from synthetic import Series, SyntheticInflux, counter_series, power_series
+
+logger = logging.getLogger("influx_report.standin")
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8086
+# bytes written at once when the bandwidth is limited
+CHUNK_SIZE = 64 * 1024
+
+COLUMNS = ("result", "table", "_time", "_value", "_field", "_measurement")
+_ANNOTATIONS = ("#datatype,string,long,dateTime:RFC3339,double,string,string\r\n"
+                "#group,false,false,false,false,true,true\r\n"
+                "#default,_result,,,,,\r\n"
+                f",{','.join(COLUMNS)}\r\n")
+
+
+@dataclass
+class Throttle:
+    """Delay and limit the responses of the stand-in
+
+    Attributes:
+        latency (float): seconds each response is delayed
+        jitter (float): the delay varies uniformly by up to this many seconds more or less
+        max_concurrent (int): queries answered at once, the others wait, 0 for no limit
+        bandwidth (int): bytes per second of a response, 0 for no limit
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+    max_concurrent: int = 0
+    bandwidth: int = 0
+    _slots: threading.Semaphore = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self._slots = threading.BoundedSemaphore(self.max_concurrent) if self.max_concurrent > 0 else None
+
+    def delay(self):
+        """Seconds to wait before a response"""
+        return max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+
+    def __enter__(self):
+        if self._slots is not None:
+            self._slots.acquire()  # pylint: disable=consider-using-with
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._slots is not None:
+            self._slots.release()
+
+
+def to_annotated_csv(tables):
+    """Annotated CSV of the tables of a query, like InfluxDB 2 answers /api/v2/query
+
+    Args:
+        tables (list): a list of FluxRecord objects per table
+
+    Returns:
+        str: the CSV, one annotated block per table
+    """
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator="\r\n")
+    for index, records in enumerate(tables):
+        output.write(_ANNOTATIONS)
+        for record in records:
+            time_ = record.get_time()
+            writer.writerow(("", record.values["result"], index, time_.strftime("%Y-%m-%dT%H:%M:%S.%fZ") if time_ else "",
+                             repr(float(record.get_value())), record.get_field(), record.get_measurement()))
+        output.write("\r\n")
+    return output.getvalue()
+
+
+def query_key(query):
+    """Name of the stored response of a query, the same for queries that only differ in whitespace
+
+    Returns:
+        str: hex digest of the query
+    """
+    return hashlib.sha256(" ".join(query.split()).encode("utf-8")).hexdigest()[:24]
+
+
+# pylint: disable-next=too-few-public-methods
+class SyntheticSource():
+    """Answers the queries from series, see SyntheticInflux"""
+
+    def __init__(self, series: list):
+        """
+        Args:
+            series (list): Series objects, one per measurement
+        """
+        self.influx = SyntheticInflux(series)
+
+    def answer(self, query, org=None):  # pylint: disable=unused-argument
+        """Annotated CSV of a query
+
+        Raises:
+            ValueError: if the query is not supported by SyntheticInflux
+
+        Returns:
+            bytes: the response
+        """
+        return to_annotated_csv(self.influx.tables(query)).encode("utf-8")
+
+
+# pylint: disable-next=too-few-public-methods
+class ReplaySource():
+    """Answers the queries with the responses stored by RecordSource"""
+
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): directory of the stored responses
+        """
+        self.directory = directory
+
+    def answer(self, query, org=None):  # pylint: disable=unused-argument
+        """The stored response of a query
+
+        Raises:
+            KeyError: if no response of the query is stored
+
+        Returns:
+            bytes: the response
+        """
+        path = os.path.join(self.directory, f"{query_key(query)}.csv")
+        if not os.path.exists(path):
+            raise KeyError(f"no recorded response of query {query_key(query)}")
+        with open(path, "rb") as file:
+            return file.read()
+
+
+# pylint: disable-next=too-few-public-methods
+class RecordSource():
+    """Forwards the queries to an InfluxDB and stores the responses for ReplaySource"""
+
+    def __init__(self, directory, url, token):
+        """
+        Args:
+            directory (str): directory of the stored responses, created if missing
+            url (str): url of the InfluxDB
+            token (str): token of the InfluxDB
+        """
+        self.directory = directory
+        self.url = url.rstrip("/")
+        self.token = token
+        os.makedirs(directory, exist_ok=True)
+
+    def answer(self, query, org=None):
+        """Response of the InfluxDB to a query, stored together with the query
+
+        Raises:
+            HTTPError: if the InfluxDB answers with an error, nothing is stored then
+
+        Returns:
+            bytes: the response
+        """
+        request = Request(f"{self.url}/api/v2/query?{urlencode({'org': org or ''})}",
+                          data=json.dumps({
+                              "query": query,
+                              "type": "flux",
+                              "dialect": {
+                                  "header": True,
+                                  "annotations": ["datatype", "group", "default"]
+                              }
+                          }).encode("utf-8"),
+                          headers={
+                              "Authorization": f"Token {self.token}",
+                              "Content-Type": "application/json",
+                              "Accept": "application/csv"
+                          })
+        with urlopen(request) as response:
+            body = response.read()
+        key = query_key(query)
+        with open(os.path.join(self.directory, f"{key}.flux"), "w", encoding="utf-8") as file:
+            file.write(query)
+        with open(os.path.join(self.directory, f"{key}.csv"), "wb") as file:
+            file.write(body)
+        logger.debug("Recorded %d bytes of query %s", len(body), key)
+        return body
+
+
+def load_fixtures(paths):
+    """Series of fixture files
+
+    Args:
+        paths (list): CSV files with the columns _measurement, _time (RFC3339) and _value
+
+    Returns:
+        list: Series objects, one per measurement with its samples of all files sorted by time
+    """
+    samples = {}
+    for path in paths:
+        with open(path, encoding="utf-8", newline="") as file:
+            for row in csv.DictReader(file):
+                time_ = datetime.fromisoformat(row["_time"].replace("Z", "+00:00"))
+                time_ = time_ if time_.tzinfo is not None else time_.replace(tzinfo=timezone.utc)
+                timestamp_ns = (time_ - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1) * 1000
+                samples.setdefault(row["_measurement"], []).append((timestamp_ns, float(row["_value"])))
+    series = []
+    for measurement, rows in samples.items():
+        rows.sort()
+        series.append(Series(measurement, np.array([row[0] for row in rows], dtype=np.int64), np.array([row[1] for row in rows])))
+    return series
+
+
+def catalog_series(first_day, days, resolution_s, catalog=None):
+    """Synthetic series of all catalog measurements
+
+    Args:
+        first_day (datetime): start of the series
+        days (int): days covered by the series
+        resolution_s (float): seconds between two samples of the power series, the counters have one sample every 5 minutes
+        catalog (list): CatalogEntry objects, defaults to the catalog file
+
+    Returns:
+        list: Series objects, one per measurement
+    """
+    series = {}
+    for seed, entry in enumerate(catalog or load_catalog()):
+        for name in source_measurements(entry.measurements):
+            if name not in series:
+                if entry.type == TYPE_WATT:
+                    series[name] = power_series(name, first_day, timedelta(days=days), resolution_s, seed=seed)
+                else:
+                    series[name] = counter_series(name, first_day, timedelta(days=days), 300, seed=seed)
+    return list(series.values())
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """HTTP endpoint of the stand-in, see the module docstring"""
+
+    # set by make_server()
+    source = None
+    throttle = Throttle()
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answer /ping and /health, which the client uses to check the server"""
+        path = urlparse(self.path).path
+        if path == "/ping":
+            self.send_response(HTTPStatus.NO_CONTENT)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif path == "/health":
+            self._send(HTTPStatus.OK, json.dumps({"name": "influx_report stand-in", "status": "pass"}).encode("utf-8"), "application/json")
+        else:
+            self._send_error(HTTPStatus.NOT_FOUND, "not found", f"unknown path {path}")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answer /api/v2/query"""
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path != "/api/v2/query":
+            self._send_error(HTTPStatus.NOT_FOUND, "not found", f"unknown path {url.path}")
+            return
+        if self.headers.get("Content-Type", "").startswith("application/vnd.flux"):
+            query = body.decode("utf-8")
+        else:
+            query = json.loads(body)["query"]
+        org = parse_qs(url.query).get("org", [None])[0]
+
+        with self.throttle:
+            time.sleep(self.throttle.delay())
+            try:
+                response = self.source.answer(query, org)
+            except ValueError as error:
+                self._send_error(HTTPStatus.BAD_REQUEST, "invalid", str(error))
+                return
+            except KeyError as error:
+                self._send_error(HTTPStatus.NOT_FOUND, "not found", error.args[0])
+                return
+            except HTTPError as error:
+                self._send_error(HTTPStatus(error.code), "upstream", str(error))
+                return
+            # compressed like InfluxDB does if the client asks for it, see the gzip option
+            gzipped = "gzip" in self.headers.get("Accept-Encoding", "")
+            self._send(HTTPStatus.OK, gzip.compress(response) if gzipped else response, "text/csv; charset=utf-8", "gzip" if gzipped else None)
+
+    def _send(self, status, payload, content_type, content_encoding=None):
+        """Send a response, limited to the bandwidth of the throttle"""
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        if content_encoding:
+            self.send_header("Content-Encoding", content_encoding)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        if self.throttle.bandwidth <= 0:
+            self.wfile.write(payload)
+            return
+        for start in range(0, len(payload), CHUNK_SIZE):
+            chunk = payload[start:start + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            time.sleep(len(chunk) / self.throttle.bandwidth)
+
+    def _send_error(self, status, code, message):
+        """Send an error like InfluxDB does"""
+        self._send(status, json.dumps({"code": code, "message": message}).encode("utf-8"), "application/json")
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Log requests with the logger of the module instead of stderr"""
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+def make_server(source, throttle: Throttle = None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """HTTP server of the stand-in
+
+    Args:
+        source: answers the queries, SyntheticSource, ReplaySource or RecordSource
+        throttle (Throttle): delays and limits of the responses, none by default
+        host (str): address to listen on, localhost by default
+        port (int): port to listen on, 0 for any free port
+
+    Returns:
+        ThreadingHTTPServer: the server, each request is answered in its own thread. Run it with serve_forever().
+    """
+    handler = type("BoundStandInRequestHandler", (StandInRequestHandler,), {"source": source, "throttle": throttle or Throttle()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def _source(args):
+    """Source of the command line"""
+    if args.source == "synthetic":
+        first_day = datetime.combine(datetime.now(timezone.utc).date() - timedelta(days=args.days - 1), datetime.min.time())
+        return SyntheticSource(catalog_series(first_day, args.days, args.resolution))
+    if args.source == "fixture":
+        return SyntheticSource(load_fixtures(args.paths))
+    if args.source == "replay":
+        return ReplaySource(args.paths[0])
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    return RecordSource(args.paths[0], config.get("InfluxDB", "url"), config.get("InfluxDB", "token"))
+
+
+def main(argv=None):
+    """Command line of the stand-in
+
+    Args:
+        argv (list): command line arguments, defaults to sys.argv
+    """
+    parser = argparse.ArgumentParser(description="Local stand-in of the InfluxDB query endpoint")
+    parser.add_argument("source", choices=["synthetic", "fixture", "record", "replay"], help="where the answers come from")
+    parser.add_argument("paths", nargs="*", help="fixture files, or the directory of the recorded responses")
+    parser.add_argument("--days", type=int, default=400, help="days of synthetic data up to today (default 400)")
+    parser.add_argument("--resolution", type=float, default=10, help="seconds between synthetic power samples (default 10)")
+    parser.add_argument("--config", default="config.ini", help="config file of the InfluxDB to record from (default config.ini)")
+    parser.add_argument("--host", default=DEFAULT_HOST, help=f"address to listen on (default {DEFAULT_HOST})")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"port to listen on (default {DEFAULT_PORT})")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds each response is delayed")
+    parser.add_argument("--jitter", type=float, default=0.0, help="seconds the delay varies by")
+    parser.add_argument("--max-concurrent", type=int, default=0, help="queries answered at once, 0 for no limit")
+    parser.add_argument("--bandwidth", type=int, default=0, help="bytes per second of a response, 0 for no limit")
+    args = parser.parse_args(argv)
+    if args.source in ("fixture", "record", "replay") and not args.paths:
+        parser.error(f"{args.source} needs {'fixture files' if args.source == 'fixture' else 'a directory'}")
+
+    server = make_server(_source(args), Throttle(args.latency, args.jitter, args.max_concurrent, args.bandwidth), args.host, args.port)
+    logger.info("Stand-in of InfluxDB on http://%s:%d", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopped")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    main()
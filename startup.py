@@ -0,0 +1,75 @@
+"""Import times of the modules of the report
+
+The modules are imported in a fresh interpreter with -X importtime, so the times are those of a
+cold start and do not depend on what the calling process already imported.
+
+    python startup.py [MODULE ...]
+"""
+import logging
+import subprocess
+import sys
+
+logger = logging.getLogger("influx_report.startup")
+
+# the report itself and the heavy modules it may load on demand
+DEFAULT_MODULES = ["main", "influxdb_client", "numpy", "create_png"]
+
+
+def measure_import_times(modules=None):
+    """Cumulative import time of modules, each imported after the ones before
+
+    Args:
+        modules (list): names of the modules, defaults to DEFAULT_MODULES
+
+    Returns:
+        list: tuples of module name and seconds, only the modules imported by that step count,
+            so a module already loaded by an earlier one takes 0
+    """
+    modules = modules or DEFAULT_MODULES
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "; ".join(f"import {module}" for module in modules)],
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    return parse_import_times(result.stderr, modules)
+
+
+def parse_import_times(output, modules):
+    """Read the cumulative time of top level modules from the output of -X importtime
+
+    Args:
+        output (str): stderr of the interpreter
+        modules (list): names of the modules
+
+    Returns:
+        list: tuples of module name and seconds
+    """
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _self, cumulative, name = line[len("import time:"):].split("|")
+        # nested imports are indented, only the top level import of a module counts
+        if not name.startswith(" ") or name.startswith("  "):
+            continue
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative) / 1_000_000
+    return [(module, times.get(module, 0.0)) for module in modules]
+
+
+def log_import_times(modules=None):
+    """Log the import time of each module and their sum
+
+    Args:
+        modules (list): names of the modules, defaults to DEFAULT_MODULES
+    """
+    times = measure_import_times(modules)
+    logger.info("-------- Import times --------")
+    for module, seconds in times:
+        logger.info("%-20s %6.3f s", module, seconds)
+    logger.info("%-20s %6.3f s", "total", sum(seconds for _, seconds in times))
+    logger.info("")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    log_import_times(sys.argv[1:])
@@ -0,0 +1,370 @@
+"""Synthetic measurement series and an in-memory stand-in for the query API of the InfluxDB client
+
+The series look like the ones of a household: power in W sampled every few seconds with a base
+load, a daily cycle, appliance bursts and noise, and energy counters that restart at zero now and
+then. Both have gaps where the sensor was offline.
+
+SyntheticInflux answers the Flux queries of GetFromInflux from these series like the query API of
+the client, so the real reduction code runs on realistic amounts of data without a server:
+
+    influx = GetFromInflux(SyntheticInflux([power_series("Herd", start, timedelta(days=7))]).session())
+
+Only the pipelines GetFromInflux sends are understood: range(), a filter on _measurement, and
+optionally last(), integral() or aggregateWindow(every: 1d) with last or integral before the yield.
+keep() is accepted and ignored, the records have the kept columns only. The pivot() and map() of a
+derived measurement are evaluated with its expression, see derived.flux_tail().
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+import json
+import re
+
+from influxdb_client.client.flux_table import FluxRecord
+import numpy as np
+
+from derived import parse_derived
+from influx import InfluxConfigClass, QueryOptionsClass
+from integration import NS_PER_HOUR, RULE_TRAPEZOID, integrate_kwh
+from metrics import RunMetrics
+from resilience import QueryGuard
+
+NS_PER_SECOND = 1_000_000_000
+NS_PER_DAY = 24 * NS_PER_HOUR
+# the longest outage of a sensor
+DEFAULT_MAX_GAP_S = 2 * 3600
+
+
+@dataclass
+class Series:
+    """Samples of one measurement
+
+    Attributes:
+        measurement (str): name of the measurement
+        timestamps_ns (np.ndarray): int64 nanoseconds since epoch (UTC), sorted ascending
+        values (np.ndarray): float64 values
+    """
+    measurement: str
+    timestamps_ns: np.ndarray
+    values: np.ndarray
+    _records: list = field(default=None, init=False, repr=False)
+
+    def __len__(self):
+        return len(self.values)
+
+    def records(self):
+        """FluxRecord objects of all samples as a query without last() returns them, built once
+
+        Returns:
+            list: FluxRecord objects in the order of time
+        """
+        if self._records is None:
+            times = [
+                time.replace(tzinfo=timezone.utc) for time in self.timestamps_ns.astype("datetime64[ns]").astype("datetime64[us]").astype(object)
+            ]
+            self._records = [_record(self.measurement, time, value) for time, value in zip(times, self.values.tolist())]
+        return self._records
+
+    def window(self, start_ns, stop_ns):
+        """Index range of the samples from start_ns until before stop_ns
+
+        Returns:
+            tuple: first index and index after the last one
+        """
+        return int(np.searchsorted(self.timestamps_ns, start_ns, "left")), int(np.searchsorted(self.timestamps_ns, stop_ns, "left"))
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def power_series(measurement, start, duration, resolution_s=10, base_w=120.0, peak_w=2500.0, gaps=3, seed=0):
+    """Power in W of a household appliance
+
+    Args:
+        measurement (str): name of the measurement
+        start (datetime): time of the first sample, naive times are UTC
+        duration (timedelta): time covered by the series
+        resolution_s (float): seconds between two samples
+        base_w (float): base load
+        peak_w (float): power of the bursts, e.g. a cooking plate that is switched on
+        gaps (int): number of outages, each up to DEFAULT_MAX_GAP_S long
+        seed (int): seed of the random numbers, the same seed gives the same series
+
+    Returns:
+        Series: the samples
+    """
+    rng = np.random.default_rng(seed)
+    timestamps_ns = _timestamps(start, duration, resolution_s)
+    hours = (timestamps_ns % (24 * NS_PER_HOUR)) / NS_PER_HOUR
+    # more load in the morning and in the evening
+    daily = base_w * (1.0 + 0.5 * np.sin((hours - 9.0) / 24.0 * 2 * np.pi))
+    # about two bursts a day of 10 to 60 minutes
+    bursts = np.zeros(len(timestamps_ns))
+    for begin in rng.integers(0, len(timestamps_ns), max(1, int(2 * len(timestamps_ns) * resolution_s / 86400))):
+        bursts[begin:begin + int(rng.integers(600, 3600) / resolution_s)] = peak_w * rng.uniform(0.5, 1.0)
+    values = np.clip(daily + bursts + rng.normal(0.0, base_w * 0.05, len(timestamps_ns)), 0.0, None)
+    return Series(measurement, *_drop_gaps(rng, timestamps_ns, values, gaps, resolution_s))
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def counter_series(measurement, start, duration, resolution_s=60, mean_w=400.0, resets=1, gaps=3, seed=0):
+    """Energy counter in kWh that restarts at zero, e.g. when a meter is replaced
+
+    Args:
+        measurement (str): name of the measurement
+        start (datetime): time of the first sample, naive times are UTC
+        duration (timedelta): time covered by the series
+        resolution_s (float): seconds between two samples
+        mean_w (float): average power counted
+        resets (int): number of restarts at zero
+        gaps (int): number of outages, each up to DEFAULT_MAX_GAP_S long
+        seed (int): seed of the random numbers, the same seed gives the same series
+
+    Returns:
+        Series: the samples
+    """
+    rng = np.random.default_rng(seed)
+    timestamps_ns = _timestamps(start, duration, resolution_s)
+    energy = rng.exponential(mean_w, len(timestamps_ns)) * resolution_s / 3600 / 1000
+    # a meter that has been counting for a while
+    energy[0] += 1000.0
+    for reset in np.sort(rng.integers(1, max(2, len(timestamps_ns)), resets)):
+        energy[reset] -= energy[:reset].sum()
+    values = np.round(np.cumsum(energy), 3)
+    return Series(measurement, *_drop_gaps(rng, timestamps_ns, values, gaps, resolution_s))
+
+
+def join_series(pieces):
+    """One series of the pieces of a measurement, e.g. generated for separate timespans
+
+    Args:
+        pieces (list): Series objects of the same measurement in the order of time
+
+    Returns:
+        Series: the samples of all pieces
+    """
+    return Series(pieces[0].measurement, np.concatenate([piece.timestamps_ns for piece in pieces]),
+                  np.concatenate([piece.values for piece in pieces]))
+
+
+def _timestamps(start, duration, resolution_s):
+    """int64 nanoseconds of the samples from start over duration"""
+    start = start if start.tzinfo is not None else start.replace(tzinfo=timezone.utc)
+    start_ns = (start - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1) * 1000
+    step_ns = int(resolution_s * NS_PER_SECOND)
+    return np.arange(start_ns, start_ns + duration // timedelta(microseconds=1) * 1000, step_ns, dtype=np.int64)
+
+
+def _drop_gaps(rng, timestamps_ns, values, gaps, resolution_s):
+    """Remove the samples of random outages"""
+    keep = np.ones(len(values), dtype=bool)
+    for begin in rng.integers(0, max(1, len(values)), gaps):
+        keep[begin:begin + int(rng.integers(1, DEFAULT_MAX_GAP_S) / resolution_s) + 1] = False
+    return timestamps_ns[keep], values[keep]
+
+
+@dataclass
+class StandInTable:
+    """Records of one table of a query, like FluxTable of the client
+
+    Attributes:
+        records (list): FluxRecord objects
+    """
+    records: list
+
+
+class StandInSession():
+    """Session of GetFromInflux that queries a stand-in instead of a database, see InfluxSession
+
+    It has only the attributes of InfluxSession that GetFromInflux uses, without cache and rollups.
+    """
+
+    def __init__(self, query_api, bucket, org, options: QueryOptionsClass = None, metrics: RunMetrics = None):
+        """
+        Args:
+            query_api (SyntheticInflux): answers the queries, e.g. an ExportInflux
+            bucket (str): bucket of the queries
+            org (str): org of the queries
+            options (QueryOptionsClass): options of the queries, the defaults without them
+            metrics (RunMetrics): records the queries of the session, a new one by default
+        """
+        self.options = options if options is not None else QueryOptionsClass()
+        self.metrics = metrics if metrics is not None else RunMetrics()
+        self.guard = QueryGuard(self.options, self.metrics)
+        self.cache = None
+        self.rollups = None
+        self.influx = InfluxConfigClass(url="", token="", org=org, bucket=bucket, client=None)
+        self.query_api = query_api
+
+    def take_response(self):
+        """No HTTP response whose bytes could be counted
+
+        Returns:
+            None: always
+        """
+        return None
+
+    def close(self):
+        """Stop the threads of the guard"""
+        self.guard.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _record(measurement, time, value, result="_result", table=0):
+    """FluxRecord with the columns the client returns for a sample"""
+    return FluxRecord(table, {"result": result, "table": table, "_time": time, "_value": value, "_field": "value", "_measurement": measurement})
+
+
+class SyntheticInflux():
+    """Answers the Flux queries of GetFromInflux from synthetic series, like query_api() of the client"""
+
+    def __init__(self, series: list, bucket="synthetic"):
+        """
+        Args:
+            series (list): Series objects, one per measurement
+            bucket (str): bucket of the session
+        """
+        self.series = {measurement.measurement: measurement for measurement in series}
+        self.bucket = bucket
+        self.queries = 0
+        self.records = 0
+
+    def session(self, metrics: RunMetrics = None, **options):
+        """Session for GetFromInflux that queries this stand-in
+
+        Args:
+            metrics (RunMetrics): records the queries of the session, a new one by default
+            **options: fields of QueryOptionsClass, e.g. streaming=True
+
+        Returns:
+            StandInSession: the session, without cache and rollups, its metrics record the queries
+        """
+        return StandInSession(self, self.bucket, "synthetic", QueryOptionsClass(**options), metrics)
+
+    def query(self, query, org=None):  # pylint: disable=unused-argument
+        """Tables of a query, one per pipeline and measurement
+
+        Returns:
+            list: StandInTable objects
+        """
+        return [StandInTable(records) for records in self.tables(query)]
+
+    def query_stream(self, query, org=None):  # pylint: disable=unused-argument
+        """Records of a query one by one
+
+        Yields:
+            FluxRecord: the records of all tables in order
+        """
+        for records in self.tables(query):
+            yield from records
+
+    def tables(self, query):
+        """Records of each table of a query
+
+        Raises:
+            ValueError: if a pipeline uses anything but range(), filter(), last(), integral(), aggregateWindow() and yield()
+
+        Returns:
+            list: a list of FluxRecord objects per table
+        """
+        self.queries += 1
+        tables = []
+        for pipeline in query.split("from(bucket:")[1:]:
+            unsupported = set(re.findall(
+                r"\|> (\w+)\(", pipeline)) - {"range", "filter", "last", "integral", "aggregateWindow", "group", "sort", "sum", "keep", "yield"}
+            derived = re.search(r'\|> map\(fn: \(r\) => \(\{_measurement: ("(?:[^"\\]|\\.)*")', pipeline)
+            if derived:
+                unsupported -= {"pivot", "map"}
+            if unsupported:
+                raise ValueError(f"SyntheticInflux does not support {', '.join(sorted(unsupported))}")
+            start, stop = (_parse_time(time) for time in re.search(r"range\(start: ([^,]+), stop: ([^)]+)\)", pipeline).groups())
+            result = re.search(r'yield\(name: "([^"]+)"\)', pipeline)
+            result = result.group(1) if result else "_result"
+            names = re.search(r"set: \[([^\]]*)\]", pipeline)
+            names = re.findall(r'"([^"]+)"', names.group(1)) if names else re.findall(r'r\._measurement == "([^"]+)"', pipeline)
+            if derived:
+                records = self._derive(parse_derived(json.loads(derived.group(1))), names, start, stop, pipeline, result, len(tables))
+                if records:
+                    tables.append(records)
+                continue
+            for name in names:
+                series = self.samples(name, start, stop)
+                if series is not None:
+                    records = self._reduce(series, start, stop, pipeline, result, len(tables))
+                    if records:
+                        tables.append(records)
+        self.records += sum(len(records) for records in tables)
+        return tables
+
+    def samples(self, measurement, start_ns, stop_ns):  # pylint: disable=unused-argument
+        """The samples of a measurement that a query of a range reduces
+
+        Args:
+            measurement (str): name of the measurement
+            start_ns (int): start of the range
+            stop_ns (int): end of the range, exclusive
+
+        Returns:
+            Series: samples including the range, None if the measurement is unknown
+        """
+        return self.series.get(measurement)
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def _reduce(self, series, start, stop, pipeline, result, table):
+        """Records of one measurement in a pipeline"""
+        first, after_last = series.window(start, stop)
+        if first == after_last:
+            return []
+        if "|> aggregateWindow(every: 1d" in pipeline:
+            return self._reduce_daily(series, first, after_last, "integral(" in pipeline, result, table)
+        if "|> integral(" in pipeline:
+            wh = integrate_kwh(series.timestamps_ns[first:after_last], series.values[first:after_last], RULE_TRAPEZOID) * 1000.0
+            return [_record(series.measurement, None, wh, result, table)]
+        if "|> last()" in pipeline:
+            return [_record(series.measurement, _datetime(series.timestamps_ns[after_last - 1]), float(series.values[after_last - 1]), result, table)]
+        records = series.records()[first:after_last]
+        if result != "_result":
+            records = [_record(series.measurement, record.get_time(), record.get_value(), result, table) for record in records]
+        return records
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments,too-many-locals
+    def _derive(self, derived, names, start, stop, pipeline, result, table):
+        """Records of a derived measurement, see derived.flux_tail(): its expression evaluated per time on the reduced measurements"""
+        time = re.search(r"_time: (\d{4}-[\d\-T:]+Z)", pipeline)
+        rows = {}
+        for name in names:
+            series = self.samples(name, start, stop)
+            for record in self._reduce(series, start, stop, pipeline, result, table) if series is not None else []:
+                rows.setdefault(_datetime(_parse_time(time.group(1))) if time else record.get_time(), {})[name] = record.get_value()
+        records = []
+        for row_time, values in sorted(rows.items()):
+            value = derived.evaluate(values)
+            if value is not None:
+                records.append(_record(derived.name, row_time, value, result, table))
+        return records
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def _reduce_daily(self, series, first, after_last, integral, result, table):
+        """One record per UTC day with data, the Wh of the day with integral, otherwise its last value"""
+        timestamps_ns = series.timestamps_ns[first:after_last]
+        values = series.values[first:after_last]
+        days = timestamps_ns // NS_PER_DAY
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(days)) + 1, [len(days)]))
+        records = []
+        for begin, end in zip(bounds[:-1], bounds[1:]):
+            value = integrate_kwh(timestamps_ns[begin:end], values[begin:end], RULE_TRAPEZOID) * 1000.0 if integral else float(values[end - 1])
+            records.append(_record(series.measurement, _datetime(days[begin] * NS_PER_DAY), value, result, table))
+        return records
+
+
+def _datetime(timestamp_ns):
+    """Timezone aware datetime of nanoseconds since epoch"""
+    return datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(microseconds=int(timestamp_ns) // 1000)
+
+
+def _parse_time(text):
+    """int64 nanoseconds of a time of range(), times without a zone are UTC"""
+    time = datetime.fromisoformat(text.strip().replace("Z", "+00:00"))
+    return (time - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1) * 1000
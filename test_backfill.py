@@ -0,0 +1,83 @@
+"""test backfill.py"""
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import backfill
+from influx import GetFromInflux, InfluxConfigClass, QueryOptionsClass
+from main import get_timeframes
+from rollup import days_between
+
+# pylint: disable=missing-function-docstring
+
+
+def make_influx():
+    session = MagicMock()
+    session.options = QueryOptionsClass()
+    session.cache = None
+    session.rollups = None
+    session.influx = InfluxConfigClass(url="http://localhost:8086", token="token", org="org", bucket="bucket", client=MagicMock())
+    influx = GetFromInflux(session)
+    # 1 kWh per day and counters that count the days
+    influx.get_daily_kwh_from_influx = MagicMock(
+        side_effect=lambda names, first, last: {name: {
+            day: 1.0 for day in days_between(first, last)
+        } for name in names})
+    influx.get_daily_last_values_from_influx = MagicMock(
+        side_effect=lambda names, first, last: {name: {
+            day: day.toordinal() for day in days_between(first, last)
+        } for name in names})
+    return influx
+
+
+def test_report_dates():
+    reports = backfill.report_dates(datetime(2024, 8, 31), datetime(2024, 10, 1))
+    assert reports == [
+        (datetime(2024, 9, 1, 23, 59, 59), True),
+        (datetime(2024, 9, 1, 23, 59, 59), False),
+        (datetime(2024, 9, 8, 23, 59, 59), False),
+        (datetime(2024, 9, 15, 23, 59, 59), False),
+        (datetime(2024, 9, 22, 23, 59, 59), False),
+        (datetime(2024, 9, 29, 23, 59, 59), False),
+        (datetime(2024, 10, 1, 23, 59, 59), True),
+    ]
+
+
+def test_backfill_timeframes_match_main():
+    reports = backfill.report_dates(datetime(2022, 12, 1), datetime(2025, 1, 31))
+    assert backfill.backfill_timeframes(reports) == [get_timeframes(date, is_month) for date, is_month in reports]
+
+
+def test_backfill(tmp_path):
+    influx = make_influx()
+    with patch('backfill.create_bar_chart') as mock_create_bar_chart:
+        results = backfill.backfill(datetime(2024, 9, 1), datetime(2024, 10, 31), influx, str(tmp_path))
+
+    # one query per kind for the whole range
+    influx.get_daily_kwh_from_influx.assert_called_once()
+    influx.get_daily_last_values_from_influx.assert_called_once()
+    influx.session.query_api.query.assert_not_called()
+
+    assert len(results) == 11
+    assert mock_create_bar_chart.call_count == 11
+    assert mock_create_bar_chart.call_args_list[0].args[1] == str(tmp_path / "bar_chart_month_2024-09-01.png")
+    assert mock_create_bar_chart.call_args_list[1].args[1] == str(tmp_path / "bar_chart_week_2024-09-01.png")
+
+    week = {measurement_set.name: measurement_set.data for measurement_set in results[1][2]}
+    assert week["Kühlschrank"] == [7.0, 7.0]
+    assert week["Kochfeld"] == [7, 7]
+    month = {measurement_set.name: measurement_set.data for measurement_set in results[0][2]}
+    assert month["Kochfeld"] == [31, 31]
+    assert month["Kühlschrank"] == [31.0, 31.0]
+
+
+def test_backfill_nothing_due(tmp_path):
+    influx = make_influx()
+    assert not backfill.backfill(datetime(2024, 9, 2), datetime(2024, 9, 3), influx, str(tmp_path))
+    influx.get_daily_kwh_from_influx.assert_not_called()
+
+
+def test_main(capsys):
+    with patch('backfill.backfill', return_value=[MagicMock()] * 3) as mock_backfill:
+        backfill.main(["2024-09-01", "2024-09-30", "--output-dir", "out"])
+    mock_backfill.assert_called_once_with(datetime(2024, 9, 1), datetime(2024, 9, 30), output_dir="out")
+    assert "3 reports created in out" in capsys.readouterr().out
@@ -0,0 +1,80 @@
+"""test baseline.py"""
+from datetime import date
+import json
+
+import numpy as np
+import pytest
+
+from baseline import DailyMatrix, baselines
+
+# pylint: disable=missing-function-docstring
+
+FIRST_DAY = date(2022, 1, 1)
+
+
+@pytest.fixture(name="matrix")
+def fixture_matrix():
+    rng = np.random.default_rng(0)
+    values = rng.normal(10.0, 2.0, (5, 200))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    values[3, 50:90] = np.nan
+    return DailyMatrix([f"line {line}" for line in range(5)], FIRST_DAY, values)
+
+
+def test_rolling_matches_nan_statistics(matrix):
+    rolling = matrix.rolling(14)
+    assert rolling.mean.shape == matrix.values.shape
+    assert np.isnan(rolling.mean[:, :14]).all()
+    for line in range(5):
+        for day in (14, 40, 70, 199):
+            window = matrix.values[line, day - 14:day]
+            if np.isnan(window).all():
+                assert np.isnan(rolling.median[line, day])
+                continue
+            assert rolling.mean[line, day] == pytest.approx(np.nanmean(window))
+            assert rolling.median[line, day] == pytest.approx(np.nanmedian(window))
+            assert rolling.low[line, day] == pytest.approx(np.nanpercentile(window, 10))
+            assert rolling.high[line, day] == pytest.approx(np.nanpercentile(window, 90))
+            assert rolling.std[line, day] == pytest.approx(np.nanstd(window))
+            expected = (matrix.values[line, day] - np.nanmean(window)) / np.nanstd(window)
+            assert rolling.zscore[line, day] == pytest.approx(expected, nan_ok=True)
+
+
+def test_rolling_of_short_matrix():
+    rolling = DailyMatrix(["a"], FIRST_DAY, [[1.0, 2.0]]).rolling(7)
+    assert rolling.median.shape == (1, 2)
+    assert np.isnan(rolling.median).all()
+
+
+def test_span_sums():
+    matrix = DailyMatrix(["a", "b"], FIRST_DAY, [[1.0, 2.0, None, 4.0], [None, None, None, 1.0]])
+    sums = matrix.span_sums([0, 0, 3, -2], [2, 4, 4, 2])
+    # unknown days and days before the matrix count with the mean of the known days of the span
+    assert sums[0].tolist() == pytest.approx([3.0, 4 * 7 / 3, 4.0, 4 * 1.5])
+    assert np.isnan(sums[1, 0]) and sums[1, 1] == 4.0
+    assert matrix.rolling_sums(3)[0].tolist() == pytest.approx([4.5, 9.0])
+
+
+def test_baselines_flag_outliers(matrix):
+    values = matrix.values.copy()
+    values[0, 193] = 100.0
+    values[1, 193:] = 30.0
+    matrix = DailyMatrix(matrix.labels, FIRST_DAY, values)
+    result = baselines(matrix, 193, 200, years=[(193 - 7 * k, 200 - 7 * k) for k in (4, 8)], window=28)
+    assert result["line 0"].outlier_days == [date(2022, 7, 13)]
+    assert result["line 0"].outlier
+    assert result["line 1"].outlier and result["line 1"].zscore > 3
+    # the days after the first one are compared with windows that contain the high usage already
+    assert result["line 1"].outlier_days[0] == date(2022, 7, 13)
+    assert not result["line 2"].outlier and not result["line 2"].outlier_days
+    yearly = matrix.span_sums([165, 137], [172, 144])[2]
+    assert result["line 2"].years == pytest.approx(yearly.tolist())
+    assert result["line 2"].expected == pytest.approx(yearly.mean())
+    assert result["line 2"].median == pytest.approx(np.nanmedian(values[2, 165:193]))
+    json.dumps(result["line 0"].to_dict())
+
+
+def test_baselines_without_history():
+    result = baselines(DailyMatrix(["a"], FIRST_DAY, [[1.0, 2.0, 3.0]]), 0, 3, years=[(-365, -362)])["a"]
+    assert (result.mean, result.zscore, result.expected, result.years, result.outlier) == (None, None, None, [None], False)
+    assert result.to_dict()["outlier_days"] == []
@@ -0,0 +1,50 @@
+"""test benchmark.py"""
+import json
+
+import pytest
+
+import benchmark
+from benchmark import BenchmarkResult, compare_results, measure, save_results
+
+# pylint: disable=missing-function-docstring
+
+
+def test_measure():
+    calls = []
+    result = measure("case", lambda: calls.append(bytearray(1_000_000)), 1000, repeats=3)
+    assert len(calls) == 5  # warm-up, repeats and the traced call
+    assert len(result.latencies) == 3
+    assert result.peak_memory >= 1_000_000
+    assert result.throughput > 0
+    assert set(result.percentiles()) == {"p50", "p90", "p99"}
+
+
+def test_result_to_dict():
+    result = BenchmarkResult("case", 100, [1.0, 2.0, 3.0], 10)
+    assert result.to_dict() == {
+        "name": "case",
+        "samples": 100,
+        "repeats": 3,
+        "throughput": 50.0,
+        "latency": {
+            "p50": 2.0,
+            "p90": pytest.approx(2.8),
+            "p99": pytest.approx(2.98)
+        },
+        "peak_memory": 10,
+    }
+
+
+def test_save_and_compare(tmp_path):
+    before = save_results([BenchmarkResult("case", 100, [2.0], 100), BenchmarkResult("gone", 1, [1.0], 1)], tmp_path / "before.json")
+    after = save_results([BenchmarkResult("case", 100, [1.0], 150), BenchmarkResult("new", 1, [1.0], 1)], tmp_path / "after.json")
+    assert json.loads((tmp_path / "after.json").read_text(encoding="utf-8")) == after
+    lines = compare_results(before, after)
+    assert len(lines) == 2
+    assert "case" in lines[1] and "-50.0%" in lines[1] and "+50.0%" in lines[1]
+
+
+def test_bench_process():
+    result = benchmark.bench_process(False, 600, repeats=1)
+    assert result.name == "process week @ 600 s"
+    assert result.samples > 0
@@ -0,0 +1,106 @@
+"""test cache.py"""
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import cache
+from cache import ResultCache
+
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+
+@pytest.fixture
+def result_cache(tmp_path):
+    with ResultCache(str(tmp_path / "cache.sqlite"), ttl=60) as opened:
+        yield opened
+
+
+def test_closed_range_is_permanent(result_cache):
+    start = datetime(2023, 1, 1)
+    stop = datetime(2023, 1, 8)
+    result_cache.put("kwh", "a", start, stop, "client", 1.5)
+    assert result_cache.get("kwh", "a", start, stop, "client") == (True, 1.5)
+    assert result_cache.get("kwh", "a", start, stop, "server") == (False, None)
+    assert result_cache.entries()[0][7] is None  # no expiry
+
+
+def test_open_range_expires(result_cache):
+    start = datetime.now() - timedelta(days=7)
+    stop = datetime.now() + timedelta(hours=1)
+    result_cache.put("values", "a", start, stop, "lookback_days=7", (1, 2))
+    assert result_cache.get("values", "a", start, stop, "lookback_days=7") == (True, (1, 2))
+    result_cache.ttl = -1
+    result_cache.put("values", "a", start, stop, "lookback_days=7", (1, 2))
+    assert result_cache.get("values", "a", start, stop, "lookback_days=7") == (False, None)
+    assert result_cache.hits == 1
+    assert result_cache.misses == 1
+
+
+def test_purge(result_cache):
+    result_cache.put("kwh", "a", datetime(2023, 1, 1), datetime(2023, 1, 8), "client", 1.0)
+    result_cache.put("kwh", "b", datetime(2023, 1, 1), datetime(2023, 1, 8), "client", 2.0)
+    result_cache.put("kwh", "b", datetime(2023, 1, 1), datetime.now() + timedelta(days=1), "client", 3.0)
+    assert result_cache.purge(open_only=True) == 1
+    assert result_cache.purge(measurement="a") == 1
+    assert result_cache.purge(expired_only=True) == 0
+    assert len(result_cache.entries()) == 1
+    assert result_cache.purge() == 1
+
+
+def test_cli_list_and_purge(tmp_path, capsys):
+    path = str(tmp_path / "cache.sqlite")
+    with ResultCache(path) as opened:
+        opened.put("kwh", "a", datetime(2023, 1, 1), datetime(2023, 1, 8), "client", 1.0)
+        opened.put("kwh", "b", datetime(2023, 1, 1), datetime.now() + timedelta(days=1), "client", 2.0)
+
+    cache.main(["--file", path, "list"])
+    output = capsys.readouterr().out
+    assert "a kwh 2023-01-01T00:00:00 - 2023-01-08T00:00:00 [client] = 1.0 (permanent)" in output
+    assert "2 entries" in output
+
+    cache.main(["--file", path, "purge", "--measurement", "b"])
+    assert "1 entries deleted" in capsys.readouterr().out
+
+
+def test_cli_without_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    with pytest.raises(SystemExit):
+        cache.main(["list"])
+
+
+def test_expiry_is_in_the_future(result_cache):
+    result_cache.put("kwh", "a", datetime(2023, 1, 1), datetime.now() + timedelta(days=1), "client", 1.0)
+    assert result_cache.entries()[0][7] > time.time()
+
+
+def test_naive_stop_is_utc(result_cache):
+    now = datetime(2024, 10, 6, 22, 30, tzinfo=timezone.utc)
+    # closed in UTC+2 already, but data of the UTC day still arrive
+    result_cache.put("kwh", "a", datetime(2024, 10, 6), datetime(2024, 10, 6, 23, 59, 59), "client", 1.0, now=now)
+    assert result_cache.entries()[0][7] is not None
+    result_cache.put("kwh", "a", datetime(2024, 10, 5), datetime(2024, 10, 5, 23, 59, 59), "client", 1.0, now=now)
+    assert result_cache.entries()[0][7] is None
+
+
+def test_sources_are_kept_apart(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    start = datetime(2023, 1, 1)
+    stop = datetime(2023, 1, 8)
+    with ResultCache(path, source="http://a:8086 org/a") as first, ResultCache(path, source="http://b:8086 org/b") as second:
+        first.put("kwh", "a", start, stop, "client", 1.5)
+        assert second.get("kwh", "a", start, stop, "client") == (False, None)
+        assert first.get("kwh", "a", start, stop, "client") == (True, 1.5)
+
+
+def test_older_layout_is_emptied(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        "CREATE TABLE results (kind TEXT, measurement TEXT, start TEXT, stop TEXT, variant TEXT, value TEXT, created REAL, expires REAL)")
+    connection.execute("INSERT INTO results VALUES ('kwh', 'a', '2023-01-01T00:00:00', '2023-01-08T00:00:00', 'client', '1.5', 0, NULL)")
+    connection.commit()
+    connection.close()
+    with ResultCache(path) as opened:
+        assert opened.entries() == []
@@ -0,0 +1,81 @@
+"""test catalog.py"""
+from datetime import datetime
+
+import pytest
+
+from catalog import TYPE_COUNTER, TYPE_WATT, CatalogEntry, load_catalog, plan_queries
+from influx import KIND_KWH, KIND_SNAPSHOTS
+
+# pylint: disable=missing-function-docstring
+
+DAY = datetime(2024, 9, 1, 23, 59, 59)
+WEEK_AGO = datetime(2024, 8, 25, 23, 59, 59)
+
+
+def write_catalog(tmp_path, content):
+    path = tmp_path / "catalog.ini"
+    path.write_text(content, encoding="utf-8")
+    return str(path)
+
+
+def test_load_catalog():
+    catalog = load_catalog()
+    labels = [entry.label for entry in catalog]
+    assert labels[0] == "Kühlschrank"
+    assert labels[-1] == "PV Einspeisung"
+    heizung = catalog[labels.index("Heizung")]
+    assert heizung == CatalogEntry("Heizung", ("SmartMeter_HeizungNeu_Bezug",), TYPE_COUNTER, 1000, 1, "Haushalt Zähler")
+    haushalt = catalog[labels.index("Haushalt absolut")]
+    assert haushalt.measurements == ("=Test_Shelly_3EM_Haushalt_Ph1_Total + Test_Shelly_3EM_Haushalt_Ph2_Total + Test_Shelly_3EM_Haushalt_Ph3_Total",)
+
+
+@pytest.mark.parametrize("content", [
+    "[A]\ntype = counter\n",
+    "[A]\nmeasurements = a\ntype = gauge\n",
+    "[A]\nmeasurements = a\nsubtract = B\n[B]\nmeasurements = b\n",
+    "[A]\nmeasurements = a\nexpression = a + b\n",
+    "[A]\nexpression = a + b\ntype = watt\n",
+    "[A]\nexpression = a ** 2\n",
+])
+def test_load_catalog_invalid(tmp_path, content):
+    with pytest.raises(ValueError):
+        load_catalog(write_catalog(tmp_path, content))
+
+
+def test_load_catalog_missing(tmp_path):
+    with pytest.raises(ValueError):
+        load_catalog(str(tmp_path / "missing.ini"))
+
+
+def test_apply():
+    entry = CatalogEntry("Heizung", ("h",), divisor=1000, decimals=1, subtract="Haushalt")
+    assert entry.apply([12345, 23456], [1.0, 2.0]) == [11.3, 21.5]
+    assert CatalogEntry("Zähler", ("z",)).apply((1, 2)) == [1, 2]
+
+
+def test_plan_deduplicates_fetches():
+    catalog = [
+        CatalogEntry("Watt", ("w1", "w2"), TYPE_WATT),
+        CatalogEntry("Summe", ("c1", "c2")),
+        CatalogEntry("Wieder c1", ("c1",)),
+    ]
+    timeframes = {TYPE_WATT: ((WEEK_AGO, DAY),), TYPE_COUNTER: ((WEEK_AGO, DAY),)}
+    plan = plan_queries(catalog, [timeframes, timeframes])
+    assert plan.fetches == 10
+    assert plan.unique_fetches == 4
+    assert [(request.kind, request.measurement_names) for request in plan.requests] == [(KIND_SNAPSHOTS, ("c1", "c2")), (KIND_KWH, ("w1", "w2"))]
+    assert plan.requests[0].days == (datetime(2024, 8, 25), datetime(2024, 9, 1))
+
+
+def test_plan_shares_days_between_reports():
+    catalog = [CatalogEntry("Zähler", ("c1",)), CatalogEntry("Andere Tage", ("c2",))]
+    month = {TYPE_WATT: (), TYPE_COUNTER: ((datetime(2024, 8, 1), DAY),)}
+    week = {TYPE_WATT: (), TYPE_COUNTER: ((WEEK_AGO, DAY),)}
+    plan = plan_queries(catalog, [month, week])
+    assert plan.snapshots == 8
+    assert plan.unique_snapshots == 6
+    assert len(plan.requests) == 1
+    assert plan.requests[0].days == (datetime(2024, 8, 1), datetime(2024, 8, 25), datetime(2024, 9, 1))
+    lines = plan.describe()
+    assert lines[0].startswith("Query plan: 1 queries")
+    assert "01.08.24, 25.08.24, 01.09.24" in lines[1]
@@ -2,7 +2,7 @@
 import datetime
 from unittest.mock import MagicMock
 
-from create_png import create_bar_chart, format_dates
+from create_png import create_bar_chart, create_daily_chart, format_dates
 from helpers import MeasurementSet
 
 # pylint: disable=missing-function-docstring
@@ -30,3 +30,10 @@ def test_create_bar_chart(monkeypatch):
 
     # Check if the function saves the file correctly (the actual save is mocked)
     assert True  # Just to ensure the test runs without errors
+
+
+def test_create_daily_chart(tmp_path):
+    days = [datetime.date(2024, 9, day) for day in range(1, 31)]
+    filename = tmp_path / "daily.png"
+    create_daily_chart("Kochfeld", days, [float(day.day) for day in days], filename=str(filename))
+    assert filename.read_bytes().startswith(b"\x89PNG")
@@ -0,0 +1,127 @@
+"""test daemon.py"""
+from datetime import datetime, time
+import json
+import threading
+from unittest.mock import MagicMock, patch
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import pytest
+
+from cache import ResultCache
+from daemon import ReportDaemon, make_server
+from helpers import MeasurementSet
+
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+MEASUREMENT_SET = MeasurementSet(name="Kochfeld",
+                                 data=[1.0, 2.0],
+                                 dates=((datetime(2023, 9, 24, 23, 59, 59), datetime(2023, 10, 1)), (datetime(2024, 9, 29, 23, 59,
+                                                                                                              59), datetime(2024, 10, 6, 23, 59,
+                                                                                                                            59))))
+
+
+@pytest.fixture
+def mock_run_reports():
+    with patch('daemon.run_reports', side_effect=lambda date, reports, influx, renderer: [[MEASUREMENT_SET]] * len(reports)) as mock:
+        yield mock
+
+
+def test_next_run():
+    daemon = ReportDaemon(MagicMock(), time(6, 0))
+    assert daemon.next_run(datetime(2024, 10, 7, 5, 0)) == datetime(2024, 10, 7, 6, 0)
+    assert daemon.next_run(datetime(2024, 10, 7, 6, 0)) == datetime(2024, 10, 8, 6, 0)
+
+
+def test_run_scheduled(mock_run_reports):
+    daemon = ReportDaemon(MagicMock())
+    # Monday after a Sunday
+    assert daemon.run_scheduled(datetime(2024, 10, 7, 6, 0)) == [[MEASUREMENT_SET]]
+    assert mock_run_reports.call_args.args[:2] == (datetime(2024, 10, 6, 23, 59, 59), [False])
+    # Tuesday, nothing due for Monday
+    mock_run_reports.reset_mock()
+    assert not daemon.run_scheduled(datetime(2024, 10, 8, 6, 0))
+    mock_run_reports.assert_not_called()
+
+
+def test_run_reports_share_session(mock_run_reports):
+    session = MagicMock()
+    daemon = ReportDaemon(session)
+    daemon.run_reports(datetime(2024, 9, 1), [True, False])
+    daemon.run_reports(datetime(2024, 9, 8), [False])
+    influx_first = mock_run_reports.call_args_list[0].args[2]
+    influx_second = mock_run_reports.call_args_list[1].args[2]
+    assert influx_first is not influx_second
+    assert influx_first.session is influx_second.session is session
+
+
+def test_run_reports_share_renderer(mock_run_reports):
+    renderer = MagicMock()
+    ReportDaemon(MagicMock(), renderer=renderer).run_reports(datetime(2024, 9, 1), [True])
+    assert mock_run_reports.call_args.args[3] is renderer
+
+
+def test_serve_stops():
+    daemon = ReportDaemon(MagicMock())
+    thread = threading.Thread(target=daemon.serve, kwargs={"now": lambda: datetime(2024, 10, 7, 5, 0)})
+    thread.start()
+    daemon.stop()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+
+
+@pytest.fixture
+def server(mock_run_reports):  # pylint: disable=unused-argument
+    http_server = make_server(ReportDaemon(MagicMock()), port=0)
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{http_server.server_address[1]}"
+    http_server.shutdown()
+    http_server.server_close()
+
+
+def test_http_report(server, mock_run_reports):
+    with urlopen(f"{server}/report?date=2024-09-01&period=due") as response:
+        body = json.loads(response.read())
+    assert mock_run_reports.call_args.args[:2] == (datetime(2024, 9, 1, 23, 59, 59), [True, False])
+    assert body["date"] == "2024-09-01"
+    assert [report["period"] for report in body["reports"]] == ["month", "week"]
+    assert body["reports"][0]["measurements"][0]["name"] == "Kochfeld"
+    assert body["reports"][0]["measurements"][0]["data"] == [1.0, 2.0]
+
+
+def test_http_report_with_cache_file(tmp_path):
+    session = MagicMock()
+    # opened on this thread, used on the thread of the server
+    session.cache = ResultCache(str(tmp_path / "cache.sqlite"))
+
+    def cached_run_reports(date, reports, influx, renderer):  # pylint: disable=unused-argument
+        influx.session.cache.put("kwh", "a", datetime(2024, 9, 1), datetime(2024, 9, 2), "client", 1.0)
+        assert influx.session.cache.get("kwh", "a", datetime(2024, 9, 1), datetime(2024, 9, 2), "client") == (True, 1.0)
+        return [[MEASUREMENT_SET]] * len(reports)
+
+    http_server = make_server(ReportDaemon(session), port=0)
+    threading.Thread(target=http_server.serve_forever, daemon=True).start()
+    try:
+        with patch('daemon.run_reports', side_effect=cached_run_reports):
+            with urlopen(f"http://127.0.0.1:{http_server.server_address[1]}/report?date=2024-09-01&period=week") as response:
+                assert response.status == 200
+    finally:
+        http_server.shutdown()
+        http_server.server_close()
+        session.cache.close()
+
+
+def test_http_health_and_errors(server, mock_run_reports):
+    with urlopen(f"{server}/health") as response:
+        assert json.loads(response.read()) == {"status": "ok"}
+    with pytest.raises(HTTPError) as error:
+        urlopen(f"{server}/report?period=year")  # pylint: disable=consider-using-with
+    assert error.value.code == 400
+    with pytest.raises(HTTPError) as error:
+        urlopen(f"{server}/other")  # pylint: disable=consider-using-with
+    assert error.value.code == 404
+    mock_run_reports.side_effect = RuntimeError("influx down")
+    with pytest.raises(HTTPError) as error:
+        urlopen(f"{server}/report?period=week")  # pylint: disable=consider-using-with
+    assert error.value.code == 500
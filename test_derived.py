@@ -0,0 +1,52 @@
+"""test derived.py"""
+import pytest
+
+from derived import derived_name, flux_string, flux_tail, is_derived, parse_derived, source_measurements
+
+# pylint: disable=missing-function-docstring
+
+
+def test_derived_name_is_canonical():
+    assert derived_name("a+b  +c") == derived_name("a + b + c") == "=a + b + c"
+    assert is_derived(derived_name("a"))
+    assert not is_derived("Strom_Herd")
+
+
+def test_parse_derived():
+    derived = parse_derived(derived_name('(a + "Zähler Haus") / 1000 - a * -2'))
+    assert derived.measurements == ("a", "Zähler Haus")
+    assert derived.flux() == '(((r["a"] + r["Zähler Haus"]) / 1000.0) - (r["a"] * -2.0))'
+    assert derived.evaluate({"a": 1.0, "Zähler Haus": 999.0}) == pytest.approx(3.0)
+    assert derived.evaluate({"a": 1.0, "Zähler Haus": None}) is None
+    assert derived.evaluate({"a": 1.0}) is None
+
+
+def test_summands():
+    assert parse_derived(derived_name('a + "Zähler Haus" + a')).summands() == ("a", "Zähler Haus", "a")
+    assert parse_derived(derived_name("a")).summands() == ("a",)
+    assert parse_derived(derived_name("a + b - c")).summands() == ()
+    assert parse_derived(derived_name("a + b / 1000")).summands() == ()
+
+
+@pytest.mark.parametrize("expression", ["", "a +", "a ** 2", "abs(a)", "a.b", "1 + 2", "a if b else c", "[a]"])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        derived_name(expression)
+
+
+def test_parse_plain_name():
+    with pytest.raises(ValueError):
+        parse_derived("a + b")
+
+
+def test_source_measurements():
+    assert source_measurements(["x", derived_name("a + b"), derived_name("b - x"), "c"]) == ["x", "a", "b", "c"]
+
+
+def test_flux_tail():
+    tail = flux_tail(parse_derived(derived_name('a + "b\\"c"')))
+    assert 'keep(columns: ["_measurement", "_time", "_value"])' in tail
+    assert '_measurement: "=a + \'b\\"c\'"' in tail
+    assert 'r["b\\"c"]' in tail
+    assert tail.strip().endswith("|> filter(fn: (r) => exists r._value)")
+    assert flux_string('a"\\') == '"a\\"\\\\"'
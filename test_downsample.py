@@ -0,0 +1,48 @@
+"""test downsample.py"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from downsample import DownsampledBucket, choose_bucket, parse_buckets, parse_duration, route
+
+# pylint: disable=missing-function-docstring
+
+BUCKETS = parse_buckets("power_1m:1m, power_1h:1h")
+
+
+def test_parse_buckets():
+    assert BUCKETS == [DownsampledBucket("power_1h", timedelta(hours=1)), DownsampledBucket("power_1m", timedelta(minutes=1))]
+    assert parse_buckets("") == []
+    assert BUCKETS[0].duration == "1h"
+
+
+@pytest.mark.parametrize("text", ["power_7m:7m", "power_1h", ":1h", "power:1x"])
+def test_parse_buckets_invalid(text):
+    with pytest.raises(ValueError):
+        parse_buckets(text)
+
+
+def test_parse_duration():
+    assert parse_duration("30s") == timedelta(seconds=30)
+    assert parse_duration("1d") == timedelta(days=1)
+    with pytest.raises(ValueError):
+        parse_duration("0h")
+
+
+def test_choose_bucket():
+    assert choose_bucket(BUCKETS, timedelta(days=31)).name == "power_1h"
+    assert choose_bucket(BUCKETS, timedelta(days=1)).name == "power_1m"
+    assert choose_bucket(BUCKETS, timedelta(hours=1)) is None
+    assert choose_bucket(BUCKETS, timedelta(days=1), accuracy=0.05).name == "power_1h"
+
+
+def test_route_edges_and_unwritten_windows():
+    now = datetime(2024, 10, 7, 12, 30, tzinfo=timezone.utc)
+    downsampled = route(BUCKETS, datetime(2024, 9, 1, 0, 15), datetime(2024, 10, 1, 6, 45), now=now)
+    assert (downsampled.bucket.name, downsampled.start, downsampled.stop) == ("power_1h", datetime(2024, 9, 1, 1), datetime(2024, 10, 1, 6))
+    # the window of 11:00 may not be written yet
+    downsampled = route(BUCKETS, datetime(2024, 9, 7, tzinfo=timezone.utc), datetime(2024, 10, 7, 12, tzinfo=timezone.utc), now=now)
+    assert downsampled.stop == datetime(2024, 10, 7, 11, tzinfo=timezone.utc)
+    assert route(BUCKETS, datetime(2024, 10, 7, 0, 10), datetime(2024, 10, 7, 0, 50), now=now) is None
+    assert route(BUCKETS, datetime(2024, 10, 6), datetime(2024, 10, 7), now=now).bucket.name == "power_1m"
+    assert route(BUCKETS, datetime(2024, 10, 6), datetime(2024, 10, 7), accuracy=1.0, now=now).bucket.name == "power_1h"
@@ -0,0 +1,30 @@
+"""test downsample_tasks.py"""
+from catalog import TYPE_WATT, CatalogEntry
+from downsample import parse_buckets
+from downsample_tasks import main, task_definition, task_definitions
+
+# pylint: disable=missing-function-docstring
+
+BUCKETS = parse_buckets("power_1m:1m, power_1h:1h")
+
+
+def test_task_definition():
+    task = task_definition(BUCKETS[0], "home", "org", ["power"], [])
+    assert 'option task = {name: "influx_report downsample power_1h", every: 1h, offset: 1m}' in task
+    assert 'from(bucket: "home")' in task
+    assert 'aggregateWindow(every: 1h, fn: mean, timeSrc: "_start", createEmpty: false)' in task
+    assert 'set(key: "_field", value: "mean")' in task
+    assert 'to(bucket: "power_1h", org: "org")' in task
+    assert "fn: last" not in task
+
+
+def test_task_definitions_written_per_bucket(tmp_path):
+    config = tmp_path / "config.ini"
+    config.write_text("[InfluxDB]\nbucket=home\norg=org\ndownsampled_buckets=power_1m:1m, power_1h:1h\n")
+    catalog = [CatalogEntry("Herd", ("Herd",), TYPE_WATT), CatalogEntry("Strom", ("Zaehler",))]
+    tasks = task_definitions(str(config), catalog)
+    assert list(tasks) == ["power_1h", "power_1m"]
+    assert '["Herd"]' in tasks["power_1m"] and '["Zaehler"]' in tasks["power_1m"]
+
+    main(["--config", str(config), "--output-dir", str(tmp_path / "tasks")])
+    assert sorted(path.name for path in (tmp_path / "tasks").iterdir()) == ["power_1h.flux", "power_1m.flux"]
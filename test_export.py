@@ -0,0 +1,170 @@
+"""test export.py"""
+from datetime import date, datetime, timedelta, timezone
+import os
+from unittest.mock import patch
+
+import pytest
+
+import export
+from export import ExportFile, ExportInflux, _parse_line_protocol, _parse_rfc3339, export_files
+from influx import GetFromInflux
+import main
+from rollup import KIND_ENERGY, KIND_LAST
+from standin import catalog_series, to_annotated_csv
+from synthetic import Series, StandInSession, SyntheticInflux, counter_series, power_series
+
+# pylint: disable=missing-function-docstring,protected-access
+
+START = datetime(2024, 9, 1)
+END = START + timedelta(days=2)
+SERIES = [power_series("Herd", START, timedelta(days=3), 60), counter_series("Zähler Haus", START - timedelta(days=10), timedelta(days=14))]
+
+
+def _line_protocol(series, tags=""):
+    measurement = series.measurement.replace(" ", "\\ ").replace(",", "\\,")
+    return "".join(
+        f"{measurement}{tags} value={value!r} {timestamp}\n" for timestamp, value in zip(series.timestamps_ns.tolist(), series.values.tolist()))
+
+
+@pytest.fixture(name="export_dir")
+def fixture_export_dir(tmp_path):
+    # the power as line protocol split into two files, the counter as annotated CSV
+    half = len(SERIES[0]) // 2
+    first = Series(SERIES[0].measurement, SERIES[0].timestamps_ns[:half], SERIES[0].values[:half])
+    second = Series(SERIES[0].measurement, SERIES[0].timestamps_ns[half:], SERIES[0].values[half:])
+    (tmp_path / "a.lp").write_text("# DML\n# CONTEXT-DATABASE: home\n" + _line_protocol(second, ",room=kitchen"), encoding="utf-8")
+    (tmp_path / "b.lp").write_text(_line_protocol(first), encoding="utf-8")
+    (tmp_path / "c.csv").write_text(to_annotated_csv([SERIES[1].records()]), encoding="utf-8")
+    (tmp_path / "notes.md").write_text("not an export", encoding="utf-8")
+    return tmp_path
+
+
+def test_answers_like_synthetic(export_dir):
+    expected = GetFromInflux(SyntheticInflux(SERIES).session())
+    with ExportInflux(str(export_dir)) as source:
+        assert source.measurements == {"Herd", "Zähler Haus"}
+        influx = GetFromInflux(source.session())
+        assert influx.get_total_kwh_consumed_from_influx("Herd", START,
+                                                         END) == pytest.approx(expected.get_total_kwh_consumed_from_influx("Herd", START, END))
+        assert influx.get_values_from_influx("Zähler Haus", START, END) == expected.get_values_from_influx("Zähler Haus", START, END)
+        for kind, name in ((KIND_ENERGY, "Herd"), (KIND_LAST, "Zähler Haus")):
+            daily = influx.get_daily_series(kind, [name], date(2024, 9, 1), date(2024, 9, 3))[name]
+            assert daily == pytest.approx(expected.get_daily_series(kind, [name], date(2024, 9, 1), date(2024, 9, 3))[name])
+
+
+def test_index_is_stored_and_reused(export_dir):
+    ExportFile(str(export_dir / "b.lp")).close()
+    assert os.path.exists(export_dir / "b.lp.index.json")
+    with patch.object(ExportFile, "_build_index", side_effect=AssertionError("index rebuilt")):
+        ExportFile(str(export_dir / "b.lp")).close()
+    with open(export_dir / "b.lp", "a", encoding="utf-8") as file:
+        file.write("Herd value=1 1893456000000000000\n")
+    export_file = ExportFile(str(export_dir / "b.lp"))
+    assert export_file.runs["Herd"][-1].last_ns == 1893456000000000000
+    export_file.close()
+
+
+def test_range_lookup_reads_only_the_lines_of_the_range(export_dir, monkeypatch):
+    monkeypatch.setattr(export, "INDEX_STRIDE", 16)
+    export_file = ExportFile(str(export_dir / "b.lp"), save_index=False)
+    run = export_file.runs["Herd"][0]
+    assert len(run.offsets) == pytest.approx(len(SERIES[0]) // 2 / 16, abs=1)
+    start_ns = int(SERIES[0].timestamps_ns[200])
+    stop_ns = int(SERIES[0].timestamps_ns[300])
+    with patch("export._parse_line_protocol", wraps=_parse_line_protocol) as parse:
+        timestamps, values = export_file.read("Herd", start_ns, stop_ns)
+    assert timestamps == SERIES[0].timestamps_ns[200:300].tolist()
+    assert values == SERIES[0].values[200:300].tolist()
+    # at most one stride before the range and the first line after it
+    assert parse.call_count <= 100 + 16 + 1
+    assert export_file.read("Herd", 0, start_ns - 10**18) == ([], [])
+    export_file.close()
+
+
+def test_runs_split_where_time_goes_back(tmp_path):
+    path = tmp_path / "mixed.lp"
+    path.write_text("a value=1 300\nb value=2 100\na value=3 400\na value=4 200\na,tag=x\\ y value=5i 500\n", encoding="utf-8")
+    export_file = ExportFile(str(path), save_index=False)
+    assert [(run.first_ns, run.last_ns) for run in export_file.runs["a"]] == [(300, 400), (200, 500)]
+    assert export_file.read("a", 200, 450) == ([300, 400, 200], [1.0, 3.0, 4.0])
+    export_file.close()
+    with ExportInflux(str(path), save_index=False) as source:
+        series = source.samples("a", 0, 1000)
+    assert series.timestamps_ns.tolist() == [200, 300, 400, 500]
+
+
+def test_interleaved_measurements_have_one_run_each(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "INDEX_STRIDE", 16)
+    names = ("a", "b", "c")
+    path = tmp_path / "interleaved.lp"
+    path.write_text("".join(f"{names[line % 3]} value={line} {line * 10}\n" for line in range(3000)), encoding="utf-8")
+    export_file = ExportFile(str(path), save_index=False)
+    assert {name: len(runs) for name, runs in export_file.runs.items()} == {"a": 1, "b": 1, "c": 1}
+    assert len(export_file.runs["b"][0].offsets) == 1000 // 16 + 1
+    with patch("export._parse_line_protocol", wraps=_parse_line_protocol) as parse:
+        timestamps, values = export_file.read("b", 15000, 16000)
+    assert timestamps == list(range(15010, 16000, 30))
+    assert values == [float(line) for line in range(1501, 1600, 3)]
+    # the lines of all measurements of one stride before the range, the range and the first line after it
+    assert parse.call_count <= 3 * (16 + 33) + 3
+    export_file.close()
+
+
+@pytest.mark.parametrize("line, expected", [
+    (b"power value=1.5 1000", ("power", 1000, 1.5)),
+    (b"Strom\\ Herd,room=k\\,1 value=7i,other=2 2000", ("Strom Herd", 2000, 7.0)),
+    (b'note text="a b" 3000', None),
+    (b"switch on=true 4000", None),
+    (b"power value=1.5", None),
+    (b"# comment", None),
+    (b"", None),
+])
+def test_parse_line_protocol(line, expected):
+    assert _parse_line_protocol(line) == expected
+
+
+def test_parse_rfc3339():
+    epoch = datetime(2024, 9, 1, tzinfo=timezone.utc).timestamp()
+    assert _parse_rfc3339("2024-09-01T00:00:00Z") == int(epoch) * 10**9
+    assert _parse_rfc3339("2024-09-01T02:00:00.000000001+02:00") == int(epoch) * 10**9 + 1
+    with pytest.raises(ValueError):
+        _parse_rfc3339("_time")
+
+
+def test_export_files(export_dir):
+    assert export_files(str(export_dir)) == [str(export_dir / name) for name in ("a.lp", "b.lp", "c.csv")]
+    assert export_files(str(export_dir / "b.lp")) == [str(export_dir / "b.lp")]
+
+
+def test_configured_session_turns_off_database_options(tmp_path):
+    config = tmp_path / "config.ini"
+    config.write_text("[InfluxDB]\nintegration_rule=trapezoid\ncache_file=cache.sqlite\nconcurrency=4\ndownsampled_buckets=p_1h:1h\n",
+                      encoding="utf-8")
+    with ExportInflux(str(tmp_path)) as source:
+        options = source.configured_session(str(config)).options
+    assert options.integration_rule == "trapezoid"
+    assert (options.cache_file, options.concurrency, options.downsampled_buckets) == ("", 0, "")
+
+
+def test_configured_session_is_closed_with_the_export(tmp_path):
+    with patch.object(StandInSession, "close", autospec=True) as close:
+        with ExportInflux(str(tmp_path)) as source:
+            session = source.configured_session(str(tmp_path / "config.ini"))
+            assert isinstance(session, StandInSession)
+            with pytest.raises(AttributeError):
+                _ = session.query_apis  # pylint: disable=no-member
+        close.assert_called_once_with(session)
+    assert not source.sessions
+
+
+def test_report_of_the_default_catalog(tmp_path):
+    report_date = datetime(2024, 9, 1, 23, 59, 59)
+    series = catalog_series(report_date - timedelta(days=20), 22, 600)
+    (tmp_path / "all.lp").write_text("".join(_line_protocol(single) for single in series), encoding="utf-8")
+    expected = main.process(report_date, False, GetFromInflux(SyntheticInflux(series).session()))
+    with ExportInflux(str(tmp_path)) as source:
+        processed = main.process(report_date, False, GetFromInflux(source.configured_session(str(tmp_path / "config.ini"))))
+    assert [line.name for line in processed] == [line.name for line in expected]
+    assert not any(line.missing for line in processed) and any(any(line.data) for line in processed)
+    for line, expected_line in zip(processed, expected):
+        assert line.data == pytest.approx(expected_line.data)
@@ -7,7 +7,8 @@ coverage html
 import logging
 from datetime import datetime, timedelta, timezone
 
-from helpers import get_latest_value, get_same_calendar_week_day_one_year_ago, is_first_of_month, is_sunday, last_sunday, log_difference
+from helpers import (get_latest_value, get_same_calendar_week_day_one_year_ago, get_same_calendar_week_days_one_year_ago, is_first_of_month,
+                     is_sunday, last_sunday, log_difference)
 
 
 def test_get_latest_value_empty_lists():
@@ -106,3 +107,10 @@ def test_log_difference(caplog):
     assert "Usage" in caplog.text
     assert "increased" in caplog.text
     assert "by 50.0 kWh" in caplog.text
+
+
+def test_get_same_calendar_week_days_one_year_ago():
+    """Vectorised and single lookup agree on every day of several years, incl. weeks 1 and 53"""
+    dates = [datetime(2018, 12, 1) + timedelta(days=offset) for offset in range(8 * 366)]
+    expected = [get_same_calendar_week_day_one_year_ago(date).date() for date in dates]
+    assert list(get_same_calendar_week_days_one_year_ago(dates).astype(object)) == expected
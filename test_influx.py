@@ -1,10 +1,16 @@
 import configparser
-from datetime import datetime
+import socket
+from datetime import date, datetime, timedelta, timezone
 from unittest.mock import MagicMock, patch
 
 import pytest
 
-from influx import GetFromInflux
+from derived import derived_name
+from downsample import DownsampleRoute, parse_buckets
+from influx import (INTEGRATION_CLIENT, INTEGRATION_SERVER, KIND_KWH, KIND_SNAPSHOTS, KIND_VALUES, RESULT_DOWNSAMPLED, RESULT_HEAD, RESULT_TAIL,
+                    GetFromInflux, InfluxSession, QueryRequest, query_options)
+from rollup import KIND_LAST, RollupStore, days_between
+from synthetic import SyntheticInflux, counter_series
 
 
 @pytest.fixture
@@ -35,13 +41,57 @@ def test_get_total_kwh_consumed_from_influx(influx_instance):
     end_date = datetime(2023, 1, 1, 2, 0)
     result = influx_instance.get_total_kwh_consumed_from_influx("test_measurement", start_date, end_date)
     assert result == 0.1  # (100W * 1h + 200W * 1h) / 1000 = 0.1 kWh
+    query = influx_instance.session.metrics.queries[-1]
+    assert (query.kind, query.measurements, query.rows) == (KIND_KWH, ("test_measurement",), 2)
+
+
+def test_query_is_retried_after_transient_error(influx_instance):
+    influx_instance.session.options.retries = 1
+    influx_instance.session.options.retry_backoff = 0.0
+    query = influx_instance.influx.client.query_api().query
+    tables = query.return_value
+    query.side_effect = [ConnectionResetError("reset"), tables]
+    result = influx_instance.get_total_kwh_consumed_from_influx("test_measurement", datetime(2023, 1, 1, 0, 0), datetime(2023, 1, 1, 2, 0))
+    assert result == 0.1
+    assert query.call_count == 2
+    assert influx_instance.session.guard.retried == 1
 
 
 def test_get_values_from_influx(influx_instance):
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[_batch_record("test_measurement", 100, result="start")]),
+        MagicMock(records=[_batch_record("test_measurement", 200, result="end")]),
+    ]
     start_date = datetime(2023, 1, 1)
     end_date = datetime(2023, 1, 2)
     result = influx_instance.get_values_from_influx("test_measurement", start_date, end_date)
-    assert result == (200, 200)  # Last values for both start and end date
+    assert result == (100, 200)  # Last values for both start and end date
+    influx_instance.influx.client.query_api().query.assert_called_once()  # both values with one query
+
+
+def test_get_values_from_influx_last_pushdown_with_lookback(influx_instance):
+    influx_instance.get_values_from_influx("test_measurement", datetime(2023, 1, 10), datetime(2023, 1, 17))
+    query = influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+    assert "|> last()" in query
+    assert "range(start: 2023-01-03T00:00:00Z, stop: 2023-01-10T23:59:59Z)" in query
+    assert "range(start: 2023-01-10T00:00:00Z, stop: 2023-01-17T23:59:59Z)" in query
+
+
+def test_queries_keep_only_needed_columns(influx_instance):
+    route = DownsampleRoute(parse_buckets("power_1h:1h")[0], datetime(2024, 9, 2), datetime(2024, 9, 29))
+    queries = [
+        influx_instance.kwh_batch_query(["a", "b"], datetime(2024, 9, 1, 12), datetime(2024, 9, 30), INTEGRATION_CLIENT, route),
+        influx_instance.kwh_batch_query(["a"], datetime(2024, 9, 1), datetime(2024, 9, 30), INTEGRATION_SERVER),
+        influx_instance.daily_kwh_query(["a"], date(2024, 9, 1), date(2024, 9, 30), route),
+        influx_instance.values_batch_query(["a"], datetime(2024, 9, 1), datetime(2024, 9, 30)),
+        influx_instance.snapshots_batch_query(["a"], (date(2024, 9, 1), date(2024, 9, 8), date(2024, 9, 15))),
+    ]
+    for query in queries:
+        pipelines = query.split("from(bucket:")[1:]
+        assert pipelines
+        for pipeline in pipelines:
+            assert '|> keep(columns: ["_measurement", "_time", "_value"])' in pipeline
+            assert pipeline.index("keep(") > pipeline.rindex("filter(")
 
 
 def test_get_total_kwh_consumed_from_influx_no_data(influx_instance):
@@ -93,3 +143,352 @@ def test_no_section_error_handling():
         except configparser.NoSectionError as error:
             assert str(error) == 'No section: \'InfluxDB\''
         mock_read.assert_called_once()
+
+
+def test_session_shared_by_getters():
+    with patch('configparser.ConfigParser.read', return_value=None), \
+         patch('configparser.ConfigParser.get', side_effect=lambda section, option: 'mock_value'), \
+         patch('influxdb_client.InfluxDBClient') as mock_client_class:
+        with InfluxSession(pool_size=8, keep_alive=False) as session:
+            first = GetFromInflux(session)
+            second = GetFromInflux(session)
+            assert first.influx.client is second.influx.client
+            query_api = session.query_api
+            assert session.query_api is query_api
+        mock_client_class.assert_called_once_with(url='mock_value', token='mock_value', connection_pool_maxsize=8, enable_gzip=True)
+        mock_client_class.return_value.query_api.assert_called_once()
+        mock_client_class.return_value.close.assert_called_once()
+
+
+def test_session_keep_alive_socket_option():
+    with patch('configparser.ConfigParser.read', return_value=None), \
+         patch('configparser.ConfigParser.get', side_effect=lambda section, option: 'http://localhost:8086'):
+        session = InfluxSession(keep_alive=True)
+        socket_options = session.influx.client.api_client.rest_client.pool_manager.connection_pool_kw["socket_options"]
+        assert (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1) in socket_options
+        session.close()
+
+
+def test_query_options_parse_float_max_gap():
+    config = configparser.ConfigParser()
+    config.read_string("[InfluxDB]\nmax_gap=2.5\n")
+    assert query_options(config).max_gap == 2.5
+
+
+def test_query_options_reject_unknown_integration():
+    config = configparser.ConfigParser()
+    config.read_string("[InfluxDB]\nintegration=Server\n")
+    with pytest.raises(ValueError):
+        query_options(config)
+
+
+def _batch_record(measurement, value, time=None, result="_result"):
+    return MagicMock(get_measurement=MagicMock(return_value=measurement),
+                     get_value=MagicMock(return_value=value),
+                     get_time=MagicMock(return_value=time),
+                     values={"result": result})
+
+
+def test_get_total_kwh_consumed_batch_from_influx(influx_instance):
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[
+            _batch_record("a", 100, datetime(2023, 1, 1, 0, 0)),
+            _batch_record("a", 200, datetime(2023, 1, 1, 1, 0)),
+        ]),
+        MagicMock(records=[
+            _batch_record("b", 1000, datetime(2023, 1, 1, 0, 0)),
+            _batch_record("b", 0, datetime(2023, 1, 1, 0, 30)),
+        ]),
+    ]
+    start_date = datetime(2023, 1, 1, 0, 0)
+    end_date = datetime(2023, 1, 1, 2, 0)
+    result = influx_instance.get_total_kwh_consumed_batch_from_influx(["a", "b", "c"], start_date, end_date)
+    assert result == {"a": 0.1, "b": 0.5, "c": 0.0}
+    query = influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+    assert 'contains(value: r._measurement, set: ["a", "b", "c"])' in query
+    assert 'group(columns: ["_measurement"])' in query
+
+    # the single getter is answered from the batch
+    influx_instance.influx.client.query_api().query.reset_mock()
+    assert influx_instance.get_total_kwh_consumed_from_influx("b", start_date, end_date) == 0.5
+    influx_instance.influx.client.query_api().query.assert_not_called()
+
+
+def test_get_values_batch_from_influx(influx_instance):
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[_batch_record("a", 10, result="start"), _batch_record("a", 11, result="start")]),
+        MagicMock(records=[_batch_record("a", 20, result="end")]),
+        MagicMock(records=[_batch_record("b", 5, result="end")]),
+    ]
+    start_date = datetime(2023, 1, 1, 23, 59)
+    end_date = datetime(2023, 1, 8, 23, 59)
+    result = influx_instance.get_values_batch_from_influx(["a", "b"], start_date, end_date)
+    assert result == {"a": (11, 20), "b": (None, 5)}
+    influx_instance.influx.client.query_api().query.assert_called_once()
+    query = influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+    assert 'yield(name: "start")' in query
+    assert 'yield(name: "end")' in query
+
+    influx_instance.influx.client.query_api().query.reset_mock()
+    assert influx_instance.get_values_from_influx("a", datetime(2023, 1, 1), datetime(2023, 1, 8)) == (11, 20)
+    influx_instance.influx.client.query_api().query.assert_not_called()
+
+
+def test_get_snapshots_batch_from_influx(influx_instance):
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[_batch_record("a", 10, result="2023-01-01"),
+                           _batch_record("a", 20, result="2023-01-08")]),
+        MagicMock(records=[_batch_record("a", 30, result="2023-02-01"),
+                           _batch_record("b", 5, result="2023-02-01")]),
+    ]
+    days = (datetime(2023, 1, 1), datetime(2023, 1, 8), datetime(2023, 2, 1))
+    result = influx_instance.get_snapshots_batch_from_influx(["a", "b"], days)
+    assert result == {"a": {days[0]: 10, days[1]: 20, days[2]: 30}, "b": {days[0]: None, days[1]: None, days[2]: 5}}
+    query = influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+    assert query.count("from(bucket:") == 3
+    assert 'yield(name: "2023-01-08")' in query
+
+    # values of any two of the days are known now
+    influx_instance.influx.client.query_api().query.reset_mock()
+    assert influx_instance.get_values_from_influx("a", datetime(2023, 1, 8, 23, 59, 59), datetime(2023, 2, 1, 23, 59, 59)) == (20, 30)
+    assert not influx_instance.pending([QueryRequest(KIND_SNAPSHOTS, ("a", "b"), days[0], days[-1], days)])
+    assert influx_instance.pending([QueryRequest(KIND_SNAPSHOTS, ("a",), days[0], datetime(2023, 3, 1), days[:1] + (datetime(2023, 3, 1),))])
+    influx_instance.influx.client.query_api().query.assert_not_called()
+
+
+def test_get_total_kwh_consumed_server_integration(influx_instance):
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[_batch_record("a", 1500.0)]),
+    ]
+    start_date = datetime(2023, 1, 1, 0, 0)
+    end_date = datetime(2023, 1, 2, 0, 0)
+    result = influx_instance.get_total_kwh_consumed_from_influx("a", start_date, end_date, INTEGRATION_SERVER)
+    assert result == 1.5
+    query = influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+    assert "integral(unit: 1h)" in query
+    assert "sort(" not in query
+
+
+def test_check_integration_parity(influx_instance):
+    influx_instance.influx.client.query_api().query.side_effect = [
+        [MagicMock(records=[
+            _batch_record("a", 100, datetime(2023, 1, 1, 0, 0)),
+            _batch_record("a", 200, datetime(2023, 1, 1, 1, 0)),
+        ])],
+        [MagicMock(records=[_batch_record("a", 150.0)])],
+    ]
+    parities = influx_instance.check_integration_parity(["a"], datetime(2023, 1, 1, 0, 0), datetime(2023, 1, 1, 2, 0))
+    assert len(parities) == 1
+    assert parities[0].client_kwh == 0.1
+    assert parities[0].server_kwh == 0.15
+    assert round(parities[0].difference, 3) == 0.05
+    assert round(parities[0].relative_difference, 3) == 0.5
+
+
+def test_streaming_uses_query_stream(influx_instance):
+    influx_instance.session.options.streaming = True
+    query_api = influx_instance.influx.client.query_api()
+    query_api.query_stream.return_value = iter([
+        _batch_record("a", 100, datetime(2023, 1, 1, 0, 0)),
+        _batch_record("a", 200, datetime(2023, 1, 1, 1, 0)),
+    ])
+    result = influx_instance.get_total_kwh_consumed_batch_from_influx(["a"], datetime(2023, 1, 1, 0, 0), datetime(2023, 1, 1, 2, 0))
+    assert result == {"a": 0.1}
+    query_api.query.assert_not_called()
+
+
+def test_cached_results_are_not_queried(tmp_path):
+    cache_file = str(tmp_path / "cache.sqlite")
+    query_api = MagicMock()
+    query_api.query.return_value = [
+        MagicMock(records=[_batch_record("a", 100, datetime(2023, 1, 1, 0, 0)),
+                           _batch_record("a", 200, datetime(2023, 1, 1, 1, 0))]),
+    ]
+    start_date = datetime(2023, 1, 1, 0, 0)
+    end_date = datetime(2023, 1, 1, 2, 0)
+    with patch('configparser.ConfigParser.read', return_value=None), \
+         patch('configparser.ConfigParser.get', side_effect=lambda section, option: cache_file if option == "cache_file" else 'mock_value'), \
+         patch('configparser.ConfigParser.has_option', side_effect=lambda section, option: option == "cache_file"), \
+         patch('influxdb_client.InfluxDBClient') as mock_client_class:
+        mock_client_class.return_value.query_api.return_value = query_api
+        with InfluxSession() as session:
+            assert GetFromInflux(session).get_total_kwh_consumed_batch_from_influx(["a"], start_date, end_date) == {"a": 0.1}
+        with InfluxSession() as session:
+            influx = GetFromInflux(session)
+            influx.prefetch([QueryRequest(KIND_KWH, ("a",), start_date, end_date)])
+            assert influx.get_total_kwh_consumed_from_influx("a", start_date, end_date) == 0.1
+            assert session.cache.hits == 1
+    query_api.query.assert_called_once()
+
+
+def test_get_daily_last_values_from_influx(influx_instance):
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[
+            _batch_record("a", 5, datetime(2023, 1, 1, tzinfo=timezone.utc)),
+            _batch_record("a", 7, datetime(2023, 1, 2, tzinfo=timezone.utc)),
+        ]),
+    ]
+    result = influx_instance.get_daily_last_values_from_influx(["a", "b"], date(2023, 1, 1), date(2023, 1, 3))
+    assert result == {"a": {date(2023, 1, 1): 5, date(2023, 1, 2): 7}, "b": {}}
+    query = influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+    assert "range(start: 2023-01-01T00:00:00Z, stop: 2023-01-04T00:00:00Z)" in query
+    assert "aggregateWindow(every: 1d, fn: last" in query
+
+
+def test_get_daily_kwh_from_influx(influx_instance):
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[
+            _batch_record("a", 1000, datetime(2023, 1, 1, 23, 0, tzinfo=timezone.utc)),
+            _batch_record("a", 500, datetime(2023, 1, 2, 1, 0, tzinfo=timezone.utc)),
+            _batch_record("a", 0, datetime(2023, 1, 2, 3, 0, tzinfo=timezone.utc)),
+        ]),
+    ]
+    result = influx_instance.get_daily_kwh_from_influx(["a"], date(2023, 1, 1), date(2023, 1, 2))
+    assert result == {"a": {date(2023, 1, 1): 2.0, date(2023, 1, 2): 1.0}}
+
+
+def _use_downsampled_buckets(influx_instance, buckets):
+    influx_instance.session.options.downsampled_buckets = buckets
+    influx_instance.downsampled_buckets = parse_buckets(buckets)
+
+
+def test_get_total_kwh_consumed_from_downsampled_bucket(influx_instance):
+    _use_downsampled_buckets(influx_instance, "power_1m:1m, power_1h:1h")
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[
+            _batch_record("a", 100, datetime(2023, 1, 1, 0, 30), result=RESULT_HEAD),
+            _batch_record("a", 200, datetime(2023, 1, 1, 0, 45), result=RESULT_HEAD),
+        ]),
+        MagicMock(records=[_batch_record("a", 5000, result=RESULT_DOWNSAMPLED)]),
+    ]
+    result = influx_instance.get_total_kwh_consumed_from_influx("a", datetime(2023, 1, 1, 0, 30), datetime(2023, 3, 1))
+    assert result == pytest.approx(5.025)  # 100 W * 0.25 h of the head and 5000 Wh of the hourly windows
+    query = influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+    assert 'from(bucket:"power_1h")' in query
+    assert "range(start: 2023-01-01T01:00:00Z, stop: 2023-03-01T00:00:00Z)" in query
+    assert 'r._field == "mean"' in query
+    assert "r._value * 1.0" in query
+    assert f'yield(name: "{RESULT_HEAD}")' in query
+    assert f'yield(name: "{RESULT_TAIL}")' not in query
+
+
+def test_get_total_kwh_consumed_short_range_stays_raw(influx_instance):
+    _use_downsampled_buckets(influx_instance, "power_1h:1h")
+    result = influx_instance.get_total_kwh_consumed_from_influx("test_measurement", datetime(2023, 1, 1, 0, 0), datetime(2023, 1, 1, 2, 0))
+    assert result == 0.1
+    assert "power_1h" not in influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+
+
+def test_get_daily_last_values_from_downsampled_bucket(influx_instance):
+    _use_downsampled_buckets(influx_instance, "counter_1h:1h")
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[_batch_record("a", 5, datetime(2023, 1, 1, tzinfo=timezone.utc), result=RESULT_DOWNSAMPLED)]),
+    ]
+    result = influx_instance.get_daily_last_values_from_influx(["a"], date(2023, 1, 1), date(2023, 1, 3))
+    assert result == {"a": {date(2023, 1, 1): 5}}
+    query = influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+    assert 'from(bucket:"counter_1h")' in query
+    assert 'r._field == "last"' in query
+    # the days are long past, so no window is read from the raw bucket
+    assert 'from(bucket:"mock_value")' not in query
+
+
+def test_prefetch_from_rollups_fetches_only_missing_days(tmp_path, influx_instance):
+    influx_instance.session.rollups = RollupStore(str(tmp_path / "rollups.sqlite"))
+    influx_instance.get_daily_kwh_from_influx = MagicMock(
+        side_effect=lambda names, first, last: {name: {
+            day: 1.0 for day in days_between(first, last)
+        } for name in names})
+    influx_instance.get_daily_last_values_from_influx = MagicMock(
+        side_effect=lambda names, first, last: {name: {
+            day: day.day for day in days_between(first, last)
+        } for name in names})
+    start_date = datetime(2024, 9, 29, 23, 59, 59)
+    end_date = datetime(2024, 10, 6, 23, 59, 59)
+    requests = [QueryRequest(KIND_KWH, ("w",), start_date, end_date), QueryRequest(KIND_VALUES, ("c",), start_date, end_date)]
+
+    influx_instance.prefetch(requests)
+    assert influx_instance.get_total_kwh_consumed_from_influx("w", start_date, end_date) == 7.0
+    assert influx_instance.get_values_from_influx("c", start_date, end_date) == (29, 6)
+    influx_instance.get_daily_kwh_from_influx.assert_called_once_with(["w"], date(2024, 9, 30), date(2024, 10, 6))
+
+    # one week later only the new days are fetched
+    influx_instance.get_daily_kwh_from_influx.reset_mock()
+    influx_instance.prefetch_from_rollups([QueryRequest(KIND_KWH, ("w",), end_date, end_date + timedelta(days=7))], today=date(2024, 10, 20))
+    influx_instance.get_daily_kwh_from_influx.assert_called_once_with(["w"], date(2024, 10, 7), date(2024, 10, 13))
+
+    # in the next run, energies of another integration rule are not mixed in, the counter values stay valid
+    next_run = GetFromInflux(influx_instance.session)
+    next_run.get_daily_kwh_from_influx = MagicMock(return_value={"w": {}})
+    next_run.get_daily_last_values_from_influx = MagicMock()
+    influx_instance.session.options.integration_rule = "trapezoid"
+    next_run.prefetch_from_rollups(requests, today=date(2024, 10, 20))
+    next_run.get_daily_kwh_from_influx.assert_called_once_with(["w"], date(2024, 9, 30), date(2024, 10, 6))
+    next_run.get_daily_last_values_from_influx.assert_not_called()
+    influx_instance.session.rollups.close()
+    influx_instance.session.rollups = None
+
+
+def test_daily_series_are_kept_and_give_the_snapshots(influx_instance):
+    influx_instance.get_daily_last_values_from_influx = MagicMock(side_effect=lambda names, first, last: {name: {last: 5.0} for name in names})
+    lookback = timedelta(days=influx_instance.session.options.lookback_days)
+    assert influx_instance.get_daily_series(KIND_LAST, ["c"], date(2024, 10, 6) - lookback, date(2024, 10, 6)) == {"c": {date(2024, 10, 6): 5.0}}
+    assert influx_instance.get_daily_series(KIND_LAST, ["c"], date(2024, 10, 5), date(2024, 10, 6)) == {"c": {date(2024, 10, 6): 5.0}}
+    influx_instance.get_daily_last_values_from_influx.assert_called_once()
+
+    days = (datetime(2023, 10, 8, 23, 59, 59), datetime(2024, 10, 6, 23, 59, 59))
+    request = QueryRequest(KIND_SNAPSHOTS, ("c", "d"), days[0], days[-1], days)
+    influx_instance.remember_known_daily([request])
+    assert influx_instance.get_snapshots_batch_from_influx(["c"], days[1:]) == {"c": {days[1]: 5.0}}
+    # only the day that is still unknown is queried
+    assert influx_instance.pending([request]) == [request]
+    assert influx_instance.pending([QueryRequest(KIND_SNAPSHOTS, ("c",), days[0], days[-1],
+                                                 days)]) == [QueryRequest(KIND_SNAPSHOTS, ("c",), days[0], days[0], days[:1])]
+
+
+def test_derived_measurements_are_evaluated_by_the_server():
+    phases = [counter_series(f"ph{phase}", datetime(2024, 9, 1), timedelta(days=20), resets=0, seed=phase) for phase in range(3)]
+    synthetic = SyntheticInflux(phases)
+    influx = GetFromInflux(synthetic.session())
+    name = derived_name("ph0 + ph1 + ph2 / 1000")
+    days = (datetime(2024, 9, 5), datetime(2024, 9, 12))
+    snapshots = influx.get_snapshots_batch_from_influx([name, "ph0"], days)
+    assert synthetic.queries == 1
+    # one record per day for the derived measurement instead of one per phase
+    assert synthetic.records == 4
+    plain = GetFromInflux(SyntheticInflux(phases).session()).get_snapshots_batch_from_influx(["ph0", "ph1", "ph2"], days)
+    for day in days:
+        assert snapshots[name][day] == pytest.approx(plain["ph0"][day] + plain["ph1"][day] + plain["ph2"][day] / 1000)
+    assert influx.get_values_from_influx(name, *days) == (snapshots[name][days[0]], snapshots[name][days[1]])
+
+    daily = influx.get_daily_last_values_from_influx([name], date(2024, 9, 3), date(2024, 9, 5))
+    assert daily[name][date(2024, 9, 5)] == pytest.approx(snapshots[name][days[0]])
+    assert len(daily[name]) == 3
+
+
+def test_derived_measurement_query(influx_instance):
+    name = derived_name('a - "b c" / 2')
+    query = influx_instance.snapshots_batch_query(["x", name], (datetime(2023, 1, 1),))
+    assert query.count("from(bucket:") == 2
+    assert 'yield(name: "2023-01-01")' in query
+    assert 'set: ["a", "b c"]' in query
+    assert '_time: 2023-01-01T23:59:59Z' in query
+    assert 'pivot(rowKey: ["_time"], columnKey: ["_measurement"], valueColumn: "_value")' in query
+    assert '_value: (r["a"] - (r["b c"] / 2.0))' in query
+    assert 'yield(name: "2023-01-01#1")' in query
+
+    influx_instance.influx.client.query_api().query.return_value = [
+        MagicMock(records=[_batch_record("x", 1, result="2023-01-01"),
+                           _batch_record(name, 5, result="2023-01-01#1")]),
+    ]
+    day = datetime(2023, 1, 1)
+    assert influx_instance.get_snapshots_batch_from_influx(["x", name], (day,)) == {"x": {day: 1}, name: {day: 5}}
+
+
+def test_derived_measurement_from_downsampled_bucket(influx_instance):
+    _use_downsampled_buckets(influx_instance, "counter_1h:1h")
+    name = derived_name("a + b")
+    influx_instance.get_daily_last_values_from_influx(["x", name], date(2023, 1, 1), date(2023, 1, 3))
+    query = influx_instance.influx.client.query_api().query.call_args.kwargs["query"]
+    assert 'yield(name: "downsampled")' in query and 'yield(name: "downsampled#1")' in query
+    assert query.count("pivot(") == 1
@@ -0,0 +1,161 @@
+"""test influx_async.py"""
+import asyncio
+import json
+import re
+import time
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import main
+from influx import KIND_KWH, KIND_SNAPSHOTS, KIND_VALUES, GetFromInflux, InfluxConfigClass, QueryOptionsClass, QueryRequest
+from influx_async import AsyncGetFromInflux, RateLimiter, prefetch_concurrently
+from resilience import QueryGuard
+
+# pylint: disable=missing-function-docstring
+
+
+def fake_tables(query):
+    """Deterministic answer for the batched queries, derived from the measurement names and the range of each pipeline"""
+    tables = []
+    for pipeline in query.split("from(bucket:")[1:]:
+        names = re.search(r"set: \[([^\]]*)\]", pipeline).group(1).replace('"', '').split(", ")
+        derived = re.search(r'_measurement: ("(?:[^"\\]|\\.)*")', pipeline)
+        if derived:
+            # the expression of a derived measurement is evaluated in the query, one value for all its measurements
+            names = [json.loads(derived.group(1))]
+        start = datetime.strptime(re.search(r"range\(start: ([0-9T:-]+)", pipeline).group(1)[:19], "%Y-%m-%dT%H:%M:%S")
+        stop = datetime.strptime(re.search(r"stop: ([0-9T:-]+)", pipeline).group(1)[:19], "%Y-%m-%dT%H:%M:%S")
+        result = re.search(r'yield\(name: "([^"]*)"\)', pipeline)
+        for name in names:
+            records = []
+            if result:
+                records.append(
+                    MagicMock(get_measurement=MagicMock(return_value=name),
+                              get_value=MagicMock(return_value=10 * len(name) + stop.day + 100 * stop.month),
+                              values={"result": result.group(1)}))
+            else:
+                for hour, value in ((0, 100 * len(name)), (1, start.day), (3, 0)):
+                    records.append(
+                        MagicMock(get_measurement=MagicMock(return_value=name),
+                                  get_value=MagicMock(return_value=value),
+                                  get_time=MagicMock(return_value=start + timedelta(hours=hour)),
+                                  values={}))
+            tables.append(MagicMock(records=records))
+    return tables
+
+
+def make_influx(concurrency=0, **options):
+    session = MagicMock()
+    session.options = QueryOptionsClass(concurrency=concurrency, **options)
+    session.cache = None
+    session.rollups = None
+    session.guard = QueryGuard(session.options, session.metrics)
+    session.influx = InfluxConfigClass(url="http://localhost:8086", token="token", org="org", bucket="bucket", client=MagicMock())
+    session.query_api.query.side_effect = lambda org, query: fake_tables(query)
+    return GetFromInflux(session)
+
+
+# pylint: disable-next=too-few-public-methods
+class FakeQueryApiAsync():
+    """Async query API that records how many queries are in flight"""
+
+    def __init__(self, delay=0.01):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.queries = 0
+
+    async def query(self, query, org=None):
+        assert org == "org"
+        self.queries += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        return fake_tables(query)
+
+
+def test_concurrency_is_bounded():
+    influx = make_influx()
+    query_api = FakeQueryApiAsync()
+    async_influx = AsyncGetFromInflux(influx, query_api, concurrency=3)
+    requests = [QueryRequest(KIND_KWH, (f"m{i}",), datetime(2023, 1, 1), datetime(2023, 1, 2)) for i in range(10)]
+
+    async def run():
+        return await asyncio.gather(*(async_influx.query_batch(request) for request in requests))
+
+    results = asyncio.run(run())
+    assert query_api.queries == 10
+    assert query_api.max_in_flight == 3
+    assert results[0] == influx.get_total_kwh_consumed_batch_from_influx(["m0"], datetime(2023, 1, 1), datetime(2023, 1, 2))
+
+
+def test_rate_limiter_spaces_starts():
+    limiter = RateLimiter(50)
+
+    async def run():
+        starts = []
+        for _ in range(5):
+            await limiter.wait()
+            starts.append(time.monotonic())
+        return starts
+
+    starts = asyncio.run(run())
+    assert starts[-1] - starts[0] >= 4 / 50 * 0.9
+
+
+def test_rate_limiter_unlimited():
+    assert RateLimiter(0).interval == 0.0
+
+
+def test_process_identical_to_sync():
+    date = datetime(2024, 10, 6, 23, 59, 59)
+    expected = main.process(date, False, make_influx())
+
+    influx = make_influx(concurrency=4)
+    query_api = FakeQueryApiAsync(delay=0)
+    with patch('influx_async.InfluxDBClientAsync') as mock_client_class:
+        client = mock_client_class.return_value.__aenter__.return_value
+        client.query_api = MagicMock(return_value=query_api)
+        result = main.process(date, False, influx)
+
+    assert query_api.queries == 3
+    influx.session.query_api.query.assert_not_called()
+    assert result == expected
+
+
+def test_prefetch_concurrently_values():
+    influx = make_influx(concurrency=2)
+    query_api = FakeQueryApiAsync(delay=0)
+    requests = [QueryRequest(KIND_VALUES, ("ab", "abc"), datetime(2023, 1, 1), datetime(2023, 1, 8))]
+    with patch('influx_async.InfluxDBClientAsync') as mock_client_class:
+        mock_client_class.return_value.__aenter__.return_value.query_api = MagicMock(return_value=query_api)
+        results = asyncio.run(prefetch_concurrently(influx, requests))
+    assert results == [{"ab": (121, 128), "abc": (131, 138)}]
+    assert influx.get_values_from_influx("abc", datetime(2023, 1, 1), datetime(2023, 1, 8)) == (131, 138)
+
+
+def test_prefetch_concurrently_snapshots():
+    influx = make_influx(concurrency=2)
+    query_api = FakeQueryApiAsync(delay=0)
+    days = (datetime(2023, 1, 1), datetime(2023, 1, 8), datetime(2023, 2, 1))
+    requests = [QueryRequest(KIND_SNAPSHOTS, ("ab",), days[0], days[-1], days)]
+    with patch('influx_async.InfluxDBClientAsync') as mock_client_class:
+        mock_client_class.return_value.__aenter__.return_value.query_api = MagicMock(return_value=query_api)
+        results = asyncio.run(prefetch_concurrently(influx, requests))
+    assert results == [{"ab": {days[0]: 121, days[1]: 128, days[2]: 221}}]
+    assert influx.get_values_from_influx("ab", days[1], days[2]) == (128, 221)
+
+
+def test_prefetch_concurrently_client_options():
+    influx = make_influx(concurrency=3, query_timeout=2.5, gzip=False)
+    requests = [QueryRequest(KIND_VALUES, ("ab",), datetime(2023, 1, 1), datetime(2023, 1, 8))]
+    with patch('influx_async.InfluxDBClientAsync') as mock_client_class:
+        mock_client_class.return_value.__aenter__.return_value.query_api = MagicMock(return_value=FakeQueryApiAsync(delay=0))
+        asyncio.run(prefetch_concurrently(influx, requests))
+    mock_client_class.assert_called_once_with(url="http://localhost:8086",
+                                              token="token",
+                                              org="org",
+                                              connection_pool_maxsize=3,
+                                              enable_gzip=False,
+                                              timeout=2500)
@@ -0,0 +1,114 @@
+"""test integration.py"""
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from integration import (RULE_LEFT, RULE_TRAPEZOID, DailyEnergyAccumulator, EnergyAccumulator, LastValueAccumulator, datetimes_to_ns, integrate_kwh,
+                         integrate_tables_kwh)
+
+# pylint: disable=missing-function-docstring
+
+HOUR_NS = 3_600_000_000_000
+
+
+def test_integrate_kwh_left():
+    timestamps = np.array([0, HOUR_NS, 2 * HOUR_NS], dtype=np.int64)
+    values = np.array([100.0, 200.0, 300.0])
+    assert integrate_kwh(timestamps, values, RULE_LEFT) == pytest.approx(0.3)
+
+
+def test_integrate_kwh_trapezoid():
+    timestamps = np.array([0, HOUR_NS, 2 * HOUR_NS], dtype=np.int64)
+    values = np.array([100.0, 200.0, 300.0])
+    assert integrate_kwh(timestamps, values, RULE_TRAPEZOID) == pytest.approx(0.4)
+
+
+def test_integrate_kwh_max_gap():
+    # 10 h outage after the second sample, only 1 h of it is integrated
+    timestamps = np.array([0, HOUR_NS, 11 * HOUR_NS], dtype=np.int64)
+    values = np.array([1000.0, 1000.0, 0.0])
+    assert integrate_kwh(timestamps, values, RULE_LEFT) == pytest.approx(11.0)
+    assert integrate_kwh(timestamps, values, RULE_LEFT, max_gap_s=3600) == pytest.approx(2.0)
+
+
+def test_integrate_kwh_not_enough_data():
+    assert integrate_kwh(np.array([0]), np.array([100.0])) == 0.0
+    assert integrate_kwh([], []) == 0.0
+
+
+def test_integrate_kwh_invalid():
+    with pytest.raises(ValueError):
+        integrate_kwh([0, 1], [1.0])
+    with pytest.raises(ValueError):
+        integrate_kwh([0, 1], [1.0, 2.0], rule="simpson")
+
+
+def test_datetimes_to_ns():
+    aware = datetimes_to_ns([datetime(1970, 1, 1, tzinfo=timezone.utc), datetime(1970, 1, 1, 0, 0, 1, 5, tzinfo=timezone.utc)])
+    assert aware.dtype == np.int64
+    assert list(aware) == [0, 1_000_005_000]
+    naive = datetimes_to_ns([datetime(2023, 1, 1, 0, 0), datetime(2023, 1, 1, 1, 0)])
+    assert naive[1] - naive[0] == HOUR_NS
+
+
+def test_integrate_tables_kwh():
+    tables = [
+        MagicMock(records=[
+            MagicMock(get_value=MagicMock(return_value=100), get_time=MagicMock(return_value=datetime(2023, 1, 1, 0, 0))),
+            MagicMock(get_value=MagicMock(return_value=200), get_time=MagicMock(return_value=datetime(2023, 1, 1, 1, 0))),
+        ])
+    ]
+    assert integrate_tables_kwh(tables) == pytest.approx(0.1)
+    assert integrate_tables_kwh(tables, RULE_TRAPEZOID) == pytest.approx(0.15)
+
+
+@pytest.mark.parametrize("rule", [RULE_LEFT, RULE_TRAPEZOID])
+def test_energy_accumulator_matches_arrays(rule):
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    timestamps = [start + timedelta(seconds=10 * i + (i % 3)) for i in range(1000)]
+    values = [float((i * 37) % 500) for i in range(1000)]
+    accumulator = EnergyAccumulator(rule, max_gap_s=11, chunk_size=64)
+    for timestamp, value in zip(timestamps, values):
+        accumulator.add(timestamp, value)
+    assert accumulator.samples == 1000
+    assert accumulator.kwh == pytest.approx(integrate_kwh(datetimes_to_ns(timestamps), values, rule, max_gap_s=11))
+    assert len(accumulator._values) <= 64  # pylint: disable=protected-access
+
+
+def test_energy_accumulator_empty():
+    accumulator = EnergyAccumulator()
+    assert accumulator.kwh == 0.0
+    accumulator.add(datetime(2023, 1, 1), 100.0)
+    assert accumulator.kwh == 0.0
+
+
+def test_last_value_accumulator():
+    accumulator = LastValueAccumulator()
+    assert accumulator.value is None
+    accumulator.add(datetime(2023, 1, 2), 2)
+    accumulator.add(datetime(2023, 1, 1), 1)
+    accumulator.add(datetime(2023, 1, 3), 3)
+    assert accumulator.value == 3
+
+
+@pytest.mark.parametrize("rule", [RULE_LEFT, RULE_TRAPEZOID])
+def test_daily_energy_accumulator_sums_to_total(rule):
+    start = datetime(2023, 1, 1, 20, 0, tzinfo=timezone.utc)
+    timestamps = [start + timedelta(minutes=7 * i) for i in range(500)]
+    values = [float(i % 50) for i in range(500)]
+    accumulator = DailyEnergyAccumulator(rule, chunk_size=32)
+    for timestamp, value in zip(timestamps, values):
+        accumulator.add(timestamp, value)
+    per_day = accumulator.kwh_per_day
+    assert sorted(per_day) == [datetime(2023, 1, day).date() for day in (1, 2, 3, 4)]
+    assert sum(per_day.values()) == pytest.approx(integrate_kwh(datetimes_to_ns(timestamps), values, rule))
+
+
+def test_daily_energy_accumulator_interval_belongs_to_first_day():
+    accumulator = DailyEnergyAccumulator()
+    accumulator.add(datetime(2023, 1, 1, 23, 0), 1000.0)
+    accumulator.add(datetime(2023, 1, 2, 1, 0), 0.0)
+    accumulator.add(datetime(2023, 1, 2, 2, 0), 0.0)
+    assert accumulator.kwh_per_day == {datetime(2023, 1, 1).date(): pytest.approx(2.0), datetime(2023, 1, 2).date(): 0.0}
@@ -1,10 +1,25 @@
 """unit test main.py"""
-from datetime import datetime
+import json
+import logging
+import os
+import pstats
+import subprocess
+import sys
+from datetime import date, datetime, timedelta
 from unittest.mock import MagicMock, patch
 
 import pytest
 
 import main
+from catalog import TYPE_WATT, CatalogEntry, load_catalog
+from derived import derived_name
+from helpers import MeasurementSet
+from influx import KIND_KWH, KIND_SNAPSHOTS, GetFromInflux, QueryOptionsClass, QueryRequest
+from manifest import Manifest
+from metrics import PHASE_INTEGRATION, PHASE_RENDERING, RunMetrics
+from resilience import DeadlineExceeded, QueryTimeout
+from rollup import KIND_ENERGY
+from synthetic import SyntheticInflux, counter_series, power_series
 
 # pylint: disable=missing-function-docstring
 
@@ -35,9 +50,9 @@ def test_process_and_log(date, is_month, measurement_name, name, is_watt):
 
         assert result == expected_output
         if is_watt:
-            mock_process_watt.assert_called_once_with(date, is_month, measurement_name)
+            mock_process_watt.assert_called_once_with(date, is_month, measurement_name, None)
         else:
-            mock_process_kwh.assert_called_once_with(date, is_month, measurement_name)
+            mock_process_kwh.assert_called_once_with(date, is_month, measurement_name, None)
         mock_log_difference.assert_called_once()
 
 
@@ -51,12 +66,18 @@ def test_main(test_date, verify_date, is_first_of_month):
     """test main function with different combinations"""
     with patch('main.process') as mock_process, \
          patch('main.datetime') as mock_datetime, \
-         patch('main.create_bar_chart') as _mock_create_bar_chart:
+         patch('main.InfluxSession') as mock_session, \
+         patch('main.GetFromInflux') as mock_influx, \
+         patch('main.ChartRenderer'), \
+         patch('main.submit_charts', return_value=([], True)):
 
         mock_datetime.now.return_value = test_date
+        mock_influx.return_value.session.options = QueryOptionsClass()
         main.main(today=test_date)
 
-        mock_process.assert_any_call(date=verify_date, is_month=is_first_of_month)
+        mock_process.assert_any_call(date=verify_date, is_month=is_first_of_month, influx=mock_influx.return_value, catalog=load_catalog())
+        mock_influx.assert_called_once_with(mock_session.return_value.__enter__.return_value)
+        mock_session.return_value.__exit__.assert_called_once()
 
 
 @pytest.mark.parametrize(
@@ -105,11 +126,12 @@ def mock_helpers():
 
 @pytest.fixture
 def mock_influx():
-    with patch('main.GetFromInflux') as mock_influx:
+    with patch('main.InfluxSession'), patch('main.GetFromInflux') as mock_influx:
         mock_instance = MagicMock()
         mock_influx.return_value = mock_instance
         mock_instance.get_values_from_influx.return_value = (100, 200)
         mock_instance.get_total_kwh_consumed_from_influx.return_value = 0.1
+        mock_instance.pending.side_effect = lambda requests: requests
         yield mock_instance
 
 
@@ -127,3 +149,335 @@ def test_process_weekly(mock_helpers, mock_influx):
     result = main.process(date, is_month)
     assert isinstance(result, list)
     assert len(result) > 0
+
+
+def test_process_shares_one_influx(mock_helpers, mock_influx):
+    main.process(datetime(2023, 9, 3), False)
+    main.GetFromInflux.assert_called_once()  # pylint: disable=no-member
+
+
+def test_process_prefetches_in_batches(mock_helpers, mock_influx):
+    main.process(datetime(2023, 9, 1), True)
+    requests = mock_influx.prefetch.call_args.args[0]
+    assert [request.kind for request in requests] == [KIND_SNAPSHOTS, KIND_KWH, KIND_KWH]
+    assert "Zaehler_Ceran" in requests[0].measurement_names
+    assert "SmartMeter_HeizungNeu_Einspeisung" in requests[0].measurement_names
+    assert len(requests[0].days) == 4
+    assert requests[1].measurement_names == tuple(entry.measurements[0] for entry in load_catalog() if entry.type == TYPE_WATT)
+
+
+def test_process_follows_catalog(mock_helpers, mock_influx):
+    result = main.process(datetime(2023, 9, 1), True, mock_influx)
+    assert len(result) == len(load_catalog())
+    with patch('main.log_difference') as mock_log_difference:
+        main.process(datetime(2023, 9, 1), True, mock_influx)
+    values = {call.args[2]: call.args[0] for call in mock_log_difference.call_args_list}
+    assert values["E-Auto"] == [10.0, 10.0]
+    assert values["Haushalt Zähler"] == [100, 100]
+    # the phases are summed by the server, the derived measurement is one value
+    assert values["Haushalt absolut"] == [0.1, 0.1]
+    assert values["Heizung"] == [0.1 - 100, 0.1 - 100]
+    assert values["Kühlschrank"] == [0.1, 0.1]
+
+
+def test_process_marks_unavailable_lines_missing(mock_influx):
+    mock_influx.prefetch.side_effect = QueryTimeout("prefetch")
+    counter = next(entry for entry in load_catalog() if entry.label == "Haushalt Zähler").measurements[0]
+
+    def get_values(measurement_name, start_date, end_date):
+        if measurement_name == counter:
+            raise DeadlineExceeded("deadline")
+        return (100, 200)
+
+    mock_influx.get_values_from_influx.side_effect = get_values
+    result = {measurement_set.name: measurement_set for measurement_set in main.process(datetime(2023, 9, 1), True, mock_influx)}
+    assert len(result) == len(load_catalog())
+    # Heizung subtracts the missing line
+    assert [name for name, measurement_set in result.items() if measurement_set.missing] == ["Haushalt Zähler", "Heizung"]
+    assert result["Heizung"].data == [0.0, 0.0]
+    assert result["Heizung"].dates == main.get_timeframes_kwh(datetime(2023, 9, 1), True)
+
+
+def test_process_raises_other_errors(mock_helpers, mock_influx):
+    mock_influx.get_values_from_influx.side_effect = ValueError("bug")
+    with pytest.raises(ValueError):
+        main.process(datetime(2023, 9, 1), True, mock_influx)
+
+
+def test_main_plans_all_reports_of_a_day():
+    # 01.09.2024 is a Sunday and the first of the month
+    with patch('main.process') as mock_process, \
+         patch('main.ChartRenderer') as mock_renderer, \
+         patch('main.submit_charts', return_value=([], True)) as mock_submit_charts:
+        influx = MagicMock()
+        influx.pending.side_effect = lambda requests: requests
+        influx.session.options = QueryOptionsClass()
+        main.main(today=datetime(2024, 9, 1, 23, 59, 59), influx=influx)
+
+    requests = influx.prefetch.call_args.args[0]
+    # week and month share the snapshot query and the current day of all counters is read once
+    assert [request.kind for request in requests] == [KIND_SNAPSHOTS] + [KIND_KWH] * 4
+    assert len(requests[0].days) == 7
+    assert mock_process.call_count == 2
+    assert [call.args[2] for call in mock_submit_charts.call_args_list] == [True, False]
+    mock_renderer.assert_called_once_with(None)
+    mock_renderer.return_value.__enter__.return_value.wait.assert_called_once()
+
+
+def test_process_measurement_kwh_missing_value():
+    with patch('main.GetFromInflux') as mock_influx:
+        mock_influx.return_value.get_values_from_influx.return_value = (None, 10)
+        result, _ = main.process_measurement_kwh(date1, True, 'measurement_kwh_1')
+        assert result == [0.0, 0.0]
+
+
+def test_import_does_not_load_heavy_modules():
+    code = "import sys, main; print('matplotlib' in sys.modules, 'influxdb_client' in sys.modules)"
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.split() == ["False", "False"]
+
+
+def test_run_reports_without_charts():
+    with patch('main.process', return_value=[]) as mock_process, \
+         patch('main.prefetch'), \
+         patch('main.submit_charts', return_value=([], True)) as mock_submit_charts:
+        influx = MagicMock()
+        influx.session.options = QueryOptionsClass()
+        assert main.run_reports(date1, [True], influx) == [[]]
+    mock_process.assert_called_once()
+    mock_submit_charts.assert_not_called()
+
+
+def test_run_reports_skips_unchanged_reports(tmp_path):
+    influx = MagicMock()
+    influx.session.options = QueryOptionsClass()
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    data = [MeasurementSet(name="Herd", data=[1.0, 2.0], dates=((date1, date2), (date1, date2)))]
+
+    def fake_submit_charts(_renderer, day, is_month, *args):
+        output_dir = args[-1]
+        path = os.path.join(output_dir, f"bar_chart_{main.report_name(day, is_month)}.png")
+        with open(path, "wb") as chart:
+            chart.write(b"png")
+        return [path], True
+
+    def run(values, missing=False):
+        measurement_set = MeasurementSet(name="Herd", data=values, dates=data[0].dates, missing=missing)
+        with patch('main.process', return_value=[measurement_set]), patch('main.prefetch'), \
+             patch('main.submit_charts', side_effect=fake_submit_charts) as mock_submit_charts:
+            main.run_reports(date2, [False], influx, MagicMock(), load_catalog(), str(tmp_path), Manifest(manifest.path))
+        return mock_submit_charts.call_count
+
+    assert run([1.0, 2.0]) == 1
+    assert list(Manifest(manifest.path).entries) == ["week_2024-10-06"]
+    assert run([1.0, 2.0]) == 0
+    assert run([1.0, 3.0]) == 1
+    # a report with a missing line is not recorded and created again
+    assert run([1.0, 0.0], missing=True) == 1
+    assert run([1.0, 0.0], missing=True) == 1
+    (tmp_path / "bar_chart_week_2024-10-06.png").unlink()
+    assert run([1.0, 3.0]) == 1
+
+
+def test_submit_charts():
+    renderer = MagicMock()
+    daily = [("Haushalt Zähler", ["day1"], [1.0]), ("E-Auto", ["day1"], [2.0])]
+    with patch('main.daily_usage', return_value=daily):
+        files, complete = main.submit_charts(renderer, date2, False, ["data"], MagicMock())
+    renderer.summary_chart.assert_called_once_with(["data"], "bar_chart_week_2024-10-06.png")
+    assert [call.args[3] for call in renderer.daily_chart.call_args_list
+           ] == ["daily_chart_week_2024-10-06_Haushalt_Zähler.png", "daily_chart_week_2024-10-06_E_Auto.png"]
+    assert files == ["bar_chart_week_2024-10-06.png", "daily_chart_week_2024-10-06_Haushalt_Zähler.png", "daily_chart_week_2024-10-06_E_Auto.png"]
+    assert complete
+
+
+@pytest.mark.parametrize("integration, queries", [("client", 4), ("server", 5)])
+def test_run_reports_charts_reuse_the_daily_usage(integration, queries):
+    start = datetime(2023, 9, 20)
+    series = [
+        power_series("herd", start, timedelta(days=390), resolution_s=900, gaps=0),
+        counter_series("zaehler", start, timedelta(days=390), resolution_s=900, resets=0, gaps=0)
+    ]
+    catalog = [CatalogEntry("Herd", ("herd",), TYPE_WATT), CatalogEntry("Zähler", ("zaehler",))]
+    day = datetime(2024, 10, 6, 23, 59, 59)
+    charted = SyntheticInflux(series)
+    with_charts = main.run_reports(day, [False], GetFromInflux(charted.session(integration=integration)), MagicMock(), catalog)
+    # daily energy and daily last values of the week, then the kWh and the counter values of the year before. The
+    # days integrated on the server miss the samples across midnight, so the kWh of the week are queried as well.
+    assert charted.queries == queries
+    plain = SyntheticInflux(series)
+    without_charts = main.run_reports(day, [False], GetFromInflux(plain.session(integration=integration)), None, catalog)
+    assert plain.queries == 3
+    for measurement_set, expected in zip(with_charts[0], without_charts[0]):
+        assert measurement_set.data == pytest.approx(expected.data, rel=1e-6)
+
+
+@pytest.mark.parametrize("charts", [False, True])
+def test_derived_sum_with_a_missing_phase(charts):
+    start = datetime(2023, 9, 20)
+    phases = [counter_series(f"ph{phase}", start, timedelta(days=390), resolution_s=900, resets=0, gaps=0, seed=phase) for phase in (1, 2)]
+    # the third phase starts during the week of the report, so it has no value at its start
+    phases.append(counter_series("ph3", datetime(2024, 10, 3), timedelta(days=4), resolution_s=900, resets=0, gaps=0, seed=3))
+    day = datetime(2024, 10, 6, 23, 59, 59)
+    derived = [CatalogEntry("Phasen", (derived_name("ph1 + ph2 + ph3"),))]
+    plain = [CatalogEntry("Phasen", ("ph1", "ph2", "ph3"))]
+    renderers = [MagicMock(), MagicMock()] if charts else [None, None]
+    result = main.run_reports(day, [False], GetFromInflux(SyntheticInflux(phases).session()), renderers[0], derived)[0][0]
+    expected = main.run_reports(day, [False], GetFromInflux(SyntheticInflux(phases).session()), renderers[1], plain)[0][0]
+    # like a line of several measurements only the missing phase counts 0
+    assert result.data == pytest.approx(expected.data)
+    assert result.data[1] > 0
+    if charts:
+        values = [renderer.daily_chart.call_args.args[2] for renderer in renderers]
+        assert values[0] == pytest.approx(values[1])
+        assert all(value > 0 for value in values[0])
+
+
+def test_daily_usage():
+    catalog = [
+        CatalogEntry("Herd", ("herd",), TYPE_WATT),
+        CatalogEntry("Zähler", ("zaehler",)),
+        CatalogEntry("Rest", ("zaehler",), subtract="Zähler"),
+    ]
+    influx = MagicMock()
+    influx.session.options.lookback_days = 1
+
+    def daily_series(kind, names, first_day, last_day):
+        days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+        if kind == KIND_ENERGY:
+            return {name: {day: 1.5 for day in days} for name in names}
+        # the counter has no value on the second day of the week
+        return {name: {day: float(day.toordinal()) for day in days if day != date(2024, 10, 1)} for name in names}
+
+    influx.get_daily_series.side_effect = daily_series
+    usage = main.daily_usage(date2, False, influx, catalog)
+    week = [date(2024, 9, 30) + timedelta(days=offset) for offset in range(7)]
+    assert usage[0] == ("Herd", week, [1.5] * 7)
+    assert usage[1] == ("Zähler", week, [1.0, 0.0, 2.0, 1.0, 1.0, 1.0, 1.0])
+    assert usage[2] == ("Rest", week, [0.0] * 7)
+
+
+def test_report_baselines(caplog):
+    catalog = [CatalogEntry("Herd", ("herd",), TYPE_WATT), CatalogEntry("Zähler", ("zaehler",))]
+    influx = MagicMock()
+    influx.session.options = QueryOptionsClass(lookback_days=1, baseline_years=2, baseline_window=14)
+    week = [date(2024, 9, 30) + timedelta(days=offset) for offset in range(7)]
+
+    def daily_series(kind, names, first_day, last_day):
+        days = [first_day + timedelta(days=offset) for offset in range((last_day - first_day).days + 1)]
+        if kind == KIND_ENERGY:
+            # the cooker is used much more in the week of the report
+            return {name: {day: 5.0 if day in week else 1.0 + day.toordinal() % 3 for day in days} for name in names}
+        return {name: {day: float(day.toordinal()) for day in days} for name in names}
+
+    influx.get_daily_series.side_effect = daily_series
+    data = [MeasurementSet(name=entry.label, data=[0.0, 0.0], dates=()) for entry in catalog]
+    with caplog.at_level(logging.INFO):
+        assert main.report_baselines(date2, False, data, influx, catalog) is data
+    herd, counter = (measurement_set.baseline for measurement_set in data)
+    # the weeks 52 and 104 weeks before, as daily_usage() of those reports
+    years = [sum(main.daily_usage(date2 - timedelta(weeks=52 * year), False, influx, catalog)[0][2]) for year in (1, 2)]
+    assert herd.years == pytest.approx(years)
+    assert herd.expected == pytest.approx(sum(years) / 2)
+    assert herd.median == 2.0
+    assert herd.outlier and herd.zscore > 3
+    assert herd.outlier_days == week[:1]
+    assert (counter.median, counter.expected, counter.outlier) == (1.0, 7.0, False)
+    assert "Herd is an outlier" in caplog.text
+    assert data[0].to_dict()["baseline"]["outlier_days"] == ["2024-09-30"]
+
+
+def test_report_baselines_unavailable(caplog):
+    influx = MagicMock()
+    influx.session.options = QueryOptionsClass(baseline_years=1)
+    influx.get_daily_series.side_effect = QueryTimeout("daily")
+    data = [MeasurementSet(name="Herd", data=[0.0, 0.0], dates=())]
+    main.report_baselines(date2, False, data, influx, [CatalogEntry("Herd", ("herd",), TYPE_WATT)])
+    assert data[0].baseline is None
+    assert "No baselines of report week_2024-10-06" in caplog.text
+
+
+def test_cli_json(capsys):
+    measurement_set = MeasurementSet(name="Kochfeld", data=[1.0, 2.5], dates=((date1, date2), (date1, date2)))
+    with patch('main.main', return_value=(date2, [False], [[measurement_set]])) as mock_main:
+        main.cli(["--format", "json"])
+    assert {
+        **mock_main.call_args.kwargs, "metrics": None,
+        "manifest": None
+    } == {
+        "influx": None,
+        "charts": False,
+        "chart_workers": None,
+        "metrics": None,
+        "manifest": None
+    }
+    output = json.loads(capsys.readouterr().out)
+    assert output["date"] == "2024-10-06"
+    assert output["reports"][0]["period"] == "week"
+    assert output["reports"][0]["measurements"][0] == {
+        "name": "Kochfeld",
+        "data": [1.0, 2.5],
+        "dates": [["2024-10-01T00:00:00", "2024-10-06T00:00:00"], ["2024-10-01T00:00:00", "2024-10-06T00:00:00"]],
+        "missing": False,
+    }
+
+
+def test_cli_no_chart_and_import_times():
+    with patch('main.main', return_value=(date2, [], [])) as mock_main, \
+         patch('startup.log_import_times') as mock_log_import_times:
+        main.cli(["--no-chart", "--import-times", "--chart-workers", "2"])
+    assert {
+        **mock_main.call_args.kwargs, "metrics": None,
+        "manifest": None
+    } == {
+        "influx": None,
+        "charts": False,
+        "chart_workers": 2,
+        "metrics": None,
+        "manifest": None
+    }
+    mock_log_import_times.assert_called_once()
+
+
+def test_cli_export(tmp_path):
+    (tmp_path / "power.lp").write_text("Herd value=100 1727740800000000000\n", encoding="utf-8")
+    with patch('main.main', return_value=(date2, [], [])) as mock_main:
+        main.cli(["--no-chart", "--export", str(tmp_path)])
+    influx = mock_main.call_args.kwargs["influx"]
+    assert influx.session.query_api.measurements == {"Herd"}
+    assert influx.session.metrics is mock_main.call_args.kwargs["metrics"]
+
+
+def test_cli_metrics_and_profile(tmp_path, caplog):
+
+    def fake_main(*_args, metrics, **_kwargs):
+        with metrics.section("week"):
+            metrics.record_query(QueryRequest(KIND_KWH, ("Kochfeld",), date1, date2), 0.5, 100, 2048, 0.1)
+        return date2, [False], [[]]
+
+    with patch('main.main', side_effect=fake_main), caplog.at_level(logging.INFO):
+        main.cli(["--no-chart", "--metrics", "--metrics-file", str(tmp_path / "report.prom"), "--profile", str(tmp_path / "report.prof")])
+    assert 'influx_report_queries{section="week"} 1' in (tmp_path / "report.prom").read_text(encoding="utf-8")
+    assert pstats.Stats(str(tmp_path / "report.prof")).total_calls > 0
+    summary = json.loads(
+        next(record.getMessage() for record in caplog.records if record.getMessage().startswith("Run metrics"))[len("Run metrics "):])
+    assert summary["total"]["rows"] == 100
+
+
+def test_run_reports_metrics_sections():
+    influx = MagicMock()
+    influx.session.metrics = RunMetrics()
+    influx.session.options = QueryOptionsClass()
+    renderer = MagicMock(seconds=1.5)
+
+    def fake_process(**arguments):
+        # run_reports() passes date, is_month, influx and catalog by keyword
+        arguments["influx"].session.metrics.add_phase(PHASE_INTEGRATION, 0.25)
+        return [arguments["date"], arguments["is_month"]]
+
+    with patch('main.process', side_effect=fake_process), patch('main.prefetch'), patch('main.submit_charts', return_value=([], True)):
+        main.run_reports(date1, [True, False], influx, renderer)
+    sections = influx.session.metrics.summary()["sections"]
+    assert list(sections) == ["month", "week", "charts"]
+    assert sections["week"]["phases"][PHASE_INTEGRATION] == 0.25
+    assert sections["charts"]["phases"][PHASE_RENDERING] == 1.5
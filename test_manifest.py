@@ -0,0 +1,62 @@
+"""test manifest.py"""
+from dataclasses import replace
+import datetime
+import os
+
+from catalog import CatalogEntry
+from helpers import MeasurementSet
+from influx import QueryOptionsClass
+from manifest import Manifest, config_version, inputs_hash, version_modules
+
+# pylint: disable=missing-function-docstring
+
+DATES = ((datetime.datetime(2023, 9, 1), datetime.datetime(2023, 9, 30)), (datetime.datetime(2024, 9, 1), datetime.datetime(2024, 9, 30)))
+CATALOG = [CatalogEntry("Herd", ("Strom_Herd",), "watt")]
+
+
+def test_inputs_hash():
+    data = [MeasurementSet("Herd", [1.0, 2.0], DATES)]
+    assert inputs_hash(data) == inputs_hash([MeasurementSet("Herd", [1.0, 2.0], DATES)])
+    assert inputs_hash(data) != inputs_hash([MeasurementSet("Herd", [1.0, 2.5], DATES)])
+    assert inputs_hash(data) != inputs_hash([MeasurementSet("Herd", [1.0, 2.0], DATES, missing=True)])
+
+
+def test_config_version():
+    options = QueryOptionsClass()
+    version = config_version(CATALOG, options)
+    assert version == config_version(CATALOG, options)
+    # options that do not change the values keep the version
+    assert version == config_version(CATALOG, replace(options, retries=3, streaming=True))
+    assert version != config_version(CATALOG, replace(options, integration_rule="trapezoid"))
+    assert version != config_version([replace(CATALOG[0], divisor=1000)], options)
+
+
+def test_version_modules():
+    names = {os.path.basename(path) for path in version_modules()}
+    assert {"main.py", "derived.py", "baseline.py", "manifest.py"} <= names
+    assert not any(name.startswith("test_") for name in names)
+
+
+def test_manifest_round_trip(tmp_path):
+    chart = tmp_path / "bar_chart_week_2024-10-06.png"
+    chart.write_bytes(b"png")
+    path = str(tmp_path / "out" / "manifest.json")
+    manifest = Manifest(path)
+    assert not manifest.unchanged("week_2024-10-06", "inputs", "version")
+    manifest.record("week_2024-10-06", "inputs", "version", [str(chart)])
+    manifest.save()
+
+    manifest = Manifest(path)
+    assert manifest.unchanged("week_2024-10-06", "inputs", "version")
+    assert not manifest.unchanged("week_2024-10-06", "other", "version")
+    assert not manifest.unchanged("week_2024-10-06", "inputs", "other")
+    assert not Manifest(path, force=True).unchanged("week_2024-10-06", "inputs", "version")
+    chart.unlink()
+    assert not manifest.unchanged("week_2024-10-06", "inputs", "version")
+
+
+def test_unreadable_manifest_is_empty(tmp_path, caplog):
+    path = tmp_path / "manifest.json"
+    path.write_text("{not json", encoding="utf-8")
+    assert not Manifest(str(path)).entries
+    assert "not readable" in caplog.text
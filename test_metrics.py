@@ -0,0 +1,78 @@
+"""test metrics.py"""
+from datetime import datetime
+import json
+
+from influx import KIND_KWH, KIND_SNAPSHOTS, QueryRequest
+from metrics import PHASE_INTEGRATION, PHASE_QUERY, PHASE_RENDERING, RunMetrics
+
+# pylint: disable=missing-function-docstring
+
+REQUEST = QueryRequest(KIND_KWH, ("Kochfeld", "Backofen"), datetime(2024, 9, 1), datetime(2024, 10, 1))
+
+
+def _metrics():
+    metrics = RunMetrics()
+    metrics.record_query(REQUEST, 0.1, 10, 100, 0.01)
+    with metrics.section("week"):
+        metrics.record_query(REQUEST, 0.3, 30, 300, 0.03, 2400)
+        metrics.record_query(QueryRequest(KIND_SNAPSHOTS, ('Zähler "alt"',), datetime(2024, 9, 1), datetime(2024, 9, 8)), 0.2, 2, 20)
+        metrics.add_phase(PHASE_RENDERING, 1.0)
+    return metrics
+
+
+def test_summary():
+    summary = _metrics().summary(slowest=1)
+    assert list(summary["sections"]) == ["run", "week"]
+    week = summary["sections"]["week"]
+    assert (week["queries"], week["rows"], week["bytes"], week["decoded_bytes"]) == (2, 32, 320, 2400)
+    assert week["phases"] == {PHASE_QUERY: 0.5, PHASE_INTEGRATION: 0.03, PHASE_RENDERING: 1.0}
+    assert week["slowest"] == [{
+        "section": "week",
+        "kind": KIND_KWH,
+        "measurements": ("Kochfeld", "Backofen"),
+        "start": "2024-09-01T00:00:00",
+        "end": "2024-10-01T00:00:00",
+        "seconds": 0.3,
+        "rows": 30,
+        "bytes": 300,
+        "decoded_bytes": 2400,
+    }]
+    assert summary["total"]["queries"] == 3
+    assert summary["total"]["phases"][PHASE_QUERY] == 0.6
+
+
+def test_section_is_restored():
+    metrics = RunMetrics()
+    with metrics.section("month"):
+        with metrics.section("charts"):
+            assert metrics.current_section == "charts"
+        assert metrics.current_section == "month"
+    assert metrics.current_section == "run"
+
+
+def test_log_summary(caplog):
+    with caplog.at_level("INFO", logger="influx_report.metrics"):
+        _metrics().log_summary()
+    message = caplog.records[0].getMessage()
+    assert json.loads(message[len("Run metrics "):])["total"]["rows"] == 42
+
+
+def test_textfile(tmp_path):
+    metrics = _metrics()
+    path = tmp_path / "influx_report.prom"
+    metrics.write_textfile(str(path))
+    text = path.read_text(encoding="utf-8")
+    assert 'influx_report_queries{section="week"} 2' in text
+    assert 'influx_report_phase_seconds{section="week",phase="rendering"} 1.000000' in text
+    assert 'influx_report_slowest_query_seconds{rank="1",section="week",kind="kwh"} 0.300000' in text
+    assert 'influx_report_slowest_query_seconds{rank="2",section="week",kind="snapshots"} 0.200000' in text
+    assert "Kochfeld" not in text and "2024-09-01" not in text
+    assert "# TYPE influx_report_response_bytes gauge" in text
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_clear():
+    metrics = _metrics()
+    metrics.clear()
+    assert metrics.summary()["total"]["queries"] == 0
+    assert not metrics.summary()["sections"]
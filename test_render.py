@@ -0,0 +1,42 @@
+"""test render.py"""
+import datetime
+import os
+
+from helpers import MeasurementSet
+from render import ChartRenderer
+
+# pylint: disable=missing-function-docstring
+
+DATES = ((datetime.datetime(2023, 9, 1), datetime.datetime(2023, 9, 30)), (datetime.datetime(2024, 9, 1), datetime.datetime(2024, 9, 30)))
+DAYS = [datetime.date(2024, 9, day) for day in range(1, 31)]
+
+
+def test_render_inline(tmp_path):
+    with ChartRenderer(0) as renderer:
+        renderer.daily_chart("Kochfeld", DAYS, [1.0] * len(DAYS), str(tmp_path / "daily.png"))
+        assert renderer.wait() == [str(tmp_path / "daily.png")]
+        assert renderer.seconds > 0
+    assert (tmp_path / "daily.png").read_bytes().startswith(b"\x89PNG")
+
+
+def test_render_in_workers(tmp_path):
+    measurement_set = MeasurementSet(name="Kochfeld", data=[1.0, 2.5], dates=DATES)
+    filenames = [str(tmp_path / "summary.png")] + [str(tmp_path / f"daily_{index}.png") for index in range(3)]
+    with ChartRenderer(2) as renderer:
+        renderer.summary_chart([measurement_set], filenames[0])
+        for index, filename in enumerate(filenames[1:]):
+            renderer.daily_chart(f"Line {index}", DAYS, [float(index)] * len(DAYS), filename)
+        assert renderer.wait() == filenames
+        assert not renderer.wait()
+    for filename in filenames:
+        with open(filename, "rb") as chart:
+            assert chart.read(4) == b"\x89PNG"
+
+
+def test_warm_imports_in_workers():
+    with ChartRenderer(2) as renderer:
+        pids = renderer.warm()
+        assert 1 <= len(pids) <= 2
+        assert os.getpid() not in pids
+    with ChartRenderer(0) as renderer:
+        assert renderer.warm() == {os.getpid()}
@@ -0,0 +1,122 @@
+"""test resilience.py"""
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from influx import KIND_KWH, QueryOptionsClass, QueryRequest
+from metrics import RunMetrics
+from resilience import DeadlineExceeded, QueryGuard, QueryTimeout, is_transient, is_unavailable
+
+# pylint: disable=missing-function-docstring
+
+
+def make_guard(**options):
+    return QueryGuard(QueryOptionsClass(**options), RunMetrics(), random.Random(1))
+
+
+def failing(errors, result="ok"):
+    """Function that raises the errors one after another, then returns the result"""
+    errors = list(errors)
+    calls = []
+
+    def function():
+        calls.append(time.monotonic())
+        if errors:
+            raise errors.pop(0)
+        return result
+
+    function.calls = calls
+    return function
+
+
+def test_is_transient():
+    assert is_transient(ConnectionRefusedError())
+    assert is_transient(QueryTimeout())
+    assert is_transient(MagicMock(spec=Exception, status=503))
+    assert not is_transient(MagicMock(spec=Exception, status=400))
+    assert not is_transient(DeadlineExceeded())
+    assert not is_transient(ValueError())
+    assert is_unavailable(DeadlineExceeded())
+
+
+def test_retries_transient_errors_with_jitter():
+    guard = make_guard(retries=2, retry_backoff=0.5)
+    function = failing([ConnectionResetError(), ConnectionResetError()])
+    with patch("resilience.time.sleep") as sleep:
+        assert guard.call(function) == "ok"
+    delays = [call.args[0] for call in sleep.call_args_list]
+    assert len(delays) == 2 and 0 <= delays[0] <= 0.5 and 0 <= delays[1] <= 1.0
+    assert guard.retried == 2
+
+
+def test_gives_up_after_retries_and_on_other_errors():
+    with patch("resilience.time.sleep"):
+        with pytest.raises(ConnectionResetError):
+            make_guard(retries=1).call(failing([ConnectionResetError(), ConnectionResetError()]))
+        function = failing([ValueError()])
+        with pytest.raises(ValueError):
+            make_guard(retries=3).call(function)
+    assert len(function.calls) == 1
+
+
+def test_query_timeout():
+    release = threading.Event()
+    guard = make_guard(query_timeout=0.05)
+    started = time.monotonic()
+    with pytest.raises(QueryTimeout):
+        guard.call(release.wait)
+    assert time.monotonic() - started < 1
+    release.set()
+    guard.close()
+
+
+def test_deadline():
+    guard = make_guard(report_deadline=0.05)
+    guard.start()
+    assert 0 < guard.timeout() <= 0.05
+    time.sleep(0.06)
+    with pytest.raises(DeadlineExceeded):
+        guard.call(lambda: "ok")
+    make_guard(report_deadline=0.05).call(lambda: "ok")  # the deadline starts with start()
+
+
+def test_hedged_request_answers_first():
+    guard = make_guard(hedge_percentile=90)
+    for _ in range(5):
+        guard.metrics.record_query(QueryRequest(KIND_KWH, ("a",), datetime(2024, 1, 1), datetime(2024, 1, 2)), 0.01, 1)
+    assert guard.hedge_delay() == pytest.approx(0.01)
+    release = threading.Event()
+    calls = []
+
+    def function():
+        calls.append(threading.current_thread().name)
+        if len(calls) == 1:
+            release.wait()
+            return "stalled"
+        return "hedged"
+
+    assert guard.call(function) == "hedged"
+    assert guard.hedged == 1
+    release.set()
+    guard.close()
+
+
+def test_call_async_timeout_and_retry():
+    guard = make_guard(query_timeout=0.05, retries=1, retry_backoff=0.0)
+    attempts = []
+
+    async def query():
+        attempts.append(1)
+        if len(attempts) == 1:
+            await asyncio.sleep(1)
+        return "ok"
+
+    assert asyncio.run(guard.call_async(query)) == "ok"
+    assert len(attempts) == 2
+    with pytest.raises(QueryTimeout):
+        asyncio.run(make_guard(query_timeout=0.01).call_async(lambda: asyncio.sleep(1)))
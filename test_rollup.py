@@ -0,0 +1,75 @@
+"""test rollup.py"""
+from datetime import date
+import sqlite3
+
+import pytest
+
+from rollup import KIND_ENERGY, KIND_LAST, RollupStore, contiguous_spans, days_between, last_on_or_before, sum_days
+
+# pylint: disable=missing-function-docstring
+
+
+@pytest.fixture
+def store(tmp_path):
+    with RollupStore(str(tmp_path / "rollups.sqlite")) as opened:
+        yield opened
+
+
+def test_missing_days(store):  # pylint: disable=redefined-outer-name
+    today = date(2024, 10, 6)
+    days = days_between(date(2024, 10, 1), date(2024, 10, 3))
+    store.put(KIND_ENERGY, {"a": {date(2024, 10, 1): 1.0, date(2024, 10, 2): 2.0}, "b": {date(2024, 10, 1): 3.0}}, days, today)
+    # b has a NULL row for 10/2 and 10/3, a has a NULL row for 10/3, so all three days are complete
+    assert store.missing_days(KIND_ENERGY, ["a", "b"], date(2024, 9, 30), date(2024, 10, 7),
+                              today) == [date(2024, 9, 30),
+                                         date(2024, 10, 4),
+                                         date(2024, 10, 5),
+                                         date(2024, 10, 6),
+                                         date(2024, 10, 7)]
+    assert store.missing_days(KIND_ENERGY, ["a", "c"], date(2024, 10, 1), date(2024, 10, 1), today) == [date(2024, 10, 1)]
+    assert store.missing_days(KIND_LAST, ["a"], date(2024, 10, 1), date(2024, 10, 1), today) == [date(2024, 10, 1)]
+
+
+def test_today_is_not_stored(store):  # pylint: disable=redefined-outer-name
+    today = date(2024, 10, 6)
+    store.put(KIND_LAST, {"a": {date(2024, 10, 5): 5.0, today: 6.0}}, [date(2024, 10, 5), today], today)
+    assert store.get(KIND_LAST, "a", date(2024, 10, 1), today) == {date(2024, 10, 5): 5.0}
+    assert store.missing_days(KIND_LAST, ["a"], date(2024, 10, 5), today, today) == [today]
+
+
+def test_variants_are_kept_apart(store):  # pylint: disable=redefined-outer-name
+    today = date(2024, 10, 6)
+    store.put(KIND_ENERGY, {"a": {date(2024, 10, 5): 5.0}}, [date(2024, 10, 5)], today, "client/left/max_gap=0.0")
+    assert store.missing_days(KIND_ENERGY, ["a"], date(2024, 10, 5), date(2024, 10, 5), today, "server") == [date(2024, 10, 5)]
+    assert not store.get(KIND_ENERGY, "a", date(2024, 10, 5), date(2024, 10, 5), "server")
+    assert store.get(KIND_ENERGY, "a", date(2024, 10, 5), date(2024, 10, 5), "client/left/max_gap=0.0") == {date(2024, 10, 5): 5.0}
+
+
+def test_older_layout_is_emptied(tmp_path):
+    path = str(tmp_path / "rollups.sqlite")
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE daily (kind TEXT, measurement TEXT, day TEXT, value REAL, PRIMARY KEY (kind, measurement, day))")
+    connection.execute("INSERT INTO daily VALUES ('energy', 'a', '2024-10-05', 5.0)")
+    connection.commit()
+    connection.close()
+    with RollupStore(path) as opened:
+        assert not opened.get(KIND_ENERGY, "a", date(2024, 10, 5), date(2024, 10, 5))
+
+
+def test_contiguous_spans():
+    days = [date(2024, 1, 1), date(2024, 1, 2), date(2024, 1, 5), date(2024, 1, 31), date(2024, 2, 1)]
+    assert contiguous_spans(days) == [(date(2024, 1, 1), date(2024, 1, 2)), (date(2024, 1, 5), date(2024, 1, 5)), (date(2024, 1,
+                                                                                                                        31), date(2024, 2, 1))]
+    assert not contiguous_spans([])
+
+
+def test_sum_days():
+    daily = {date(2024, 1, 1): 1.0, date(2024, 1, 2): None, date(2024, 1, 3): 2.5}
+    assert sum_days(daily, date(2024, 1, 1), date(2024, 1, 4)) == 3.5
+
+
+def test_last_on_or_before():
+    daily = {date(2024, 1, 1): 10, date(2024, 1, 2): None}
+    assert last_on_or_before(daily, date(2024, 1, 1), 0) == 10
+    assert last_on_or_before(daily, date(2024, 1, 3), 2) == 10
+    assert last_on_or_before(daily, date(2024, 1, 3), 1) is None
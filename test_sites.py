@@ -0,0 +1,136 @@
+"""test sites.py"""
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from helpers import MeasurementSet
+from influx import KIND_KWH, InfluxSession
+from render import ChartRenderer
+from rollup import KIND_ENERGY
+from sites import Site, load_sites, main, report_sites, shared_pool_manager
+
+# pylint: disable=missing-function-docstring
+
+CONFIG = """
+[InfluxDB]
+url=http://shared:8086
+token=shared-token
+org=shared
+bucket=shared
+pool_size=3
+retries=2
+concurrency=4
+
+[InfluxDB home]
+org=home
+bucket=home
+catalog=catalog_home.ini
+
+[InfluxDB cabin]
+url=http://cabin:8086
+token=cabin-token
+org=cabin
+bucket=cabin
+retries=0
+output_dir=out/cabin
+"""
+
+DATE = datetime.datetime(2024, 10, 6, 23, 59, 59)
+DATES = ((datetime.datetime(2023, 9, 1), datetime.datetime(2023, 9, 30)), (datetime.datetime(2024, 9, 1), datetime.datetime(2024, 9, 30)))
+
+
+@pytest.fixture(name="config_file")
+def fixture_config_file(tmp_path):
+    path = tmp_path / "config.ini"
+    path.write_text(CONFIG, encoding="utf-8")
+    return str(path)
+
+
+def test_load_sites(config_file):
+    assert load_sites(config_file, "reports") == [
+        Site("home", "InfluxDB home", "http://shared:8086", "catalog_home.ini", "reports/home"),
+        Site("cabin", "InfluxDB cabin", "http://cabin:8086", "catalog.ini", "out/cabin"),
+    ]
+    assert load_sites(config_file)[1].host == "cabin:8086"
+
+
+def test_session_of_site_falls_back_to_influxdb_section(config_file):
+    with InfluxSession(config_file, section="InfluxDB home") as home, InfluxSession(config_file, section="InfluxDB cabin") as cabin:
+        assert (home.influx.url, home.influx.org, home.influx.bucket) == ("http://shared:8086", "home", "home")
+        assert (home.pool_size, home.options.retries) == (3, 2)
+        assert (cabin.influx.url, cabin.influx.org, cabin.options.retries) == ("http://cabin:8086", "cabin", 0)
+
+
+def test_sites_share_cache_and_rollup_files_apart(tmp_path):
+    path = tmp_path / "config.ini"
+    path.write_text(CONFIG.replace("retries=2\n", f"retries=2\ncache_file={tmp_path / 'cache.sqlite'}\nrollup_file={tmp_path / 'rollups.sqlite'}\n"),
+                    encoding="utf-8")
+    start, stop = datetime.datetime(2024, 9, 1), datetime.datetime(2024, 9, 8)
+    day = datetime.date(2024, 9, 1)
+    with InfluxSession(str(path), section="InfluxDB home") as home, InfluxSession(str(path), section="InfluxDB cabin") as cabin:
+        assert home.cache.path == cabin.cache.path
+        home.cache.put(KIND_KWH, "Kochfeld", start, stop, "client", 1.5)
+        home.rollups.put(KIND_ENERGY, {"Kochfeld": {day: 1.5}}, [day], datetime.date(2024, 10, 6))
+        assert cabin.cache.get(KIND_KWH, "Kochfeld", start, stop, "client") == (False, None)
+        assert not cabin.rollups.get(KIND_ENERGY, "Kochfeld", day, day)
+        assert home.cache.get(KIND_KWH, "Kochfeld", start, stop, "client") == (True, 1.5)
+        assert home.rollups.get(KIND_ENERGY, "Kochfeld", day, day) == {day: 1.5}
+
+
+def test_sessions_share_pool_manager(config_file):
+    sites = load_sites(config_file)
+    pool_manager = shared_pool_manager(sites, pool_size=2)
+    assert pool_manager.connection_pool_kw["maxsize"] == 2
+    assert pool_manager.connection_pool_kw["block"]
+    pool = pool_manager.connection_from_url("http://cabin:8086")
+    with InfluxSession(config_file, section="InfluxDB home", pool_manager=pool_manager) as home, \
+         InfluxSession(config_file, section="InfluxDB cabin", pool_manager=pool_manager) as cabin:
+        assert home.influx.client.api_client.rest_client.pool_manager is pool_manager
+        assert cabin.influx.client.api_client.rest_client.pool_manager is pool_manager
+        # the async client would open connections beside the shared pool
+        assert home.options.concurrency == cabin.options.concurrency == 0
+    with InfluxSession(config_file, section="InfluxDB home") as alone:
+        assert alone.options.concurrency == 4
+    # closing the sessions leaves the shared pools open
+    assert pool_manager.connection_from_url("http://cabin:8086") is pool
+    pool_manager.clear()
+
+
+def test_report_sites_writes_per_site_and_isolates_failures(config_file, tmp_path):
+    sites = [Site(name, f"InfluxDB {name}", "http://shared:8086", "catalog.ini", str(tmp_path / name)) for name in ("home", "cabin")]
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def fake_run_reports(date, reports, influx, renderer, catalog, output_dir, manifest):
+        assert renderer is None and catalog and date == DATE and influx and manifest.path == f"{output_dir}/manifest.json"
+        if output_dir.endswith("cabin"):
+            raise RuntimeError("cabin is offline")
+        return [[MeasurementSet("Kochfeld", [1.0, 2.0], DATES), MeasurementSet("Wallbox", [0.0, 0.0], DATES, missing=True)] for _ in reports]
+
+    with patch("sites.InfluxSession", MagicMock()) as mock_session, patch("sites.run_reports", side_effect=fake_run_reports):
+        results = report_sites(sites, DATE, [False], config_file, workers=2, charts=False)
+    assert sorted(call.kwargs["section"] for call in mock_session.call_args_list) == ["InfluxDB cabin", "InfluxDB home"]
+    home, cabin = results
+    assert not home.error and home.missing == ["Wallbox"]
+    assert home.files == [str(tmp_path / "home" / "report.json")]
+    report = json.loads((tmp_path / "home" / "report.json").read_text(encoding="utf-8"))
+    assert report["site"] == "home"
+    assert report["reports"][0]["measurements"][1]["missing"]
+    assert cabin.error == "cabin is offline" and not cabin.files
+
+
+def test_main_exit_code(config_file):
+    with patch("sites.report_sites", return_value=[MagicMock(error="")]) as mock_report:
+        assert main(["--config", config_file, "--site", "cabin", "--no-chart"]) == 0
+    sites, _, reports = mock_report.call_args.args[:3]
+    assert [site.name for site in sites] == ["cabin"] and reports
+    assert main(["--config", config_file, "--site", "nowhere"]) == 1
+
+
+def test_renderer_keeps_shared_executor_open():
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        with ChartRenderer(executor=executor):
+            pass
+        assert executor.submit(abs, -1).result() == 1
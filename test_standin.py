@@ -0,0 +1,144 @@
+"""test standin.py"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+import json
+import threading
+import time
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from influx import KIND_KWH, KIND_VALUES, GetFromInflux, InfluxSession
+from rollup import KIND_LAST
+from standin import ReplaySource, RecordSource, SyntheticSource, Throttle, load_fixtures, make_server, query_key
+from synthetic import SyntheticInflux, counter_series, power_series
+
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+START = datetime(2024, 9, 1)
+SERIES = [power_series("power", START, timedelta(days=3), 60), counter_series("counter", START - timedelta(days=10), timedelta(days=14))]
+
+
+def _serve(source, throttle=None):
+    server = make_server(source, throttle, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _session(server, tmp_path, options=""):
+    config = tmp_path / "config.ini"
+    config.write_text(f"[InfluxDB]\nurl = http://127.0.0.1:{server.server_address[1]}\ntoken = token\norg = org\nbucket = bucket\n{options}",
+                      encoding="utf-8")
+    return InfluxSession(str(config))
+
+
+def _query(server, query):
+    request = Request(f"http://127.0.0.1:{server.server_address[1]}/api/v2/query?org=org",
+                      data=json.dumps({
+                          "query": query
+                      }).encode("utf-8"),
+                      headers={"Content-Type": "application/json"})
+    with urlopen(request) as response:
+        return response.read()
+
+
+@pytest.fixture
+def server():
+    server = _serve(SyntheticSource(SERIES))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("options", ["", "streaming = true\n"])
+def test_synthetic_over_http(server, tmp_path, options):
+    expected = GetFromInflux(SyntheticInflux(SERIES).session())
+    with _session(server, tmp_path, options) as session:
+        influx = GetFromInflux(session)
+        end = START + timedelta(days=2)
+        assert influx.get_total_kwh_consumed_from_influx("power", START,
+                                                         end) == pytest.approx(expected.get_total_kwh_consumed_from_influx("power", START, end))
+        assert influx.get_values_from_influx("counter", START, end) == expected.get_values_from_influx("counter", START, end)
+        daily = influx.get_daily_series(KIND_LAST, ["counter"], date(2024, 9, 1), date(2024, 9, 2))
+        assert daily == expected.get_daily_series(KIND_LAST, ["counter"], date(2024, 9, 1), date(2024, 9, 2))
+        queries = session.metrics.queries
+        assert [query.kind for query in queries] == [KIND_KWH, KIND_VALUES, KIND_LAST]
+        first, after_last = SERIES[0].window(*(int(day.replace(tzinfo=timezone.utc).timestamp()) * 1_000_000_000 for day in (START, end)))
+        assert queries[0].rows == after_last - first
+        assert all(query.bytes > 0 for query in queries)
+
+
+@pytest.mark.parametrize("options", ["", "gzip = false\n"])
+def test_response_bytes_on_the_wire_and_decoded(server, tmp_path, options):
+    with _session(server, tmp_path, options) as session:
+        GetFromInflux(session).get_total_kwh_consumed_from_influx("power", START, START + timedelta(days=2))
+        query = session.metrics.queries[0]
+    assert query.decoded_bytes > 0
+    if options:
+        assert query.bytes == query.decoded_bytes
+    else:
+        assert query.bytes < query.decoded_bytes / 3
+
+
+def test_unsupported_query(server):
+    with pytest.raises(HTTPError) as error:
+        _query(server, 'from(bucket:"b") |> range(start: 2024-09-01T00:00:00Z, stop: 2024-09-02T00:00:00Z) |> pivot()')
+    assert error.value.code == 400
+    assert "pivot" in json.loads(error.value.read())["message"]
+
+
+def test_record_and_replay(server, tmp_path):
+    recorder = _serve(RecordSource(str(tmp_path / "recorded"), f"http://127.0.0.1:{server.server_address[1]}", "token"))
+    with _session(recorder, tmp_path) as session:
+        recorded = GetFromInflux(session).get_values_from_influx("counter", START, START + timedelta(days=1))
+    recorder.shutdown()
+    assert len(list((tmp_path / "recorded").glob("*.csv"))) == 1
+
+    replay = _serve(ReplaySource(str(tmp_path / "recorded")))
+    with _session(replay, tmp_path) as session:
+        assert GetFromInflux(session).get_values_from_influx("counter", START, START + timedelta(days=1)) == recorded
+    with pytest.raises(HTTPError) as error:
+        _query(replay, "unknown query")
+    assert error.value.code == 404
+    replay.shutdown()
+
+
+def test_query_key_ignores_whitespace():
+    assert query_key("from(bucket: \"b\")\n  |> last()") == query_key("from(bucket: \"b\") |> last()")
+    assert query_key("a") != query_key("b")
+
+
+def test_load_fixtures(tmp_path):
+    fixture = tmp_path / "fixture.csv"
+    fixture.write_text(
+        "_measurement,_time,_value\npower,2024-09-01T01:00:00Z,200\npower,2024-09-01T00:00:00Z,100\n"
+        "counter,2024-09-01T12:00:00,5.5\n",
+        encoding="utf-8")
+    series = {series.measurement: series for series in load_fixtures([str(fixture)])}
+    assert list(series["power"].values) == [100.0, 200.0]
+    # times without a zone are UTC
+    assert series["counter"].timestamps_ns[0] == int(datetime(2024, 9, 1, 12, tzinfo=timezone.utc).timestamp()) * 1_000_000_000
+    influx = GetFromInflux(SyntheticInflux(list(series.values())).session())
+    assert influx.get_total_kwh_consumed_from_influx("power", START, START + timedelta(hours=2)) == 0.1
+
+
+def test_throttle_delay():
+    throttle = Throttle(latency=0.1, jitter=0.05)
+    assert all(0.05 <= throttle.delay() <= 0.15 for _ in range(100))
+    assert Throttle(latency=0.01, jitter=0.05).delay() >= 0.0
+
+
+def test_latency_and_max_concurrent():
+    server = _serve(SyntheticSource(SERIES), Throttle(latency=0.2, max_concurrent=1))
+    query = ('from(bucket:"b") |> range(start: 2024-09-01T00:00:00Z, stop: 2024-09-02T00:00:00Z) '
+             '|> filter(fn: (r) => r._measurement == "power") |> last()')
+    started = time.perf_counter()
+    with ThreadPoolExecutor(2) as executor:
+        responses = list(executor.map(lambda _: _query(server, query), range(2)))
+    # both queries wait for the latency one after another
+    assert time.perf_counter() - started >= 0.4
+    assert responses[0] == responses[1]
+    assert b"power" in responses[0]
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,22 @@
+"""test startup.py"""
+from startup import measure_import_times, parse_import_times
+
+# pylint: disable=missing-function-docstring
+
+OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       100 |        100 |   _io
+import time:       200 |        300 | json
+import time:      1500 |       1500 |     numpy.core
+import time:       500 |       2500 |   numpy.random
+import time:      1000 |       4000 | numpy
+"""
+
+
+def test_parse_import_times():
+    assert parse_import_times(OUTPUT, ["json", "numpy", "main"]) == [("json", 0.0003), ("numpy", 0.004), ("main", 0.0)]
+
+
+def test_measure_import_times():
+    times = measure_import_times(["json", "json"])
+    assert [module for module, _ in times] == ["json", "json"]
+    assert all(seconds >= 0.0 for _, seconds in times)
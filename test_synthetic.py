@@ -0,0 +1,102 @@
+"""test synthetic.py"""
+from datetime import date, datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from influx import INTEGRATION_SERVER, GetFromInflux
+from integration import RULE_LEFT, RULE_TRAPEZOID, integrate_kwh
+from rollup import KIND_ENERGY, KIND_LAST
+from synthetic import NS_PER_SECOND, StandInTable, SyntheticInflux, counter_series, join_series, power_series
+
+# pylint: disable=missing-function-docstring
+
+START = datetime(2024, 9, 1)
+
+
+def test_power_series():
+    series = power_series("power", START, timedelta(days=2), resolution_s=10, gaps=2)
+    assert len(series) < 2 * 24 * 360  # the gaps are missing
+    assert series.timestamps_ns[0] == int(START.replace(tzinfo=timezone.utc).timestamp()) * NS_PER_SECOND
+    assert np.all(np.diff(series.timestamps_ns) >= 10 * NS_PER_SECOND)
+    assert np.all(series.values >= 0)
+    assert series.values.max() > 1000  # at least one burst
+    assert np.array_equal(series.values, power_series("power", START, timedelta(days=2), resolution_s=10, gaps=2).values)
+
+
+def test_counter_series_resets():
+    series = counter_series("counter", START, timedelta(days=7), resets=2, gaps=0)
+    assert len(series) == 7 * 24 * 60
+    assert series.values[0] >= 1000
+    assert np.sum(np.diff(series.values) < 0) == 2
+
+
+def test_records():
+    series = power_series("power", START, timedelta(hours=1), resolution_s=60, gaps=0)
+    records = series.records()
+    assert len(records) == 60
+    assert records[1].get_time() == datetime(2024, 9, 1, 0, 1, tzinfo=timezone.utc)
+    assert records[1].get_measurement() == "power"
+    assert records[1].get_value() == series.values[1]
+    assert series.records() is records
+
+
+@pytest.mark.parametrize("options", [{}, {"streaming": True}])
+def test_kwh_from_synthetic_influx(options):
+    series = power_series("power", START, timedelta(days=1), resolution_s=10)
+    influx = SyntheticInflux([series])
+    kwh = GetFromInflux(influx.session(**options)).get_total_kwh_consumed_from_influx("power", START, START + timedelta(hours=12))
+    half = series.timestamps_ns < series.timestamps_ns[0] + 12 * 3600 * NS_PER_SECOND
+    assert kwh == pytest.approx(integrate_kwh(series.timestamps_ns[half], series.values[half], RULE_LEFT))
+    assert influx.queries == 1
+    assert influx.records == np.sum(half)
+
+
+def test_server_integration_and_last_values():
+    power = join_series([
+        power_series("power", START, timedelta(days=1), resolution_s=60, gaps=0),
+        power_series("power", START + timedelta(days=2), timedelta(days=1), resolution_s=60, gaps=0),
+    ])
+    counter = counter_series("counter", START - timedelta(days=10), timedelta(days=20), gaps=0, resets=0)
+    influx = SyntheticInflux([power, counter])
+    server = GetFromInflux(influx.session(integration=INTEGRATION_SERVER))
+    client = GetFromInflux(influx.session())
+    end = START + timedelta(days=3)
+    assert server.get_total_kwh_consumed_from_influx("power", START,
+                                                     end) == pytest.approx(client.get_total_kwh_consumed_from_influx("power", START, end), rel=0.01)
+    assert client.get_values_from_influx("counter", START, end) == (counter.values[10 * 1440 + 1439], counter.values[13 * 1440 + 1439])
+
+
+def test_daily_aggregates():
+    power = power_series("power", START, timedelta(days=2), resolution_s=60, gaps=0)
+    counter = counter_series("counter", START, timedelta(days=2), gaps=0, resets=0)
+    influx = SyntheticInflux([power, counter])
+    server = GetFromInflux(influx.session(integration=INTEGRATION_SERVER))
+    energy = server.get_daily_series(KIND_ENERGY, ["power"], date(2024, 9, 1), date(2024, 9, 2))["power"]
+    first_day = power.timestamps_ns < power.timestamps_ns[0] + 24 * 3600 * NS_PER_SECOND
+    assert energy[date(2024, 9, 1)] == pytest.approx(integrate_kwh(power.timestamps_ns[first_day], power.values[first_day], RULE_TRAPEZOID))
+    assert server.get_daily_series(KIND_LAST, ["counter"], date(2024, 9, 1), date(2024, 9, 2)) == {
+        "counter": {
+            date(2024, 9, 1): counter.values[1439],
+            date(2024, 9, 2): counter.values[-1]
+        }
+    }
+
+
+def test_unsupported_query():
+    with pytest.raises(ValueError, match="pivot"):
+        SyntheticInflux([]).query('from(bucket:"b") |> range(start: 2024-09-01T00:00:00Z, stop: 2024-09-02T00:00:00Z) |> pivot()')
+
+
+def test_session_has_only_the_attributes_of_a_session():
+    influx = SyntheticInflux([power_series("power", START, timedelta(hours=1), resolution_s=60, gaps=0)])
+    with influx.session(streaming=True) as session:
+        assert session.options.streaming
+        assert session.cache is None and session.rollups is None
+        assert session.take_response() is None
+        with pytest.raises(AttributeError):
+            session.rollup  # pylint: disable=pointless-statement,no-member
+    tables = influx.query('from(bucket:"b") |> range(start: 2024-09-01T00:00:00Z, stop: 2024-09-02T00:00:00Z)'
+                          ' |> filter(fn: (r) => r._measurement == "power")')
+    assert isinstance(tables[0], StandInTable)
+    assert len(tables[0].records) == 60